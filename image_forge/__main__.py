@@ -62,6 +62,7 @@ def generate(
     height: int = typer.Option(1024, "--height", "-h"),
     steps: int = typer.Option(28, "--steps", "-s"),
     output: Optional[str] = typer.Option(None, "--output", "-o"),
+    draft: bool = typer.Option(False, "--draft", help="Fast low-res preview"),
 ):
     """Generate a single image (CLI)"""
     import httpx
@@ -81,6 +82,7 @@ def generate(
                 "width": width,
                 "height": height,
                 "steps": steps,
+                "draft": draft,
             },
             timeout=10,
         )
@@ -113,7 +115,14 @@ def generate(
                 console.print(f"[red]✗ Generation failed: {task.get('error')}[/red]")
                 break
             
-            console.print(".", end="")
+            progress = task.get("progress")
+            if progress and progress.get("it_per_sec"):
+                console.print(
+                    f"  step {progress['step']}/{progress['total_steps']} "
+                    f"({progress['it_per_sec']:.2f} it/s)"
+                )
+            else:
+                console.print(".", end="")
 
 
 if __name__ == "__main__":
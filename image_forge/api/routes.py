@@ -2,16 +2,21 @@
 API Routes for ImageForge
 """
 from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
-from typing import List, Optional
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import List, Optional, Dict, Any
 from pathlib import Path
 import asyncio
+import json
 
 from ..core.models import (
     GenerationRequest,
     GenerationResult,
     GenerationTask,
     TaskStatus,
+    TaskProgress,
+    BatchRequest,
+    BatchSubmission,
+    BatchStatus,
     WorkerInfo,
     QueueStats,
 )
@@ -55,17 +60,57 @@ async def get_task(task_id: str):
 
 @router.delete("/task/{task_id}")
 async def cancel_task(task_id: str):
-    """Cancel a pending task"""
+    """Cancel a pending or running task"""
     queue = get_queue()
     success = await queue.cancel_task(task_id)
     if not success:
         raise HTTPException(
             status_code=400, 
-            detail="Task cannot be cancelled (not pending)"
+            detail="Task cannot be cancelled (already finished)"
         )
     return {"status": "cancelled"}
 
 
+@router.get("/task/{task_id}/stream")
+async def stream_task(task_id: str):
+    """
+    Server-Sent Events stream of task status and step progress.
+    Ends when the task completes, fails or is cancelled.
+    """
+    queue = get_queue()
+    if not await queue.get_task(task_id):
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    terminal = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+    
+    async def event_stream():
+        last_payload = None
+        while True:
+            # Subscribe before reading: an update in between still wakes us
+            update = queue.subscribe(task_id)
+            task = await queue.get_task(task_id)
+            if not task:
+                break
+            
+            payload = json.dumps({
+                "status": task.status.value,
+                "progress": task.progress.model_dump(mode="json") if task.progress else None,
+                "error": task.error,
+            })
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+            
+            if task.status in terminal:
+                break
+            
+            if not await queue.wait_for_update(task_id, timeout=15, event=update):
+                # Keep-alive for proxies on quiet stretches
+                yield ": ping\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/generate/sync", response_model=GenerationResult)
 async def generate_sync(request: GenerationRequest):
     """
@@ -73,17 +118,17 @@ async def generate_sync(request: GenerationRequest):
     Use for single images when you need immediate result
     """
     queue = get_queue()
-    task = await queue.add_task(request)
+    try:
+        task = await queue.add_task(request)
+    except ValueError as e:
+        raise HTTPException(status_code=429, detail=str(e))
     
-    # Poll for completion
+    # Poll for completion (checks first: duplicates may already be done)
     max_wait = 300  # 5 minutes
     poll_interval = 1
     waited = 0
     
     while waited < max_wait:
-        await asyncio.sleep(poll_interval)
-        waited += poll_interval
-        
         task = await queue.get_task(task.id)
         if task.status == TaskStatus.COMPLETED:
             return GenerationResult(
@@ -98,6 +143,9 @@ async def generate_sync(request: GenerationRequest):
                 status=task.status,
                 error=task.error,
             )
+        
+        await asyncio.sleep(poll_interval)
+        waited += poll_interval
     
     raise HTTPException(status_code=408, detail="Generation timeout")
 
@@ -126,20 +174,90 @@ async def get_image(task_id: str, index: int = 0):
 
 # ============== Batch Endpoints ==============
 
-@router.post("/batch/generate", response_model=List[GenerationTask])
-async def create_batch(requests: List[GenerationRequest]):
-    """Submit multiple generation requests"""
+@router.post("/batch/generate", response_model=BatchSubmission)
+async def create_batch(batch: BatchRequest):
+    """
+    Submit multiple generation requests atomically.
+    
+    all_or_nothing (default): 429 if the whole batch doesn't fit.
+    partial: enqueue what fits; skipped indexes are listed in "rejected".
+    """
+    queue = get_queue()
+    try:
+        return await queue.add_tasks(batch.requests, batch.mode, batch.batch_id)
+    except ValueError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+
+@router.get("/batch/{batch_id}", response_model=BatchStatus)
+async def get_batch_status(batch_id: str):
+    """Get aggregate progress of a batch"""
+    queue = get_queue()
+    status = await queue.get_batch_status(batch_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return status
+
+
+@router.get("/batch/{batch_id}/stream")
+async def stream_batch(batch_id: str):
+    """
+    Server-Sent Events stream of a batch.
+    
+    "task" events report each finished task once (index in task_ids,
+    status, error, duration); "batch" events carry the aggregate
+    BatchStatus without task_ids. Ends when every task has finished.
+    """
     queue = get_queue()
-    tasks = []
+    if not await queue.get_batch_status(batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    terminal = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
     
-    for request in requests:
-        try:
-            task = await queue.add_task(request)
-            tasks.append(task)
-        except ValueError:
-            break  # Queue full
+    async def event_stream():
+        reported = set()
+        last_payload = None
+        while True:
+            status = await queue.get_batch_status(batch_id)
+            if not status:
+                break
+            
+            updates = {}
+            for index, task_id in enumerate(status.task_ids):
+                if index in reported:
+                    continue
+                # Subscribe before reading: an update in between still wakes us
+                updates[task_id] = queue.subscribe(task_id)
+                task = await queue.get_task(task_id)
+                if task and task.status in terminal:
+                    reported.add(index)
+                    event = json.dumps({
+                        "index": index,
+                        "task_id": task_id,
+                        "status": task.status.value,
+                        "error": task.error,
+                        "images": len(task.result_paths),
+                        "duration": task.duration,
+                    })
+                    yield f"event: task\ndata: {event}\n\n"
+            
+            payload = status.model_dump_json(exclude={"task_ids"})
+            if payload != last_payload:
+                yield f"event: batch\ndata: {payload}\n\n"
+                last_payload = payload
+            
+            if status.done:
+                break
+            
+            unfinished = [
+                task_id for index, task_id in enumerate(status.task_ids)
+                if index not in reported
+            ]
+            if not await queue.wait_for_any_update(unfinished, timeout=15, events=updates):
+                # Keep-alive for proxies on quiet stretches
+                yield ": ping\n\n"
     
-    return tasks
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 
 # ============== Queue & Stats Endpoints ==============
@@ -176,10 +294,13 @@ async def register_worker(worker: WorkerInfo):
 
 
 @router.post("/worker/{worker_id}/heartbeat")
-async def worker_heartbeat(worker_id: str):
-    """Worker heartbeat"""
+async def worker_heartbeat(
+    worker_id: str,
+    cache_stats: Optional[Dict[str, Any]] = None,
+):
+    """Worker heartbeat (optionally carrying embedding cache stats)"""
     queue = get_queue()
-    await queue.worker_heartbeat(worker_id)
+    await queue.worker_heartbeat(worker_id, cache_stats)
     return {"status": "ok"}
 
 
@@ -204,6 +325,14 @@ async def complete_worker_task(
     return {"status": "completed"}
 
 
+@router.post("/worker/{worker_id}/progress")
+async def report_worker_progress(worker_id: str, task_id: str, progress: TaskProgress):
+    """Step progress from worker; tells it to stop if the task was cancelled"""
+    queue = get_queue()
+    keep_going = await queue.update_progress(task_id, worker_id, progress)
+    return {"status": "ok" if keep_going else "cancelled"}
+
+
 @router.post("/worker/{worker_id}/fail")
 async def fail_worker_task(worker_id: str, task_id: str, error: str):
     """Mark task as failed by worker"""
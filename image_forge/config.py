@@ -30,6 +30,24 @@ WORKER_DEVICE = os.getenv("WORKER_DEVICE", "auto")  # auto, cuda, mps, cpu
 # FLUX Model Settings
 FLUX_MODEL = os.getenv("FLUX_MODEL", "black-forest-labs/FLUX.1-dev")
 FLUX_DTYPE = os.getenv("FLUX_DTYPE", "float16")  # float16, bfloat16, float32
+FLUX_MAX_SEQUENCE_LENGTH = int(os.getenv("FLUX_MAX_SEQUENCE_LENGTH", "512"))  # 256 for schnell
+
+# CPU Execution Profile (used when the worker falls back to CPU)
+CPU_THREADS = int(os.getenv("CPU_THREADS", "0"))  # 0 = all cores in affinity mask
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "1"))
+ENABLE_CHANNELS_LAST = os.getenv("ENABLE_CHANNELS_LAST", "true").lower() == "true"
+ENABLE_TORCH_COMPILE = os.getenv("ENABLE_TORCH_COMPILE", "false").lower() == "true"
+
+# Draft previews (request.draft=true, or every task with ALWAYS_DRAFT)
+DRAFT_STEPS = int(os.getenv("DRAFT_STEPS", "8"))
+DRAFT_MAX_SIDE = int(os.getenv("DRAFT_MAX_SIDE", "512"))
+ALWAYS_DRAFT = os.getenv("ALWAYS_DRAFT", "false").lower() == "true"
+
+# Progress reporting: latent preview every N steps (0 disables previews)
+PREVIEW_INTERVAL = int(os.getenv("PREVIEW_INTERVAL", "4"))
+
+# Prompt embedding cache (CLIP/T5 outputs, kept in RAM; 0 disables)
+EMBEDDING_CACHE_MB = int(os.getenv("EMBEDDING_CACHE_MB", "256"))
 
 # Generation Defaults
 DEFAULT_WIDTH = int(os.getenv("DEFAULT_WIDTH", "1024"))
@@ -1,12 +1,15 @@
 """
 ImageForge Core Module
 """
-from .flux_engine import FluxEngine
+from .flux_engine import FluxEngine, GenerationCancelled
+from .embedding_cache import PromptEmbeddingCache
 from .queue_manager import QueueManager
 from .models import GenerationRequest, GenerationResult, TaskStatus
 
 __all__ = [
     "FluxEngine",
+    "GenerationCancelled",
+    "PromptEmbeddingCache",
     "QueueManager", 
     "GenerationRequest",
     "GenerationResult",
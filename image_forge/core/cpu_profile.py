@@ -0,0 +1,93 @@
+"""
+CPU execution profile for FluxEngine
+dtype selection from CPU features and torch threading setup
+"""
+import os
+import platform
+from pathlib import Path
+from typing import Set, Tuple
+
+import torch
+
+from rich.console import Console
+
+console = Console()
+
+# Flags that mean the CPU has native bf16 matmul support
+BF16_CPU_FLAGS = {"avx512_bf16", "amx_bf16", "bf16"}
+
+
+def get_cpu_flags() -> Set[str]:
+    """Read CPU feature flags (Linux /proc/cpuinfo; empty elsewhere)"""
+    cpuinfo = Path("/proc/cpuinfo")
+    if not cpuinfo.exists():
+        return set()
+
+    flags: Set[str] = set()
+    try:
+        for line in cpuinfo.read_text().splitlines():
+            # x86 uses "flags", ARM uses "Features"
+            key, _, value = line.partition(":")
+            if key.strip() in ("flags", "Features"):
+                flags.update(value.split())
+    except OSError:
+        pass
+    return flags
+
+
+def detect_cpu_dtype(requested: str = "auto") -> torch.dtype:
+    """
+    Pick the inference dtype for CPU.
+
+    float16 has no fast CPU kernels, so "auto" (and float16) resolve to
+    bfloat16 on CPUs with native bf16 support, otherwise float32.
+    """
+    if requested not in ("auto", "float16"):
+        return getattr(torch, requested)
+
+    flags = get_cpu_flags()
+    if flags & BF16_CPU_FLAGS:
+        return torch.bfloat16
+
+    # Apple Silicon (M2+) has bf16; M1 handles it through emulation reasonably
+    if platform.system() == "Darwin" and platform.machine() == "arm64":
+        return torch.bfloat16
+
+    return torch.float32
+
+
+def configure_threads(num_threads: int = 0, interop_threads: int = 1) -> Tuple[int, int]:
+    """
+    Configure torch intra-op / inter-op thread pools.
+
+    num_threads=0 uses every core visible to this process (respects
+    taskset/cgroup affinity), so several workers on one box can be pinned
+    to separate core groups.
+
+    Returns:
+        Tuple of (intra_op_threads, inter_op_threads) actually in effect
+    """
+    if num_threads <= 0:
+        try:
+            num_threads = len(os.sched_getaffinity(0))
+        except AttributeError:
+            num_threads = os.cpu_count() or 1
+
+    torch.set_num_threads(num_threads)
+
+    # Inter-op pool can only be sized before the first parallel op runs
+    try:
+        torch.set_interop_threads(max(1, interop_threads))
+    except RuntimeError:
+        console.print("[yellow]  Inter-op threads already initialized, keeping current[/yellow]")
+
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def draft_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """Scale (width, height) down to max_side keeping aspect, multiples of 16"""
+    scale = min(1.0, max_side / max(width, height))
+    return (
+        max(256, int(width * scale) // 16 * 16),
+        max(256, int(height * scale) // 16 * 16),
+    )
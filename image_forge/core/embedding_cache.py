@@ -0,0 +1,99 @@
+"""
+Prompt Embedding Cache
+LRU cache of text-encoder outputs (CLIP pooled + T5 sequence embeddings)
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Any
+
+import torch
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so trivially different prompts share an entry.
+
+    Case is preserved: the T5 tokenizer is case-sensitive.
+    """
+    return " ".join(prompt.split())
+
+
+def _tensor_bytes(tensor: Optional[torch.Tensor]) -> int:
+    if tensor is None:
+        return 0
+    return tensor.element_size() * tensor.nelement()
+
+
+class PromptEmbeddingCache:
+    """Thread-safe LRU of prompt embeddings bounded by total tensor bytes"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        # key -> (prompt_embeds, pooled_prompt_embeds)
+        self._entries: "OrderedDict[Tuple, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._sizes: Dict[Tuple, int] = {}
+        self._bytes = 0
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(prompt: str, model_id: str, max_sequence_length: int) -> Tuple:
+        return (model_id, max_sequence_length, normalize_prompt(prompt))
+
+    def get(self, key: Tuple) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """Return cached (prompt_embeds, pooled_prompt_embeds) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, prompt_embeds: torch.Tensor, pooled_prompt_embeds: torch.Tensor):
+        """Store embeddings (kept on CPU so the cache never holds VRAM)"""
+        prompt_embeds = prompt_embeds.detach().to("cpu")
+        pooled_prompt_embeds = pooled_prompt_embeds.detach().to("cpu")
+        size = _tensor_bytes(prompt_embeds) + _tensor_bytes(pooled_prompt_embeds)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizes[key]
+                del self._entries[key]
+
+            self._entries[key] = (prompt_embeds, pooled_prompt_embeds)
+            self._sizes[key] = size
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -6,15 +6,45 @@ import torch
 import gc
 import time
 from pathlib import Path
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Callable, Dict, Any
 from PIL import Image
 import io
 import base64
 
 from rich.console import Console
 
+from .embedding_cache import PromptEmbeddingCache
+from . import cpu_profile
+
 console = Console()
 
+# Linear approximation of the FLUX VAE decoder (16 latent channels -> RGB),
+# good enough for a thumbnail-sized preview without running the VAE
+LATENT_RGB_FACTORS = [
+    [-0.0346, 0.0244, 0.0681],
+    [0.0034, 0.0210, 0.0687],
+    [0.0275, -0.0668, -0.0433],
+    [-0.0174, 0.0160, 0.0617],
+    [0.0859, 0.0721, 0.0329],
+    [0.0004, 0.0383, 0.0115],
+    [0.0405, 0.0861, 0.0915],
+    [-0.0236, -0.0185, -0.0259],
+    [-0.0245, 0.0250, 0.1180],
+    [0.1008, 0.0755, -0.0421],
+    [-0.0515, 0.0201, 0.0011],
+    [0.0428, -0.0012, -0.0036],
+    [0.0817, 0.0765, 0.0749],
+    [-0.1264, -0.0522, -0.1103],
+    [-0.0280, -0.0881, -0.0499],
+    [-0.1262, -0.0982, -0.0778],
+]
+LATENT_RGB_BIAS = [-0.0329, -0.0718, -0.0851]
+
+
+class GenerationCancelled(Exception):
+    """Raised from a progress callback to abort generation between steps"""
+
+
 
 class FluxEngine:
     """FLUX Dev image generation engine with memory optimizations"""
@@ -27,23 +57,60 @@ class FluxEngine:
         enable_cpu_offload: bool = True,
         enable_attention_slicing: bool = True,
         enable_vae_tiling: bool = True,
+        embedding_cache_mb: int = 256,
+        max_sequence_length: int = 512,
+        cpu_threads: int = 0,
+        cpu_interop_threads: int = 1,
+        channels_last: bool = True,
+        compile_model: bool = False,
+        draft_steps: int = 8,
+        draft_max_side: int = 512,
+        always_draft: bool = False,
     ):
         self.model_id = model_id
-        self.dtype = getattr(torch, dtype)
         self.enable_cpu_offload = enable_cpu_offload
         self.enable_attention_slicing = enable_attention_slicing
         self.enable_vae_tiling = enable_vae_tiling
+        self.max_sequence_length = max_sequence_length
+        
+        # Prompt embedding cache (0 disables)
+        self.embedding_cache: Optional[PromptEmbeddingCache] = None
+        if embedding_cache_mb > 0:
+            self.embedding_cache = PromptEmbeddingCache(
+                max_bytes=embedding_cache_mb * 1024 * 1024
+            )
+        
+        # Execution tuning
+        self.channels_last = channels_last
+        self.compile_model = compile_model
+        self.draft_steps = draft_steps
+        self.draft_max_side = draft_max_side
+        self.always_draft = always_draft
         
         # Detect device
         self.device = self._detect_device(device)
         self.device_name = self._get_device_name()
         
+        # CPU profile: float16 has no fast CPU kernels, and the thread
+        # pools must be sized before the first op runs
+        if self.device == "cpu":
+            self.dtype = cpu_profile.detect_cpu_dtype(dtype)
+            self.cpu_threads = cpu_profile.configure_threads(
+                cpu_threads, cpu_interop_threads
+            )
+        else:
+            self.dtype = getattr(torch, dtype)
+            self.cpu_threads = None
+        
         self.pipe = None
         self._loaded = False
         
         console.print(f"[green]FluxEngine initialized[/green]")
         console.print(f"  Device: {self.device} ({self.device_name})")
         console.print(f"  Model: {self.model_id}")
+        console.print(f"  Dtype: {str(self.dtype).replace('torch.', '')}")
+        if self.cpu_threads:
+            console.print(f"  Threads: {self.cpu_threads[0]} intra-op, {self.cpu_threads[1]} inter-op")
     
     def _detect_device(self, device: str) -> str:
         """Detect the best available device"""
@@ -97,7 +164,8 @@ class FluxEngine:
             else:
                 self.pipe = self.pipe.to(self.device)
             
-            if self.enable_attention_slicing:
+            # Slicing trades speed for VRAM; on CPU it only costs speed
+            if self.enable_attention_slicing and self.device != "cpu":
                 console.print("  Enabling attention slicing...")
                 self.pipe.enable_attention_slicing(1)
             
@@ -105,6 +173,14 @@ class FluxEngine:
                 console.print("  Enabling VAE tiling...")
                 self.pipe.enable_vae_tiling()
             
+            if self.channels_last and self.device == "cpu":
+                console.print("  Using channels-last VAE...")
+                self.pipe.vae.to(memory_format=torch.channels_last)
+            
+            if self.compile_model:
+                console.print("  Compiling transformer (first generation will be slow)...")
+                self.pipe.transformer = torch.compile(self.pipe.transformer)
+            
             self._loaded = True
             load_time = time.time() - start_time
             console.print(f"[green]Model loaded in {load_time:.1f}s[/green]")
@@ -119,11 +195,125 @@ class FluxEngine:
             del self.pipe
             self.pipe = None
             self._loaded = False
+            if self.embedding_cache is not None:
+                self.embedding_cache.clear()
             gc.collect()
             if self.device == "cuda":
                 torch.cuda.empty_cache()
             console.print("[yellow]Model unloaded[/yellow]")
     
+    def _encode_prompt(
+        self,
+        prompt: str,
+        batch_size: int,
+    ) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """
+        Get (prompt_embeds, pooled_prompt_embeds) for the prompt,
+        running the CLIP/T5 encoders only on a cache miss.
+        
+        Returns None when the cache is disabled.
+        """
+        if self.embedding_cache is None:
+            return None
+        
+        key = self.embedding_cache.make_key(
+            prompt, self.model_id, self.max_sequence_length
+        )
+        cached = self.embedding_cache.get(key)
+        device = self.pipe._execution_device
+        
+        if cached is None:
+            with torch.no_grad():
+                prompt_embeds, pooled_prompt_embeds, _ = self.pipe.encode_prompt(
+                    prompt=prompt,
+                    prompt_2=None,
+                    device=device,
+                    num_images_per_prompt=1,
+                    max_sequence_length=self.max_sequence_length,
+                )
+            self.embedding_cache.put(key, prompt_embeds, pooled_prompt_embeds)
+        else:
+            prompt_embeds, pooled_prompt_embeds = cached
+            console.print("  Prompt embeddings: cache hit")
+        
+        # Cached entries are per-prompt; expand to the batch here so the
+        # pipeline derives batch size from the embeddings themselves
+        prompt_embeds = prompt_embeds.to(device=device, dtype=self.dtype)
+        pooled_prompt_embeds = pooled_prompt_embeds.to(device=device, dtype=self.dtype)
+        if batch_size > 1:
+            prompt_embeds = prompt_embeds.repeat(batch_size, 1, 1)
+            pooled_prompt_embeds = pooled_prompt_embeds.repeat(batch_size, 1)
+        
+        return prompt_embeds, pooled_prompt_embeds
+    
+    def get_cache_stats(self) -> dict:
+        """Get prompt embedding cache statistics"""
+        if self.embedding_cache is None:
+            return {}
+        return self.embedding_cache.stats()
+    
+    @staticmethod
+    def latents_to_preview(
+        latents: torch.Tensor,
+        width: int,
+        height: int,
+    ) -> Image.Image:
+        """
+        Cheap preview of the first image in a batch of packed FLUX latents.
+        
+        Packed latents are (batch, (h/2)*(w/2), 16*2*2) over the 1/8 VAE grid;
+        the result is an RGB image at 1/8 of the output resolution.
+        """
+        packed = latents[0].detach().float().cpu()
+        grid_h = height // 16
+        grid_w = packed.shape[0] // grid_h
+        
+        unpacked = (
+            packed.view(grid_h, grid_w, 16, 2, 2)
+            .permute(2, 0, 3, 1, 4)
+            .reshape(16, grid_h * 2, grid_w * 2)
+        )
+        factors = torch.tensor(LATENT_RGB_FACTORS)
+        bias = torch.tensor(LATENT_RGB_BIAS)
+        rgb = torch.einsum("chw,cr->hwr", unpacked, factors) + bias
+        rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).byte()
+        
+        return Image.fromarray(rgb.numpy(), mode="RGB")
+    
+    def _make_step_callback(
+        self,
+        progress_callback: Callable[[Dict[str, Any]], None],
+        steps: int,
+        width: int,
+        height: int,
+        preview_interval: int,
+    ) -> Callable:
+        """Wrap progress_callback as a diffusers callback_on_step_end"""
+        start_time = time.time()
+        
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            done = step + 1
+            elapsed = time.time() - start_time
+            
+            preview = None
+            if preview_interval and done % preview_interval == 0 and done < steps:
+                image = self.latents_to_preview(
+                    callback_kwargs["latents"], width, height
+                )
+                preview = self.image_to_base64(image, format="JPEG")
+            
+            # May raise GenerationCancelled to abort the run
+            progress_callback({
+                "step": done,
+                "total_steps": steps,
+                "elapsed": elapsed,
+                "it_per_sec": done / elapsed if elapsed > 0 else None,
+                "preview": preview,
+            })
+            return callback_kwargs
+        
+        return on_step_end
+    
     def generate(
         self,
         prompt: str,
@@ -134,16 +324,31 @@ class FluxEngine:
         guidance: float = 3.5,
         seed: Optional[int] = None,
         batch_size: int = 1,
+        draft: bool = False,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        preview_interval: int = 0,
     ) -> Tuple[List[Image.Image], int, float]:
         """
         Generate images from prompt
         
+        Args:
+            draft: Fast preview - caps steps and downscales resolution
+            progress_callback: Called after every denoising step with
+                step/total_steps/elapsed/it_per_sec/preview (base64 JPEG
+                every preview_interval steps, else None). Raise
+                GenerationCancelled from it to stop the run.
+            preview_interval: Steps between latent previews (0 = none)
+        
         Returns:
             Tuple of (images, seed_used, generation_time)
         """
         if not self._loaded:
             self.load_model()
         
+        if draft or self.always_draft:
+            steps = min(steps, self.draft_steps)
+            width, height = cpu_profile.draft_size(width, height, self.draft_max_side)
+        
         # Set seed
         if seed is None:
             seed = torch.randint(0, 2**32 - 1, (1,)).item()
@@ -157,15 +362,34 @@ class FluxEngine:
         start_time = time.time()
         
         try:
+            embeds = self._encode_prompt(prompt, batch_size)
+            if embeds is not None:
+                prompt_kwargs = {
+                    "prompt_embeds": embeds[0],
+                    "pooled_prompt_embeds": embeds[1],
+                    "num_images_per_prompt": 1,
+                }
+            else:
+                prompt_kwargs = {
+                    "prompt": prompt,
+                    "num_images_per_prompt": batch_size,
+                }
+            
+            if progress_callback is not None:
+                prompt_kwargs["callback_on_step_end"] = self._make_step_callback(
+                    progress_callback, steps, width, height, preview_interval
+                )
+                prompt_kwargs["callback_on_step_end_tensor_inputs"] = ["latents"]
+            
             result = self.pipe(
-                prompt=prompt,
                 negative_prompt=negative_prompt if negative_prompt else None,
                 width=width,
                 height=height,
                 num_inference_steps=steps,
                 guidance_scale=guidance,
-                num_images_per_prompt=batch_size,
                 generator=generator,
+                max_sequence_length=self.max_sequence_length,
+                **prompt_kwargs,
             )
             
             images = result.images
@@ -179,6 +403,12 @@ class FluxEngine:
             
             return images, seed, generation_time
             
+        except GenerationCancelled:
+            console.print("[yellow]Generation cancelled[/yellow]")
+            if self.device == "cuda":
+                torch.cuda.empty_cache()
+            raise
+            
         except Exception as e:
             console.print(f"[red]Generation failed: {e}[/red]")
             raise
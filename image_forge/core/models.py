@@ -3,8 +3,10 @@ Data models for ImageForge
 """
 from enum import Enum
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
+import hashlib
+import json
 import uuid
 
 
@@ -27,16 +29,51 @@ class GenerationRequest(BaseModel):
     seed: Optional[int] = Field(default=None)
     batch_size: int = Field(default=1, ge=1, le=4)
     priority: int = Field(default=0, ge=0, le=10)  # Higher = more priority
+    draft: bool = False  # Fast low-res preview (fewer steps)
+    use_cache: bool = True  # Reuse results of identical seeded requests
     
     # Metadata
     project_id: Optional[str] = None
     callback_url: Optional[str] = None
+    
+    def fingerprint(self) -> Optional[str]:
+        """
+        Hash of everything that determines the output images.
+        None when the seed is random (output is not reproducible).
+        """
+        if self.seed is None:
+            return None
+        key = {
+            "prompt": " ".join(self.prompt.split()),
+            "negative_prompt": " ".join(self.negative_prompt.split()),
+            "width": self.width,
+            "height": self.height,
+            "steps": self.steps,
+            "guidance": self.guidance,
+            "seed": self.seed,
+            "batch_size": self.batch_size,
+            "draft": self.draft,
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True).encode()
+        ).hexdigest()
+
+
+class TaskProgress(BaseModel):
+    """Step-level progress reported by a worker"""
+    step: int = 0
+    total_steps: int = 0
+    elapsed: float = 0.0
+    it_per_sec: Optional[float] = None
+    preview: Optional[str] = None  # Base64 JPEG of the latest latent preview
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
 class GenerationTask(BaseModel):
     """Task in the queue"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     request: GenerationRequest
+    batch_id: Optional[str] = None
     status: TaskStatus = TaskStatus.PENDING
     worker_id: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -44,6 +81,10 @@ class GenerationTask(BaseModel):
     completed_at: Optional[datetime] = None
     error: Optional[str] = None
     result_paths: List[str] = Field(default_factory=list)
+    progress: Optional[TaskProgress] = None
+    # Submitters sharing this task (coalesced duplicates); cancelled
+    # only when the last of them cancels
+    subscribers: int = 1
     
     @property
     def duration(self) -> Optional[float]:
@@ -62,6 +103,41 @@ class GenerationResult(BaseModel):
     error: Optional[str] = None
 
 
+class BatchMode(str, Enum):
+    ALL_OR_NOTHING = "all_or_nothing"  # Reject the whole batch if it doesn't fit
+    PARTIAL = "partial"  # Enqueue as many as fit, report the rest
+
+
+class BatchRequest(BaseModel):
+    """Bulk submission of generation requests"""
+    requests: List[GenerationRequest] = Field(..., min_length=1)
+    mode: BatchMode = BatchMode.ALL_OR_NOTHING
+    batch_id: Optional[str] = None  # Generated if not given
+
+
+class BatchSubmission(BaseModel):
+    """Result of a bulk submission"""
+    batch_id: str
+    mode: BatchMode
+    accepted: int = 0
+    rejected: List[int] = Field(default_factory=list)  # Indexes not enqueued (queue full)
+    tasks: List[GenerationTask] = Field(default_factory=list)
+
+
+class BatchStatus(BaseModel):
+    """Aggregate progress of a batch"""
+    batch_id: str
+    total: int = 0
+    pending: int = 0
+    processing: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    progress: float = 0.0  # 0..1, includes step progress of running tasks
+    done: bool = False
+    task_ids: List[str] = Field(default_factory=list)
+
+
 class WorkerInfo(BaseModel):
     """Information about a worker"""
     id: str
@@ -73,6 +149,8 @@ class WorkerInfo(BaseModel):
     tasks_completed: int = 0
     last_heartbeat: datetime = Field(default_factory=datetime.utcnow)
     avg_generation_time: Optional[float] = None
+    avg_it_per_sec: Optional[float] = None  # Denoising speed
+    cache_stats: Dict[str, Any] = Field(default_factory=dict)  # Prompt embedding cache
 
 
 class QueueStats(BaseModel):
@@ -83,3 +161,5 @@ class QueueStats(BaseModel):
     failed_tasks: int = 0
     active_workers: int = 0
     estimated_wait_time: Optional[float] = None
+    cache_hits: int = 0  # Duplicates served from stored results
+    coalesced: int = 0  # Duplicates attached to an in-flight task
@@ -3,16 +3,22 @@ Task Queue Manager for distributed generation
 """
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Any
 from collections import defaultdict
 import heapq
+import uuid
+from pathlib import Path
 
 from .models import (
     GenerationTask, 
     GenerationRequest, 
     TaskStatus, 
+    TaskProgress,
     WorkerInfo,
     QueueStats,
+    BatchMode,
+    BatchSubmission,
+    BatchStatus,
 )
 
 
@@ -27,26 +33,128 @@ class QueueManager:
         
         # Priority queue: (priority, created_at, task_id)
         self._pending_queue: List[tuple] = []
+        # Live PENDING tasks: the heap also holds stale entries (priority
+        # bumps, cancelled tasks) until they are popped
+        self._pending_count = 0
         
         # Workers
         self._workers: Dict[str, WorkerInfo] = {}
         
+        # Batch id -> task ids (in submission order)
+        self._batches: Dict[str, List[str]] = {}
+        
+        # Request fingerprint -> task id (seeded requests only)
+        self._result_index: Dict[str, str] = {}  # completed
+        self._inflight_index: Dict[str, str] = {}  # pending / processing
+        
         # Stats
         self._completed_count = 0
         self._failed_count = 0
         self._total_generation_time = 0.0
+        self._cache_hits = 0
+        self._coalesced_count = 0
+        
+        # Per-task events, set on any status/progress change
+        self._task_events: Dict[str, asyncio.Event] = {}
         
         # Lock for thread safety
         self._lock = asyncio.Lock()
     
+    def _notify(self, task_id: str):
+        """Wake everyone waiting on this task's next update"""
+        event = self._task_events.pop(task_id, None)
+        if event:
+            event.set()
+    
+    def subscribe(self, task_id: str) -> asyncio.Event:
+        """
+        Event set by the task's next update.
+        
+        Take it before reading the task's state: an update that lands
+        between the read and the wait then still wakes the waiter.
+        """
+        return self._task_events.setdefault(task_id, asyncio.Event())
+    
+    async def wait_for_update(
+        self,
+        task_id: str,
+        timeout: float = 30.0,
+        event: Optional[asyncio.Event] = None,
+    ) -> bool:
+        """
+        Wait until the task changes status or reports progress.
+        
+        Args:
+            event: from subscribe() before the state was read
+        
+        Returns:
+            False on timeout
+        """
+        event = event or self.subscribe(task_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    async def wait_for_any_update(
+        self,
+        task_ids: List[str],
+        timeout: float = 30.0,
+        events: Optional[Dict[str, asyncio.Event]] = None,
+    ) -> bool:
+        """
+        Wait until any of the tasks changes status or reports progress.
+        
+        Args:
+            events: task id -> event from subscribe() before the state was read
+        
+        Returns:
+            False on timeout
+        """
+        events = events or {}
+        waiters = [
+            asyncio.ensure_future(
+                (events.get(task_id) or self.subscribe(task_id)).wait()
+            )
+            for task_id in set(task_ids)
+        ]
+        if not waiters:
+            return False
+        try:
+            done, _ = await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            return bool(done)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+    
     async def add_task(self, request: GenerationRequest) -> GenerationTask:
-        """Add a new generation task to the queue"""
+        """
+        Add a new generation task to the queue.
+        
+        Seeded requests identical to an earlier one are deduplicated:
+        a completed match is returned as-is (its images are reused) and an
+        in-flight match is shared by every submitter.
+        """
         async with self._lock:
-            if len(self._pending_queue) >= self.max_queue_size:
+            fingerprint = request.fingerprint() if request.use_cache else None
+            
+            if fingerprint:
+                existing = self._find_duplicate(fingerprint, request)
+                if existing:
+                    return existing
+            
+            if self._pending_count >= self.max_queue_size:
                 raise ValueError("Queue is full")
             
             task = GenerationTask(request=request)
             self._tasks[task.id] = task
+            self._pending_count += 1
+            
+            if fingerprint:
+                self._inflight_index[fingerprint] = task.id
             
             # Add to priority queue (negative priority for max-heap behavior)
             heapq.heappush(
@@ -56,6 +164,190 @@ class QueueManager:
             
             return task
     
+    def _lookup_duplicate(self, fingerprint: str) -> Optional[GenerationTask]:
+        """Completed or in-flight task for the fingerprint (lock held)"""
+        task_id = self._result_index.get(fingerprint)
+        if task_id:
+            task = self._tasks.get(task_id)
+            if (
+                task
+                and task.status == TaskStatus.COMPLETED
+                and task.result_paths
+                and all(Path(p).exists() for p in task.result_paths)
+            ):
+                return task
+            # Task was cleaned up or its images deleted
+            del self._result_index[fingerprint]
+        
+        task_id = self._inflight_index.get(fingerprint)
+        if task_id:
+            task = self._tasks.get(task_id)
+            if task and task.status in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+                return task
+            del self._inflight_index[fingerprint]
+        
+        return None
+    
+    def _attach_duplicate(self, task: GenerationTask, request: GenerationRequest):
+        """Account for a request served by an existing task (lock held)"""
+        if task.status == TaskStatus.COMPLETED:
+            self._cache_hits += 1
+            return
+        
+        # Every submitter holds the shared task until it cancels
+        task.subscribers += 1
+        
+        # A more urgent duplicate bumps the shared task; the stale
+        # heap entry is skipped once the task leaves PENDING
+        if (
+            task.status == TaskStatus.PENDING
+            and request.priority > task.request.priority
+        ):
+            task.request.priority = request.priority
+            heapq.heappush(
+                self._pending_queue,
+                (-request.priority, task.created_at.timestamp(), task.id)
+            )
+        self._coalesced_count += 1
+    
+    def _find_duplicate(
+        self,
+        fingerprint: str,
+        request: GenerationRequest,
+    ) -> Optional[GenerationTask]:
+        """Find and attach to a completed or in-flight duplicate (lock held)"""
+        task = self._lookup_duplicate(fingerprint)
+        if task:
+            self._attach_duplicate(task, request)
+        return task
+    
+    async def add_tasks(
+        self,
+        requests: List[GenerationRequest],
+        mode: BatchMode = BatchMode.ALL_OR_NOTHING,
+        batch_id: Optional[str] = None,
+    ) -> BatchSubmission:
+        """
+        Atomically add a batch of tasks under one lock acquisition.
+        
+        Duplicates (see add_task) take no queue slot. In ALL_OR_NOTHING mode
+        nothing is enqueued unless every new task fits; in PARTIAL mode
+        requests are enqueued in order until the queue is full and the
+        rest are reported in BatchSubmission.rejected.
+        
+        Raises:
+            ValueError: ALL_OR_NOTHING batch does not fit
+        """
+        batch_id = batch_id or str(uuid.uuid4())
+        
+        async with self._lock:
+            # Pass 1: resolve duplicates; nothing is enqueued or attached
+            # yet (only stale index entries are pruned)
+            fingerprints = [
+                r.fingerprint() if r.use_cache else None for r in requests
+            ]
+            duplicates: List[Optional[GenerationTask]] = []
+            seen_in_batch = set()
+            new_count = 0
+            for fingerprint in fingerprints:
+                existing = self._lookup_duplicate(fingerprint) if fingerprint else None
+                duplicates.append(existing)
+                if existing is None and fingerprint not in seen_in_batch:
+                    new_count += 1
+                if fingerprint:
+                    seen_in_batch.add(fingerprint)
+            
+            free_slots = max(0, self.max_queue_size - self._pending_count)
+            if mode == BatchMode.ALL_OR_NOTHING and new_count > free_slots:
+                raise ValueError(
+                    f"Queue is full: batch needs {new_count} slots, {free_slots} free"
+                )
+            
+            # Pass 2: create tasks; distinct created_at keeps batch order in the heap
+            base_time = datetime.utcnow()
+            submission = BatchSubmission(batch_id=batch_id, mode=mode)
+            batch_task_ids: List[str] = []
+            in_batch: Dict[str, GenerationTask] = {}
+            new_entries = []
+            
+            for index, (request, fingerprint, existing) in enumerate(
+                zip(requests, fingerprints, duplicates)
+            ):
+                if existing is None and fingerprint in in_batch:
+                    existing = in_batch[fingerprint]
+                
+                if existing is not None:
+                    self._attach_duplicate(existing, request)
+                    task = existing
+                elif len(new_entries) >= free_slots:
+                    submission.rejected.append(index)
+                    continue
+                else:
+                    task = GenerationTask(
+                        request=request,
+                        batch_id=batch_id,
+                        created_at=base_time + timedelta(microseconds=index),
+                    )
+                    self._tasks[task.id] = task
+                    if fingerprint:
+                        self._inflight_index[fingerprint] = task.id
+                        in_batch[fingerprint] = task
+                    new_entries.append(
+                        (-request.priority, task.created_at.timestamp(), task.id)
+                    )
+                
+                submission.tasks.append(task)
+                batch_task_ids.append(task.id)
+            
+            if new_entries:
+                self._pending_queue.extend(new_entries)
+                heapq.heapify(self._pending_queue)
+                self._pending_count += len(new_entries)
+            
+            self._batches.setdefault(batch_id, []).extend(batch_task_ids)
+            submission.accepted = len(submission.tasks)
+            
+            return submission
+    
+    async def get_batch_status(self, batch_id: str) -> Optional[BatchStatus]:
+        """Aggregate status of a batch, None if unknown"""
+        task_ids = self._batches.get(batch_id)
+        if task_ids is None:
+            return None
+        
+        status = BatchStatus(batch_id=batch_id, task_ids=list(task_ids))
+        finished = 0.0
+        for task_id in task_ids:
+            task = self._tasks.get(task_id)
+            if not task:
+                continue
+            status.total += 1
+            if task.status == TaskStatus.PENDING:
+                status.pending += 1
+            elif task.status == TaskStatus.PROCESSING:
+                status.processing += 1
+                if task.progress and task.progress.total_steps:
+                    finished += task.progress.step / task.progress.total_steps
+            elif task.status == TaskStatus.COMPLETED:
+                status.completed += 1
+            elif task.status == TaskStatus.FAILED:
+                status.failed += 1
+            elif task.status == TaskStatus.CANCELLED:
+                status.cancelled += 1
+        
+        terminal = status.completed + status.failed + status.cancelled
+        if status.total:
+            status.progress = (terminal + finished) / status.total
+        status.done = terminal == status.total
+        return status
+    
+    def _release_fingerprint(self, task: GenerationTask):
+        """Drop a finished task from the in-flight index (lock held)"""
+        fingerprint = task.request.fingerprint()
+        if fingerprint and self._inflight_index.get(fingerprint) == task.id:
+            del self._inflight_index[fingerprint]
+        return fingerprint
+    
     async def get_next_task(self, worker_id: str) -> Optional[GenerationTask]:
         """Get the next task for a worker"""
         async with self._lock:
@@ -64,6 +356,7 @@ class QueueManager:
                 task = self._tasks.get(task_id)
                 
                 if task and task.status == TaskStatus.PENDING:
+                    self._pending_count -= 1
                     task.status = TaskStatus.PROCESSING
                     task.worker_id = worker_id
                     task.started_at = datetime.utcnow()
@@ -73,6 +366,7 @@ class QueueManager:
                         self._workers[worker_id].status = "busy"
                         self._workers[worker_id].current_task_id = task_id
                     
+                    self._notify(task_id)
                     return task
             
             return None
@@ -89,10 +383,24 @@ class QueueManager:
             if not task:
                 return
             
+            if task.status == TaskStatus.CANCELLED:
+                # Cancelled while the last step ran: keep it cancelled, no
+                # stats and no result index (duplicates must not get it)
+                self._release_worker(task)
+                return
+            
+            if task.status == TaskStatus.PENDING:
+                self._pending_count -= 1
             task.status = TaskStatus.COMPLETED
             task.completed_at = datetime.utcnow()
             task.result_paths = result_paths
             
+            fingerprint = self._release_fingerprint(task)
+            if fingerprint and task.request.use_cache and result_paths:
+                self._result_index[fingerprint] = task.id
+            
+            self._notify(task_id)
+            
             self._completed_count += 1
             self._total_generation_time += duration
             
@@ -112,37 +420,95 @@ class QueueManager:
                     worker.avg_generation_time = duration
     
     async def fail_task(self, task_id: str, error: str):
-        """Mark a task as failed"""
+        """Mark a task as failed (a cancelled task stays cancelled)"""
         async with self._lock:
             task = self._tasks.get(task_id)
             if not task:
                 return
             
-            task.status = TaskStatus.FAILED
-            task.completed_at = datetime.utcnow()
-            task.error = error
-            
-            self._failed_count += 1
+            if task.status != TaskStatus.CANCELLED:
+                if task.status == TaskStatus.PENDING:
+                    self._pending_count -= 1
+                task.status = TaskStatus.FAILED
+                task.completed_at = datetime.utcnow()
+                task.error = error
+                
+                self._release_fingerprint(task)
+                
+                self._failed_count += 1
+                self._notify(task_id)
             
-            # Update worker
-            if task.worker_id and task.worker_id in self._workers:
-                worker = self._workers[task.worker_id]
-                worker.status = "idle"
-                worker.current_task_id = None
+            self._release_worker(task)
+    
+    def _release_worker(self, task: GenerationTask):
+        """Mark the task's worker idle (lock held)"""
+        if task.worker_id and task.worker_id in self._workers:
+            worker = self._workers[task.worker_id]
+            worker.status = "idle"
+            worker.current_task_id = None
     
     async def get_task(self, task_id: str) -> Optional[GenerationTask]:
         """Get task by ID"""
         return self._tasks.get(task_id)
     
     async def cancel_task(self, task_id: str) -> bool:
-        """Cancel a pending task"""
+        """
+        Cancel a pending or processing task.
+        A processing task is stopped by its worker at the next step.
+        A task shared by coalesced submitters only loses one subscriber;
+        the work is cancelled when the last of them cancels.
+        """
         async with self._lock:
             task = self._tasks.get(task_id)
-            if task and task.status == TaskStatus.PENDING:
+            if task and task.status in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+                if task.subscribers > 1:
+                    task.subscribers -= 1
+                    return True
+                if task.status == TaskStatus.PENDING:
+                    self._pending_count -= 1
                 task.status = TaskStatus.CANCELLED
+                task.completed_at = datetime.utcnow()
+                self._release_fingerprint(task)
+                self._notify(task_id)
                 return True
             return False
     
+    async def update_progress(
+        self,
+        task_id: str,
+        worker_id: str,
+        progress: TaskProgress,
+    ) -> bool:
+        """
+        Store step progress from a worker.
+        
+        Returns:
+            False if the worker should stop (task cancelled or gone)
+        """
+        async with self._lock:
+            task = self._tasks.get(task_id)
+            if not task or task.status != TaskStatus.PROCESSING:
+                return False
+            
+            # Keep the last preview when this step didn't carry one
+            if progress.preview is None and task.progress is not None:
+                progress.preview = task.progress.preview
+            task.progress = progress
+            
+            worker = self._workers.get(worker_id)
+            if worker:
+                worker.last_heartbeat = datetime.utcnow()
+                if progress.it_per_sec:
+                    if worker.avg_it_per_sec:
+                        worker.avg_it_per_sec = (
+                            worker.avg_it_per_sec * 0.9 + progress.it_per_sec * 0.1
+                        )
+                    else:
+                        worker.avg_it_per_sec = progress.it_per_sec
+            
+            self._notify(task_id)
+            return True
+    
     async def register_worker(self, worker: WorkerInfo):
         """Register a new worker"""
         async with self._lock:
@@ -154,11 +520,17 @@ class QueueManager:
             if worker_id in self._workers:
                 del self._workers[worker_id]
     
-    async def worker_heartbeat(self, worker_id: str):
+    async def worker_heartbeat(
+        self,
+        worker_id: str,
+        cache_stats: Optional[Dict[str, Any]] = None,
+    ):
         """Update worker heartbeat"""
         async with self._lock:
             if worker_id in self._workers:
                 self._workers[worker_id].last_heartbeat = datetime.utcnow()
+                if cache_stats is not None:
+                    self._workers[worker_id].cache_stats = cache_stats
     
     async def get_workers(self) -> List[WorkerInfo]:
         """Get all registered workers"""
@@ -193,6 +565,8 @@ class QueueManager:
             failed_tasks=self._failed_count,
             active_workers=active_workers,
             estimated_wait_time=estimated_wait,
+            cache_hits=self._cache_hits,
+            coalesced=self._coalesced_count,
         )
     
     async def get_recent_tasks(self, limit: int = 50) -> List[GenerationTask]:
@@ -216,4 +590,16 @@ class QueueManager:
             for task_id in to_remove:
                 del self._tasks[task_id]
             
+            removed = set(to_remove)
+            for task_id in removed:
+                self._task_events.pop(task_id, None)
+            self._batches = {
+                batch_id: task_ids for batch_id, task_ids in self._batches.items()
+                if not removed.issuperset(task_ids)
+            }
+            self._result_index = {
+                fp: task_id for fp, task_id in self._result_index.items()
+                if task_id not in removed
+            }
+            
             return len(to_remove)
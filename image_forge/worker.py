@@ -12,7 +12,7 @@ from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn
 
 from . import config
-from .core.flux_engine import FluxEngine
+from .core.flux_engine import FluxEngine, GenerationCancelled
 from .core.models import WorkerInfo, TaskStatus
 
 console = Console()
@@ -36,6 +36,9 @@ class Worker:
         self.running = False
         self.tasks_completed = 0
         
+        # Tasks the master told us to stop (checked between steps)
+        self._cancelled_tasks: set = set()
+        
     async def start(self):
         """Start the worker"""
         console.print(f"[bold green]🚀 Starting ImageForge Worker[/bold green]")
@@ -50,6 +53,15 @@ class Worker:
             enable_cpu_offload=config.ENABLE_CPU_OFFLOAD,
             enable_attention_slicing=config.ENABLE_ATTENTION_SLICING,
             enable_vae_tiling=config.ENABLE_VAE_TILING,
+            embedding_cache_mb=config.EMBEDDING_CACHE_MB,
+            max_sequence_length=config.FLUX_MAX_SEQUENCE_LENGTH,
+            cpu_threads=config.CPU_THREADS,
+            cpu_interop_threads=config.CPU_INTEROP_THREADS,
+            channels_last=config.ENABLE_CHANNELS_LAST,
+            compile_model=config.ENABLE_TORCH_COMPILE,
+            draft_steps=config.DRAFT_STEPS,
+            draft_max_side=config.DRAFT_MAX_SIDE,
+            always_draft=config.ALWAYS_DRAFT,
         )
         
         # Load model
@@ -92,6 +104,7 @@ class Worker:
             try:
                 await client.post(
                     f"{self.master_url}/api/worker/{self.worker_id}/heartbeat",
+                    json=self.engine.get_cache_stats(),
                     timeout=5,
                 )
             except:
@@ -128,6 +141,37 @@ class Worker:
             except Exception as e:
                 console.print(f"[red]Failed to report completion: {e}[/red]")
     
+    async def _report_progress(self, task_id: str, progress: dict):
+        """Send step progress to master; remember if the task was cancelled"""
+        async with httpx.AsyncClient() as client:
+            try:
+                response = await client.post(
+                    f"{self.master_url}/api/worker/{self.worker_id}/progress",
+                    params={"task_id": task_id},
+                    json=progress,
+                    timeout=5,
+                )
+                if response.json().get("status") == "cancelled":
+                    self._cancelled_tasks.add(task_id)
+            except Exception:
+                pass  # Progress is best-effort
+    
+    def _make_progress_callback(self, task_id: str):
+        """
+        Progress callback for FluxEngine. Runs on the generation thread,
+        so reports are scheduled onto the worker's event loop.
+        """
+        loop = asyncio.get_running_loop()
+        
+        def on_progress(progress: dict):
+            if task_id in self._cancelled_tasks:
+                raise GenerationCancelled(task_id)
+            asyncio.run_coroutine_threadsafe(
+                self._report_progress(task_id, progress), loop
+            )
+        
+        return on_progress
+    
     async def _fail_task(self, task_id: str, error: str):
         """Report task failure to master"""
         async with httpx.AsyncClient() as client:
@@ -151,8 +195,9 @@ class Worker:
         console.print(f"\n[cyan]📋 Processing task {task_id[:8]}...[/cyan]")
         
         try:
-            # Generate images
-            images, seed, duration = self.engine.generate(
+            # Generate images (in a thread so progress reports can go out)
+            images, seed, duration = await asyncio.to_thread(
+                self.engine.generate,
                 prompt=request["prompt"],
                 negative_prompt=request.get("negative_prompt", ""),
                 width=request.get("width", 1024),
@@ -161,6 +206,9 @@ class Worker:
                 guidance=request.get("guidance", 3.5),
                 seed=request.get("seed"),
                 batch_size=request.get("batch_size", 1),
+                draft=request.get("draft", False),
+                progress_callback=self._make_progress_callback(task_id),
+                preview_interval=config.PREVIEW_INTERVAL,
             )
             
             # Save images
@@ -180,9 +228,24 @@ class Worker:
             console.print(f"[green]✓ Task completed ({duration:.1f}s)[/green]")
             console.print(f"   Total completed: {self.tasks_completed}")
             
+            cache_stats = self.engine.get_cache_stats()
+            if cache_stats:
+                console.print(
+                    f"   Embedding cache: {cache_stats['hit_rate']:.0%} hit rate "
+                    f"({cache_stats['entries']} prompts)"
+                )
+            
+        except GenerationCancelled:
+            console.print("[yellow]⏹ Task cancelled by master[/yellow]")
+            # Frees this worker on the master; the task stays cancelled
+            await self._fail_task(task_id, "cancelled")
+            
         except Exception as e:
             console.print(f"[red]✗ Task failed: {e}[/red]")
             await self._fail_task(task_id, str(e))
+        
+        finally:
+            self._cancelled_tasks.discard(task_id)
     
     async def _process_loop(self):
         """Main processing loop"""
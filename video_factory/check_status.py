@@ -1,8 +1,10 @@
-import json
+import sys
 from pathlib import Path
 
-with open('video_factory/output/projects.json', 'r') as f:
-    data = json.load(f)
+sys.path.insert(0, 'video_factory/core')
+from project_store import ProjectStore
+
+data = ProjectStore(Path('video_factory/output')).load()
 
 print('=== СТАТУС ПРОЕКТОВ ===')
 for key, proj in data.items():
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Video Factory — консольный режим (без GUI)
+
+Те же проекты и очередь, что во вкладке «Очередь», но без PyQt6: для
+серверов и рендер-машин под systemd.
+
+    python cli.py create "Название" "Тема видео" [--competitor URL]
+                         [--priority 5] [--deadline 2025-03-01T18:00]
+    python cli.py enqueue proj_1 proj_2
+    python cli.py prioritize proj_1 [--priority 5] [--deadline ...]
+    python cli.py requeue-failed
+    python cli.py status [--json] [proj_1]
+    python cli.py run                 # обработать очередь и выйти
+    python cli.py daemon              # работать постоянно, ждать команды
+    python cli.py render proj_1 [--subtitles]
+    python cli.py startup             # проверка времени старта
+
+Если демон уже работает, create/enqueue/requeue-failed/render не трогают
+хранилище, а передаются ему (core/pipeline_daemon.py).
+
+Тяжёлые модули (MoviePy, gradio_client, Groq) импортируются только когда
+этап их реально использует, поэтому status и create стартуют за доли
+секунды. Бюджет старта проверяет команда startup (VF_STARTUP_BUDGET, сек).
+
+Пример юнита systemd:
+
+    [Unit]
+    Description=Video Factory queue
+    After=network-online.target
+
+    [Service]
+    WorkingDirectory=/opt/video_factory
+    ExecStart=/usr/bin/python3 cli.py daemon --render-workers 2
+    KillSignal=SIGTERM
+    TimeoutStopSec=900
+    Restart=on-failure
+
+    [Install]
+    WantedBy=multi-user.target
+"""
+
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+# Добавляем корневую папку в path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которых не должно быть в процессе после старта
+HEAVY_MODULES = ("moviepy", "gradio_client", "groq", "PyQt6", "googleapiclient")
+
+DEFAULT_STARTUP_BUDGET = 1.0  # Сек до готового SmartPipeline
+
+
+def _deadline(text: str) -> str:
+    """Проверка ISO-даты дедлайна (пустая строка — без дедлайна)"""
+    if text:
+        from datetime import datetime
+        try:
+            datetime.fromisoformat(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"не ISO-дата: {text}")
+    return text
+
+
+def _output_dir(args) -> Path:
+    if args.output:
+        return Path(args.output)
+    from config import OUTPUT_DIR
+    return OUTPUT_DIR
+
+
+def _pipeline(args, **kwargs):
+    from core.smart_pipeline import SmartPipeline
+    return SmartPipeline(_output_dir(args), **kwargs)
+
+
+def _daemon_pid(args):
+    from core.pipeline_daemon import running_pid
+    return running_pid(_output_dir(args))
+
+
+def _send(args, command: dict):
+    from core.pipeline_daemon import send_command
+    send_command(_output_dir(args), command)
+    print(f"→ Передано демону: {command['cmd']}")
+
+
+# === Команды ===
+
+def cmd_create(args) -> int:
+    project_id = f"proj_{int(time.time())}_{os.getpid()}"
+    command = {
+        "cmd": "create",
+        "project_id": project_id,
+        "name": args.name,
+        "topic": args.topic,
+        "competitor_channel": args.competitor,
+        "duration": args.duration,
+        "language": args.language,
+        "priority": args.priority,
+        "deadline": args.deadline,
+        "enqueue": not args.no_enqueue,
+    }
+    if _daemon_pid(args):
+        _send(args, command)
+    else:
+        pipeline = _pipeline(args, render_workers=0)
+        project = pipeline.create_project(
+            args.name, args.topic, args.competitor, args.duration, args.language,
+            project_id=project_id, priority=args.priority, deadline=args.deadline,
+        )
+        if args.no_enqueue:
+            pipeline.hold_project(project.id)
+        else:
+            pipeline.add_to_queue(project.id)
+        pipeline.close()
+    print(project_id)
+    return 0
+
+
+def cmd_enqueue(args) -> int:
+    if _daemon_pid(args):
+        _send(args, {"cmd": "enqueue", "project_ids": args.project_ids})
+        return 0
+
+    pipeline = _pipeline(args, render_workers=0)
+    code = 0
+    for project_id in args.project_ids:
+        if pipeline.get_project(project_id) is None:
+            print(f"Нет проекта: {project_id}", file=sys.stderr)
+            code = 1
+            continue
+        pipeline.add_to_queue(project_id)
+    pipeline.close()
+    return code
+
+
+def cmd_prioritize(args) -> int:
+    command = {"cmd": "prioritize", "project_id": args.project_id,
+               "priority": args.priority, "deadline": args.deadline}
+    if _daemon_pid(args):
+        _send(args, command)
+        return 0
+    pipeline = _pipeline(args, render_workers=0)
+    if pipeline.get_project(args.project_id) is None:
+        print(f"Нет проекта: {args.project_id}", file=sys.stderr)
+        pipeline.close()
+        return 1
+    pipeline.set_priority(args.project_id, args.priority, args.deadline)
+    pipeline.close()
+    return 0
+
+
+def cmd_requeue_failed(args) -> int:
+    if _daemon_pid(args):
+        _send(args, {"cmd": "requeue_failed"})
+        return 0
+    pipeline = _pipeline(args, render_workers=0)
+    print(f"Возвращено в очередь: {pipeline.requeue_failed()}")
+    pipeline.close()
+    return 0
+
+
+def cmd_status(args) -> int:
+    # Только чтение хранилища — без SmartPipeline, журнала и config
+    from core.project_store import ProjectStore
+
+    data = ProjectStore(_output_dir(args)).load()
+    queue = data.get("_queue", [])
+    etas = data.get("_eta", {})
+    projects = {k: v for k, v in data.items() if not k.startswith("_")}
+    if args.project_id:
+        projects = {k: v for k, v in projects.items() if k == args.project_id}
+        if not projects:
+            print(f"Нет проекта: {args.project_id}", file=sys.stderr)
+            return 1
+
+    fields = ("name", "status", "progress", "current_step", "error_message", "final_video",
+              "priority", "deadline", "channel_style_id")
+    rows = [
+        {"id": pid, **{f: p.get(f, "") for f in fields}, "queued": pid in queue, "eta": etas.get(pid)}
+        for pid, p in sorted(projects.items(), key=lambda item: item[1].get("created_at", ""))
+    ]
+    # Очередь — в порядке обработки, остальные после
+    rows.sort(key=lambda row: queue.index(row["id"]) if row["queued"] else len(queue))
+
+    if args.json:
+        print(json.dumps({"daemon_pid": _daemon_pid(args), "queue": queue, "projects": rows},
+                         ensure_ascii=False, indent=2))
+        return 0
+
+    pid = _daemon_pid(args)
+    print(f"Демон: {'pid ' + str(pid) if pid else 'не запущен'} | В очереди: {len(queue)}")
+    for row in rows:
+        mark = "⏳" if row["queued"] else " "
+        eta = f"≈{time.strftime('%d.%m %H:%M', time.localtime(row['eta']))}" if row["eta"] else ""
+        print(f"{mark} {row['id']:28} {row['status']:18} {row['progress']:>3}% {eta:13} {row['name'][:40]}")
+        if row["priority"] or row["deadline"]:
+            print(f"    приоритет {row['priority'] or 0}, дедлайн {row['deadline'] or '-'}")
+        if row["error_message"]:
+            print(f"    ⚠️ {row['error_message'][:120]}")
+        if row["final_video"] and args.project_id:
+            print(f"    🎬 {row['final_video']}")
+    return 0
+
+
+def _serve(args, until_idle: bool) -> int:
+    from core.pipeline_daemon import DaemonBusyError, PipelineDaemon
+
+    kwargs = {"max_active_projects": args.max_active}
+    if args.render_workers is not None:
+        kwargs["render_workers"] = args.render_workers
+    pipeline = _pipeline(args, **kwargs)
+    try:
+        return PipelineDaemon(pipeline).serve(until_idle=until_idle)
+    except DaemonBusyError as e:
+        pipeline.close()
+        print(e, file=sys.stderr)
+        return 2
+
+
+def cmd_run(args) -> int:
+    return _serve(args, until_idle=True)
+
+
+def cmd_daemon(args) -> int:
+    return _serve(args, until_idle=False)
+
+
+def cmd_render(args) -> int:
+    if _daemon_pid(args):
+        _send(args, {"cmd": "render", "project_id": args.project_id, "subtitles": args.subtitles})
+        return 0
+
+    kwargs = {}
+    if args.render_workers is not None:
+        kwargs["render_workers"] = args.render_workers
+    pipeline = _pipeline(args, **kwargs)
+    result = pipeline.render_final(args.project_id, add_subtitles=args.subtitles)
+    pipeline.close()
+    if result:
+        print(result)
+        return 0
+    return 1
+
+
+def cmd_startup(args) -> int:
+    """Время старта до готового SmartPipeline и какие тяжёлые модули загружены"""
+    import tempfile
+
+    budget = args.budget
+    if budget is None:
+        budget = float(os.environ.get("VF_STARTUP_BUDGET", DEFAULT_STARTUP_BUDGET))
+
+    imported = time.perf_counter()
+    from core.smart_pipeline import SmartPipeline
+    import_time = time.perf_counter() - imported
+
+    # Пустая папка — меряем сам старт, а не чтение конкретных проектов
+    with tempfile.TemporaryDirectory() as tmp:
+        created = time.perf_counter()
+        pipeline = SmartPipeline(Path(tmp), render_workers=0)
+        create_time = time.perf_counter() - created
+        pipeline.close()
+
+    total = time.perf_counter() - _STARTED
+    heavy = sorted(m for m in HEAVY_MODULES if m in sys.modules)
+
+    print(f"Старт интерпретатора → готовый пайплайн: {total * 1000:.0f} мс (бюджет {budget * 1000:.0f} мс)")
+    print(f"  импорт SmartPipeline: {import_time * 1000:.0f} мс")
+    print(f"  создание SmartPipeline: {create_time * 1000:.0f} мс")
+    print(f"  тяжёлые модули: {', '.join(heavy) if heavy else 'нет'}")
+
+    if heavy or total > budget:
+        print("❌ Бюджет старта превышен", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Video Factory без GUI")
+    parser.add_argument("--output", help="Папка output (по умолчанию из config.py)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("create", help="Создать проект")
+    p.add_argument("name")
+    p.add_argument("topic")
+    p.add_argument("--competitor", default="", help="Канал конкурента")
+    p.add_argument("--duration", default="20-30 минут")
+    p.add_argument("--language", default="Русский")
+    p.add_argument("--priority", type=int, default=0, help="Больше — раньше")
+    p.add_argument("--deadline", type=_deadline, default="", help="Время публикации, ISO: 2025-03-01T18:00")
+    p.add_argument("--no-enqueue", action="store_true", help="Не ставить в очередь")
+    p.set_defaults(func=cmd_create)
+
+    p = sub.add_parser("enqueue", help="Поставить проекты в очередь")
+    p.add_argument("project_ids", nargs="+")
+    p.set_defaults(func=cmd_enqueue)
+
+    p = sub.add_parser("prioritize", help="Приоритет и дедлайн проекта")
+    p.add_argument("project_id")
+    p.add_argument("--priority", type=int, default=None)
+    p.add_argument("--deadline", type=_deadline, default=None, help="ISO; пустая строка — снять")
+    p.set_defaults(func=cmd_prioritize)
+
+    p = sub.add_parser("requeue-failed", help="Вернуть в очередь проекты с ошибкой")
+    p.set_defaults(func=cmd_requeue_failed)
+
+    p = sub.add_parser("status", help="Состояние проектов и очереди")
+    p.add_argument("project_id", nargs="?")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_status)
+
+    for name, func, text in (("run", cmd_run, "Обработать очередь и выйти"),
+                             ("daemon", cmd_daemon, "Работать постоянно (systemd)")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("--max-active", type=int, default=3, help="Проектов одновременно")
+        p.add_argument("--render-workers", type=int, default=None,
+                       help="Процессов рендера (по умолчанию из настроек)")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("render", help="Финальный рендер проекта")
+    p.add_argument("project_id")
+    p.add_argument("--subtitles", action="store_true")
+    p.add_argument("--render-workers", type=int, default=None)
+    p.set_defaults(func=cmd_render)
+
+    p = sub.add_parser("startup", help="Проверить бюджет времени старта")
+    p.add_argument("--budget", type=float, default=None, help="Сек (VF_STARTUP_BUDGET)")
+    p.set_defaults(func=cmd_startup)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
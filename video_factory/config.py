@@ -57,6 +57,9 @@ class APIConfig:
     # Hugging Face (FLUX генерация)
     huggingface_tokens: List[str] = field(default_factory=list)  # Токены для ротации
     
+    # Свой image_forge master (генерация на своих воркерах)
+    image_forge_url: str = ""  # http://host:8000
+    
     # Telegram
     telegram_bot_token: str = ""
     telegram_chat_id: str = ""
@@ -137,6 +140,7 @@ class APIConfig:
             stability_keys=parse_keys("STABILITY_API_KEYS"),
             novita_keys=parse_keys("NOVITA_API_KEYS"),
             huggingface_tokens=parse_keys("HUGGINGFACE_TOKENS"),
+            image_forge_url=os.environ.get("IMAGE_FORGE_URL", ""),
             telegram_bot_token=os.environ.get("TELEGRAM_BOT_TOKEN", ""),
             telegram_chat_id=os.environ.get("TELEGRAM_CHAT_ID", "")
         )
@@ -156,6 +160,18 @@ class VideoConfig:
     resolution: str = "1920x1080"
     fps: int = 30
     bitrate: str = "12M"
+    render_workers: int = 0  # >0 — рендер в отдельных процессах (core/render_farm.py)
+    # Провайдеры картинок сцен (core/image_router.py): пусто — все настроенные
+    image_providers: List[str] = field(default_factory=list)
+    image_hedging: bool = False  # Дублировать медленный запрос второму провайдеру
+    image_cache_gb: float = 5.0  # Кэш картинок по промпту для всех проектов (0 — выкл)
+    # Проходные сцены — похожей картинкой из кэша другого проекта: порог
+    # сходства промптов 0..1 (0 — выкл, разумно 0.8)
+    image_reuse_similar: float = 0.0
+    # Проверка кадров до рендера (core/image_triage.py): однотонные, тёмные,
+    # повторы, не те пропорции — перегенерировать столько раз
+    image_triage: bool = True
+    image_triage_retries: int = 1
 
 
 @dataclass
@@ -197,6 +213,7 @@ class AppConfig:
                 "groq_model": self.api.groq_model,
                 "temperature": self.api.temperature,
                 "huggingface_tokens": self.api.huggingface_tokens,
+                "image_forge_url": self.api.image_forge_url,
                 "telegram_bot_token": self.api.telegram_bot_token,
                 "telegram_chat_id": self.api.telegram_chat_id,
             },
@@ -233,6 +250,7 @@ class AppConfig:
                         groq_model=api_data.get("groq_model", "llama-3.3-70b-versatile"),
                         temperature=api_data.get("temperature", 0.7),
                         huggingface_tokens=api_data.get("huggingface_tokens", []),
+                        image_forge_url=api_data.get("image_forge_url", ""),
                         together_keys=api_data.get("together_keys", []),
                         stability_keys=api_data.get("stability_keys", []),
                         replicate_keys=api_data.get("replicate_keys", []),
@@ -274,6 +292,8 @@ class AppConfig:
                         config.api.novita_keys = env_api.novita_keys
                     if env_api.huggingface_tokens:
                         config.api.huggingface_tokens = env_api.huggingface_tokens
+                    if env_api.image_forge_url:
+                        config.api.image_forge_url = env_api.image_forge_url
                     # Telegram
                     if env_api.telegram_bot_token:
                         config.api.telegram_bot_token = env_api.telegram_bot_token
@@ -1,70 +1,73 @@
 # Core модули Video Factory
+#
+# Импорт ленивый (PEP 562): `from core.smart_pipeline import ...` или
+# `core.SmartPipeline` загружают только нужный модуль. Раньше импорт пакета
+# тянул MoviePy, gradio_client, Groq и Google API сразу — это секунды
+# старта даже для консольной команды status.
 
-from .youtube_analyzer import YouTubeAnalyzer, ChannelInfo, VideoInfo
-from .groq_client import GroqClient
-from .channel_profile import ChannelProfile, ProfileManager
-from .elevenlabs_client import ElevenLabsClient, Voice
-from .image_generator import ImageGenerator, ImageResult
-from .video_editor import VideoEditor, VideoConfig, SceneConfig
-from .srt_generator import SRTGenerator
-from .copyright_checker import CopyrightChecker, CopyrightStatus
-from .project_manager import ProjectManager, VideoProject, ProjectStage
-from .youtube_music import YouTubeAudioLibrary, AudioTrack
-from .retention_analyzer import RetentionAnalyzer, VideoStructure
-from .seo_optimizer import SEOOptimizer, SEOResult
-from .script_parser import ScriptParser, Scene
-from .batch_processor import BatchProcessor, VideoTask, TaskStatus
-from .exporter import ProjectExporter, ExportResult
-from .pipeline import VideoPipeline, PipelineResult
-from .smart_pipeline import SmartPipeline, SmartProject, ProjectStatus
-from .channel_style import ChannelStyle, ChannelStyleManager
-from .thumbnail_generator import ThumbnailGenerator, ThumbnailResult, TrendAnalyzer
-from .quality_checker import QualityChecker, QualityReport, QualityIssue
-
-__all__ = [
+import importlib
+
+# Имя -> модуль, в котором оно определено
+_EXPORTS = {
     # YouTube
-    'YouTubeAnalyzer', 'ChannelInfo', 'VideoInfo',
-    'YouTubeAudioLibrary', 'AudioTrack',
-    
+    'YouTubeAnalyzer': 'youtube_analyzer', 'ChannelInfo': 'youtube_analyzer', 'VideoInfo': 'youtube_analyzer',
+    'YouTubeAudioLibrary': 'youtube_music', 'AudioTrack': 'youtube_music',
+
     # AI
-    'GroqClient',
-    
+    'GroqClient': 'groq_client',
+
     # Профили
-    'ChannelProfile', 'ProfileManager',
-    
+    'ChannelProfile': 'channel_profile', 'ProfileManager': 'channel_profile',
+
     # Озвучка
-    'ElevenLabsClient', 'Voice',
-    
+    'ElevenLabsClient': 'elevenlabs_client', 'Voice': 'elevenlabs_client',
+
     # Изображения
-    'ImageGenerator', 'ImageResult',
-    
+    'ImageGenerator': 'image_generator', 'ImageResult': 'image_generator',
+
     # Видео
-    'VideoEditor', 'VideoConfig', 'SceneConfig',
-    'SRTGenerator',
-    
+    'VideoEditor': 'video_editor', 'VideoConfig': 'video_editor', 'SceneConfig': 'video_editor',
+    'SRTGenerator': 'srt_generator',
+
     # Анализ
-    'RetentionAnalyzer', 'VideoStructure',
-    'SEOOptimizer', 'SEOResult',
-    'CopyrightChecker', 'CopyrightStatus',
-    
+    'RetentionAnalyzer': 'retention_analyzer', 'VideoStructure': 'retention_analyzer',
+    'SEOOptimizer': 'seo_optimizer', 'SEOResult': 'seo_optimizer',
+    'CopyrightChecker': 'copyright_checker', 'CopyrightStatus': 'copyright_checker',
+
     # Сценарий
-    'ScriptParser', 'Scene',
-    
+    'ScriptParser': 'script_parser', 'Scene': 'script_parser',
+
     # Проекты
-    'ProjectManager', 'VideoProject', 'ProjectStage',
-    'BatchProcessor', 'VideoTask', 'TaskStatus',
-    'ProjectExporter', 'ExportResult',
-    
+    'ProjectManager': 'project_manager', 'VideoProject': 'project_manager', 'ProjectStage': 'project_manager',
+    'BatchProcessor': 'batch_processor', 'VideoTask': 'batch_processor', 'TaskStatus': 'batch_processor',
+    'ProjectExporter': 'exporter', 'ExportResult': 'exporter',
+
     # Pipeline
-    'VideoPipeline', 'PipelineResult',
-    'SmartPipeline', 'SmartProject', 'ProjectStatus',
-    
+    'VideoPipeline': 'pipeline', 'PipelineResult': 'pipeline',
+    'SmartPipeline': 'smart_pipeline', 'SmartProject': 'smart_pipeline', 'ProjectStatus': 'smart_pipeline',
+
     # Профили каналов
-    'ChannelStyle', 'ChannelStyleManager',
-    
+    'ChannelStyle': 'channel_style', 'ChannelStyleManager': 'channel_style',
+
     # Превью и тренды
-    'ThumbnailGenerator', 'ThumbnailResult', 'TrendAnalyzer',
-    
+    'ThumbnailGenerator': 'thumbnail_generator', 'ThumbnailResult': 'thumbnail_generator',
+    'TrendAnalyzer': 'thumbnail_generator',
+
     # Контроль качества
-    'QualityChecker', 'QualityReport', 'QualityIssue',
-]
+    'QualityChecker': 'quality_checker', 'QualityReport': 'quality_checker', 'QualityIssue': 'quality_checker',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value  # Следующее обращение — без __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
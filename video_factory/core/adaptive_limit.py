@@ -0,0 +1,246 @@
+"""
+Адаптивная параллельность провайдеров картинок (AIMD)
+
+Фиксированный лимит (у FLUX — min(8, число токенов)) плох в обе стороны.
+Когда Space свободен, можно больше. Когда растёт очередь Space или пошли
+rate limit и таймауты, лишние запросы только стоят в чужой очереди и жгут
+квоту токенов на повторах.
+
+Лимит меняется как окно TCP:
+
+    рост      +1 за «окно» (limit успешных ответов), пока задержка и доля
+              успехов в норме, а лимит действительно выбирается
+    снижение  ×0.5 при перегрузке: rate limit, таймаут или задержка
+              короткого окна (EWMA) в latency_tolerance раз больше долгой —
+              запросы ждут в очереди Space, а не генерируются
+
+Снижение — не чаще раза за окно: запросы, начатые до прошлого снижения,
+его не повторяют, иначе одна волна ошибок роняет лимит до минимума.
+Ошибки квоты и фильтра контента о нагрузке ничего не говорят и не
+учитываются; отмена (hedging, остановка проекта) — тоже.
+
+Живёт в event loop ImageService: acquire/release — без потоковых замков,
+статистика для логов и UI читается из других потоков под своим замком.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Optional
+
+from .retry_policy import QUOTA, RATE_LIMIT, SAFETY, classify_error
+
+OK = "ok"
+ERROR = "error"
+OVERLOAD = "overload"
+
+SHORT_ALPHA = 0.3         # EWMA задержки последних ответов
+LONG_ALPHA = 0.05         # EWMA «нормальной» задержки
+MIN_SAMPLES = 5           # Меньше ответов — задержке ещё не верим
+HEALTHY_SUCCESS = 0.8     # Доля успехов в окне, при которой можно расти
+THROUGHPUT_WINDOW = 300   # Сек, за которые считается пропускная способность
+
+
+def outcome_of(error: BaseException) -> Optional[str]:
+    """Что ошибка говорит о нагрузке: OVERLOAD, ERROR или None (ничего)"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or "timeout" in type(error).__name__.lower():
+        return OVERLOAD
+    error_class = classify_error(error)
+    if error_class == RATE_LIMIT:
+        return OVERLOAD
+    if error_class in (QUOTA, SAFETY):
+        return None
+    message = str(error).lower()
+    if "timeout" in message or "timed out" in message:
+        return OVERLOAD
+    return ERROR
+
+
+class _Slot:
+    """Место в лимите на время одного запроса"""
+
+    def __init__(self, start: float):
+        self.start = start
+        self.latency: Optional[float] = None
+        self.success = True
+
+    def done(self, response):
+        """Итог запроса: задержка — время генерации у провайдера, если он его знает"""
+        self.latency = getattr(response, "generation_time", None) or None
+        self.success = bool(getattr(response, "success", True))
+
+
+def _percentile(ordered: list, q: float) -> float:
+    return ordered[int(q * (len(ordered) - 1))] if ordered else 0.0
+
+
+class AdaptiveLimit:
+    """AIMD-лимит одновременных запросов к одному провайдеру"""
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: int = None,
+                 latency_tolerance: float = 2.0, backoff: float = 0.5, window: int = 50,
+                 name: str = "", log: Callable[[str], None] = print,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.name = name
+        self._log = log
+        self._clock = clock
+        # Старт с половины потолка: до первых ответов нагрузка Space неизвестна
+        self._limit = float(initial or max(self.min_limit, (self.max_limit + 1) // 2))
+        self.in_flight = 0
+        self._epoch = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+        self._stats_lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._done_at: Deque[float] = deque()
+        self._started: Optional[float] = None
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    # === Места ===
+
+    async def acquire(self) -> int:
+        """Занять место (ждёт, пока лимит не освободится); возвращает эпоху"""
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # Разбудили, но запрос отменён — место следующему
+                else:
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                raise
+        self.in_flight += 1
+        if self._started is None:
+            self._started = self._clock()
+        return self._epoch
+
+    def release(self, epoch: int, latency: Optional[float] = None, outcome: Optional[str] = None):
+        """Вернуть место; outcome — итог запроса (None — не учитывать)"""
+        saturated = self.in_flight >= self.limit or bool(self._waiters)
+        self.in_flight = max(0, self.in_flight - 1)
+        if outcome is not None:
+            self._record(epoch, latency, outcome, saturated)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        async with limit.slot() as slot: ... slot.done(response)
+
+        Исключение внутри — итог по outcome_of(), отмена не учитывается
+        """
+        epoch = await self.acquire()
+        slot = _Slot(self._clock())
+        try:
+            yield slot
+        except asyncio.CancelledError:
+            self.release(epoch)
+            raise
+        except Exception as e:
+            self.release(epoch, None, outcome_of(e))
+            raise
+        latency = slot.latency or (self._clock() - slot.start)
+        self.release(epoch, latency, OK if slot.success else ERROR)
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    # === AIMD ===
+
+    def _record(self, epoch: int, latency: Optional[float], outcome: str, saturated: bool):
+        now = self._clock()
+        with self._stats_lock:
+            self._outcomes.append(outcome == OK)
+            if outcome == OK and latency is not None:
+                self._latencies.append(latency)
+                self._done_at.append(now)
+                self._short = latency if self._short is None else self._short + SHORT_ALPHA * (latency - self._short)
+                self._long = latency if self._long is None else self._long + LONG_ALPHA * (latency - self._long)
+            while self._done_at and now - self._done_at[0] > THROUGHPUT_WINDOW:
+                self._done_at.popleft()
+            inflated = (len(self._latencies) >= MIN_SAMPLES
+                        and self._short > self._long * self.latency_tolerance)
+            success_rate = sum(self._outcomes) / len(self._outcomes)
+
+        if outcome == OVERLOAD:
+            self._decrease(epoch, "rate limit/таймаут")
+        elif outcome == OK and inflated:
+            self._decrease(epoch, f"задержка {self._short:.0f}с при норме {self._long:.0f}с")
+        elif outcome == OK and saturated and success_rate >= HEALTHY_SUCCESS:
+            self._increase()
+
+    def _increase(self):
+        before = self.limit
+        self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+        if self.limit > before:
+            self.increases += 1  # Рост — без лога: видно в snapshot(), а снижений мало
+
+    def _decrease(self, epoch: int, reason: str):
+        if epoch < self._epoch:
+            return  # Запрос начат до прошлого снижения — на эту волну уже отреагировали
+        before = self.limit
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        self._epoch += 1
+        if self.limit < before:
+            self.decreases += 1
+            self._log(f"[{self.name}] ⬇ Параллельность {self.limit}/{self.max_limit}: {reason}")
+
+    # === Статистика (из любого потока) ===
+
+    def snapshot(self) -> dict:
+        """Уровень, перцентили задержки и пропускная способность — для логов и UI"""
+        now = self._clock()
+        with self._stats_lock:
+            ordered = sorted(self._latencies)
+            outcomes = list(self._outcomes)
+            done = sum(1 for t in self._done_at if now - t <= THROUGHPUT_WINDOW)
+        elapsed = min(THROUGHPUT_WINDOW, now - self._started) if self._started is not None else 0
+        return {
+            "limit": self.limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "p50": round(_percentile(ordered, 0.5), 1),
+            "p90": round(_percentile(ordered, 0.9), 1),
+            "p99": round(_percentile(ordered, 0.99), 1),
+            "throughput": round(done * 60 / max(elapsed, 1.0), 1),  # Картинок в минуту
+            "success_rate": round(sum(outcomes) / len(outcomes), 2) if outcomes else 1.0,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+def describe(name: str, snapshot: dict) -> str:
+    """Одна строка для лога/статуса: flux-dev ×5/8, p50 24с p90 41с, 9.5/мин"""
+    line = f"{name} ×{snapshot['limit']}/{snapshot['max_limit']}"
+    if snapshot["p50"]:
+        line += f", p50 {snapshot['p50']:g}с p90 {snapshot['p90']:g}с p99 {snapshot['p99']:g}с"
+    if snapshot["throughput"]:
+        line += f", {snapshot['throughput']:g}/мин"
+    if snapshot["success_rate"] < 1:
+        line += f", успех {snapshot['success_rate']:.0%}"
+    return line
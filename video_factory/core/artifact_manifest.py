@@ -0,0 +1,155 @@
+"""
+Манифест артефактов проекта
+
+output/<project_id>/manifest.json — для каждого созданного файла:
+хэш содержимого, размер, mtime, длительность/размеры и отпечаток входных
+данных (промпт, голос, хэш сценария), из которых он получен.
+
+Продолжение проекта читает только манифест и stat() файлов: артефакт
+считается готовым, если отпечаток входа совпадает, а файл на месте и не
+менялся. Изменился промпт одной картинки — перегенерируется только она.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+
+def fingerprint(*parts: Any) -> str:
+    """Отпечаток входных данных артефакта"""
+    data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+def file_hash(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """Хэш содержимого файла (blake2b, потоково)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactManifest:
+    """Манифест артефактов одного проекта"""
+
+    FILENAME = "manifest.json"
+    VERSION = 1
+
+    def __init__(self, project_dir: Path):
+        self.project_dir = Path(project_dir)
+        self.path = self.project_dir / self.FILENAME
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+                if data.get("version") == self.VERSION:
+                    self._entries = data.get("artifacts", {})
+            except (OSError, ValueError) as e:
+                print(f"[Manifest] Не удалось прочитать {self.path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def keys(self, prefix: str = "") -> list:
+        with self._lock:
+            return [k for k in self._entries if k.startswith(prefix)]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry else None
+
+    def _resolve(self, path: str) -> Path:
+        path = Path(path)
+        return path if path.is_absolute() else self.project_dir / path
+
+    def record(self, key: str, path: Path, input_fingerprint: str, **meta) -> Dict[str, Any]:
+        """
+        Записать готовый артефакт.
+
+        Args:
+            key: "image:001", "voiceover", ...
+            path: Файл артефакта
+            input_fingerprint: fingerprint(...) входных данных
+            meta: duration, width, height и т.п.
+        """
+        path = Path(path)
+        stat = path.stat()
+        try:
+            stored_path = str(path.relative_to(self.project_dir))
+        except ValueError:
+            stored_path = str(path)
+
+        entry = {
+            "path": stored_path,
+            "hash": file_hash(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "input": input_fingerprint,
+        }
+        entry.update({k: v for k, v in meta.items() if v is not None})
+
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def is_fresh(self, key: str, input_fingerprint: str) -> bool:
+        """
+        Артефакт готов и соответствует входу.
+
+        Дешёвая проверка: отпечаток входа + stat() (размер и mtime).
+        Если файл трогали, но содержимое то же — пересчитываем хэш и
+        обновляем запись.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if not entry or entry.get("input") != input_fingerprint:
+            return False
+
+        path = self._resolve(entry["path"])
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns != entry["mtime_ns"]:
+            if file_hash(path) != entry["hash"]:
+                return False
+            with self._lock:
+                entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def path_of(self, key: str) -> Optional[Path]:
+        entry = self.get(key)
+        return self._resolve(entry["path"]) if entry else None
+
+    def remove(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def prune(self, prefix: str, keep: Iterable[str]):
+        """Удалить записи с префиксом, которых нет в keep"""
+        keep = set(keep)
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix) and k not in keep]:
+                del self._entries[key]
+
+    def save(self):
+        """Атомарная запись манифеста"""
+        with self._lock:
+            text = json.dumps(
+                {"version": self.VERSION, "artifacts": self._entries},
+                ensure_ascii=False, indent=2,
+            )
+            self.project_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, self.path)
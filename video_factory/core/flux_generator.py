@@ -15,6 +15,30 @@ from typing import Optional, List, Callable
 from dataclasses import dataclass
 from gradio_client import Client
 
+from .adaptive_limit import describe
+from .artifact_manifest import fingerprint
+from .hf_client_pool import get_client_pool
+from .image_service import (
+    ContentRejected, ImageProvider, ImageRequest, ImageResponse, ProviderError,
+    QuotaExceeded, get_image_service,
+)
+from .retry_policy import (
+    FLUX_RETRY_POLICY, QUOTA, RATE_LIMIT, SAFETY, RetryBudget, RetryState, classify_error,
+)
+from .token_scheduler import DEFAULT_COOLDOWN, get_token_scheduler
+
+
+def _replace_with_copy(source: str, output_path: Path):
+    """
+    Новый файл вместо старого (tmp + os.replace), а не запись поверх
+
+    Старый файл сцены мог прийти из кэша картинок — запись поверх изменила
+    бы его и у кэша, и у других проектов с тем же inode.
+    """
+    tmp_path = output_path.with_name(f".{output_path.name}.part")
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, output_path)
+
 
 @dataclass
 class FluxResult:
@@ -25,6 +49,8 @@ class FluxResult:
     seed: int = 0
     generation_time: float = 0
     token_used: str = ""
+    token_index: int = -1              # Номер токена в hf_tokens (для логов)
+    retry_after: Optional[float] = None  # Неудача из-за квоты: через сколько сек она восстановится
 
 
 class FluxGenerator:
@@ -32,7 +58,7 @@ class FluxGenerator:
     Генератор изображений на базе FLUX через Hugging Face Spaces
     
     Особенности:
-    - Ротация токенов при исчерпании лимита GPU
+    - Выбор токена по прогнозу квоты GPU (TokenScheduler)
     - FLUX.1-dev для максимального качества
     - Автоматическое переключение между аккаунтами
     """
@@ -48,15 +74,14 @@ class FluxGenerator:
         
         # Токены для ротации
         self.hf_tokens = [t for t in (hf_tokens or []) if t and t.startswith("hf_")]
-        self._current_token_idx = 0
-        
-        # Клиенты для каждого токена (ленивая инициализация)
-        self._clients = {}
         
         # Какую модель использовать
         self.use_dev = use_dev
         self.space_name = "black-forest-labs/FLUX.1-dev" if use_dev else "black-forest-labs/FLUX.1-schnell"
         
+        # Клиенты по токенам — общий пул на процесс (core/hf_client_pool.py)
+        self._clients = get_client_pool(self.space_name)
+        
         # Статистика
         self.stats = {
             "generated": 0,
@@ -65,173 +90,28 @@ class FluxGenerator:
             "token_switches": 0
         }
         
-        # Трекинг лимитов токенов
-        self._token_cooldowns = {}  # token -> время когда можно снова использовать
-        self._cooldown_file = self.output_dir.parent / "hf_cooldowns.json"
-        self._load_cooldowns()  # Загружаем сохранённые cooldowns
-        
-        # Для параллельной работы — какие токены сейчас используются
-        self._tokens_in_use = set()
-        self._token_lock = None  # Инициализируем при первом использовании
+        # Квоты токенов — общий планировщик на процесс (core/token_scheduler.py)
+        self.scheduler = get_token_scheduler(self.hf_tokens)
     
     def _get_client(self, token: str = None) -> Client:
-        """Получение клиента для токена"""
-        import os
-        
-        if token and token not in self._clients:
-            print(f"[FLUX] Подключаюсь с токеном ...{token[-8:]}")
-            # Устанавливаем токен через переменную окружения
-            os.environ["HF_TOKEN"] = token
-            self._clients[token] = Client(self.space_name)
-        elif not token and None not in self._clients:
-            print(f"[FLUX] Подключаюсь без токена...")
-            if "HF_TOKEN" in os.environ:
-                del os.environ["HF_TOKEN"]
-            self._clients[None] = Client(self.space_name)
-        
-        # Устанавливаем текущий токен
-        if token:
-            os.environ["HF_TOKEN"] = token
-        
-        return self._clients.get(token) or self._clients.get(None)
+        """Клиент для токена — из общего пула, с явным hf_token (без HF_TOKEN в окружении)"""
+        return self._clients.get(token)
     
-    def _get_available_token(self, for_parallel: bool = False) -> Optional[str]:
+    def _get_available_token(self, for_parallel: bool = False, width: int = 1280,
+                             height: int = 720, steps: int = 28) -> Optional[str]:
         """
-        Получение доступного токена (не в cooldown и не используется)
+        Получение доступного токена (см. TokenScheduler.acquire)
         
         ВАЖНО: Эта функция НИКОГДА не возвращает ошибку!
-        Если все токены в cooldown — ждёт пока хотя бы один освободится.
+        Если квота всех токенов исчерпана — ждёт прогнозного восстановления.
         Это гарантирует что проект НЕ уйдёт в ошибку из-за квот.
         """
-        import threading
-        
-        # Ленивая инициализация lock
-        if self._token_lock is None:
-            self._token_lock = threading.Lock()
-        
-        wait_time = 0
-        
-        # Если нет токенов — работаем без токена
-        if not self.hf_tokens:
-            return None
-        
-        while True:  # Бесконечный цикл пока не найдём токен
-            now = time.time()
-            
-            with self._token_lock:
-                # Ищем токен не в cooldown и не используемый
-                for i in range(len(self.hf_tokens)):
-                    idx = (self._current_token_idx + i) % len(self.hf_tokens)
-                    token = self.hf_tokens[idx]
-                    
-                    cooldown_until = self._token_cooldowns.get(token, 0)
-                    is_available = now >= cooldown_until
-                    is_free = token not in self._tokens_in_use
-                    
-                    if is_available and (is_free or not for_parallel):
-                        self._current_token_idx = (idx + 1) % len(self.hf_tokens)
-                        if for_parallel:
-                            self._tokens_in_use.add(token)
-                        return token
-                
-                # Все токены заняты или в cooldown
-                available_tokens = [t for t in self.hf_tokens if t not in self._tokens_in_use]
-                
-                if not available_tokens:
-                    # Все токены используются другими потоками — короткое ожидание
-                    wait_time = 5
-                else:
-                    # Находим токен который раньше освободится
-                    min_cooldown_token = min(available_tokens, key=lambda t: self._token_cooldowns.get(t, 0))
-                    wait_time = self._token_cooldowns.get(min_cooldown_token, 0) - now
-                    
-                    if wait_time <= 0:
-                        # Токен уже доступен — пробуем снова
-                        continue
-                    
-                    # Показываем статус ожидания
-                    mins = int(wait_time / 60)
-                    available_count = sum(1 for t in self.hf_tokens if self._token_cooldowns.get(t, 0) <= now)
-                    print(f"[FLUX] ⏳ Все {len(self.hf_tokens)} токенов в cooldown ({available_count} доступно)")
-                    print(f"[FLUX] 💤 Ожидание {mins} мин до восстановления квоты...")
-            
-            # Ждём вне lock чтобы не блокировать другие потоки
-            if wait_time > 0:
-                # Ждём порциями по 10 минут с логированием
-                wait_interval = 600  # 10 минут
-                total_waited = 0
-                
-                while total_waited < wait_time:
-                    actual_wait = min(wait_interval, wait_time - total_waited)
-                    time.sleep(actual_wait)
-                    total_waited += actual_wait
-                    
-                    # Проверяем не освободился ли токен раньше
-                    now = time.time()
-                    available_count = sum(1 for t in self.hf_tokens if self._token_cooldowns.get(t, 0) <= now)
-                    
-                    if available_count > 0:
-                        print(f"[FLUX] ✅ Токен освободился! Продолжаю генерацию...")
-                        break
-                    
-                    remaining = int((wait_time - total_waited) / 60)
-                    if remaining > 0:
-                        print(f"[FLUX] ⏳ Ещё {remaining} мин до восстановления квоты...")
-    
-    def _release_token(self, token: str):
-        """Освободить токен после использования"""
-        if self._token_lock and token:
-            with self._token_lock:
-                self._tokens_in_use.discard(token)
-    
-    def _load_cooldowns(self):
-        """Загрузка сохранённых cooldowns из файла"""
-        import json
-        try:
-            if self._cooldown_file.exists():
-                with open(self._cooldown_file, 'r') as f:
-                    data = json.load(f)
-                    self._token_cooldowns = data.get('cooldowns', {})
-                    
-                    # Показываем статус при загрузке
-                    now = time.time()
-                    available = sum(1 for t in self.hf_tokens if self._token_cooldowns.get(t, 0) <= now)
-                    in_cooldown = len(self.hf_tokens) - available
-                    
-                    if in_cooldown > 0:
-                        print(f"[FLUX] Загружены cooldowns: {available}/{len(self.hf_tokens)} токенов доступно")
-        except Exception as e:
-            print(f"[FLUX] Не удалось загрузить cooldowns: {e}")
-            self._token_cooldowns = {}
-    
-    def _save_cooldowns(self):
-        """Сохранение cooldowns в файл"""
-        import json
-        try:
-            with open(self._cooldown_file, 'w') as f:
-                json.dump({'cooldowns': self._token_cooldowns}, f)
-        except Exception as e:
-            print(f"[FLUX] Не удалось сохранить cooldowns: {e}")
+        return self.scheduler.acquire(width, height, steps, exclusive=for_parallel)
     
-    def _mark_token_cooldown(self, token: str, seconds: int = 5400):
-        """
-        Пометить токен как в cooldown
-        
-        По умолчанию 5400 секунд (1.5 часа) — время восстановления GPU квоты на HuggingFace.
-        Это предотвращает постоянные запросы на исчерпанные аккаунты.
-        """
-        self._token_cooldowns[token] = time.time() + seconds
-        self.stats["token_switches"] += 1
-        self._save_cooldowns()  # Сохраняем в файл
-        
-        # Показываем сколько токенов доступно
-        now = time.time()
-        available = sum(1 for t in self.hf_tokens if self._token_cooldowns.get(t, 0) <= now)
-        in_cooldown = len(self.hf_tokens) - available
-        
-        hours = seconds / 3600
-        print(f"[FLUX] Токен ...{token[-8:] if token else 'none'} в cooldown на {hours:.1f}ч")
-        print(f"[FLUX] Доступно: {available}/{len(self.hf_tokens)} токенов ({in_cooldown} в cooldown)")
+    def _release_token(self, token: str, gpu_seconds: float = None, width: int = 1280,
+                       height: int = 720, steps: int = 28):
+        """Освободить токен после использования (с учётом потраченной квоты)"""
+        self.scheduler.release(token, gpu_seconds, width, height, steps)
     
     def generate(
         self,
@@ -245,14 +125,27 @@ class FluxGenerator:
         randomize_seed: bool = True,
         enhance_prompt: bool = True,
         max_retries: int = 3,
-        for_parallel: bool = False
+        for_parallel: bool = False,
+        budget: RetryBudget = None
     ) -> FluxResult:
         """
         Генерация изображения с автоматической ротацией токенов
         
+        Повторы — по FLUX_RETRY_POLICY (core/retry_policy.py): ошибка квоты
+        сразу уходит на другой токен, rate limit — экспоненциальная пауза,
+        фильтр контента — перефразировка. Без рекурсии: когда повторы
+        кончились, возвращается неудача с прогнозом восстановления квоты
+        (FluxResult.retry_after) — повторить позже решает вызывающий.
+        
+        Вызов синхронный: ожидание токена (scheduler.acquire) и пауза перед
+        повтором держат поток. Поток не занимает только FluxSpaceProvider
+        (ImageService, generate_parallel).
+        
         Args:
+            max_retries: попыток на ошибки контента и сети
             for_parallel: True если вызывается из параллельной генерации
                          (токен будет заблокирован на время использования)
+            budget: общий запас повторов проекта
         """
         start_time = time.time()
         
@@ -260,35 +153,36 @@ class FluxGenerator:
         if enhance_prompt:
             prompt = self._enhance_prompt(prompt)
         
+        policy = FLUX_RETRY_POLICY.with_retries(max(0, max_retries - 1))
+        state = RetryState()
         last_error = ""
-        current_token = None
         
-        for attempt in range(max_retries):
-            # Получаем токен (с блокировкой для параллельной работы)
-            token = self._get_available_token(for_parallel=for_parallel)
-            
-            # Если токен не получен — ждём и пробуем снова
-            if token is None and for_parallel:
-                time.sleep(5)
-                continue
-            
-            current_token = token
+        # Параметры запроса — по ним планировщик оценивает расход квоты
+        req_width, req_height = min(width, 1440), min(height, 1440)
+        req_steps = steps if self.use_dev else 4
+        
+        while True:
+            attempt = state.total
+            # Получаем токен (для параллельной работы — эксклюзивно)
+            token = self._get_available_token(for_parallel, req_width, req_height, req_steps)
+            gpu_seconds = None  # Заполняется при успехе — расход квоты токена
             
             try:
                 client = self._get_client(token)
                 
-                print(f"[FLUX] Генерирую ({attempt+1}/{max_retries}): {prompt[:50]}...")
+                print(f"[FLUX] Генерирую (попытка {attempt+1}): {prompt[:50]}...")
                 
+                predict_start = time.time()
                 if self.use_dev:
                     # FLUX.1-dev параметры
                     result = client.predict(
                         prompt=prompt,
                         seed=seed,
                         randomize_seed=randomize_seed,
-                        width=min(width, 1440),
-                        height=min(height, 1440),
+                        width=req_width,
+                        height=req_height,
                         guidance_scale=guidance,
-                        num_inference_steps=steps,
+                        num_inference_steps=req_steps,
                         api_name="/infer"
                     )
                 else:
@@ -297,18 +191,19 @@ class FluxGenerator:
                         prompt=prompt,
                         seed=seed,
                         randomize_seed=randomize_seed,
-                        width=min(width, 1440),
-                        height=min(height, 1440),
-                        num_inference_steps=4,
+                        width=req_width,
+                        height=req_height,
+                        num_inference_steps=req_steps,
                         api_name="/infer"
                     )
                 
                 # Успех!
+                gpu_seconds = time.time() - predict_start
                 temp_path = result[0]
                 used_seed = result[1] if len(result) > 1 else 0
                 
                 output_path = self.output_dir / f"{filename}.webp"
-                shutil.copy(temp_path, output_path)
+                _replace_with_copy(temp_path, output_path)
                 
                 generation_time = time.time() - start_time
                 self.stats["generated"] += 1
@@ -316,78 +211,70 @@ class FluxGenerator:
                 
                 print(f"[FLUX] ✅ Готово за {generation_time:.1f}с: {output_path.name}")
                 
-                # Освобождаем токен при успехе
-                if for_parallel and current_token:
-                    self._release_token(current_token)
-                
                 return FluxResult(
                     success=True,
                     path=output_path,
                     seed=used_seed,
                     generation_time=generation_time,
-                    token_used=f"...{token[-8:]}" if token else "none"
+                    token_used=f"...{token[-8:]}" if token else "none",
+                    token_index=self.hf_tokens.index(token) if token in self.hf_tokens else -1
                 )
                 
             except Exception as e:
                 error_msg = str(e)
                 last_error = error_msg
+                error_class = classify_error(e)
                 
                 # Проверяем тип ошибки
-                if "GPU quota" in error_msg or "exceeded" in error_msg.lower():
-                    # Лимит GPU — ставим токен в cooldown на 1.5 часа
-                    self._mark_token_cooldown(token, 5400)  # 1.5 часа для восстановления квоты
-                    if for_parallel and current_token:
-                        self._release_token(current_token)
-                    current_token = None
-                    continue
+                if error_class == QUOTA:
+                    # Лимит GPU — планировщик прогнозирует восстановление по тексту ошибки
+                    self.scheduler.report_quota_exceeded(
+                        token, error_msg, self.scheduler.cost(req_width, req_height, req_steps)
+                    )
+                    self.stats["token_switches"] += 1
                     
-                elif "rate limit" in error_msg.lower():
+                elif error_class == RATE_LIMIT:
                     # Rate limit — короткий cooldown
-                    self._mark_token_cooldown(token, 60)
-                    if for_parallel and current_token:
-                        self._release_token(current_token)
-                    current_token = None
-                    continue
+                    self.scheduler.report_rate_limited(token, 60)
+                    self.stats["token_switches"] += 1
                     
-                elif "content" in error_msg.lower() or "safety" in error_msg.lower() or "nsfw" in error_msg.lower():
-                    # Контент заблокирован — перефразируем промпт
-                    print(f"[FLUX] ⚠️ Контент заблокирован, перефразирую промпт...")
-                    prompt = self._rephrase_prompt(prompt, attempt + 1)
-                    continue
+                elif error_class == SAFETY:
+                    print(f"[FLUX] ⚠️ Контент заблокирован: {error_msg[:100]}")
                     
                 else:
-                    # Другая ошибка — пробуем с другой вариацией промпта
                     print(f"[FLUX] ❌ Ошибка: {error_msg[:100]}")
-                    if attempt < max_retries - 1:
-                        prompt = self._enhance_prompt(prompt, attempt + 1)
-                        print(f"[FLUX] 🔄 Пробую с изменённым промптом...")
+                    if isinstance(e, (ConnectionError, TimeoutError)) or "connect" in error_msg.lower():
+                        self._clients.discard(token)  # Следующая попытка — с новым подключением
                     self.stats["errors"] += 1
-        
-        # Освобождаем токен при неудаче
-        if for_parallel and current_token:
-            self._release_token(current_token)
-        
-        # Если ошибка связана с квотой — пробуем ещё раз после ожидания
-        if "GPU quota" in last_error or "exceeded" in last_error.lower():
-            print(f"[FLUX] 🔄 Все попытки исчерпаны из-за квот, жду и пробую снова...")
-            time.sleep(60)  # Ждём минуту
-            return self.generate(
-                prompt=prompt.split(',')[0],  # Упрощаем промпт
-                filename=filename,
-                width=width,
-                height=height,
-                steps=steps,
-                guidance=guidance,
-                seed=seed,
-                randomize_seed=randomize_seed,
-                enhance_prompt=True,
-                max_retries=max_retries,
-                for_parallel=for_parallel
-            )
-        
-        return FluxResult(success=False, error=last_error)
+            
+            finally:
+                # Токен возвращается после каждой попытки — ожидающие потоки просыпаются сразу
+                self._release_token(token, gpu_seconds, req_width, req_height, req_steps)
+            
+            decision = policy.next(state, error_class, budget=budget)
+            if not decision.retry:
+                break
+            if decision.rewrite:
+                if error_class == SAFETY:
+                    # Контент заблокирован — перефразируем промпт
+                    print(f"[FLUX] 🔄 Перефразирую промпт...")
+                    prompt = self._rephrase_prompt(prompt, state.total)
+                else:
+                    # Другая ошибка — пробуем с другой вариацией промпта
+                    print(f"[FLUX] 🔄 Пробую с изменённым промптом...")
+                    prompt = self._enhance_prompt(prompt, state.total)
+            if decision.delay:
+                time.sleep(decision.delay)
+        
+        print(f"[FLUX] 💀 {filename}: {decision.reason}")
+        retry_after = None
+        if state.last_class == QUOTA:
+            # Прогноз восстановления квоты — вызывающий может повторить позже
+            retry_after = self.scheduler.predicted_wait(req_width, req_height, req_steps)
+        return FluxResult(success=False, error=last_error, retry_after=retry_after)
     
-    def _enhance_prompt(self, prompt: str, variation: int = 0) -> str:
+    @staticmethod
+    def _enhance_prompt(prompt: str, variation: int = 0) -> str:
         """
         Улучшение промпта для военной тематики
         variation: 0-5 для разных вариаций при перегенерации
@@ -461,7 +348,8 @@ class FluxGenerator:
         
         return f"{prompt}, {', '.join(additions)}, {final_tags}"
     
-    def _rephrase_prompt(self, original_prompt: str, attempt: int) -> str:
+    @staticmethod
+    def _rephrase_prompt(original_prompt: str, attempt: int) -> str:
         """Перефразировка промпта при ошибке генерации"""
         # Извлекаем основную идею
         base = original_prompt.split(',')[0].strip()
@@ -515,73 +403,108 @@ class FluxGenerator:
         self,
         prompts: List[str],
         base_filename: str = "image",
-        max_workers: int = 4,
-        on_progress: Callable = None
+        max_workers: int = None,
+        on_progress: Callable = None,
+        filenames: List[str] = None
     ) -> List[FluxResult]:
         """
         ПАРАЛЛЕЛЬНАЯ генерация изображений
         
         Использует несколько токенов одновременно для ускорения.
-        С 16 токенами можно генерировать 4-8 изображений параллельно.
+        Число параллельных запросов подбирается на ходу (AdaptiveLimit в
+        ImageService): растёт, пока Space отвечает быстро и без ошибок,
+        и падает вдвое на rate limit, таймаутах и росте очереди Space.
         
         Args:
             prompts: Список промптов
             base_filename: Базовое имя файла
-            max_workers: Максимум параллельных генераций (рекомендуется 4-8)
+            max_workers: Потолок параллельных генераций (по умолчанию
+                         min(8, число токенов))
             on_progress: Callback для прогресса (index, total, result)
+            filenames: Имена файлов для каждого промпта (по умолчанию
+                       base_filename_001, base_filename_002, ...)
         
         Returns:
             Список результатов в том же порядке что и промпты
         """
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import threading
-        
-        # Ограничиваем воркеры количеством токенов
-        actual_workers = min(max_workers, len(self.hf_tokens)) if self.hf_tokens else 1
-        
-        print(f"[FLUX] 🚀 Параллельная генерация: {len(prompts)} изображений, {actual_workers} потоков")
-        
-        # Результаты с сохранением порядка
-        results = [None] * len(prompts)
-        completed = 0
-        lock = threading.Lock()
-        
-        def generate_one(args):
-            nonlocal completed
-            index, prompt = args
-            filename = f"{base_filename}_{index+1:03d}"
-            
-            # for_parallel=True чтобы токены распределялись между потоками
-            result = self.generate(prompt, filename, enhance_prompt=False, for_parallel=True)
-            
-            with lock:
-                completed += 1
-                if on_progress:
-                    on_progress(completed, len(prompts), result)
-            
-            return index, result
+        service = get_image_service()
+        provider = self._space_provider(service)
+        # Потолок — не больше токенов; текущий уровень выбирает AIMD-лимит провайдера
+        ceiling = min(max_workers or provider.max_concurrency, len(self.hf_tokens)) if self.hf_tokens else 1
+        
+        print(f"[FLUX] 🚀 Параллельная генерация: {len(prompts)} изображений, "
+              f"параллельность до {ceiling}")
+        
+        # Подключаем токены заранее, пока первые запросы идут на уже готовых клиентах
+        self._clients.warm(self.hf_tokens or [None])
+        
+        requests = [
+            ImageRequest(
+                prompt=prompt,
+                filename=filenames[i] if filenames else f"{base_filename}_{i+1:03d}",
+                output_dir=self.output_dir,
+            )
+            for i, prompt in enumerate(prompts)
+        ]
         
-        # Запускаем параллельно
-        with ThreadPoolExecutor(max_workers=actual_workers) as executor:
-            futures = {executor.submit(generate_one, (i, p)): i for i, p in enumerate(prompts)}
-            
-            for future in as_completed(futures):
-                try:
-                    index, result = future.result()
-                    results[index] = result
-                except Exception as e:
-                    index = futures[future]
-                    results[index] = FluxResult(success=False, error=str(e))
-                    print(f"[FLUX] ❌ Ошибка генерации #{index+1}: {e}")
+        def on_result(completed: int, total: int, response: ImageResponse):
+            result = self._to_flux_result(response)
+            if result.success:
+                self.stats["generated"] += 1
+                self.stats["total_time"] += result.generation_time
+            else:
+                self.stats["errors"] += 1
+            if on_progress:
+                on_progress(completed, total, result)
+        
+        # Все запросы — в общем event loop сервиса изображений (без пула потоков)
+        responses = service.generate_batch(
+            requests,
+            provider=provider,
+            on_progress=on_result,
+            max_parallel=ceiling,
+        )
+        results = [self._to_flux_result(r) for r in responses]
         
         # Статистика
         success_count = sum(1 for r in results if r and r.success)
         total_time = sum(r.generation_time for r in results if r and r.success)
         
         print(f"[FLUX] ✅ Готово: {success_count}/{len(prompts)} за {total_time:.1f}с")
+        status = service.concurrency_status().get(provider.name)
+        if status:
+            print(f"[FLUX] 📊 {describe(provider.name, status)}")
         
         return results
     
+    def _space_provider(self, service) -> "FluxSpaceProvider":
+        """
+        Провайдер Space с токенами этого генератора, зарегистрированный в сервисе
+        
+        Под именем flux-dev сервис уже держит провайдера с токенами из
+        конфига; у генератора их может быть больше (HUGGINGFACE_TOKENS) —
+        тогда свой провайдер под именем с отпечатком набора токенов.
+        """
+        provider = FluxSpaceProvider(self.hf_tokens, self.use_dev)
+        registered = service.providers.get(provider.name)
+        if isinstance(registered, FluxSpaceProvider) and registered.hf_tokens == provider.hf_tokens:
+            return registered
+        if registered is not None:
+            provider.name = f"{provider.name}-{fingerprint(*provider.hf_tokens)[:8]}"
+        return service.add_provider(provider)
+    
+    def _to_flux_result(self, response: ImageResponse) -> FluxResult:
+        token = self.hf_tokens[response.token_index] if 0 <= response.token_index < len(self.hf_tokens) else None
+        return FluxResult(
+            success=response.success,
+            path=response.path,
+            error=response.error,
+            seed=response.seed,
+            generation_time=response.generation_time,
+            token_used=f"...{token[-8:]}" if token else "none",
+            token_index=response.token_index,
+        )
+    
     def get_stats(self) -> dict:
         """Статистика"""
         avg_time = self.stats["total_time"] / max(self.stats["generated"], 1)
@@ -603,19 +526,17 @@ class FluxGenerator:
         available = []
         in_cooldown = []
         
-        for token in self.hf_tokens:
-            cooldown_until = self._token_cooldowns.get(token, 0)
-            token_short = f"...{token[-8:]}"
-            
-            if now >= cooldown_until:
-                available.append(token_short)
+        # Прогноз планировщика: когда квоты токена хватит на запрос по умолчанию
+        for info in self.scheduler.status()["tokens"]:
+            remaining = info["ready_in"]
+            if remaining is not None and remaining <= 0:
+                available.append(info["token"])
             else:
-                remaining = cooldown_until - now
-                mins = int(remaining / 60)
+                remaining = remaining if remaining is not None else DEFAULT_COOLDOWN
                 in_cooldown.append({
-                    "token": token_short,
-                    "remaining_min": mins,
-                    "available_at": time.strftime("%H:%M", time.localtime(cooldown_until))
+                    "token": info["token"],
+                    "remaining_min": int(remaining / 60),
+                    "available_at": time.strftime("%H:%M", time.localtime(now + remaining))
                 })
         
         return {
@@ -629,11 +550,107 @@ class FluxGenerator:
     
     def clear_cooldowns(self):
         """Очистить все cooldowns (для тестирования)"""
-        self._token_cooldowns = {}
-        self._save_cooldowns()
+        self.scheduler.clear()
         print(f"[FLUX] Все cooldowns очищены. Доступно {len(self.hf_tokens)} токенов")
 
 
+class FluxSpaceProvider(ImageProvider):
+    """
+    FLUX Space как провайдер ImageService
+    
+    Токен — от TokenScheduler, клиент — из пула; сам запрос идёт через
+    client.submit() (Job — concurrent Future), так что ожидание не держит
+    поток, а отмена снимает задачу в очереди Space.
+    """
+    
+    retry_policy = FLUX_RETRY_POLICY
+    
+    def __init__(self, hf_tokens: List[str] = None, use_dev: bool = True):
+        self.hf_tokens = [t for t in (hf_tokens or []) if t and t.startswith("hf_")]
+        self.use_dev = use_dev
+        self.name = "flux-dev" if use_dev else "flux-schnell"
+        self.space_name = "black-forest-labs/FLUX.1-dev" if use_dev else "black-forest-labs/FLUX.1-schnell"
+        self.max_concurrency = min(8, len(self.hf_tokens)) or 1
+        self.typical_latency = 30.0 if use_dev else 8.0
+        self.scheduler = get_token_scheduler(self.hf_tokens)
+        self.clients = get_client_pool(self.space_name)
+    
+    def _size(self, request: ImageRequest):
+        return min(request.width, 1440), min(request.height, 1440), (request.steps if self.use_dev else 4)
+    
+    def predicted_wait(self, request: ImageRequest) -> float:
+        return self.scheduler.predicted_wait(*self._size(request))
+    
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        import asyncio
+        
+        width, height, steps = self._size(request)
+        params = dict(
+            prompt=request.prompt,
+            seed=request.seed or 0,
+            randomize_seed=request.seed is None,
+            width=width,
+            height=height,
+            num_inference_steps=steps,
+            api_name="/infer",
+        )
+        if self.use_dev:
+            params["guidance_scale"] = request.guidance
+        
+        # Ждём токен с квотой в цикле событий — поток не держим
+        try:
+            token = await self.scheduler.acquire_async(width, height, steps, True, request.quota_wait)
+        except TimeoutError as e:
+            raise QuotaExceeded(str(e), retry_after=self.scheduler.predicted_wait(width, height, steps)) from e
+        gpu_seconds = None
+        try:
+            client = await asyncio.to_thread(self.clients.get, token)
+            start_time = time.time()
+            job = client.submit(**params)
+            try:
+                result = await asyncio.wrap_future(job)
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+            gpu_seconds = time.time() - start_time
+            
+            output_path = request.path(".webp")
+            await asyncio.to_thread(_replace_with_copy, result[0], output_path)
+            return ImageResponse(
+                success=True,
+                path=output_path,
+                seed=result[1] if len(result) > 1 else 0,
+                generation_time=gpu_seconds,
+                provider=self.name,
+                token_index=self.hf_tokens.index(token) if token in self.hf_tokens else -1,
+            )
+        except Exception as e:
+            error_msg = str(e)
+            lowered = error_msg.lower()
+            if "GPU quota" in error_msg or "exceeded" in lowered:
+                self.scheduler.report_quota_exceeded(token, error_msg, self.scheduler.cost(width, height, steps))
+                # Закончилась квота одного токена: retry_after — когда будет
+                # следующий (0, если свободен другой), а не пауза всего FLUX
+                raise QuotaExceeded(error_msg, retry_after=self.scheduler.predicted_wait(width, height, steps)) from e
+            if "rate limit" in lowered:
+                self.scheduler.report_rate_limited(token, 60)
+                raise QuotaExceeded(error_msg, retry_after=60) from e
+            if "content" in lowered or "safety" in lowered or "nsfw" in lowered:
+                raise ContentRejected(error_msg) from e
+            if isinstance(e, (ConnectionError, TimeoutError)) or "connect" in lowered:
+                self.clients.discard(token)
+            raise ProviderError(error_msg) from e
+        finally:
+            self.scheduler.release(token, gpu_seconds, width, height, steps)
+    
+    def retry_prompt(self, prompt: str, attempt: int, error: ProviderError) -> str:
+        # Как в FluxGenerator.generate: перефразировка или другая вариация тегов
+        if isinstance(error, ContentRejected):
+            print(f"[FLUX] ⚠️ Контент заблокирован, перефразирую промпт...")
+            return FluxGenerator._rephrase_prompt(prompt, attempt)
+        return FluxGenerator._enhance_prompt(prompt, attempt)
+
+
 # === Глобальный экземпляр ===
 
 _flux_generator: Optional[FluxGenerator] = None
@@ -0,0 +1,207 @@
+"""
+События вместо опроса — ожидание файлов и завершения этапов
+
+CompletionEvents — события внутри процесса: этап изображений сообщает
+«готово», и рендер, который его ждёт, просыпается сразу, а не через минуту.
+
+wait_for_files — ожидание файлов в папке: на Linux через inotify (ядро
+будит нас при записи файла), иначе — опрос с коротким интервалом.
+Нужен, когда файлы пишет другой процесс или поток без событий.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+class CompletionEvents:
+    """
+    Именованные события завершения: "proj_1:images" и т.п.
+
+    begin(key) — работа началась, finish(key) — закончилась (успешно или
+    нет). pending(key) — работа идёт прямо сейчас, её стоит дождаться.
+    """
+
+    def __init__(self):
+        self._events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> threading.Event:
+        with self._lock:
+            event = self._events.get(key)
+            if event is None:
+                event = self._events[key] = threading.Event()
+            return event
+
+    def begin(self, key: str):
+        self.get(key).clear()
+
+    def finish(self, key: str):
+        self.get(key).set()
+
+    def pending(self, key: str) -> bool:
+        with self._lock:
+            event = self._events.get(key)
+        return event is not None and not event.is_set()
+
+    def wait(self, key: str, timeout: Optional[float] = None) -> bool:
+        return self.get(key).wait(timeout)
+
+    def discard(self, prefix: str):
+        """Забыть события проекта (после удаления/завершения)"""
+        with self._lock:
+            for key in [k for k in self._events if k.startswith(prefix)]:
+                del self._events[key]
+
+
+# === inotify ===
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+_libc = None
+
+
+def _inotify_libc():
+    """libc с inotify или None (не Linux / нет функций)"""
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith("linux"):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                _libc = libc
+            except (OSError, AttributeError):
+                pass
+    return _libc or None
+
+
+class DirectoryWatcher:
+    """
+    Уведомления о новых/дописанных файлах в папке
+
+    wait(timeout) возвращает True, если в папке что-то появилось
+    (или inotify недоступен — тогда просто спит poll_interval).
+    """
+
+    def __init__(self, directory: Path, poll_interval: float = 5.0):
+        self.directory = Path(directory)
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+
+        libc = _inotify_libc()
+        if libc is None:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            return
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, str(self.directory).encode(), mask) < 0:
+            os.close(fd)
+            return
+        self._fd = fd
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def wait(self, timeout: float) -> bool:
+        if self._fd is None:
+            time.sleep(min(timeout, self.poll_interval))
+            return True
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        # Вычитываем все накопившиеся события — нам важен сам факт
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def wait_for_files(
+    directory: Path,
+    pattern: str = "*",
+    timeout: float = 7200,
+    done: Optional[threading.Event] = None,
+    on_waiting: Optional[Callable[[float], None]] = None,
+    report_every: float = 300,
+    poll_interval: float = 5.0,
+    accept: Optional[Callable[[Path], bool]] = None,
+) -> List[Path]:
+    """
+    Ждать появления файлов по шаблону.
+
+    Args:
+        directory: Папка
+        pattern: glob-шаблон ("*.webp")
+        timeout: Максимум ожидания, сек
+        done: Событие «источник закончил» — проверяем папку сразу
+        on_waiting: Колбэк(прошло_сек) раз в report_every секунд
+        poll_interval: Интервал опроса, если inotify недоступен
+        accept: Дополнительный фильтр найденных файлов (несколько
+            расширений, без временных файлов)
+
+    Returns:
+        Отсортированный список найденных файлов (пустой — не дождались)
+    """
+    directory = Path(directory)
+    start = time.time()
+    next_report = start + report_every
+
+    def found() -> List[Path]:
+        if not directory.exists():
+            return []
+        return sorted(p for p in directory.glob(pattern) if accept is None or accept(p))
+
+    with DirectoryWatcher(directory, poll_interval=poll_interval) as watcher:
+        while True:
+            files = found()
+            if files:
+                return files
+
+            now = time.time()
+            if now - start >= timeout:
+                return []
+            if done is not None and done.is_set():
+                # Источник закончил, а файлов нет — ждать больше нечего
+                return []
+
+            if on_waiting and now >= next_report:
+                on_waiting(now - start)
+                next_report += report_every
+
+            slice_timeout = timeout - (now - start)
+            if on_waiting:
+                slice_timeout = min(slice_timeout, next_report - now)
+            if done is not None:
+                # Короткие срезы, чтобы заметить done без файловых событий
+                slice_timeout = min(slice_timeout, 1.0)
+            watcher.wait(max(0.05, slice_timeout))
@@ -0,0 +1,131 @@
+"""
+Пул клиентов gradio_client для Hugging Face Spaces
+
+Раньше токен передавался клиенту через os.environ["HF_TOKEN"] — это
+глобальная переменная процесса, и при 8 потоках generate_parallel запрос
+мог уйти с токеном соседнего потока (ложные ошибки квоты и повторы).
+Теперь у каждого токена свой Client с явно переданным hf_token, а
+окружение не трогается.
+
+Пул общий на процесс и Space (get_client_pool): FluxGenerator создаётся
+заново на каждый этап проекта, а подключение к Space (загрузка конфига)
+стоит секунды — готовые клиенты переживают генератор. Размер ограничен
+(LRU), warm() подключает токены заранее в фоне.
+
+Поиск готового клиента — чтение словаря без блокировок; блокировка
+берётся только на создание, и своя для каждого токена, так что медленное
+подключение одного токена не задерживает остальные.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
+
+from gradio_client import Client
+
+
+def _connect(space_name: str, token: Optional[str]) -> Client:
+    """Client с явным токеном (без HF_TOKEN в окружении)"""
+    try:
+        return Client(space_name, hf_token=token)
+    except TypeError:
+        # Новые версии gradio_client называют параметр token
+        return Client(space_name, token=token)
+
+
+class HFClientPool:
+    """Клиенты одного Space по токенам, не больше max_clients"""
+
+    def __init__(self, space_name: str, max_clients: int = 32):
+        self.space_name = space_name
+        self.max_clients = max(1, max_clients)
+        self._clients: Dict[Optional[str], Client] = {}
+        self._last_used: Dict[Optional[str], float] = {}
+        self._token_locks: Dict[Optional[str], threading.Lock] = {}
+        self._lock = threading.Lock()  # Только для словарей блокировок и вытеснения
+        self._warmer: Optional[ThreadPoolExecutor] = None
+
+    def get(self, token: Optional[str] = None) -> Client:
+        """Клиент для токена (None — без токена); создаётся при первом запросе"""
+        client = self._clients.get(token)
+        if client is not None:
+            self._last_used[token] = time.monotonic()
+            return client
+
+        with self._lock:
+            token_lock = self._token_locks.setdefault(token, threading.Lock())
+        with token_lock:
+            client = self._clients.get(token)
+            if client is None:
+                print(f"[FLUX] Подключаюсь {'с токеном ...' + token[-8:] if token else 'без токена'}")
+                client = _connect(self.space_name, token)
+                with self._lock:
+                    self._evict(keep=token)
+                    self._clients[token] = client
+            self._last_used[token] = time.monotonic()
+            return client
+
+    def _evict(self, keep: Optional[str]):
+        """Освободить место под новый клиент (под self._lock)"""
+        while len(self._clients) >= self.max_clients:
+            oldest = min(
+                (t for t in self._clients if t != keep),
+                key=lambda t: self._last_used.get(t, 0.0),
+                default=None,
+            )
+            if oldest is None:
+                return
+            self._close(self._clients.pop(oldest))
+            self._last_used.pop(oldest, None)
+
+    @staticmethod
+    def _close(client: Client):
+        close = getattr(client, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+    def discard(self, token: Optional[str]):
+        """Забыть клиента (сломанное соединение) — следующий get() подключится заново"""
+        with self._lock:
+            client = self._clients.pop(token, None)
+            self._last_used.pop(token, None)
+        if client is not None:
+            self._close(client)
+
+    def warm(self, tokens: Iterable[Optional[str]], max_workers: int = 4):
+        """Подключить токены заранее в фоне (не больше размера пула)"""
+        missing = [t for t in list(tokens)[:self.max_clients] if t not in self._clients]
+        if not missing:
+            return
+        with self._lock:
+            if self._warmer is None:
+                self._warmer = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hf-warm")
+        for token in missing:
+            self._warmer.submit(self._warm_one, token)
+
+    def _warm_one(self, token: Optional[str]):
+        try:
+            self.get(token)
+        except Exception as e:
+            # Не страшно: get() при генерации попробует ещё раз
+            print(f"[FLUX] Не удалось подключиться заранее ({'...' + token[-8:] if token else 'без токена'}): {e}")
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_pools: Dict[str, HFClientPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_client_pool(space_name: str, max_clients: int = 32) -> HFClientPool:
+    """Общий пул клиентов для Space"""
+    with _pools_lock:
+        pool = _pools.get(space_name)
+        if pool is None:
+            pool = _pools[space_name] = HFClientPool(space_name, max_clients)
+        return pool
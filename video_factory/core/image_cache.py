@@ -0,0 +1,301 @@
+"""
+Кэш картинок по промпту — общий для всех проектов
+
+Проекты одной ниши и стиля дают очень похожие промпты
+(_enhance_military_prompt добавляет одни и те же теги), а перезапуск
+после сбоя заново заказывает уже оплаченные картинки. Кэш хранит каждую
+сгенерированную картинку под ключом
+
+    sha256(нормализованный промпт, модель, ширина, высота, шаги, политика seed)
+
+в output/image_cache/<ключ[:2]>/<ключ><расширение>, индекс —
+output/image_cache/index.json. Политика seed: случайный seed — любая
+картинка по промпту подходит ("random"); заданный — только с ним ("seed:N").
+
+Картинки в кэш и из кэша в проект попадают копией, а не жёсткой ссылкой:
+у проекта и кэша нет общего inode, так что перегенерация сцены в одном
+проекте не меняет картинку в кэше и в других проектах, а вытеснение из
+кэша (LRU по last_used, лимит max_bytes) не трогает собранные проекты.
+
+Режим похожих (similar): для проходных сцен можно взять картинку с
+похожим промптом из другого проекта. Сходство — взвешенный Жаккар по
+словам промпта с весом IDF: общие для всего кэша стилевые теги почти
+ничего не весят, совпадать должны слова сюжета.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Слова без смысла для сравнения сюжетов
+_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "at", "to", "and", "or", "with", "by",
+    "for", "from", "as", "is", "are", "his", "her", "their", "its", "into",
+}
+_WORD = re.compile(r"[a-zа-яё0-9]+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Регистр, пунктуация и пробелы не влияют на ключ"""
+    return " ".join(_WORD.findall(prompt.lower()))
+
+
+def prompt_tokens(prompt: str) -> List[str]:
+    """Значимые слова промпта (для режима похожих)"""
+    return sorted({w for w in _WORD.findall(prompt.lower()) if w not in _STOPWORDS and len(w) > 1})
+
+
+def seed_policy(seed: Optional[int]) -> str:
+    return "random" if seed is None else f"seed:{seed}"
+
+
+@dataclass
+class CacheHit:
+    """Найденная в кэше картинка"""
+    key: str
+    path: Path
+    model: str
+    seed: int = 0
+    similarity: float = 1.0  # 1.0 — точное совпадение ключа
+
+
+class ImageCache:
+    """Картинки по ключу промпта на диске с вытеснением по LRU"""
+
+    INDEX = "index.json"
+
+    def __init__(self, root: Path, max_bytes: int = 5 * 1024 ** 3):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._df: Dict[str, int] = {}  # В скольких записях встречается слово
+        self._dirty = False
+        self._saved_at = 0.0
+
+        index_path = self.root / self.INDEX
+        if index_path.exists():
+            try:
+                self._entries = json.loads(index_path.read_text()).get("entries", {})
+            except (OSError, ValueError):
+                self._entries = {}
+        for entry in self._entries.values():
+            self._count_tokens(entry.get("tokens", ()), 1)
+
+    @staticmethod
+    def key(prompt: str, model: str, width: int, height: int, steps: int,
+            seed: Optional[int] = None) -> str:
+        data = json.dumps([normalize_prompt(prompt), model, width, height, steps, seed_policy(seed)])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, entry: dict) -> Path:
+        return self.root / key[:2] / f"{key}{entry.get('suffix', '.png')}"
+
+    def _count_tokens(self, tokens: Iterable[str], delta: int):
+        for token in tokens:
+            count = self._df.get(token, 0) + delta
+            if count > 0:
+                self._df[token] = count
+            else:
+                self._df.pop(token, None)
+
+    def _hit(self, key: str, entry: dict, similarity: float = 1.0) -> Optional[CacheHit]:
+        """Отметить использование (под self._lock); None — файла уже нет"""
+        path = self._path(key, entry)
+        if not path.exists():
+            self._drop(key)
+            return None
+        entry["last_used"] = time.time()
+        entry["hits"] = entry.get("hits", 0) + 1
+        self._dirty = True
+        return CacheHit(key=key, path=path, model=entry["model"],
+                        seed=entry.get("seed", 0), similarity=similarity)
+
+    # === Поиск ===
+
+    def get(self, prompt: str, models: Iterable[str], width: int, height: int, steps: int,
+            seed: Optional[int] = None) -> Optional[CacheHit]:
+        """Картинка с тем же ключом у любой из моделей (в порядке предпочтения)"""
+        with self._lock:
+            for model in models:
+                key = self.key(prompt, model, width, height, steps, seed)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    hit = self._hit(key, entry)
+                    if hit is not None:
+                        return hit
+        return None
+
+    def similar(self, prompt: str, models: Iterable[str], width: int, height: int, steps: int,
+                threshold: float = 0.8, exclude_project: str = None) -> Optional[CacheHit]:
+        """
+        Самая похожая картинка (сходство ≥ threshold) со случайным seed
+
+        Args:
+            exclude_project: не брать картинки этого проекта — иначе в
+                ролике повторятся кадры
+        """
+        tokens = set(prompt_tokens(prompt))
+        if not tokens:
+            return None
+        models = set(models)
+        with self._lock:
+            total = len(self._entries)
+            idf = lambda t: math.log((total + 1) / (self._df.get(t, 0) + 1))
+            best_key, best_score = None, threshold
+            for key, entry in self._entries.items():
+                if (entry["model"] not in models or entry.get("seed_policy") != "random"
+                        or (entry["width"], entry["height"], entry["steps"]) != (width, height, steps)
+                        or (exclude_project and entry.get("project_id") == exclude_project)):
+                    continue
+                other = set(entry.get("tokens", ()))
+                union = sum(idf(t) for t in tokens | other)
+                if not union:
+                    continue
+                score = sum(idf(t) for t in tokens & other) / union
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            return self._hit(best_key, self._entries[best_key], round(best_score, 3))
+
+    # === Запись ===
+
+    def put(self, prompt: str, model: str, width: int, height: int, steps: int,
+            seed: Optional[int], path: Path, used_seed: int = 0,
+            project_id: str = None) -> Optional[Path]:
+        """Положить сгенерированную картинку (файл проекта остаётся на месте)"""
+        path = Path(path)
+        key = self.key(prompt, model, width, height, steps, seed)
+        entry = {
+            "suffix": path.suffix or ".png",
+            "model": model,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "seed_policy": seed_policy(seed),
+            "seed": used_seed,
+            "tokens": prompt_tokens(prompt),
+            "project_id": project_id,
+            "created": time.time(),
+            "last_used": time.time(),
+            "hits": 0,
+        }
+        target = self._path(key, entry)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            _copy_atomic(path, target)
+            size = target.stat().st_size
+        except OSError as e:
+            print(f"[ImageCache] Не удалось сохранить {path.name}: {e}")
+            return None
+        entry["size"] = size
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key, keep_file=True)
+            self._entries[key] = entry
+            self._count_tokens(entry["tokens"], 1)
+            self._dirty = True
+            self._evict()
+            self._save(force=False)
+        return target
+
+    def discard(self, key: str):
+        """Убрать запись: картинка оказалась плохой (image_triage) — не выдавать её снова"""
+        with self._lock:
+            self._drop(key)
+    
+    def materialize(self, hit: CacheHit, dest: Path) -> Path:
+        """Файл кэша в папку проекта (копия — см. описание модуля)"""
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        _copy_atomic(hit.path, dest)
+        return dest
+
+    # === Обслуживание ===
+
+    def _drop(self, key: str, keep_file: bool = False):
+        """Удалить запись (под self._lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._count_tokens(entry.get("tokens", ()), -1)
+        self._dirty = True
+        if not keep_file:
+            self._path(key, entry).unlink(missing_ok=True)
+
+    def _evict(self):
+        """Самые давно не нужные записи — пока кэш больше лимита (под self._lock)"""
+        total = sum(entry.get("size", 0) for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._entries, key=lambda k: self._entries[k].get("last_used", 0)):
+            total -= self._entries[key].get("size", 0)
+            self._drop(key)
+            if total <= self.max_bytes:
+                break
+
+    def _save(self, force: bool = True):
+        """Записать индекс (под self._lock); без force — не чаще раза в 5 сек"""
+        if not self._dirty or (not force and time.time() - self._saved_at < 5):
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        index_path = self.root / self.INDEX
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        tmp_path.write_text(json.dumps({"entries": self._entries}))
+        os.replace(tmp_path, index_path)
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def flush(self):
+        """Сохранить индекс (после пачки — last_used и новые записи)"""
+        with self._lock:
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry.get("size", 0) for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": sum(entry.get("hits", 0) for entry in self._entries.values()),
+            }
+
+
+def _copy_atomic(source: Path, target: Path):
+    """
+    Копия через временный файл и os.replace
+
+    Жёсткая ссылка экономила место, но делила inode между проектами и
+    кэшем: генератор, пишущий поверх файла сцены, менял картинку всем.
+    """
+    tmp_path = target.with_name(f".{target.name}.part")
+    tmp_path.unlink(missing_ok=True)
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+_cache: Optional[ImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """Кэш процесса в output/image_cache; None — кэш выключен (image_cache_gb = 0)"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from config import config, OUTPUT_DIR
+            size_gb = getattr(config.video, "image_cache_gb", 5.0)
+            if size_gb <= 0:
+                return None
+            _cache = ImageCache(OUTPUT_DIR / "image_cache", int(size_gb * 1024 ** 3))
+        return _cache
@@ -0,0 +1,278 @@
+"""
+Клиент своего image_forge master (../image_forge) — генерация на наших воркерах
+
+Адрес master — config.api.image_forge_url (IMAGE_FORGE_URL), например
+http://192.168.1.10:8000. Квот нет: master ставит задачи в очередь, а
+воркеры (GPU/Apple Silicon/CPU) разбирают их сами.
+
+ImageForgeProvider — провайдер ImageService: POST /api/generate, ожидание
+по SSE-потоку /api/task/{id}/stream (без опроса), скачивание
+/api/image/{id}/0. Отмена запроса снимает задачу на master.
+
+ImageForgeBatch — все сцены проекта одной заявкой /api/batch/generate
+(mode=partial) и один SSE-поток /api/batch/{id}/stream на всю пачку:
+картинка скачивается, как только master сообщает о готовой задаче.
+Не влезшие в очередь, упавшие и зависшие без воркеров сцены возвращаются
+неуспешными — SmartPipeline отдаёт их ImageRouter.
+"""
+
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from .image_service import (
+    ImageProvider, ImageRequest, ImageResponse, ProviderError, QuotaExceeded,
+    download, get_image_service, raise_for_status,
+)
+from .retry_policy import standard_policy
+
+TERMINAL = ("completed", "failed", "cancelled")
+
+
+def _forge_size(value: int) -> int:
+    """Размер в пределах GenerationRequest image_forge (256..2048, кратно 8)"""
+    return max(256, min(2048, value - value % 8))
+
+
+def _payload(request: ImageRequest, priority: int, project_id: Optional[str]) -> dict:
+    """ImageRequest → GenerationRequest image_forge"""
+    payload = {
+        "prompt": request.prompt[:2000],
+        "negative_prompt": request.negative_prompt[:1000],
+        "width": _forge_size(request.width),
+        "height": _forge_size(request.height),
+        "steps": request.steps,
+        "guidance": request.guidance,
+        "seed": request.seed,
+        "priority": priority,
+    }
+    if project_id:
+        payload["project_id"] = project_id
+    return payload
+
+
+class ImageForgeProvider(ImageProvider):
+    """Свой master image_forge как провайдер ImageService"""
+
+    name = "image_forge"
+    max_concurrency = 64  # Очередь держит master; ограничиваем только соединения
+    retry_policy = standard_policy(max_retries=1)
+    typical_latency = 60.0  # Зависит от воркеров; ImageRouter быстро уточнит
+
+    def __init__(self, base_url: str, project_id: Optional[str] = None, priority: int = 0):
+        self.base_url = (base_url or "").rstrip("/")
+        self.project_id = project_id
+        self.priority = priority
+
+    def available(self) -> bool:
+        return bool(self.base_url)
+
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        start_time = time.time()
+        response = await http.post(f"{self.base_url}/api/generate",
+                                   json=_payload(request, self.priority, self.project_id), timeout=30)
+        if response.status_code == 429:
+            raise QuotaExceeded(f"image_forge: очередь заполнена ({response.json().get('detail', '')})", 10)
+        raise_for_status(response, self.name)
+        task_id = response.json()["id"]
+
+        try:
+            status = await self.wait_task(http, task_id)
+        except asyncio.CancelledError:
+            # Снимаем задачу на master, чтобы воркер не тратил на неё время
+            try:
+                await asyncio.shield(http.delete(f"{self.base_url}/api/task/{task_id}", timeout=10))
+            except Exception:
+                pass
+            raise
+
+        if status.get("status") != "completed":
+            raise ProviderError(f"image_forge: {status.get('error') or status.get('status')}")
+        path = await download(http, f"{self.base_url}/api/image/{task_id}/0", request.path(".png"), timeout=60)
+        return ImageResponse(success=True, path=path, seed=request.seed or 0,
+                             generation_time=time.time() - start_time, provider=self.name)
+
+    async def wait_task(self, http, task_id: str) -> dict:
+        """Ждать конца задачи по SSE; при обрыве потока — переподключение"""
+        status: dict = {}
+        while status.get("status") not in TERMINAL:
+            try:
+                async with http.stream("GET", f"{self.base_url}/api/task/{task_id}/stream",
+                                       timeout=None) as stream:
+                    if stream.status_code != 200:
+                        await stream.aread()
+                        raise_for_status(stream, self.name)
+                    async for line in stream.aiter_lines():
+                        if line.startswith("data:"):
+                            status = json.loads(line[5:])
+                            if status.get("status") in TERMINAL:
+                                break
+            except (httpx.TransportError, OSError) as e:
+                # Обрыв соединения — статус дочитаем при переподключении
+                print(f"[image_forge] Поток задачи {task_id[:8]} прерван: {e}")
+                await asyncio.sleep(2)
+        return status
+
+
+class ImageForgeBatch:
+    """Пачка сцен проекта на master image_forge с ожиданием по событиям"""
+
+    name = "image_forge"
+
+    def __init__(self, base_url: str, project_id: Optional[str] = None, priority: int = 0,
+                 stall_timeout: float = 600, log: Callable[[str], None] = print):
+        """
+        Args:
+            stall_timeout: сек без движения пачки (нет воркеров, master
+                недоступен) — оставшиеся задачи снимаются и возвращаются
+                неуспешными
+        """
+        self.base_url = (base_url or "").rstrip("/")
+        self.project_id = project_id
+        self.priority = priority
+        self.stall_timeout = stall_timeout
+        self._log = log
+
+    def _failed(self, error: str) -> ImageResponse:
+        return ImageResponse(success=False, error=f"image_forge: {error}", provider=self.name)
+
+    async def generate_many(self, requests: Sequence[ImageRequest], http,
+                            on_result: Callable[[int, ImageResponse], None] = None,
+                            ) -> List[ImageResponse]:
+        """
+        Сгенерировать пачку; результаты в порядке запросов
+
+        Args:
+            on_result: (индекс запроса, результат) — для каждой готовой
+                картинки, как только она скачана
+        """
+        results: List[Optional[ImageResponse]] = [None] * len(requests)
+        response = await http.post(
+            f"{self.base_url}/api/batch/generate",
+            json={
+                "requests": [_payload(r, self.priority, self.project_id) for r in requests],
+                "mode": "partial",
+            },
+            timeout=60,
+        )
+        if response.status_code == 429:
+            return [self._failed("очередь заполнена") for _ in requests]
+        raise_for_status(response, self.name)
+        submission = response.json()
+
+        rejected = set(submission.get("rejected", []))
+        accepted = [i for i in range(len(requests)) if i not in rejected]
+        for i in rejected:
+            results[i] = self._failed("не поместилось в очередь")
+        # Индекс в task_ids пачки → индекс запроса (отклонённые в пачку не попали)
+        request_of: Dict[int, int] = dict(enumerate(accepted))
+        task_ids = [task["id"] for task in submission.get("tasks", [])]
+        if rejected:
+            self._log(f"[image_forge] Очередь заполнена: принято {len(accepted)}/{len(requests)}")
+
+        async def fetch(index: int, task_id: str, event: dict):
+            request = requests[index]
+            try:
+                path = await download(http, f"{self.base_url}/api/image/{task_id}/0",
+                                      request.path(".png"), timeout=60)
+                result = ImageResponse(success=True, path=path, seed=request.seed or 0,
+                                       generation_time=event.get("duration") or 0, provider=self.name)
+            except (ProviderError, httpx.HTTPError, OSError) as e:
+                result = self._failed(f"не удалось скачать: {e}")
+            results[index] = result
+            if on_result:
+                on_result(index, result)
+
+        downloads = []
+        try:
+            async for event in self.wait_batch(http, submission["batch_id"]):
+                index = request_of.get(event["index"])
+                if index is None or results[index] is not None:
+                    continue
+                if event["status"] == "completed" and event.get("images"):
+                    downloads.append(asyncio.ensure_future(fetch(index, event["task_id"], event)))
+                else:
+                    results[index] = self._failed(event.get("error") or event["status"])
+            await asyncio.gather(*downloads)
+        except asyncio.CancelledError:
+            for task in downloads:
+                task.cancel()
+            await asyncio.shield(self._cancel_tasks(http, task_ids))
+            raise
+
+        unfinished = [i for i in accepted if results[i] is None]
+        if unfinished:
+            # Пачка встала: снимаем остаток, чтобы воркеры не делали его дважды
+            await self._cancel_tasks(http, [task_ids[j] for j, i in request_of.items()
+                                            if results[i] is None])
+            for i in unfinished:
+                results[i] = self._failed("задача не завершилась")
+        return results
+
+    async def wait_batch(self, http, batch_id: str):
+        """
+        События "task" потока /api/batch/{id}/stream до конца пачки
+
+        При обрыве — переподключение (master повторит уже готовые задачи).
+        Нет движения дольше stall_timeout — генератор заканчивается раньше.
+        """
+        last_change = time.time()
+        last_batch = None
+        done = False
+        while not done:
+            event_type = None
+            try:
+                async with http.stream("GET", f"{self.base_url}/api/batch/{batch_id}/stream",
+                                       timeout=httpx.Timeout(60.0, connect=15.0)) as stream:
+                    if stream.status_code != 200:
+                        await stream.aread()
+                        raise_for_status(stream, self.name)
+                    async for line in stream.aiter_lines():
+                        if time.time() - last_change > self.stall_timeout:
+                            self._log(f"[image_forge] Пачка {batch_id[:8]} стоит "
+                                      f"{int(self.stall_timeout)} сек — прекращаю ожидание")
+                            return
+                        if line.startswith("event:"):
+                            event_type = line[6:].strip()
+                        elif line.startswith("data:"):
+                            data = json.loads(line[5:])
+                            if event_type == "task":
+                                last_change = time.time()
+                                yield data
+                            elif event_type == "batch":
+                                if data != last_batch:
+                                    last_change = time.time()
+                                    last_batch = data
+                                done = data.get("done", False)
+                # Поток закончился сам — пачка завершена
+                done = True
+            except (httpx.TransportError, OSError) as e:
+                if time.time() - last_change > self.stall_timeout:
+                    self._log(f"[image_forge] Master недоступен: {e}")
+                    return
+                print(f"[image_forge] Поток пачки {batch_id[:8]} прерван: {e}")
+                await asyncio.sleep(5)
+
+    async def _cancel_tasks(self, http, task_ids: Sequence[str]):
+        """Снять задачи на master (готовые master не отменит — это не ошибка)"""
+        async def cancel(task_id: str):
+            try:
+                await http.delete(f"{self.base_url}/api/task/{task_id}", timeout=10)
+            except (httpx.HTTPError, OSError):
+                pass
+        # Одна отмена на каждую отправленную картинку: дубли в пачке — это
+        # подписчики одной задачи master, и снять её должны все
+        await asyncio.gather(*(cancel(t) for t in task_ids))
+
+    def generate_batch(self, requests: Sequence[ImageRequest],
+                       on_result: Callable[[int, ImageResponse], None] = None) -> List[ImageResponse]:
+        """generate_many в loop ImageService из обычного потока"""
+        service = get_image_service()
+
+        async def run():
+            return await self.generate_many(requests, service.client(), on_result)
+
+        return service.run(run())
@@ -2,6 +2,7 @@
 Генератор изображений через Pollinations.ai (бесплатно, без API ключей)
 """
 
+import concurrent.futures
 import requests
 import urllib.parse
 import time
@@ -9,6 +10,11 @@ from pathlib import Path
 from typing import List, Callable, Optional
 from dataclasses import dataclass
 
+from .image_service import (
+    ImageProvider, ImageRequest, ImageResponse, ProviderError, download, get_image_service,
+)
+from .retry_policy import standard_policy
+
 
 @dataclass
 class ImageResult:
@@ -38,12 +44,16 @@ class ImageGenerator:
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.width = width
         self.height = height
-        self.max_workers = max_workers  # Количество параллельных потоков
+        self.max_workers = max_workers  # Количество параллельных запросов
         self.should_stop = False
+        self._batch = None  # Future пачки в ImageService (для stop)
     
     def stop(self):
-        """Остановить генерацию"""
+        """Остановить генерацию (запросы в полёте отменяются)"""
         self.should_stop = True
+        batch = self._batch
+        if batch is not None:
+            batch.cancel()
     
     def generate_single(self, prompt: str, filename: str = None, 
                         style: str = None, seed: int = None,
@@ -150,7 +160,8 @@ class ImageGenerator:
             error=f"Все {max_retries} попыток неудачны: {last_error}"
         )
     
-    def _simplify_prompt(self, prompt: str) -> str:
+    @staticmethod
+    def _simplify_prompt(prompt: str) -> str:
         """Умное упрощение промпта для повторной попытки — сохраняем суть, убираем проблемы"""
         simplified = prompt.lower()
         
@@ -259,19 +270,9 @@ class ImageGenerator:
             on_progress: Callback(current, total, status)
             on_image_ready: Callback(index, path, success) — вызывается когда картинка готова
         """
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        import threading
-        
         total = len(prompts)
-        results = [None] * total  # Предзаполняем для сохранения порядка
-        completed_count = 0
-        lock = threading.Lock()
-        
-        def generate_one(index: int, prompt_data: dict) -> tuple:
-            """Генерация одной картинки с 5 попытками"""
-            if self.should_stop:
-                return index, ImageResult(prompt="", path=None, success=False, error="Stopped")
-            
+        image_requests = []
+        for index, prompt_data in enumerate(prompts):
             if isinstance(prompt_data, dict):
                 prompt = prompt_data.get('prompt_en', str(prompt_data))
                 timecode = prompt_data.get('timecode', f'scene_{index+1}')
@@ -281,52 +282,72 @@ class ImageGenerator:
             
             # Очищаем имя файла от проблемных символов
             safe_timecode = timecode.replace(':', '-').replace(' ', '_').replace('/', '-')
-            filename = f"{index+1:03d}_{safe_timecode[:30]}"
-            
-            # 5 попыток на каждую картинку!
-            result = self.generate_single(prompt, filename, style, max_retries=5)
-            
-            return index, result
+            image_requests.append(ImageRequest(
+                prompt=f"{prompt}, {style}" if style else prompt,
+                filename=f"{index+1:03d}_{safe_timecode[:30]}",
+                output_dir=self.output_dir,
+                width=self.width,
+                height=self.height,
+            ))
         
-        # Запускаем параллельную генерацию
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Отправляем все задачи
-            futures = {
-                executor.submit(generate_one, i, prompt): i 
-                for i, prompt in enumerate(prompts)
-            }
-            
-            # Обрабатываем результаты по мере готовности
-            for future in as_completed(futures):
-                if self.should_stop:
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    break
-                
-                try:
-                    index, result = future.result()
-                    results[index] = result
-                    
-                    with lock:
-                        completed_count += 1
-                        
-                        if on_progress:
-                            on_progress(completed_count, total, f"Готово: {completed_count}/{total}")
-                        
-                        if on_image_ready:
-                            path = str(result.path) if result.success and result.path else ""
-                            on_image_ready(index, path, result.success)
-                            
-                except Exception as e:
-                    results[futures[future]] = ImageResult(
-                        prompt="", path=None, success=False, error=str(e)
-                    )
+        def on_result(index: int, completed: int, response: ImageResponse):
+            if on_progress:
+                on_progress(completed, total, f"Готово: {completed}/{total}")
+            if on_image_ready:
+                path = str(response.path) if response.success and response.path else ""
+                on_image_ready(index, path, response.success)
         
-        # Заполняем None результаты ошибками
-        for i, r in enumerate(results):
-            if r is None:
-                results[i] = ImageResult(prompt="", path=None, success=False, error="Not completed")
+        # Запросы идут в общем event loop сервиса (5 попыток на картинку)
+        service = get_image_service()
+        self._batch = service.submit(service.generate_many(
+            image_requests, PollinationsProvider(), max_parallel=self.max_workers, on_result=on_result
+        ))
+        try:
+            responses = self._batch.result()
+        except concurrent.futures.CancelledError:
+            responses = [None] * total
+        finally:
+            self._batch = None
         
-        return results
+        return [
+            ImageResult(prompt=request.prompt, path=r.path, success=r.success, error=r.error or None)
+            if r is not None else ImageResult(prompt="", path=None, success=False, error="Stopped")
+            for request, r in zip(image_requests, responses)
+        ]
+
+
+class PollinationsProvider(ImageProvider):
+    """Pollinations.ai как провайдер ImageService (без ключей)"""
+    
+    name = "pollinations"
+    max_concurrency = 4
+    typical_latency = 20.0
+    retry_policy = standard_policy(max_retries=4, base_delay=3)  # 5 попыток, как generate_single
+    
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        start_time = time.time()
+        full_prompt = request.prompt
+        if "8k" not in full_prompt.lower():
+            full_prompt = f"{full_prompt}, 8k, high quality, detailed"
+        
+        url = f"{ImageGenerator.BASE_URL}{urllib.parse.quote(full_prompt)}"
+        seed = request.seed or int(time.time() * 1000)  # Разный seed каждую попытку
+        params = {"width": request.width, "height": request.height, "nologo": "true", "seed": seed}
+        
+        print(f"[Pollinations] Генерация: {request.filename}...")
+        path = await download(http, url, request.path(".png"), params=params, timeout=90)
+        print(f"[✅] Успешно: {request.filename}")
+        return ImageResponse(
+            success=True, path=path, seed=seed,
+            generation_time=time.time() - start_time, provider=self.name,
+        )
+    
+    def retry_prompt(self, prompt: str, attempt: int, error: ProviderError) -> str:
+        # Со 2-й неудачи упрощаем промпт
+        if attempt >= 2:
+            print(f"[🔄] Упрощаю промпт для следующей попытки...")
+            return ImageGenerator._simplify_prompt(prompt)
+        return prompt
 
 
 class MultiServiceGenerator:
@@ -0,0 +1,243 @@
+"""
+Подготовка картинок к монтажу — сразу по мере генерации
+
+Раньше сгенерированную картинку каждый потребитель заново декодировал,
+масштабировал и обрезал: Ken Burns в финальном рендере, быстрое превью,
+слайдшоу, сетка сцен в UI. А цветокоррекция рендера прогонялась через
+PIL на каждом кадре видео — десятки тысяч раз для статичных картинок.
+
+Теперь по каждой пришедшей картинке в пуле потоков один раз делается:
+
+    мастер — images/render/<сцена>.<профиль>.<исходник>.jpg: ровно кадр
+             рендера с запасом под зум (max_zoom * 1.1, как в
+             create_ken_burns_clip) и, если грейд статичный, уже с
+             цветокоррекцией
+    превью — images/preview/<сцена>.<исходник>.jpg: 1280x720, обрезка по центру
+
+Профиль (разрешение, max_zoom, грейд) входит в имя мастера: если эффекты
+проекта поменялись, старый мастер просто не найдётся и рендер пойдёт по
+исходнику, как раньше. <исходник> — отпечаток файла сцены (размер,
+mtime_ns, inode): перегенерированная сцена или картинка из кэша на её
+месте — другой отпечаток, даже если mtime старше производных (кэш
+сохраняет mtime), и старые производные не используются.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageEnhance, ImageOps
+
+PREVIEW_SIZE = (1280, 720)
+MASTER_QUALITY = 95
+PREVIEW_QUALITY = 85
+HEADROOM = 1.1  # Запас поверх max_zoom (create_ken_burns_clip)
+
+# Грейды, не зависящие от времени: их можно применить к картинке, а не к кадрам
+STATIC_GRADES = {"cinematic", "cinematic_bw", "warm", "cold", "vintage", "dramatic"}
+
+
+def grade_image(img: Image.Image, grade: str) -> Image.Image:
+    """Цветокоррекция одной картинки (см. VideoEditor.apply_color_grade)"""
+    if grade == "cinematic":
+        # Увеличиваем контраст, слегка синий оттенок
+        img = ImageEnhance.Contrast(img).enhance(1.2)
+        img = ImageEnhance.Color(img).enhance(0.9)
+
+    elif grade == "cinematic_bw":
+        # Ч/Б с высоким контрастом — стиль военных документалок
+        img = img.convert('L').convert('RGB')
+        img = ImageEnhance.Contrast(img).enhance(1.3)
+        img = ImageEnhance.Brightness(img).enhance(1.05)  # Чуть светлее
+
+    elif grade == "warm":
+        img = ImageEnhance.Color(img).enhance(1.1)
+
+    elif grade == "cold":
+        img = ImageEnhance.Color(img).enhance(0.9)
+
+    elif grade == "vintage":
+        # Винтажный стиль — сепия + низкий контраст
+        img = ImageEnhance.Contrast(img).enhance(0.9)
+        img = ImageEnhance.Color(img).enhance(0.7)
+        # Добавляем тёплый оттенок
+        r, g, b = img.split()
+        r = r.point(lambda x: min(255, x + 20))
+        b = b.point(lambda x: max(0, x - 10))
+        img = Image.merge('RGB', (r, g, b))
+
+    elif grade == "dramatic":
+        # Высокий контраст для драматичных сцен
+        img = ImageEnhance.Contrast(img).enhance(1.4)
+        img = ImageEnhance.Color(img).enhance(0.85)  # Слегка десатурация
+
+    return img
+
+
+def headroom_size(resolution: Tuple[int, int], max_zoom: float) -> Tuple[int, int]:
+    """Размер картинки под Ken Burns: кадр с запасом под максимальный зум"""
+    scale = max_zoom * HEADROOM
+    return int(resolution[0] * scale), int(resolution[1] * scale)
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """Что рендер сделает с картинкой — от этого зависит мастер"""
+    resolution: Tuple[int, int] = (1920, 1080)
+    max_zoom: float = 1.2
+    grade: str = "none"
+
+    @classmethod
+    def from_video_config(cls, config) -> "RenderProfile":
+        """Профиль из video_editor.VideoConfig"""
+        return cls(tuple(config.resolution), config.max_zoom, config.color_grade or "none")
+
+    @property
+    def pregraded(self) -> bool:
+        """Грейд уже в мастере — рендеру не нужно красить кадры"""
+        return self.grade in STATIC_GRADES
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return headroom_size(self.resolution, self.max_zoom)
+
+    @property
+    def key(self) -> str:
+        width, height = self.resolution
+        return f"{width}x{height}z{self.max_zoom:g}{self.grade if self.pregraded else 'none'}"
+
+
+def source_tag(source: Path) -> Optional[str]:
+    """Отпечаток файла исходника: меняется при любой замене файла"""
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    return _tag(stat)
+
+
+def _tag(stat: os.stat_result) -> str:
+    key = f"{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}".encode()
+    return hashlib.blake2b(key, digest_size=5).hexdigest()
+
+
+def master_path(source: Path, profile: RenderProfile, tag: str) -> Path:
+    source = Path(source)
+    return source.parent / "render" / f"{source.stem}.{profile.key}.{tag}.jpg"
+
+
+def preview_path(source: Path, tag: str) -> Path:
+    source = Path(source)
+    return source.parent / "preview" / f"{source.stem}.{tag}.jpg"
+
+
+def find_master(source: Path, profile: RenderProfile) -> Optional[Path]:
+    """Готовый мастер картинки под профиль рендера или None"""
+    tag = source_tag(source)
+    path = master_path(source, profile, tag) if tag else None
+    return path if path is not None and path.exists() else None
+
+
+def find_preview(source: Path) -> Optional[Path]:
+    """Готовое превью 1280x720 или None"""
+    tag = source_tag(source)
+    path = preview_path(source, tag) if tag else None
+    return path if path is not None and path.exists() else None
+
+
+def _remove_stale(current: Path, pattern: str):
+    """Производные прежних версий исходника"""
+    for path in current.parent.glob(pattern):
+        if path != current:
+            path.unlink(missing_ok=True)
+
+
+def _save_jpeg(img: Image.Image, path: Path, quality: int):
+    """Атомарная запись: рендер не увидит наполовину записанный файл"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.part")
+    img.save(tmp_path, "JPEG", quality=quality)
+    os.replace(tmp_path, path)
+
+
+def prepare_image(source: Path, profile: RenderProfile) -> Tuple[Path, Path]:
+    """Мастер и превью из одного декодирования исходника"""
+    source = Path(source)
+    with open(source, "rb") as f:
+        # Отпечаток открытого файла: если сцену заменят во время подготовки,
+        # производные останутся под старым отпечатком и не подойдут новой
+        tag = _tag(os.fstat(f.fileno()))
+        with Image.open(f) as img:
+            img = img.convert("RGB")
+
+    master = ImageOps.fit(img, profile.size, Image.Resampling.LANCZOS)
+    if profile.pregraded:
+        master = grade_image(master, profile.grade)
+    master_file = master_path(source, profile, tag)
+    _save_jpeg(master, master_file, MASTER_QUALITY)
+    _remove_stale(master_file, f"{source.stem}.{profile.key}.*.jpg")
+
+    preview = ImageOps.fit(img, PREVIEW_SIZE, Image.Resampling.LANCZOS)
+    preview_file = preview_path(source, tag)
+    _save_jpeg(preview, preview_file, PREVIEW_QUALITY)
+    _remove_stale(preview_file, f"{source.stem}.*.jpg")
+    return master_file, preview_file
+
+
+class ImagePostprocessor:
+    """
+    Пул подготовки картинок
+
+    submit() — по мере прихода картинок (из колбэка генерации), ensure() —
+    перед рендером для всего, что ещё не готово. PIL отпускает GIL на
+    декодировании и ресайзе, поэтому хватает потоков.
+    """
+
+    def __init__(self, profile: RenderProfile, workers: int = None,
+                 log: Callable[[str], None] = print):
+        self.profile = profile
+        self.log = log
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or min(4, os.cpu_count() or 1),
+            thread_name_prefix="image-postprocess",
+        )
+        self._futures: List[concurrent.futures.Future] = []
+
+    def _prepare(self, source: Path) -> Optional[Tuple[Path, Path]]:
+        try:
+            return prepare_image(source, self.profile)
+        except Exception as e:
+            # Без мастера рендер возьмёт исходник — это не ошибка этапа
+            self.log(f"[Postprocess] ⚠️ {Path(source).name}: {e}")
+            return None
+
+    def submit(self, source: Path) -> Optional[concurrent.futures.Future]:
+        """Подготовить картинку в фоне; None — производные уже актуальны"""
+        if find_master(source, self.profile) and find_preview(source):
+            return None
+        future = self._pool.submit(self._prepare, Path(source))
+        self._futures.append(future)
+        return future
+
+    def wait(self) -> int:
+        """Дождаться всех поставленных картинок; возвращает число подготовленных"""
+        futures, self._futures = self._futures, []
+        return sum(1 for future in futures if future.result() is not None)
+
+    def ensure(self, sources: Iterable[Path]) -> int:
+        """Подготовить всё, чего ещё нет, и дождаться"""
+        for source in sources:
+            self.submit(source)
+        return self.wait()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
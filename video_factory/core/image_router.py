@@ -0,0 +1,323 @@
+"""
+Маршрутизация картинок между провайдерами ImageService
+
+Раньше сцены шли только во FLUX: когда все HF-токены в cooldown,
+FluxGenerator ждал квоту часами, хотя Pollinations, Leonardo и свой
+image_forge были свободны. ImageRouter для каждой картинки выбирает
+провайдера с наименьшей прогнозной задержкой:
+
+    ожидание квоты + очередь к слотам провайдера + среднее время картинки
+    ───────────────────────────────────────────────────────────────────
+                       доля успешных запросов
+
+Ожидание квоты — от провайдера (FLUX: прогноз TokenScheduler) или своё
+после QuotaExceeded (retry_after). Очередь — запросы роутера в полёте
+сверх текущего лимита параллельности провайдера (AdaptiveLimit). Время и
+доля успехов — скользящее окно последних запросов (до статистики —
+typical_latency провайдера).
+
+- Failover: запрос уходит с quota_wait — провайдер не ждёт квоту дольше,
+  QuotaExceeded или исчерпанные повторы переключают картинку на
+  следующего провайдера.
+- Hedging (hedge=True): если провайдер не ответил за свой p90, тот же
+  запрос уходит второму провайдеру; берётся первый успешный результат,
+  второй запрос отменяется.
+
+Если все провайдеры упёрлись в квоты — последняя попытка у того, кто
+восстановится раньше, уже с ожиданием квоты (как раньше FLUX).
+"""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Callable, Deque, Dict, List, Optional, Sequence
+
+from .image_service import (
+    ImageProvider, ImageRequest, ImageResponse, ImageService, ProgressCallback,
+    QuotaExceeded, gather_images, get_image_service,
+)
+
+# Сколько провайдер может ждать квоту, прежде чем картинка уйдёт другому, сек
+DEFAULT_QUOTA_WAIT = 30.0
+# Пауза провайдера после QuotaExceeded без retry_after, сек
+DEFAULT_QUOTA_COOLDOWN = 300.0
+# Сколько замеров нужно для p90 (до этого hedging ждёт 2 × typical_latency)
+HEDGE_MIN_SAMPLES = 5
+
+
+@dataclass
+class ProviderStats:
+    """Скользящая статистика провайдера в роутере"""
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=50))
+    outcomes: Deque[bool] = field(default_factory=lambda: deque(maxlen=50))
+    in_flight: int = 0
+    cooldown_until: float = 0.0
+    hedged: int = 0       # Сколько его медленных запросов продублировано другому
+    failovers: int = 0    # Сколько картинок ушло с него другому провайдеру
+
+    def mean(self, default: float) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else default
+
+    def percentile(self, q: float, default: float) -> float:
+        if not self.latencies:
+            return default
+        ordered = sorted(self.latencies)
+        return ordered[int(q * (len(ordered) - 1))]
+
+    def success_rate(self) -> float:
+        """Доля успехов со сглаживанием (у нового провайдера — 1.0)"""
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 1)
+
+
+class ImageRouter:
+    """Выбор провайдера по прогнозной задержке, failover и hedging"""
+
+    def __init__(self, service: ImageService = None, providers: Sequence[str] = (),
+                 hedge: bool = False, quota_wait: float = DEFAULT_QUOTA_WAIT,
+                 log: Callable[[str], None] = print, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            providers: имена провайдеров сервиса (пусто — все доступные)
+            hedge: дублировать медленные запросы второму провайдеру
+            quota_wait: сколько провайдер может ждать квоту до failover
+        """
+        self.service = service or get_image_service()
+        self.provider_names = list(providers)
+        self.hedge = hedge
+        self.quota_wait = quota_wait
+        self._log = log
+        self._clock = clock
+        self._stats: Dict[str, ProviderStats] = {}
+
+    def stats(self, provider: ImageProvider) -> ProviderStats:
+        return self._stats.setdefault(provider.name, ProviderStats())
+
+    def candidates(self) -> List[ImageProvider]:
+        names = self.provider_names or list(self.service.providers)
+        return [
+            self.service.providers[name] for name in names
+            if name in self.service.providers and self.service.providers[name].available()
+        ]
+
+    # === Прогноз ===
+
+    def _wait(self, provider: ImageProvider, request: ImageRequest, now: float) -> float:
+        return max(0.0, provider.predicted_wait(request), self.stats(provider).cooldown_until - now)
+
+    def _queue(self, provider: ImageProvider) -> float:
+        """Ожидание свободного слота провайдера за запросами в полёте, сек"""
+        slots = self.service.concurrency(provider)  # Текущий уровень AIMD, а не потолок
+        queued = max(0, self.stats(provider).in_flight + 1 - slots)
+        return queued / slots * self.stats(provider).mean(provider.typical_latency)
+
+    def predict(self, provider: ImageProvider, request: ImageRequest, now: float = None) -> float:
+        """Прогноз секунд до готовой картинки у провайдера"""
+        now = self._clock() if now is None else now
+        stats = self.stats(provider)
+        service_time = stats.mean(provider.typical_latency)
+        return (self._wait(provider, request, now) + self._queue(provider) + service_time) / stats.success_rate()
+
+    def rank(self, request: ImageRequest, exclude: Sequence[str] = ()) -> List[ImageProvider]:
+        """Провайдеры от лучшего прогноза к худшему (при равенстве — порядок сервиса)"""
+        now = self._clock()
+        scored = [
+            (self.predict(provider, request, now), index, provider)
+            for index, provider in enumerate(self.candidates())
+            if provider.name not in exclude
+        ]
+        return [provider for _, _, provider in sorted(scored, key=lambda item: item[:2])]
+
+    def hedge_delay(self, provider: ImageProvider, request: ImageRequest) -> float:
+        """Через сколько секунд дублировать запрос: ожидание квоты и слота + p90 провайдера"""
+        stats = self.stats(provider)
+        if len(stats.latencies) >= HEDGE_MIN_SAMPLES:
+            p90 = stats.percentile(0.9, provider.typical_latency)
+        else:
+            p90 = 2 * provider.typical_latency
+        return self._wait(provider, request, self._clock()) + self._queue(provider) + p90
+
+    # === Генерация ===
+
+    def _start(self, provider: ImageProvider, request: ImageRequest) -> asyncio.Task:
+        """
+        Запустить запрос к провайдеру
+
+        in_flight растёт сразу, а не когда задача начнёт выполняться: пачка
+        маршрутизируется за один проход loop, и следующие картинки должны
+        видеть очередь, набранную предыдущими.
+        """
+        stats = self.stats(provider)
+        stats.in_flight += 1
+        task = asyncio.ensure_future(self._attempt(provider, request))
+        task.add_done_callback(lambda _: setattr(stats, "in_flight", stats.in_flight - 1))
+        return task
+
+    async def _attempt(self, provider: ImageProvider, request: ImageRequest) -> ImageResponse:
+        """Запрос к одному провайдеру; статистика и cooldown по результату"""
+        stats = self.stats(provider)
+        start_time = self._clock()
+        try:
+            response = await self.service.generate(request, provider)
+        except QuotaExceeded as e:
+            cooldown = DEFAULT_QUOTA_COOLDOWN if e.retry_after is None else e.retry_after
+            stats.cooldown_until = self._clock() + cooldown
+            return ImageResponse(success=False, error=str(e), provider=provider.name)
+        stats.outcomes.append(response.success)
+        if response.success:
+            # Время самой генерации, без ожидания слота (очередь прогнозируется отдельно)
+            stats.latencies.append(response.generation_time or self._clock() - start_time)
+        return response
+
+    async def _race(self, primary: ImageProvider, request: ImageRequest,
+                    tried: set) -> ImageResponse:
+        """Запрос к primary; при hedging — дубль второму провайдеру после p90"""
+        delay = self.hedge_delay(primary, request)
+        primary_task = self._start(primary, request)
+        if not self.hedge:
+            return await primary_task
+
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+        backups = [] if done else self.rank(request, exclude=tried)
+        if not backups:
+            return await primary_task
+
+        backup = backups[0]
+        tried.add(backup.name)
+        self.stats(primary).hedged += 1
+        self._log(f"[images] 🐢 {request.filename}: {primary.name} медлит, дублирую в {backup.name}")
+        # Свой файл у дубля: проигравший запрос не должен затереть победителя
+        backup_task = self._start(backup, replace(request, filename=f"{request.filename}.hedge"))
+        tasks = [primary_task, backup_task]
+        pending = set(tasks)
+        winner: Optional[ImageResponse] = None
+        try:
+            while pending and winner is None:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finished = [t for t in tasks if t.done() and not t.cancelled() and t.result().success]
+                if finished:
+                    winner = finished[0].result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner is None:
+            return primary_task.result()
+        # Успевший дубль-проигравший — лишний файл
+        for task in tasks:
+            result = task.result() if task.done() and not task.cancelled() else None
+            if result is not None and result is not winner and result.success and result.path:
+                result.path.unlink(missing_ok=True)
+        if winner.path and winner.path.name.startswith(f"{request.filename}.hedge"):
+            final_path = request.path(winner.path.suffix)
+            winner.path.replace(final_path)
+            winner.path = final_path
+        return winner
+
+    async def generate(self, request: ImageRequest, exclude: Sequence[str] = ()) -> ImageResponse:
+        """
+        Одна картинка: лучший провайдер, при неудаче — следующий
+
+        Args:
+            exclude: провайдеры, которые уже не справились с этой картинкой
+        """
+        routed = request if request.quota_wait is not None else replace(request, quota_wait=self.quota_wait)
+        tried: set = set(exclude)
+        attempts = 0
+        last: Optional[ImageResponse] = None
+
+        while True:
+            ranked = self.rank(routed, exclude=tried)
+            if not ranked:
+                break
+            provider = ranked[0]
+            tried.add(provider.name)
+            if last is not None:
+                self._log(f"[images] ↪ {request.filename}: {last.provider} не справился, пробую {provider.name}")
+            response = await self._race(provider, routed, tried)
+            attempts += response.attempts
+            if response.success:
+                response.attempts = attempts
+                return response
+            self.stats(self.service.providers.get(response.provider, provider)).failovers += 1
+            last = response
+
+        # Все упёрлись в квоты — ждём того, кто восстановится раньше
+        now = self._clock()
+        allowed = [p for p in self.candidates() if p.name not in exclude]
+        limited = [p for p in allowed if self._wait(p, routed, now) > 0]
+        if limited and len(limited) == len(allowed):
+            provider = min(limited, key=lambda p: self.predict(p, routed, now))
+            self._log(f"[images] ⏳ {request.filename}: все провайдеры на квоте, жду {provider.name}")
+            response = await self._start(provider, replace(routed, quota_wait=None))
+            response.attempts += attempts
+            return response
+
+        if last is None:
+            return ImageResponse(success=False, error="Нет доступных провайдеров изображений")
+        last.attempts = attempts
+        return last
+
+    async def generate_many(self, requests: Sequence[ImageRequest],
+                            on_progress: ProgressCallback = None,
+                            max_parallel: int = None,
+                            on_result: Callable[[int, int, ImageResponse], None] = None,
+                            exclude: Sequence[str] = (),
+                            ) -> List[ImageResponse]:
+        """Пачка картинок через роутер; результаты в порядке запросов"""
+        return await gather_images(
+            requests, lambda request: self.generate(request, exclude),
+            on_progress, max_parallel, on_result, self._log,
+        )
+
+    def generate_batch(self, requests: Sequence[ImageRequest],
+                       on_progress: ProgressCallback = None,
+                       max_parallel: int = None,
+                       on_result: Callable[[int, int, ImageResponse], None] = None,
+                       exclude: Sequence[str] = (),
+                       ) -> List[ImageResponse]:
+        """generate_many из обычного потока (блокирует до конца пачки)"""
+        return self.service.run(self.generate_many(requests, on_progress, max_parallel, on_result, exclude))
+
+    def status(self, request: ImageRequest = None) -> List[dict]:
+        """Прогноз и статистика по провайдерам (для логов и UI)"""
+        request = request or ImageRequest(prompt="", filename="", output_dir=".")
+        now = self._clock()
+        rows = []
+        for provider in self.candidates():
+            stats = self.stats(provider)
+            rows.append({
+                "provider": provider.name,
+                "predicted": round(self.predict(provider, request, now), 1),
+                "wait": round(self._wait(provider, request, now), 1),
+                "p50": round(stats.percentile(0.5, provider.typical_latency), 1),
+                "p90": round(stats.percentile(0.9, provider.typical_latency), 1),
+                "success_rate": round(stats.success_rate(), 2),
+                "in_flight": stats.in_flight,
+                "concurrency": self.service.concurrency(provider),
+                "hedged": stats.hedged,
+                "failovers": stats.failovers,
+            })
+        return rows
+
+
+_router: Optional[ImageRouter] = None
+
+
+def get_image_router() -> ImageRouter:
+    """Роутер процесса: провайдеры и hedging из config.video"""
+    global _router
+    if _router is None:
+        try:
+            from config import config
+            providers = getattr(config.video, "image_providers", [])
+            hedge = getattr(config.video, "image_hedging", False)
+        except ImportError:
+            providers, hedge = [], False
+        _router = ImageRouter(providers=providers, hedge=hedge)
+    return _router
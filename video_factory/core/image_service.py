@@ -0,0 +1,441 @@
+"""
+Асинхронный сервис генерации изображений
+
+Раньше каждый генератор (FluxGenerator, ImageGenerator, ThumbnailAI,
+LeonardoClient) держал свой ThreadPoolExecutor с блокирующими запросами и
+time.sleep между попытками: поток на каждый запрос в полёте. Здесь один
+event loop в фоновом потоке процесса и общий httpx.AsyncClient — сотни
+запросов к разным провайдерам одновременно, без потока на запрос.
+
+Провайдер (ImageProvider) — один запрос к одному сервису: FLUX Space
+(flux_generator), Pollinations (image_generator), Leonardo
+(leonardo_client), Replicate/FAL (thumbnail_ai), свой image_forge master
+(image_forge_client). Сервис добавляет общее для всех:
+
+- лимит одновременных запросов на провайдера (на весь процесс): потолок —
+  max_concurrency, текущий уровень подбирает AIMD (adaptive_limit);
+- повторы по политике провайдера (retry_policy): пауза asyncio.sleep без
+  занятого слота, правка промпта, общий бюджет повторов проекта;
+- отмену: отменённый Future/Task снимает запросы у провайдеров;
+- единый результат ImageResponse (поля как у FluxResult).
+
+Из обычного потока (этапы SmartPipeline):
+
+    service = get_image_service()
+    results = service.generate_batch(requests, provider="pollinations", on_progress=cb)
+
+Корутины сервиса выполняются только в его loop: из чужого event loop —
+`await asyncio.wrap_future(service.submit(service.generate(request)))`.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+import httpx
+
+from .adaptive_limit import AdaptiveLimit
+from .retry_policy import RetryBudget, RetryPolicy, RetryState, classify_error, standard_policy
+
+
+# === Ошибки провайдеров ===
+
+class ProviderError(Exception):
+    """Запрос к провайдеру не удался (можно повторить)"""
+
+
+class QuotaExceeded(ProviderError):
+    """Квота или rate limit провайдера"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ContentRejected(ProviderError):
+    """Промпт отклонён фильтром контента — нужен другой промпт"""
+
+
+# === Запрос и результат ===
+
+@dataclass
+class ImageRequest:
+    """Одна картинка: промпт и куда сохранить"""
+    prompt: str
+    filename: str
+    output_dir: Path
+    width: int = 1280
+    height: int = 720
+    steps: int = 28
+    guidance: float = 3.5
+    seed: Optional[int] = None
+    negative_prompt: str = ""
+    # Сколько ждать квоту провайдера, сек: None — сколько нужно; число —
+    # дольше не ждать, QuotaExceeded уходит вызывающему (ImageRouter
+    # переключает запрос на другой провайдер)
+    quota_wait: Optional[float] = None
+    retry_budget: Optional[RetryBudget] = None  # Общий запас повторов проекта
+
+    def path(self, suffix: str) -> Path:
+        return Path(self.output_dir) / f"{self.filename}{suffix}"
+
+
+@dataclass
+class ImageResponse:
+    """Результат генерации — единый для всех провайдеров (поля как у FluxResult)"""
+    success: bool
+    path: Optional[Path] = None
+    error: str = ""
+    seed: int = 0
+    generation_time: float = 0
+    provider: str = ""
+    token_index: int = -1              # Номер ключа/токена провайдера (для логов)
+    attempts: int = 0
+
+
+# === Провайдер ===
+
+class ImageProvider:
+    """
+    Интерфейс провайдера: один запрос, без повторов
+
+    generate() либо возвращает ImageResponse(success=True), либо бросает
+    ProviderError/QuotaExceeded/ContentRejected. Повторы, паузы и лимиты —
+    забота ImageService по retry_policy провайдера (core/retry_policy.py).
+    """
+
+    name = "provider"
+    max_concurrency = 4     # Потолок параллельности (см. AdaptiveLimit)
+    typical_latency = 30.0  # Сек на картинку, пока нет своей статистики (ImageRouter)
+    retry_policy: RetryPolicy = standard_policy()
+
+    def available(self) -> bool:
+        return True
+
+    def predicted_wait(self, request: ImageRequest) -> float:
+        """Сколько секунд ждать квоту до начала запроса (0 — можно сразу)"""
+        return 0.0
+
+    async def generate(self, request: ImageRequest, http: httpx.AsyncClient) -> ImageResponse:
+        raise NotImplementedError
+
+    def retry_prompt(self, prompt: str, attempt: int, error: ProviderError) -> str:
+        """Промпт для следующей попытки (если правило класса ошибки велит менять)"""
+        return prompt
+
+
+def is_image(content: bytes) -> bool:
+    """PNG/JPEG/WEBP по сигнатуре (а не страница ошибки)"""
+    return (
+        content[:8] == b"\x89PNG\r\n\x1a\n"
+        or content[:2] == b"\xff\xd8"
+        or (content[:4] == b"RIFF" and content[8:12] == b"WEBP")
+    ) and len(content) > 500
+
+
+async def download(http: httpx.AsyncClient, url: str, path: Path, **kwargs) -> Path:
+    """Скачать картинку по URL в path (атомарно)"""
+    response = await http.get(url, **kwargs)
+    if response.status_code != 200:
+        raise ProviderError(f"Ошибка скачивания: HTTP {response.status_code}")
+    if not is_image(response.content):
+        raise ProviderError(f"Ответ не является изображением (размер: {len(response.content)} байт)")
+    await asyncio.to_thread(_write_bytes, path, response.content)
+    return path
+
+
+def _write_bytes(path: Path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.part")
+    tmp_path.write_bytes(content)
+    tmp_path.replace(path)
+
+
+def raise_for_status(response: httpx.Response, provider: str):
+    """Коды ответа REST-провайдеров → ошибки сервиса"""
+    status = response.status_code
+    if status in (402, 429):
+        retry_after = response.headers.get("retry-after")
+        raise QuotaExceeded(
+            f"{provider}: HTTP {status}",
+            float(retry_after) if retry_after and retry_after.isdigit() else None,
+        )
+    if status >= 400:
+        raise ProviderError(f"{provider}: HTTP {status} {response.text[:200]}")
+
+
+# === Сервис ===
+
+ProgressCallback = Callable[[int, int, ImageResponse], None]
+
+
+class ImageService:
+    """Один event loop на процесс для всех запросов к генераторам картинок"""
+
+    def __init__(self, providers: Sequence[ImageProvider] = (), log: Callable[[str], None] = print):
+        self.providers: Dict[str, ImageProvider] = {}
+        for provider in providers:
+            self.add_provider(provider)
+        self._log = log
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        self._limits: Dict[str, AdaptiveLimit] = {}
+        self._start_lock = threading.Lock()
+
+    # === Провайдеры ===
+
+    def add_provider(self, provider: ImageProvider) -> ImageProvider:
+        """Зарегистрировать провайдера (уже известное имя — возвращается старый)"""
+        return self.providers.setdefault(provider.name, provider)
+
+    def available(self) -> List[str]:
+        return [name for name, provider in self.providers.items() if provider.available()]
+
+    def _resolve(self, provider: Union[str, ImageProvider, None]) -> ImageProvider:
+        if isinstance(provider, ImageProvider):
+            return self.add_provider(provider)
+        if provider is None:
+            names = self.available()
+            if not names:
+                raise ValueError("Нет доступных провайдеров изображений")
+            provider = names[0]
+        if provider not in self.providers:
+            raise ValueError(f"Неизвестный провайдер: {provider}")
+        return self.providers[provider]
+
+    def _limit(self, provider: ImageProvider) -> AdaptiveLimit:
+        """Лимит провайдера: max_concurrency — потолок, текущий уровень подбирает AIMD"""
+        limit = self._limits.get(provider.name)
+        if limit is None:
+            limit = self._limits[provider.name] = AdaptiveLimit(
+                provider.max_concurrency, name=provider.name, log=self._log
+            )
+        return limit
+
+    def concurrency(self, provider: ImageProvider) -> int:
+        """Текущий лимит параллельности провайдера"""
+        limit = self._limits.get(provider.name)
+        return limit.limit if limit is not None else max(1, provider.max_concurrency)
+
+    def concurrency_status(self) -> Dict[str, dict]:
+        """Уровень, задержки и пропускная способность по провайдерам (из любого потока)"""
+        return {name: limit.snapshot() for name, limit in list(self._limits.items())}
+
+    # === Event loop в фоне ===
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="image-service", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Запустить корутину в loop сервиса; future.cancel() отменяет её"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run(self, coro, timeout: float = None):
+        """Выполнить корутину и дождаться результата (из обычного потока)"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def client(self) -> httpx.AsyncClient:
+        """Общий HTTP-клиент (только внутри loop сервиса)"""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(120.0, connect=15.0),
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+                follow_redirects=True,
+            )
+        return self._http
+
+    def close(self):
+        """Закрыть соединения и остановить loop"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        if self._http is not None:
+            asyncio.run_coroutine_threadsafe(self._http.aclose(), loop).result(10)
+            self._http = None
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(10)
+        loop.close()
+        self._limits.clear()
+
+    # === Генерация ===
+
+    async def generate(self, request: ImageRequest,
+                       provider: Union[str, ImageProvider, None] = None) -> ImageResponse:
+        """Одна картинка у одного провайдера, с повторами"""
+        provider = self._resolve(provider)
+        policy = provider.retry_policy
+        state = RetryState()
+        prompt = request.prompt
+        attempt = 0
+        start_time = time.time()
+
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                # Слот провайдера — только на время запроса: пауза перед
+                # повтором не отнимает параллельность у остальных картинок
+                async with self._limit(provider).slot() as slot:
+                    response = await provider.generate(_with_prompt(request, prompt), self.client())
+                    slot.done(response)
+                response.attempts = attempt
+                response.provider = response.provider or provider.name
+                return response
+            except QuotaExceeded as e:
+                # С quota_wait ждём квоту сами, только если она вернётся в
+                # этот срок (у FLUX — другой токен, retry_after=0); иначе
+                # решает вызывающий (роутер уходит к другому провайдеру)
+                if request.quota_wait is not None and (
+                        e.retry_after is None or e.retry_after > request.quota_wait):
+                    raise
+                error, retry_after = e, e.retry_after
+            except ProviderError as e:
+                error = e
+            except (httpx.HTTPError, OSError) as e:
+                error = ProviderError(f"{type(e).__name__}: {e}")
+
+            decision = policy.next(state, classify_error(error), retry_after, request.retry_budget)
+            if not decision.retry and isinstance(error, QuotaExceeded) and request.quota_wait is not None:
+                raise error  # Повторы квоты кончились — пусть роутер поставит cooldown
+            if not decision.retry:
+                self._log(f"[{provider.name}] 💀 {request.filename}: {decision.reason} ({attempt} попыток)")
+                return ImageResponse(
+                    success=False, error=str(error), provider=provider.name,
+                    attempts=attempt, generation_time=time.time() - start_time,
+                )
+            if decision.rewrite:
+                prompt = provider.retry_prompt(prompt, state.total, error)
+            if decision.delay > 0:
+                await asyncio.sleep(decision.delay)
+
+    async def generate_many(self, requests: Sequence[ImageRequest],
+                            provider: Union[str, ImageProvider, None] = None,
+                            on_progress: ProgressCallback = None,
+                            max_parallel: int = None,
+                            on_result: Callable[[int, int, ImageResponse], None] = None,
+                            ) -> List[ImageResponse]:
+        """
+        Пачка картинок параллельно; результаты в порядке запросов
+
+        Args:
+            on_progress: (готово, всего, результат) — по мере готовности
+            max_parallel: дополнительный лимит для этой пачки (общий лимит
+                провайдера действует всегда)
+            on_result: (индекс запроса, готово, результат) — если нужен номер
+        """
+        provider = self._resolve(provider)
+        return await gather_images(
+            requests, lambda request: self.generate(request, provider),
+            on_progress, max_parallel, on_result, self._log,
+        )
+
+    def generate_batch(self, requests: Sequence[ImageRequest],
+                       provider: Union[str, ImageProvider, None] = None,
+                       on_progress: ProgressCallback = None,
+                       max_parallel: int = None) -> List[ImageResponse]:
+        """generate_many из обычного потока (блокирует до конца пачки)"""
+        return self.run(self.generate_many(requests, provider, on_progress, max_parallel))
+
+
+async def gather_images(requests: Sequence[ImageRequest],
+                        generate: Callable[[ImageRequest], Awaitable[ImageResponse]],
+                        on_progress: ProgressCallback = None,
+                        max_parallel: int = None,
+                        on_result: Callable[[int, int, ImageResponse], None] = None,
+                        log: Callable[[str], None] = print) -> List[ImageResponse]:
+    """Запустить generate() для всех запросов, колбэки — по мере готовности"""
+    total = len(requests)
+    results: List[Optional[ImageResponse]] = [None] * total
+    completed = 0
+    batch_limit = asyncio.Semaphore(max_parallel) if max_parallel else None
+
+    async def one(index: int, request: ImageRequest):
+        nonlocal completed
+        if batch_limit is None:
+            result = await generate(request)
+        else:
+            async with batch_limit:
+                result = await generate(request)
+        results[index] = result
+        completed += 1
+        try:
+            if on_progress:
+                on_progress(completed, total, result)
+            if on_result:
+                on_result(index, completed, result)
+        except Exception as e:
+            log(f"[images] Ошибка в колбэке прогресса: {e}")
+
+    # gather отменяет все запросы пачки, если отменили её саму
+    await asyncio.gather(*(one(i, r) for i, r in enumerate(requests)))
+    return results
+
+
+def _with_prompt(request: ImageRequest, prompt: str) -> ImageRequest:
+    if prompt == request.prompt:
+        return request
+    return replace(request, prompt=prompt)
+
+
+# === Общий сервис ===
+
+_service: Optional[ImageService] = None
+_service_lock = threading.Lock()
+
+
+def get_image_service() -> ImageService:
+    """Сервис процесса с провайдерами из конфига"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ImageService(_configured_providers())
+        return _service
+
+
+def _configured_providers() -> List[ImageProvider]:
+    """Провайдеры с ключами из config (порядок — предпочтение по умолчанию)"""
+    try:
+        from config import config
+        api = config.api
+    except ImportError:
+        api = None
+
+    providers: List[ImageProvider] = []
+    if api is not None:
+        from .flux_generator import FluxSpaceProvider
+        from .image_forge_client import ImageForgeProvider
+        from .leonardo_client import LeonardoProvider
+        from .thumbnail_ai import FalProvider, ReplicateProvider
+
+        tokens = getattr(api, "huggingface_tokens", [])
+        if tokens:
+            providers.append(FluxSpaceProvider(tokens))
+        if getattr(api, "image_forge_url", ""):
+            providers.append(ImageForgeProvider(api.image_forge_url))
+        if getattr(api, "leonardo_keys", []):
+            providers.append(LeonardoProvider(api.leonardo_keys))
+        if getattr(api, "replicate_keys", []):
+            providers.append(ReplicateProvider(api.replicate_keys))
+        if getattr(api, "fal_keys", []):
+            providers.append(FalProvider(api.fal_keys))
+
+    from .image_generator import PollinationsProvider
+    providers.append(PollinationsProvider())  # Без ключей — всегда последний
+    return providers
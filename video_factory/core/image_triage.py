@@ -0,0 +1,208 @@
+"""
+Быстрая проверка картинок сцен — до рендера, а не после
+
+QualityChecker смотрел только на наличие и размер файла, и пустой серый
+кадр, чёрная «ночь», повтор соседней сцены или картинка не тех пропорций
+обнаруживались уже в готовом ролике после 40 минут рендера. Здесь каждая
+картинка по мере прихода проверяется в пуле процессов (NumPy, уменьшенная
+копия в оттенках серого, миллисекунды на кадр):
+
+    blank      почти однотонный кадр: заглушка, ошибка генерации
+    dark       слишком тёмный: средняя яркость и светлые участки у нуля
+    aspect     пропорции не совпадают с ожидаемыми (16:9)
+    duplicate  перцептивный хэш (pHash, DCT 32x32) почти равен хэшу
+               более ранней сцены — один и тот же кадр дважды
+    unreadable файл не декодируется
+
+SmartPipeline перегенерирует не прошедшие проверку сцены до рендера.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+BLANK_STD = 8.0             # Стандартное отклонение яркости (0..255) у однотонного кадра
+BLANK_SHARE = 0.98          # ...или такая доля пикселей в ±10 от медианы
+DARK_MEAN = 18.0            # Средняя яркость тёмного кадра
+DARK_HIGHLIGHTS = 60.0      # 99-й перцентиль: в тёмном кадре нет светлых участков
+ASPECT_TOLERANCE = 0.03     # Допустимое отклонение пропорций (доля)
+DUPLICATE_DISTANCE = 6      # Бит из 63 — ближе считается тем же кадром
+ANALYSIS_SIZE = 256         # Сторона уменьшенной копии для статистики
+
+PROBLEMS = {
+    "blank": "однотонный кадр",
+    "dark": "слишком тёмный",
+    "aspect": "не те пропорции",
+    "duplicate": "повтор сцены",
+    "unreadable": "не читается",
+}
+
+
+@dataclass
+class TriageResult:
+    """Итог проверки одной картинки"""
+    path: str
+    problems: List[str] = field(default_factory=list)
+    width: int = 0
+    height: int = 0
+    mean: float = 0.0
+    std: float = 0.0
+    phash: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    return np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def phash(gray: Image.Image) -> int:
+    """Перцептивный хэш: знаки низких частот DCT относительно медианы (63 бита)"""
+    pixels = np.asarray(gray.resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    coeffs = (_DCT32 @ pixels @ _DCT32.T)[:8, :8].flatten()[1:]  # Без постоянной составляющей
+    bits = coeffs > np.median(coeffs)
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def analyze_image(path: str, aspect: float = 16 / 9) -> TriageResult:
+    """Проверить одну картинку (выполняется в воркере пула)"""
+    result = TriageResult(path=str(path))
+    try:
+        with Image.open(path) as img:
+            result.width, result.height = img.size
+            img.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))  # JPEG декодируется сразу уменьшенным
+            gray = img.convert("L")
+    except Exception:
+        result.problems.append("unreadable")
+        return result
+
+    gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(gray, dtype=np.float32)
+    result.mean = float(pixels.mean())
+    result.std = float(pixels.std())
+    result.phash = phash(gray)
+
+    near_median = float(np.mean(np.abs(pixels - np.median(pixels)) <= 10))
+    if result.mean < DARK_MEAN and float(np.percentile(pixels, 99)) < DARK_HIGHLIGHTS:
+        result.problems.append("dark")
+    elif result.std < BLANK_STD or near_median >= BLANK_SHARE:
+        result.problems.append("blank")
+
+    if aspect and result.height and abs(result.width / result.height - aspect) / aspect > ASPECT_TOLERANCE:
+        result.problems.append("aspect")
+    return result
+
+
+def describe(failures: Dict[Hashable, List[str]]) -> str:
+    """Сводка для лога: 'однотонный кадр: 2, повтор сцены: 1'"""
+    counts: Dict[str, int] = {}
+    for problems in failures.values():
+        for problem in problems:
+            counts[problem] = counts.get(problem, 0) + 1
+    return ", ".join(f"{PROBLEMS.get(p, p)}: {n}" for p, n in counts.items())
+
+
+class ImageTriage:
+    """
+    Проверка картинок в пуле процессов по мере их появления
+
+    Ключ картинки — номер сцены: дубликатом считается более поздняя из
+    двух похожих сцен. submit() не ждёт, failures() дожидается всех.
+
+    processes=False — пул потоков: для разовой проверки готового набора
+    запуск spawn-процессов (импорт NumPy/PIL в каждом) дороже самой
+    проверки, а декодирование и NumPy отпускают GIL.
+    """
+
+    def __init__(self, aspect: float = 16 / 9, workers: int = None,
+                 duplicate_distance: int = DUPLICATE_DISTANCE,
+                 log: Callable[[str], None] = print, processes: bool = True):
+        self.aspect = aspect
+        self.duplicate_distance = duplicate_distance
+        self.log = log
+        workers = workers or min(4, os.cpu_count() or 1)
+        if processes:
+            # spawn, а не fork: в процессе UI и фоновые потоки (fork их копирует наполовину)
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="image-triage",
+            )
+        self._futures: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def submit(self, key: Hashable, path: Path):
+        """Поставить картинку на проверку (повторный submit ключа — новая версия)"""
+        self._futures[key] = self._pool.submit(analyze_image, str(path), self.aspect)
+
+    def results(self) -> Dict[Hashable, TriageResult]:
+        """Дождаться всех проверок"""
+        results = {}
+        for key, future in list(self._futures.items()):
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                # Упал воркер пула — картинку не браковать
+                self.log(f"[Triage] ⚠️ {key}: {e}")
+        return results
+
+    def failures(self, keys: Iterable[Hashable] = None) -> Dict[Hashable, List[str]]:
+        """
+        Проблемы картинок: {ключ: [код, ...]}
+
+        Args:
+            keys: вернуть только эти ключи (остальные картинки — только
+                образцы для поиска повторов)
+        """
+        results = self.results()
+        failures: Dict[Hashable, List[str]] = {}
+        seen: List[int] = []
+        for key in sorted(results):
+            result = results[key]
+            problems = list(result.problems)
+            if result.phash is not None and not problems:
+                if any(hamming(result.phash, other) <= self.duplicate_distance for other in seen):
+                    problems.append("duplicate")
+                else:
+                    seen.append(result.phash)
+            if problems:
+                failures[key] = problems
+        if keys is not None:
+            keys = set(keys)
+            failures = {key: problems for key, problems in failures.items() if key in keys}
+        return failures
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def triage_images(paths: List[Path], aspect: float = 16 / 9) -> Dict[int, List[str]]:
+    """Проверить готовый набор картинок целиком (в потоках): {номер: [код, ...]}"""
+    with ImageTriage(aspect, processes=False) as triage:
+        for i, path in enumerate(paths):
+            triage.submit(i, path)
+        return triage.failures()
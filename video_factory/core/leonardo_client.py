@@ -5,12 +5,18 @@ Leonardo даёт высокое качество изображений, иде
 Поддержка ротации нескольких аккаунтов.
 """
 
+import itertools
 import requests
 import time
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass
 
+from .image_service import (
+    ImageProvider, ImageRequest, ImageResponse, ProviderError, QuotaExceeded,
+    download, raise_for_status,
+)
+
 
 @dataclass
 class LeonardoResult:
@@ -371,6 +377,94 @@ class LeonardoClient:
         }
 
 
+class LeonardoProvider(ImageProvider):
+    """Leonardo AI как провайдер ImageService (ключи по кругу)"""
+    
+    name = "leonardo"
+    typical_latency = 40.0
+    
+    def __init__(self, api_keys: List[str], model: str = "leonardo_vision_xl"):
+        self.api_keys = [k for k in (api_keys or []) if k]
+        self.model_id = LeonardoClient.MODELS.get(model, LeonardoClient.MODELS["leonardo_vision_xl"])
+        self.max_concurrency = 2 * max(1, len(self.api_keys))
+        self._next_key = itertools.count()
+        self._bad_keys: set = set()  # Индексы ключей, отвергнутых с 401/403
+    
+    def available(self) -> bool:
+        return len(self._bad_keys) < len(self.api_keys)
+    
+    def _pick_key(self) -> Optional[int]:
+        """Следующий ключ по кругу, пропуская нерабочие"""
+        for _ in range(len(self.api_keys)):
+            key_index = next(self._next_key) % len(self.api_keys)
+            if key_index not in self._bad_keys:
+                return key_index
+        return None
+    
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        import asyncio
+        
+        start_time = time.time()
+        
+        # 1. Создаём генерацию. Нерабочий ключ (401/403) — проблема ключа,
+        # а не провайдера: убираем его из ротации и пробуем следующий.
+        # QuotaExceeded (и пауза для всего Leonardo) — только когда
+        # рабочих ключей не осталось
+        while True:
+            key_index = self._pick_key()
+            if key_index is None:
+                raise QuotaExceeded("Leonardo: нет рабочих ключей")
+            headers = {"Authorization": f"Bearer {self.api_keys[key_index]}"}
+            response = await http.post(
+                f"{LeonardoClient.BASE_URL}/generations",
+                headers=headers,
+                json={
+                    "prompt": request.prompt,
+                    "negative_prompt": request.negative_prompt or "blurry, low quality, distorted, watermark, text",
+                    "modelId": self.model_id,
+                    "width": request.width,
+                    "height": request.height,
+                    "num_images": 1,
+                    "alchemy": True,
+                    "photoReal": True,
+                    "presetStyle": "CINEMATIC",
+                    **({"seed": request.seed} if request.seed else {}),
+                },
+                timeout=60,
+            )
+            if response.status_code not in (401, 403):
+                break
+            self._bad_keys.add(key_index)
+            print(f"[Leonardo] Ключ #{key_index + 1} не работает ({response.status_code}), исключён из ротации")
+        raise_for_status(response, self.name)
+        generation_id = response.json().get("sdGenerationJob", {}).get("generationId")
+        if not generation_id:
+            raise ProviderError("Leonardo: не получен generation_id")
+        
+        # 2. Ждём завершения (без блокировки потока)
+        deadline = time.time() + 180
+        while time.time() < deadline:
+            await asyncio.sleep(3)
+            status = await http.get(f"{LeonardoClient.BASE_URL}/generations/{generation_id}",
+                                    headers=headers, timeout=30)
+            raise_for_status(status, self.name)
+            generation = status.json().get("generations_by_pk", {})
+            if generation.get("status") == "FAILED":
+                raise ProviderError("Leonardo: генерация не удалась")
+            if generation.get("status") == "COMPLETE":
+                images = generation.get("generated_images", [])
+                if not images or not images[0].get("url"):
+                    raise ProviderError("Leonardo: нет URL изображения")
+                # 3. Скачиваем
+                path = await download(http, images[0]["url"], request.path(".png"), timeout=60)
+                return ImageResponse(
+                    success=True, path=path, seed=request.seed or 0,
+                    generation_time=time.time() - start_time, provider=self.name,
+                    token_index=key_index,
+                )
+        raise ProviderError("Leonardo: таймаут генерации")
+
+
 # === ГЛОБАЛЬНЫЙ ЭКЗЕМПЛЯР ===
 
 _client: Optional[LeonardoClient] = None
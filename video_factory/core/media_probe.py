@@ -0,0 +1,337 @@
+"""
+Быстрое чтение параметров медиафайлов — длительность и размеры
+
+Раньше длительность узнавали через MoviePy AudioFileClip: это запуск
+ffmpeg и начало декодирования ради одного числа. Здесь читаются только
+заголовки:
+
+- MP3 — заголовок первого кадра + Xing/Info/VBRI (или расчёт для CBR)
+- WAV — стандартный модуль wave
+- изображения — заголовок через Pillow
+- остальное — один вызов ffprobe с JSON, если он установлен
+- mutagen используется для аудио, если установлен
+
+Результаты кэшируются по (путь, размер, mtime) — повторный запрос стоит
+один stat().
+"""
+
+import json
+import shutil
+import struct
+import subprocess
+import threading
+import wave
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+class MediaProbeError(Exception):
+    """Не удалось определить параметры файла"""
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    """Параметры медиафайла (None — неизвестно/неприменимо)"""
+    duration: Optional[float] = None     # Секунды
+    width: Optional[int] = None
+    height: Optional[int] = None
+    sample_rate: Optional[int] = None
+    bitrate: Optional[int] = None        # Бит/сек
+    source: str = ""                     # Чем прочитано: mp3, wave, pillow, ffprobe...
+
+
+# === MP3 ===
+
+_MP3_BITRATES = {
+    # (MPEG-1?, layer) -> кбит/с по индексу
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG-1
+    2: [22050, 24000, 16000],  # MPEG-2
+    0: [11025, 12000, 8000],   # MPEG-2.5
+}
+
+
+def _parse_mp3_frame_header(header: bytes) -> Optional[dict]:
+    """Разбор 4-байтного заголовка кадра MPEG audio"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0x03
+    layer = 4 - ((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    mono = (header[3] >> 6) == 3
+
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][sample_rate_index]
+
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or mpeg1) else 576
+        frame_length = (samples // 8) * bitrate // sample_rate + padding
+
+    return {
+        "mpeg1": mpeg1,
+        "layer": layer,
+        "mono": mono,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "samples": samples,
+        "frame_length": frame_length,
+    }
+
+
+def _probe_mp3(path: Path, size: int) -> Optional[MediaInfo]:
+    """Длительность MP3 по заголовкам (без декодирования)"""
+    with open(path, "rb") as f:
+        head = f.read(10)
+        offset = 0
+        # ID3v2 в начале файла
+        if head[:3] == b"ID3" and len(head) == 10:
+            tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+            offset = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+
+        f.seek(offset)
+        data = f.read(64 * 1024)
+
+        # ID3v1 в конце
+        tail_size = 0
+        if size >= 128:
+            f.seek(size - 128)
+            if f.read(3) == b"TAG":
+                tail_size = 128
+
+    # Первый кадр: синхрослово, за которым следует ещё один кадр
+    pos = 0
+    frame = None
+    while pos < len(data) - 4:
+        pos = data.find(b"\xff", pos)
+        if pos < 0 or pos > len(data) - 4:
+            return None
+        frame = _parse_mp3_frame_header(data[pos:pos + 4])
+        if frame:
+            next_pos = pos + frame["frame_length"]
+            if next_pos + 4 > len(data) or _parse_mp3_frame_header(data[next_pos:next_pos + 4]):
+                break
+        frame = None
+        pos += 1
+    if frame is None:
+        return None
+
+    # VBR: Xing/Info после side info, VBRI — фиксированное смещение 32
+    if frame["layer"] == 3:
+        if frame["mpeg1"]:
+            side_info = 17 if frame["mono"] else 32
+        else:
+            side_info = 9 if frame["mono"] else 17
+        xing = pos + 4 + side_info
+        if data[xing:xing + 4] in (b"Xing", b"Info"):
+            flags = struct.unpack(">I", data[xing + 4:xing + 8])[0]
+            if flags & 0x01:
+                frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+                duration = frames * frame["samples"] / frame["sample_rate"]
+                return MediaInfo(
+                    duration=duration,
+                    sample_rate=frame["sample_rate"],
+                    bitrate=int((size - offset - tail_size) * 8 / duration) if duration else None,
+                    source="mp3",
+                )
+        vbri = pos + 4 + 32
+        if data[vbri:vbri + 4] == b"VBRI":
+            frames = struct.unpack(">I", data[vbri + 14:vbri + 18])[0]
+            duration = frames * frame["samples"] / frame["sample_rate"]
+            return MediaInfo(duration=duration, sample_rate=frame["sample_rate"], source="mp3")
+
+    # CBR: размер аудиоданных / битрейт
+    audio_bytes = size - offset - pos - tail_size
+    return MediaInfo(
+        duration=audio_bytes * 8 / frame["bitrate"],
+        sample_rate=frame["sample_rate"],
+        bitrate=frame["bitrate"],
+        source="mp3",
+    )
+
+
+# === Остальные форматы ===
+
+def _probe_wave(path: Path, size: int) -> Optional[MediaInfo]:
+    with wave.open(str(path), "rb") as w:
+        rate = w.getframerate()
+        return MediaInfo(duration=w.getnframes() / rate, sample_rate=rate, source="wave")
+
+
+def _probe_image(path: Path, size: int) -> Optional[MediaInfo]:
+    from PIL import Image
+    with Image.open(path) as img:  # Читает только заголовок
+        width, height = img.size
+    return MediaInfo(width=width, height=height, source="pillow")
+
+
+def _probe_mutagen(path: Path, size: int) -> Optional[MediaInfo]:
+    try:
+        import mutagen
+    except ImportError:
+        return None
+    audio = mutagen.File(str(path))
+    if audio is None or not getattr(audio, "info", None):
+        return None
+    info = audio.info
+    return MediaInfo(
+        duration=getattr(info, "length", None),
+        sample_rate=getattr(info, "sample_rate", None),
+        bitrate=getattr(info, "bitrate", None),
+        source="mutagen",
+    )
+
+
+def _probe_ffprobe(path: Path, size: int) -> Optional[MediaInfo]:
+    ffprobe = shutil.which("ffprobe")
+    if not ffprobe:
+        return None
+    result = subprocess.run(
+        [ffprobe, "-v", "error", "-print_format", "json",
+         "-show_format", "-show_streams", str(path)],
+        capture_output=True, text=True, timeout=30,
+    )
+    if result.returncode != 0:
+        return None
+
+    data = json.loads(result.stdout or "{}")
+    fmt = data.get("format", {})
+    width = height = sample_rate = None
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and width is None:
+            width, height = stream.get("width"), stream.get("height")
+        elif stream.get("codec_type") == "audio" and sample_rate is None:
+            sample_rate = int(stream.get("sample_rate", 0)) or None
+
+    duration = fmt.get("duration")
+    bitrate = fmt.get("bit_rate")
+    return MediaInfo(
+        duration=float(duration) if duration else None,
+        width=width,
+        height=height,
+        sample_rate=sample_rate,
+        bitrate=int(bitrate) if bitrate else None,
+        source="ffprobe",
+    )
+
+
+def _probe_moviepy(path: Path, size: int) -> Optional[MediaInfo]:
+    """Последний вариант — как раньше, через MoviePy"""
+    from moviepy import AudioFileClip, VideoFileClip
+    if path.suffix.lower() in VIDEO_EXTENSIONS:
+        clip = VideoFileClip(str(path))
+        info = MediaInfo(duration=clip.duration, width=clip.w, height=clip.h, source="moviepy")
+    else:
+        clip = AudioFileClip(str(path))
+        info = MediaInfo(duration=clip.duration, source="moviepy")
+    clip.close()
+    return info
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".mkv", ".webm", ".avi"}
+
+
+def _probers(suffix: str):
+    if suffix in IMAGE_EXTENSIONS:
+        return [_probe_image]
+    if suffix == ".mp3":
+        return [_probe_mutagen, _probe_mp3, _probe_ffprobe, _probe_moviepy]
+    if suffix == ".wav":
+        return [_probe_wave, _probe_ffprobe, _probe_moviepy]
+    if suffix in VIDEO_EXTENSIONS:
+        return [_probe_ffprobe, _probe_moviepy]
+    return [_probe_mutagen, _probe_ffprobe, _probe_moviepy]
+
+
+# === Кэш ===
+
+class MediaProbe:
+    """Кэш параметров медиафайлов по (путь, размер, mtime)"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, Tuple[int, int, MediaInfo]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def probe(self, path) -> MediaInfo:
+        path = Path(path)
+        try:
+            stat = path.stat()
+        except OSError as e:
+            raise MediaProbeError(f"Файл недоступен: {path} ({e})")
+
+        key = str(path.resolve())
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                self._cache.move_to_end(key)
+                return cached[2]
+
+        info = None
+        errors = []
+        for prober in _probers(path.suffix.lower()):
+            try:
+                info = prober(path, stat.st_size)
+            except Exception as e:
+                errors.append(f"{prober.__name__}: {e}")
+                continue
+            if info is not None and (info.duration is not None or info.width is not None):
+                break
+            info = None
+
+        if info is None:
+            raise MediaProbeError(f"Не удалось прочитать {path.name}: {'; '.join(errors) or 'формат не распознан'}")
+
+        with self._lock:
+            self._cache[key] = (stat.st_size, stat.st_mtime_ns, info)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_default_probe = MediaProbe()
+
+
+def probe(path) -> MediaInfo:
+    """Параметры файла (с кэшем)"""
+    return _default_probe.probe(path)
+
+
+def get_duration(path) -> float:
+    """Длительность аудио/видео в секундах"""
+    info = probe(path)
+    if info.duration is None:
+        raise MediaProbeError(f"У файла нет длительности: {path}")
+    return info.duration
+
+
+def get_dimensions(path) -> Tuple[int, int]:
+    """(ширина, высота) изображения или видео"""
+    info = probe(path)
+    if info.width is None:
+        raise MediaProbeError(f"У файла нет размеров: {path}")
+    return info.width, info.height
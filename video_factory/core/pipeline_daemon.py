@@ -0,0 +1,207 @@
+"""
+Демон SmartPipeline — работа очереди без GUI
+
+Один процесс владеет состоянием проектов (output/projects/) и крутит
+очередь. Остальные процессы (команды cli.py) не пишут в хранилище сами,
+а кладут команды во входящую папку демона — так у проектов всегда один
+писатель:
+
+    output/daemon/daemon.pid     — pid работающего демона
+    output/daemon/inbox/*.json   — команды: create, enqueue, requeue_failed,
+                                   prioritize, render, stop
+
+Демон ждёт команды через inotify (fs_events.DirectoryWatcher), а не опросом.
+"""
+
+import json
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from .fs_events import DirectoryWatcher
+
+
+def _daemon_dir(output_dir: Path) -> Path:
+    return Path(output_dir) / "daemon"
+
+
+def running_pid(output_dir: Path) -> Optional[int]:
+    """pid работающего демона или None"""
+    try:
+        pid = int((_daemon_dir(output_dir) / "daemon.pid").read_text().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+def send_command(output_dir: Path, command: dict) -> Path:
+    """Положить команду во входящие демона (атомарно)"""
+    inbox = _daemon_dir(output_dir) / "inbox"
+    inbox.mkdir(parents=True, exist_ok=True)
+    path = inbox / f"{time.time_ns()}_{os.getpid()}.json"
+    tmp_path = inbox / f".{path.name}.tmp"
+    tmp_path.write_text(json.dumps(command, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp_path, path)
+    return path
+
+
+class DaemonBusyError(Exception):
+    """Для этой папки output уже работает демон"""
+
+
+class PipelineDaemon:
+    """
+    Очередь SmartPipeline в фоне (systemd, сервер без экрана)
+
+    serve(until_idle=True) — обработать очередь и выйти (cli.py run),
+    serve() — работать, пока не придёт SIGTERM или команда stop.
+    """
+
+    def __init__(self, pipeline, log: Callable[[str], None] = print):
+        self.pipeline = pipeline
+        self.dir = _daemon_dir(pipeline.output_dir)
+        self.inbox = self.dir / "inbox"
+        self.inbox.mkdir(parents=True, exist_ok=True)
+        self.pid_path = self.dir / "daemon.pid"
+        self._log = log
+        self._stop = threading.Event()
+        self._tasks: List[threading.Thread] = []  # Ручные рендеры
+
+    # === Команды ===
+
+    def apply(self, command: dict):
+        """Выполнить одну команду из входящих"""
+        pipeline = self.pipeline
+        action = command.get("cmd")
+
+        if action == "create":
+            project = pipeline.create_project(
+                name=command["name"],
+                topic=command["topic"],
+                competitor_channel=command.get("competitor_channel", ""),
+                duration=command.get("duration", "20-30 минут"),
+                language=command.get("language", "Русский"),
+                project_id=command.get("project_id"),
+                priority=command.get("priority", 0),
+                deadline=command.get("deadline", ""),
+            )
+            self._log(f"📥 Создан проект {project.id}: {project.name}")
+            if command.get("enqueue", True):
+                pipeline.add_to_queue(project.id)
+            else:
+                pipeline.hold_project(project.id)
+        elif action == "enqueue":
+            for project_id in command.get("project_ids", []):
+                if pipeline.get_project(project_id) is None:
+                    self._log(f"⚠️ Нет проекта {project_id}")
+                    continue
+                pipeline.add_to_queue(project_id)
+                self._log(f"📥 В очереди: {project_id}")
+        elif action == "prioritize":
+            pipeline.set_priority(command["project_id"], command.get("priority"),
+                                  command.get("deadline"))
+            self._log(f"📥 Приоритет {command['project_id']}: "
+                      f"{command.get('priority')} / {command.get('deadline') or '-'}")
+        elif action == "requeue_failed":
+            self._log(f"📥 Возвращено в очередь: {pipeline.requeue_failed()}")
+        elif action == "render":
+            task = threading.Thread(
+                target=pipeline.render_final,
+                args=(command["project_id"],),
+                kwargs={"add_subtitles": command.get("subtitles", False)},
+                daemon=True,
+            )
+            task.start()
+            self._tasks.append(task)
+        elif action == "stop":
+            self._stop.set()
+        else:
+            self._log(f"⚠️ Неизвестная команда: {command}")
+
+    def process_inbox(self) -> int:
+        """Выполнить накопившиеся команды по порядку поступления"""
+        applied = 0
+        for path in sorted(self.inbox.glob("*.json")):
+            try:
+                command = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                self._log(f"⚠️ Повреждённая команда {path.name}: {e}")
+                command = None
+            path.unlink(missing_ok=True)
+            if command is None:
+                continue
+            try:
+                self.apply(command)
+                applied += 1
+            except Exception as e:
+                self._log(f"❌ Команда {command.get('cmd')}: {e}")
+        if applied:
+            # status из другого процесса читает хранилище — пишем сразу
+            self.pipeline._save_projects(immediate=True)
+        return applied
+
+    # === Цикл ===
+
+    def _busy(self) -> bool:
+        self._tasks = [t for t in self._tasks if t.is_alive()]
+        return bool(self.pipeline.queue) or self.pipeline.is_running or bool(self._tasks)
+
+    def serve(self, until_idle: bool = False, idle_timeout: float = 30.0) -> int:
+        """
+        Главный цикл демона.
+
+        Returns:
+            Код выхода: 0 — нормально, 1 — остались проекты с ошибкой
+        """
+        other = running_pid(self.pipeline.output_dir)
+        if other and other != os.getpid():
+            raise DaemonBusyError(f"Демон уже работает (pid {other})")
+        self.pid_path.write_text(str(os.getpid()))
+
+        def on_signal(signum, frame):
+            self._stop.set()
+            # Файл во входящих будит watcher.wait() сразу, а не через idle_timeout
+            send_command(self.pipeline.output_dir, {"cmd": "stop"})
+        previous = {sig: signal.signal(sig, on_signal) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+        try:
+            with DirectoryWatcher(self.inbox) as watcher:
+                while not self._stop.is_set():
+                    self.process_inbox()
+                    pipeline = self.pipeline
+                    if pipeline.queue and not pipeline.is_running:
+                        pipeline.start_queue()
+                    if until_idle and not self._busy():
+                        break
+                    # Просыпаемся по команде; короткий срез — чтобы заметить
+                    # конец очереди в режиме until_idle
+                    watcher.wait(1.0 if until_idle else idle_timeout)
+        finally:
+            self._log("⏹ Остановка: текущие этапы доработают...")
+            self.pipeline.stop_queue()
+            while not self.pipeline.wait_queue(timeout=1.0):
+                pass
+            for task in self._tasks:
+                task.join()
+            self.pipeline.close()
+            self.pid_path.unlink(missing_ok=True)
+            for path in self.inbox.glob("*.json"):
+                try:
+                    if json.loads(path.read_text(encoding="utf-8")).get("cmd") == "stop":
+                        path.unlink()
+                except (OSError, ValueError):
+                    pass
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+        failed = self.pipeline.get_snapshot().with_status("error")
+        return 1 if failed else 0
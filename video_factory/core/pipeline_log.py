@@ -0,0 +1,209 @@
+"""
+Журнал пайплайна — асинхронный, структурированный
+
+Сообщения кладутся в очередь (QueueHandler) и пишутся фоновым потоком
+(QueueListener), поэтому вызов лога из колбэков FLUX/озвучки не ждёт диска
+и UI. Куда пишется:
+
+    output/pipeline.log        — текст, как раньше (с ротацией)
+    output/pipeline.jsonl      — JSON-строки с полями для анализа таймингов
+    output/<project_id>/pipeline.jsonl — журнал отдельного проекта
+
+Поля JSON: ts, level, msg, project_id, stage, duration_ms, api, key_index, event.
+project_id и stage берутся из log_context(), остальные передаются явно:
+
+    with log_context(project_id=pid, stage="images"):
+        log.info("Готово", extra=fields(duration_ms=1234, api="flux", key_index=2))
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+# Структурные поля записи (всё остальное — служебные поля logging)
+FIELDS = ("project_id", "stage", "duration_ms", "api", "key_index", "event")
+
+_context: contextvars.ContextVar = contextvars.ContextVar("pipeline_log_context", default={})
+
+
+@contextmanager
+def log_context(**values):
+    """Поля, добавляемые ко всем записям внутри блока (в этом потоке)"""
+    token = _context.set({**_context.get(), **values})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def current_context() -> dict:
+    """Текущие поля контекста — чтобы передать их в другой поток"""
+    return dict(_context.get())
+
+
+def fields(**values) -> dict:
+    """extra= для logging с структурными полями"""
+    return {"fields": {k: v for k, v in values.items() if v is not None}}
+
+
+class _ContextFilter(logging.Filter):
+    """Сливает поля контекста и extra в record.fields (в потоке вызова)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        merged = dict(_context.get())
+        merged.update(getattr(record, "fields", {}) or {})
+        record.fields = merged
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        record_fields = getattr(record, "fields", {})
+        for name in FIELDS:
+            if name in record_fields:
+                entry[name] = record_fields[name]
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ProjectFileHandler(logging.Handler):
+    """
+    Запись в output/<project_id>/pipeline.jsonl
+
+    Держит открытыми несколько последних файлов — проекты идут параллельно,
+    но открывать файл на каждую строку дорого.
+    """
+
+    def __init__(self, output_dir: Path, max_open: int = 8):
+        super().__init__()
+        self.output_dir = Path(output_dir)
+        self.max_open = max_open
+        self._streams: "OrderedDict[str, object]" = OrderedDict()
+
+    def emit(self, record: logging.LogRecord):
+        project_id = getattr(record, "fields", {}).get("project_id")
+        if not project_id:
+            return
+        try:
+            stream = self._streams.get(project_id)
+            if stream is None:
+                project_dir = self.output_dir / project_id
+                project_dir.mkdir(parents=True, exist_ok=True)
+                stream = open(project_dir / "pipeline.jsonl", "a", encoding="utf-8")
+                self._streams[project_id] = stream
+                while len(self._streams) > self.max_open:
+                    _, old = self._streams.popitem(last=False)
+                    old.close()
+            else:
+                self._streams.move_to_end(project_id)
+            stream.write(self.format(record) + "\n")
+            stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+        self._streams.clear()
+        super().close()
+
+
+class CallbackHandler(logging.Handler):
+    """Передаёт текст сообщения в колбэк UI (из потока журнала)"""
+
+    def __init__(self, callback: Callable[[str], None]):
+        super().__init__()
+        self.callback = callback
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.callback(record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+
+class PipelineLogger:
+    """
+    Логгер пайплайна с фоновой записью
+
+    Все обработчики (консоль, файлы, колбэк) работают в потоке
+    QueueListener — вызывающий поток только кладёт запись в очередь.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        on_message: Optional[Callable[[str], None]] = None,
+        name: str = "video_factory.pipeline",
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+    ):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.logger = logging.getLogger(f"{name}.{id(self)}")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+        # Текстовый лог — прежний формат строк
+        text_handler = logging.handlers.RotatingFileHandler(
+            self.output_dir / "pipeline.log", maxBytes=max_bytes,
+            backupCount=backup_count, encoding="utf-8",
+        )
+        text_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S"))
+
+        json_handler = logging.handlers.RotatingFileHandler(
+            self.output_dir / "pipeline.jsonl", maxBytes=max_bytes,
+            backupCount=backup_count, encoding="utf-8",
+        )
+        json_handler.setFormatter(JsonFormatter())
+
+        project_handler = ProjectFileHandler(self.output_dir)
+        project_handler.setFormatter(JsonFormatter())
+
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(
+            logging.Formatter("[Pipeline] [%(asctime)s] %(message)s", "%H:%M:%S")
+        )
+
+        handlers = [console_handler, text_handler, json_handler, project_handler]
+        if on_message:
+            handlers.append(CallbackHandler(on_message))
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(self._queue)
+        queue_handler.addFilter(_ContextFilter())
+        self.logger.addHandler(queue_handler)
+
+        self._handlers = handlers
+        self._listener = logging.handlers.QueueListener(
+            self._queue, *handlers, respect_handler_level=True
+        )
+        self._listener.start()
+        atexit.register(self.close)
+
+    def log(self, message: str, level: int = logging.INFO, **values):
+        self.logger.log(level, message, extra=fields(**values))
+
+    def close(self):
+        """Дописать очередь и закрыть файлы"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self._listener = None
+        for handler in self._handlers:
+            handler.close()
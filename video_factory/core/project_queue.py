@@ -0,0 +1,271 @@
+"""
+Очередь проектов с приоритетами, дедлайнами и честностью между каналами
+
+Вместо списка, который обходится по порядку, у каждого канала
+(channel_style_id) своя куча проектов, упорядоченная по
+(приоритет ↓, дедлайн ↑, порядок добавления). Следующий проект выбирается так:
+
+1. среди голов каналов — только с наивысшим приоритетом;
+2. если у кого-то из них дедлайн «горит» (если отложить проект ещё на
+   одну итерацию очереди, он не успеет), берётся самый ранний дедлайн;
+3. иначе — взвешенный round-robin (stride): канал с весом 2 получает
+   вдвое больше слотов, чем канал с весом 1, и один плодовитый канал не
+   задерживает остальные.
+
+Добавление, удаление и выбор — O(log n) по проектам (плюс O(каналов) на
+сравнение голов). Удаление ленивое: запись помечается, а из кучи
+выбрасывается, когда всплывёт. Отложенные повторы (после ошибки) лежат
+в отдельной куче по времени и возвращаются в очередь, когда наступит срок.
+
+Снаружи очередь ведёт себя как список ID (in, len, итерация, append,
+remove, insert(0, ...)), поэтому сохранение и UI работают как раньше.
+Не потокобезопасна — SmartPipeline обращается к ней под state.lock.
+"""
+
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+INF = float("inf")
+
+# describe(project_id) -> (канал, приоритет, дедлайн в unix-сек или None)
+Describe = Callable[[str], Tuple[str, int, Optional[float]]]
+
+
+@dataclass
+class _Entry:
+    project_id: str
+    channel: str
+    priority: int
+    deadline: float       # INF — без дедлайна
+    seq: int              # Порядок добавления (FIFO внутри равных)
+    version: int          # Устаревшие копии в кучах пропускаются (уникальна в очереди)
+    not_before: float = 0.0
+    claimed: bool = False  # Взят в работу, но ещё в очереди
+
+    def key(self) -> tuple:
+        return (-self.priority, self.deadline, self.seq, self.version, self.project_id)
+
+
+class ProjectQueue:
+    """Очередь проектов: приоритеты, дедлайны, взвешенная честность каналов"""
+
+    def __init__(self, describe: Describe, weights: Dict[str, float] = None):
+        self._describe = describe
+        self.weights: Dict[str, float] = dict(weights or {})
+        self._entries: Dict[str, _Entry] = {}
+        self._heaps: Dict[str, list] = {}
+        self._delayed: list = []              # (not_before, seq, version, project_id)
+        self._pass: Dict[str, float] = {}     # Виртуальное время канала (stride)
+        self._vtime = 0.0
+        self._seq = itertools.count(1)
+        self._front_seq = itertools.count(-1, -1)
+        # Версии записей — общий счётчик очереди, а не +1 от прежней записи:
+        # после remove()/requeue() проект начинает не с 0, и его старые
+        # копии в кучах не оживают
+        self._version = itertools.count()
+
+    # === Как список ===
+
+    def __contains__(self, project_id: str) -> bool:
+        return project_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.order())
+
+    def copy(self) -> List[str]:
+        return self.order()
+
+    def append(self, project_id: str):
+        self.push(project_id)
+
+    def extend(self, project_ids: Iterable[str]):
+        for project_id in project_ids:
+            self.push(project_id)
+
+    def insert(self, index: int, project_id: str):
+        """insert(0, id) — вперёд среди равных по приоритету"""
+        self.push(project_id, front=index == 0)
+
+    def remove(self, project_id: str):
+        if self._entries.pop(project_id, None) is None:
+            raise ValueError(f"{project_id} не в очереди")
+
+    # === Основные операции ===
+
+    def weight(self, channel: str) -> float:
+        return max(0.01, float(self.weights.get(channel, 1.0)))
+
+    def set_weight(self, channel: str, weight: float):
+        self.weights[channel] = weight
+
+    def push(self, project_id: str, front: bool = False, not_before: float = 0.0):
+        """Добавить проект или обновить его ключ (приоритет/дедлайн/канал)"""
+        channel, priority, deadline = self._describe(project_id)
+        old = self._entries.get(project_id)
+        if front:
+            seq = next(self._front_seq)
+        elif old is not None and not not_before:
+            seq = old.seq  # Обновление ключа не сдвигает проект в конец
+        else:
+            seq = next(self._seq)
+
+        entry = _Entry(
+            project_id=project_id,
+            channel=channel or "default",
+            priority=int(priority or 0),
+            deadline=deadline if deadline else INF,
+            seq=seq,
+            version=next(self._version),
+            not_before=not_before,
+            claimed=old.claimed if (old and not not_before) else False,
+        )
+        self._entries[project_id] = entry
+        if entry.claimed:
+            return  # Вернётся в кучу при release()
+        if not_before > time.time():
+            heapq.heappush(self._delayed, (not_before, entry.seq, entry.version, project_id))
+        else:
+            self._push_ready(entry)
+
+    def refresh(self, project_id: str):
+        """Пересчитать ключ после изменения приоритета/дедлайна/канала"""
+        if project_id in self._entries:
+            self.push(project_id)
+
+    def requeue(self, project_id: str, delay: float = 0.0):
+        """Повтор после ошибки: в конец своего приоритета, не раньше чем через delay"""
+        self._entries.pop(project_id, None)
+        self.push(project_id, not_before=time.time() + delay if delay else 0.0)
+
+    def _push_ready(self, entry: _Entry):
+        heap = self._heaps.setdefault(entry.channel, [])
+        if not self._live_head(entry.channel):
+            # Канал простаивал — не даём ему «накопить» слоты за время простоя
+            self._pass[entry.channel] = max(self._pass.get(entry.channel, 0.0), self._vtime)
+        heapq.heappush(heap, entry.key())
+
+    def _valid(self, item: tuple) -> Optional[_Entry]:
+        entry = self._entries.get(item[4])
+        if entry is None or entry.version != item[3] or entry.claimed or entry.not_before > time.time():
+            return None
+        return entry
+
+    def _live_head(self, channel: str) -> Optional[_Entry]:
+        """Голова кучи канала (выбрасывает устаревшие записи)"""
+        heap = self._heaps.get(channel)
+        while heap:
+            entry = self._valid(heap[0])
+            if entry is not None:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def _release_due(self, now: float):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, version, project_id = heapq.heappop(self._delayed)
+            entry = self._entries.get(project_id)
+            if entry is not None and entry.version == version:
+                entry.not_before = 0.0
+                self._push_ready(entry)
+
+    def has_delayed(self) -> bool:
+        """Есть проекты, ждущие своего времени повтора"""
+        now = time.time()
+        return any(
+            self._entries.get(pid) is not None and self._entries[pid].version == version and nb > now
+            for nb, _, version, pid in self._delayed
+        )
+
+    def next(self, now: float = None,
+             urgent: Callable[[str, float], bool] = None) -> Optional[str]:
+        """
+        Взять следующий проект в работу (он остаётся в очереди как claimed).
+
+        Args:
+            urgent(project_id, deadline): дедлайн не выдержит ожидания
+                следующей итерации — такой проект берётся вне очереди каналов
+        """
+        now = now or time.time()
+        self._release_due(now)
+
+        heads = [h for h in (self._live_head(c) for c in list(self._heaps)) if h is not None]
+        if not heads:
+            return None
+
+        top = max(h.priority for h in heads)
+        candidates = [h for h in heads if h.priority == top]
+
+        chosen = None
+        if urgent:
+            pressed = [h for h in candidates if h.deadline < INF and urgent(h.project_id, h.deadline)]
+            if pressed:
+                chosen = min(pressed, key=lambda h: (h.deadline, h.seq))
+        if chosen is None:
+            chosen = min(candidates, key=lambda h: (self._pass.get(h.channel, 0.0), h.seq))
+
+        heapq.heappop(self._heaps[chosen.channel])
+        chosen.claimed = True
+        self._vtime = self._pass.get(chosen.channel, 0.0)
+        self._pass[chosen.channel] = self._vtime + 1.0 / self.weight(chosen.channel)
+        return chosen.project_id
+
+    def release(self, project_id: str):
+        """Вернуть взятый проект обратно (очередь остановлена до его конца)"""
+        entry = self._entries.get(project_id)
+        if entry is not None and entry.claimed:
+            entry.claimed = False
+            entry.version = next(self._version)
+            self._push_ready(entry)
+
+    def release_all(self):
+        for project_id in [pid for pid, e in self._entries.items() if e.claimed]:
+            self.release(project_id)
+
+    # === Порядок и оценки ===
+
+    def order(self) -> List[str]:
+        """
+        Ожидаемый порядок обработки: взятые в работу, затем готовые в
+        порядке выбора (симуляция round-robin без «горящих» дедлайнов),
+        затем отложенные повторы.
+        """
+        claimed = sorted((e for e in self._entries.values() if e.claimed), key=lambda e: e.seq)
+        now = time.time()
+        ready = [e for e in self._entries.values() if not e.claimed and e.not_before <= now]
+        delayed = sorted(
+            (e for e in self._entries.values() if not e.claimed and e.not_before > now),
+            key=lambda e: e.not_before,
+        )
+
+        heaps: Dict[str, list] = {}
+        for entry in ready:
+            heaps.setdefault(entry.channel, []).append(entry.key())
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        passes = {c: max(self._pass.get(c, 0.0), self._vtime) for c in heaps}
+
+        ordered = [e.project_id for e in claimed]
+        while heaps:
+            top = min(heap[0][0] for heap in heaps.values())
+            channel = min(
+                (c for c, heap in heaps.items() if heap[0][0] == top),
+                key=lambda c: (passes[c], heaps[c][0][2]),
+            )
+            ordered.append(heapq.heappop(heaps[channel])[4])
+            passes[channel] += 1.0 / self.weight(channel)
+            if not heaps[channel]:
+                del heaps[channel]
+        ordered.extend(e.project_id for e in delayed)
+        return ordered
+
+    def entry(self, project_id: str) -> Optional[_Entry]:
+        return self._entries.get(project_id)
@@ -0,0 +1,125 @@
+"""
+Состояние проектов SmartPipeline — сериализованные изменения и снимки
+
+Проекты меняют поток очереди, потоки этапов (изображения, озвучка) и
+колбэки FLUX одновременно. Все изменения идут через один замок
+ProjectStateManager (одновременно пишет только один поток), а читатели —
+например таблица QueueTab — получают неизменяемый снимок и не трогают
+живые объекты проектов.
+"""
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class ProjectView:
+    """Неизменяемая копия полей проекта для UI"""
+    id: str
+    name: str
+    topic: str
+    duration: str
+    language: str
+    status: str
+    progress: int
+    current_step: str
+    error_message: str
+    final_video: str
+
+    @classmethod
+    def from_project(cls, project) -> "ProjectView":
+        return cls(**{name: getattr(project, name) for name in cls.__dataclass_fields__})
+
+
+@dataclass(frozen=True)
+class PipelineSnapshot:
+    """Снимок очереди и проектов на момент version"""
+    version: int
+    projects: Tuple[ProjectView, ...]
+    queue: Tuple[str, ...]
+    current_project_id: Optional[str]
+    is_running: bool
+    active_projects: Tuple[str, ...] = ()
+    etas: Tuple[Tuple[str, float], ...] = ()  # (id, ожидаемое время готовности)
+
+    def get(self, project_id: str) -> Optional[ProjectView]:
+        for project in self.projects:
+            if project.id == project_id:
+                return project
+        return None
+
+    def eta(self, project_id: str) -> Optional[float]:
+        """Оценка времени готовности проекта в очереди (unix-сек)"""
+        for pid, eta in self.etas:
+            if pid == project_id:
+                return eta
+        return None
+
+    def with_status(self, status: str) -> Tuple[ProjectView, ...]:
+        return tuple(p for p in self.projects if p.status == status)
+
+
+class ProjectStateManager:
+    """
+    Единая точка изменения состояния проектов
+
+    update()/transaction() выполняются под одним замком и увеличивают
+    версию состояния. snapshot() пересобирается только при смене версии.
+    on_change(full) вызывается после каждого изменения — через него
+    пайплайн ставит отложенное сохранение (full=False — только статус
+    и прогресс).
+    """
+
+    # Поля, изменение которых не требует перезаписи файла проекта
+    PROGRESS_FIELDS = frozenset({"status", "progress", "current_step", "error_message"})
+
+    def __init__(
+        self,
+        build_snapshot: Callable[[int], PipelineSnapshot],
+        on_change: Callable[[bool], None] = None,
+    ):
+        self.lock = threading.RLock()
+        self._build_snapshot = build_snapshot
+        self._on_change = on_change
+        self._version = 0
+        self._snapshot: Optional[PipelineSnapshot] = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def changed(self, full: bool = True):
+        """Отметить изменение, сделанное под lock (или без гонок)"""
+        with self.lock:
+            self._version += 1
+        if self._on_change:
+            self._on_change(full)
+
+    def update(self, project, **fields):
+        """Атомарно изменить несколько полей проекта"""
+        with self.lock:
+            for name, value in fields.items():
+                setattr(project, name, value)
+        self.changed(full=not set(fields) <= self.PROGRESS_FIELDS)
+
+    @contextmanager
+    def transaction(self, full: bool = True):
+        """
+        Группа изменений одним блоком:
+
+            with pipeline.state.transaction():
+                project.images = images
+                pipeline.queue.remove(project.id)
+        """
+        with self.lock:
+            yield
+        self.changed(full=full)
+
+    def snapshot(self) -> PipelineSnapshot:
+        """Текущий снимок (кэшируется до следующего изменения)"""
+        with self.lock:
+            if self._snapshot is None or self._snapshot.version != self._version:
+                self._snapshot = self._build_snapshot(self._version)
+            return self._snapshot
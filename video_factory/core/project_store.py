@@ -0,0 +1,220 @@
+"""
+Хранилище проектов — по файлу на проект + лёгкий индекс очереди
+
+Раскладка в output_dir/projects/:
+    _index.json   — очередь, флаги и статус/прогресс каждого проекта (маленький)
+    <id>.json     — всё остальное: сценарий, промпты, sync_data... (большой)
+
+Прогресс пишет только индекс. Файл проекта перезаписывается, только если его
+содержимое действительно изменилось. Запись атомарная (tmp + rename),
+частые сохранения склеиваются в одну запись раз в debounce секунд.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+
+class ProjectStore:
+    """
+    Инкрементальное хранилище проектов SmartPipeline
+
+    Снаружи работает с тем же «плоским» словарём, что и старый projects.json:
+    {"_queue": [...], "_is_running": ..., "_current_project": ..., "<id>": {...}}
+    """
+
+    # Быстро меняющиеся поля — живут в индексе, а не в файле проекта
+    STATE_FIELDS = ("status", "progress", "current_step", "error_message")
+
+    INDEX_NAME = "_index.json"
+    LEGACY_NAME = "projects.json"
+
+    def __init__(self, output_dir: Path, debounce: float = 1.0):
+        self.output_dir = Path(output_dir)
+        self.root = self.output_dir / "projects"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.debounce = debounce
+
+        self._digests: Dict[str, str] = {}  # id -> хэш последнего записанного файла
+        self._index_digest: Optional[str] = None
+        self._write_lock = threading.Lock()
+
+        # Отложенная запись
+        self._cond = threading.Condition()
+        self._pending_fn: Optional[Callable[[bool], dict]] = None
+        self._pending_full = False
+        self._deadline = 0.0
+        self._writing = 0  # Снимок взят, но ещё не записан
+        self._writer: Optional[threading.Thread] = None
+
+        atexit.register(self.flush)
+
+    # === Чтение ===
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / self.INDEX_NAME
+
+    def _project_path(self, project_id: str) -> Path:
+        return self.root / f"{project_id}.json"
+
+    def load(self) -> dict:
+        """Загрузка всех проектов (со старым projects.json — миграция)"""
+        legacy_path = self.output_dir / self.LEGACY_NAME
+        if not self.index_path.exists() and legacy_path.exists():
+            data = json.loads(legacy_path.read_text())
+            self.save(data, full=True)
+            legacy_path.rename(legacy_path.with_suffix(".json.migrated"))
+            print(f"[ProjectStore] Миграция {len(data)} записей из {self.LEGACY_NAME}")
+            return data
+
+        index = {}
+        if self.index_path.exists():
+            index = json.loads(self.index_path.read_text())
+
+        data = {k: v for k, v in index.items() if k.startswith("_")}
+        states = index.get("projects", {})
+
+        for path in sorted(self.root.glob("*.json")):
+            if path.name == self.INDEX_NAME:
+                continue
+            project_id = path.stem
+            try:
+                text = path.read_text()
+                project = json.loads(text)
+            except (OSError, ValueError) as e:
+                print(f"[ProjectStore] Пропускаю повреждённый {path.name}: {e}")
+                continue
+            self._digests[project_id] = self._digest(text)
+            project.update(states.get(project_id, {}))
+            data[project_id] = project
+
+        return data
+
+    # === Запись ===
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _atomic_write(path: Path, text: str):
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def save(self, data: dict, full: bool = True):
+        """
+        Синхронная запись.
+
+        Args:
+            data: Плоский словарь как у projects.json
+            full: False — только индекс (статус/прогресс/очередь)
+        """
+        meta = {k: v for k, v in data.items() if k.startswith("_")}
+        projects = {k: v for k, v in data.items() if not k.startswith("_")}
+
+        index = dict(meta)
+        index["projects"] = {
+            pid: {f: p[f] for f in self.STATE_FIELDS if f in p}
+            for pid, p in projects.items()
+        }
+
+        with self._write_lock:
+            if full:
+                for pid, project in projects.items():
+                    body = {k: v for k, v in project.items() if k not in self.STATE_FIELDS}
+                    text = json.dumps(body, ensure_ascii=False, indent=2)
+                    digest = self._digest(text)
+                    if self._digests.get(pid) != digest:
+                        self._atomic_write(self._project_path(pid), text)
+                        self._digests[pid] = digest
+
+                # Удалённые проекты
+                for pid in set(self._digests) - set(projects):
+                    self._project_path(pid).unlink(missing_ok=True)
+                    del self._digests[pid]
+
+            text = json.dumps(index, ensure_ascii=False)
+            digest = self._digest(text)
+            if digest != self._index_digest:
+                self._atomic_write(self.index_path, text)
+                self._index_digest = digest
+
+    def save_later(self, snapshot: Callable[[bool], dict], full: bool = True):
+        """
+        Отложенная запись: все вызовы за debounce секунд дают одну запись.
+
+        Args:
+            snapshot: Вызывается в потоке записи, получает full и
+                возвращает плоский словарь (при full=False достаточно
+                служебных ключей и полей STATE_FIELDS)
+        """
+        with self._cond:
+            if self._pending_fn is None:
+                self._deadline = time.time() + self.debounce
+            self._pending_fn = snapshot
+            self._pending_full = self._pending_full or full
+
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._writer_loop, daemon=True, name="project-store"
+                )
+                self._writer.start()
+            self._cond.notify_all()
+
+    def _take_pending(self):
+        """Забрать отложенный снимок на запись (под self._cond)"""
+        snapshot, full = self._pending_fn, self._pending_full
+        self._pending_fn = None
+        self._pending_full = False
+        self._writing += 1
+        return snapshot, full
+
+    def _write(self, snapshot: Callable[[bool], dict], full: bool):
+        try:
+            self.save(snapshot(full), full=full)
+        finally:
+            with self._cond:
+                self._writing -= 1
+                self._cond.notify_all()
+
+    def _writer_loop(self):
+        while True:
+            with self._cond:
+                # Запись flush() в процессе — её снимок новее, не обгонять
+                while self._pending_fn is None or self._writing:
+                    self._cond.wait()
+                delay = self._deadline - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                snapshot, full = self._take_pending()
+
+            try:
+                self._write(snapshot, full)
+            except Exception as e:
+                print(f"[ProjectStore] Ошибка сохранения: {e}")
+
+    def flush(self):
+        """
+        Немедленно записать отложенное (перед выходом, после важных шагов)
+
+        Снимок, который поток записи уже взял, дожидаемся: иначе выход
+        после flush() потеряет последнее изменение.
+        """
+        with self._cond:
+            while self._writing:
+                self._cond.wait()
+            if self._pending_fn is None:
+                return
+            snapshot, full = self._take_pending()
+        self._write(snapshot, full)
@@ -31,7 +31,8 @@ class QualityChecker:
     
     Проверяет:
     - Все ли изображения сгенерированы
-    - Качество изображений (размер, формат)
+    - Качество изображений (размер, формат; однотонные, тёмные, повторы,
+      пропорции — core/image_triage.py)
     - Наличие озвучки
     - Синхронизация картинок и текста
     - SEO заполненность
@@ -100,6 +101,7 @@ class QualityChecker:
         # Проверяем каждое изображение
         missing = 0
         small = 0
+        existing = []  # (номер сцены, путь)
         
         for i, img_path in enumerate(project.images):
             path = Path(img_path) if isinstance(img_path, str) else img_path
@@ -107,6 +109,7 @@ class QualityChecker:
             if not path or not path.exists():
                 missing += 1
                 continue
+            existing.append((i, path))
             
             # Проверяем размер файла
             if path.stat().st_size < self.min_image_size:
@@ -128,6 +131,21 @@ class QualityChecker:
                 fix_suggestion='Возможно это ошибки генерации, перегенерируйте'
             ))
         
+        # Содержимое кадров: однотонные, тёмные, повторы, не те пропорции
+        if existing:
+            from .image_triage import describe, triage_images
+            
+            aspect = self.required_image_width / self.required_image_height
+            bad = triage_images([path for _, path in existing], aspect)
+            if bad:
+                scenes = ", ".join(f"#{existing[k][0] + 1}" for k in sorted(bad)[:10])
+                issues.append(QualityIssue(
+                    severity='critical' if len(bad) > len(existing) * 0.1 else 'warning',
+                    category='images',
+                    message=f'{len(bad)} плохих кадров ({describe(bad)}): {scenes}',
+                    fix_suggestion='Перегенерируйте отмеченные сцены'
+                ))
+        
         # Проверяем количество
         expected_count = len(project.image_prompts) if project.image_prompts else 0
         if expected_count > 0 and len(project.images) < expected_count * 0.9:
@@ -0,0 +1,542 @@
+"""
+Локальная рендер-ферма — рендер в отдельных процессах
+
+Рендер MoviePy в потоке UI-процесса делит GIL с интерфейсом и клиентами
+API. Здесь задания рендера кладутся в папку-спул, а N процессов-воркеров
+(каждый на своей группе ядер) забирают их и пишут прогресс обратно.
+Внешних сервисов нет — только файлы на одном Linux-хосте.
+
+    output/render_farm/
+        pending/<job_id>.json    — ждут воркера
+        running/<job_id>.json    — в работе (+ <job_id>.lease: pid воркера)
+        done/<job_id>.json       — готовы (output_path, время рендера)
+        failed/<job_id>.json     — ошибка после всех попыток
+        progress/<job_id>.json   — прогресс 0..1, обновляет воркер
+        workers/<name>.json      — pid, ядра, heartbeat воркера
+        logs/<name>.log          — stdout/stderr воркера
+
+Задание забирается атомарным os.rename(pending → running): из нескольких
+воркеров его получит ровно один. Воркеры запускаются в своей сессии и
+переживают перезапуск UI; новый UI находит их по workers/*.json, а
+задание проекта — по детерминированному job_id. Если воркер умер посреди
+рендера, его задание возвращается в pending (recover()).
+
+Запуск воркера вручную:
+    python -m core.render_farm worker --spool output/render_farm --cores 0-3
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .artifact_manifest import fingerprint
+from .fs_events import DirectoryWatcher
+
+STATES = ("pending", "running", "done", "failed")
+
+# Корень пакета video_factory — рабочая папка воркеров (python -m core.render_farm)
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Размер, mtime_ns и inode файла — меняются при любой перезаписи"""
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+@dataclass
+class RenderJob:
+    """Задание рендера: всё, что нужно VideoEditor.create_video"""
+    project_id: str
+    output_path: str
+    audio_path: str
+    scenes: List[Dict]                 # [{image_path, duration, start_time, zoom_direction}]
+    video_config: Dict                 # asdict(VideoConfig)
+    music_path: str = ""
+    music_volume: float = 0.15
+    max_attempts: int = 2
+    job_id: str = ""
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        if not self.job_id:
+            # Одинаковые входы → тот же job_id: повторная отправка после
+            # перезапуска UI находит уже идущее или готовое задание.
+            # Входы — это и содержимое файлов: картинка или озвучка,
+            # перегенерированная по тому же пути, даёт новое задание
+            inputs = [self.audio_path, self.music_path] + [scene.get("image_path", "") for scene in self.scenes]
+            digest = fingerprint(self.output_path, self.audio_path, self.scenes,
+                                 self.video_config, self.music_path, self.music_volume,
+                                 [_file_stamp(path) for path in inputs])
+            self.job_id = f"{self.project_id}_{digest[:12]}"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RenderJob":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+def _write_json(path: Path, data: dict):
+    """Атомарная запись JSON (tmp + os.replace в той же папке)"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        # Воркер, запущенный этим процессом, после смерти остаётся зомби
+        # (kill(pid, 0) для него успешен) — сначала пробуем его забрать
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def core_groups(workers: int) -> List[List[int]]:
+    """Разбить доступные ядра на workers непрерывных групп"""
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    groups, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def _parse_cores(text: str) -> List[int]:
+    """"0-3,8" -> [0, 1, 2, 3, 8]"""
+    cores = []
+    for part in filter(None, text.split(",")):
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cores.extend(range(int(lo), int(hi) + 1))
+        else:
+            cores.append(int(part))
+    return cores
+
+
+class RenderSpool:
+    """Папка-спул заданий: общая для UI и воркеров"""
+
+    def __init__(self, spool_dir: Path):
+        self.root = Path(spool_dir)
+        self.dirs = {name: self.root / name for name in STATES + ("progress", "workers", "logs")}
+        for directory in self.dirs.values():
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def job_path(self, state: str, job_id: str) -> Path:
+        return self.dirs[state] / f"{job_id}.json"
+
+    def lease_path(self, job_id: str) -> Path:
+        return self.dirs["running"] / f"{job_id}.lease"
+
+    def find(self, job_id: str) -> Tuple[Optional[str], Optional[dict]]:
+        """(состояние, данные задания) или (None, None)"""
+        for state in STATES:
+            data = _read_json(self.job_path(state, job_id))
+            if data is not None:
+                return state, data
+        return None, None
+
+    def progress(self, job_id: str) -> Optional[dict]:
+        return _read_json(self.dirs["progress"] / f"{job_id}.json")
+
+    def set_progress(self, job_id: str, fraction: float, **extra):
+        _write_json(self.dirs["progress"] / f"{job_id}.json",
+                    {"job_id": job_id, "progress": round(fraction, 4),
+                     "updated_at": time.time(), **extra})
+
+    def pending_jobs(self) -> List[Path]:
+        """Ожидающие задания, старые первыми"""
+        paths = []
+        for path in self.dirs["pending"].glob("*.json"):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except OSError:
+                continue  # Уже забрал другой воркер
+        return [path for _, path in sorted(paths)]
+
+    def recover(self) -> int:
+        """
+        Вернуть в pending задания умерших воркеров.
+
+        Задание в running без живого владельца (lease с pid) снова
+        ставится в очередь, или уходит в failed, если попытки кончились.
+        """
+        recovered = 0
+        for path in self.dirs["running"].glob("*.json"):
+            job_id = path.stem
+            lease = _read_json(self.lease_path(job_id)) or {}
+            if _pid_alive(lease.get("pid", 0)):
+                continue
+            if not lease:
+                # Воркер мог забрать задание и ещё не успеть записать lease
+                # (rename обновляет ctime, mtime остаётся от постановки)
+                try:
+                    if time.time() - path.stat().st_ctime < 30:
+                        continue
+                except OSError:
+                    continue
+
+            # Забираем задание себе тем же rename — recover() могут
+            # одновременно вызвать несколько воркеров
+            claimed = path.with_name(f".{job_id}.recover.{os.getpid()}")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            data = _read_json(claimed) or {"job_id": job_id}
+            data["attempts"] = data.get("attempts", 0) + 1
+            data["error"] = f"Воркер {lease.get('worker', '?')} завершился во время рендера"
+            target = "pending" if data["attempts"] < data.get("max_attempts", 2) else "failed"
+            _write_json(self.job_path(target, job_id), data)
+            claimed.unlink(missing_ok=True)
+            self.lease_path(job_id).unlink(missing_ok=True)
+            recovered += 1
+        return recovered
+
+
+# === Воркер ===
+
+class RenderWorker:
+    """Процесс-воркер: забирает задания из pending и рендерит их"""
+
+    def __init__(self, spool_dir: Path, name: str, cores: List[int] = None,
+                 idle_timeout: float = 30.0):
+        self.spool = RenderSpool(spool_dir)
+        self.name = name
+        self.cores = cores or []
+        self.idle_timeout = idle_timeout
+        self._stop = False
+
+    def _heartbeat(self, job_id: str = ""):
+        _write_json(self.spool.dirs["workers"] / f"{self.name}.json", {
+            "name": self.name,
+            "pid": os.getpid(),
+            "cores": self.cores,
+            "job_id": job_id,
+            "heartbeat": time.time(),
+        })
+
+    def _claim(self) -> Optional[dict]:
+        for path in self.spool.pending_jobs():
+            target = self.spool.job_path("running", path.stem)
+            try:
+                os.rename(path, target)  # Атомарно: задание получит один воркер
+            except FileNotFoundError:
+                continue
+            _write_json(self.spool.lease_path(path.stem),
+                        {"pid": os.getpid(), "worker": self.name, "claimed_at": time.time()})
+            data = _read_json(target)
+            if data is not None:
+                return data
+        return None
+
+    def _render(self, job: RenderJob):
+        from .video_editor import SceneConfig, VideoConfig, VideoEditor
+
+        config_data = dict(job.video_config)
+        if "resolution" in config_data:
+            config_data["resolution"] = tuple(config_data["resolution"])
+        editor = VideoEditor(VideoConfig(**config_data))
+        scenes = [
+            SceneConfig(**{**scene, "image_path": Path(scene["image_path"])})
+            for scene in job.scenes
+        ]
+
+        last_report = [0.0]
+
+        def on_progress(fraction: float):
+            now = time.time()
+            if now - last_report[0] >= 1.0 or fraction >= 1.0:
+                last_report[0] = now
+                self.spool.set_progress(job.job_id, fraction, worker=self.name, state="running")
+                self._heartbeat(job.job_id)
+
+        # Пишем во временный файл — недорендеренное видео не примут за готовое
+        output_path = Path(job.output_path)
+        part_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+        editor.create_video(
+            scenes=scenes,
+            audio_path=Path(job.audio_path),
+            output_path=part_path,
+            music_path=Path(job.music_path) if job.music_path else None,
+            music_volume=job.music_volume,
+            on_progress=on_progress,
+        )
+        os.replace(part_path, output_path)
+
+    def _finish(self, data: dict, state: str, **result):
+        job_id = data["job_id"]
+        data.update(result)
+        running = self.spool.job_path("running", job_id)
+        _write_json(running, data)
+        os.replace(running, self.spool.job_path(state, job_id))
+        self.spool.lease_path(job_id).unlink(missing_ok=True)
+        self.spool.set_progress(job_id, 1.0 if state == "done" else 0.0,
+                                worker=self.name, state=state)
+
+    def run_one(self, data: dict):
+        try:
+            job = RenderJob.from_dict(data)
+        except TypeError as e:
+            self._finish(data, "failed", error=f"Повреждённое задание: {e}")
+            return
+        print(f"[RenderWorker {self.name}] ▶ {job.job_id} ({len(job.scenes)} сцен)", flush=True)
+        self.spool.set_progress(job.job_id, 0.0, worker=self.name, state="running")
+        self._heartbeat(job.job_id)
+        start = time.time()
+        try:
+            self._render(job)
+        except Exception as e:
+            traceback.print_exc()
+            data["attempts"] = data.get("attempts", 0) + 1
+            state = "pending" if data["attempts"] < data.get("max_attempts", 2) else "failed"
+            self._finish(data, state, error=str(e))
+            print(f"[RenderWorker {self.name}] ❌ {job.job_id}: {e} → {state}", flush=True)
+        else:
+            elapsed = time.time() - start
+            self._finish(data, "done", worker=self.name, elapsed=round(elapsed, 1),
+                         finished_at=time.time())
+            print(f"[RenderWorker {self.name}] ✅ {job.job_id}: {elapsed:.0f} сек", flush=True)
+        self._heartbeat()
+
+    def run(self):
+        if self.cores and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cores)
+
+        busy = [False]
+
+        def on_signal(signum, frame):
+            # Текущий рендер дописываем, новых заданий не берём;
+            # без задания выходим сразу
+            self._stop = True
+            if not busy[0]:
+                raise SystemExit(0)
+        signal.signal(signal.SIGTERM, on_signal)
+
+        print(f"[RenderWorker {self.name}] pid={os.getpid()} ядра={self.cores or 'все'}", flush=True)
+        self._heartbeat()
+        try:
+            with DirectoryWatcher(self.spool.dirs["pending"]) as watcher:
+                while not self._stop:
+                    self.spool.recover()
+                    busy[0] = True
+                    data = self._claim()
+                    if data is not None:
+                        self.run_one(data)
+                    busy[0] = False
+                    if data is not None:
+                        continue
+                    self._heartbeat()
+                    watcher.wait(self.idle_timeout)
+        finally:
+            (self.spool.dirs["workers"] / f"{self.name}.json").unlink(missing_ok=True)
+
+
+# === Сторона пайплайна ===
+
+class RenderFarmError(Exception):
+    """Задание рендера завершилось ошибкой"""
+
+
+class RenderFarm:
+    """
+    Управление рендер-фермой из пайплайна
+
+    start() поднимает недостающих воркеров (уже работающие после прошлого
+    запуска UI переиспользуются), submit() кладёт задание в спул,
+    wait() ждёт результата с колбэком прогресса.
+    """
+
+    def __init__(self, spool_dir: Path, workers: int = 2):
+        self.spool = RenderSpool(spool_dir)
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+
+    def worker_names(self) -> List[str]:
+        return [f"render-{i}" for i in range(self.workers)]
+
+    def alive_workers(self) -> Dict[str, dict]:
+        alive = {}
+        for path in self.spool.dirs["workers"].glob("*.json"):
+            info = _read_json(path)
+            if info and _pid_alive(info.get("pid", 0)):
+                alive[info["name"]] = info
+        return alive
+
+    def start(self) -> int:
+        """Запустить недостающих воркеров. Возвращает число запущенных"""
+        with self._lock:
+            alive = self.alive_workers()
+            groups = core_groups(self.workers)
+            started = 0
+            for i, name in enumerate(self.worker_names()):
+                if name in alive:
+                    continue
+                cores = groups[i % len(groups)]
+                log_file = open(self.spool.dirs["logs"] / f"{name}.log", "ab")
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "core.render_farm", "worker",
+                     "--spool", str(self.spool.root.resolve()), "--name", name,
+                     "--cores", ",".join(map(str, cores))],
+                    cwd=str(PACKAGE_ROOT),
+                    stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                    start_new_session=True,  # Переживает закрытие UI
+                )
+                log_file.close()
+                # Запись до первого heartbeat — чтобы параллельный start() не запустил дубль
+                _write_json(self.spool.dirs["workers"] / f"{name}.json", {
+                    "name": name, "pid": process.pid, "cores": cores,
+                    "job_id": "", "heartbeat": time.time(),
+                })
+                started += 1
+            return started
+
+    def stop(self):
+        """Попросить воркеров завершиться после текущего задания"""
+        for info in self.alive_workers().values():
+            try:
+                os.kill(info["pid"], signal.SIGTERM)
+            except OSError:
+                pass
+
+    def submit(self, job: RenderJob) -> str:
+        """
+        Поставить задание (идемпотентно по job_id).
+
+        Уже ждущее или идущее задание не дублируется; готовое
+        переиспользуется, если видео на месте.
+        """
+        state, data = self.spool.find(job.job_id)
+        if state in ("pending", "running"):
+            return job.job_id
+        if state == "done" and Path(data.get("output_path", "")).exists():
+            return job.job_id
+        if state is not None:
+            self.spool.job_path(state, job.job_id).unlink(missing_ok=True)
+
+        self.spool.set_progress(job.job_id, 0.0, state="pending")
+        _write_json(self.spool.job_path("pending", job.job_id), asdict(job))
+        return job.job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """Убрать задание, которое ещё не начато"""
+        try:
+            self.spool.job_path("pending", job_id).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def status(self, job_id: str) -> dict:
+        state, data = self.spool.find(job_id)
+        progress = self.spool.progress(job_id) or {}
+        return {
+            "job_id": job_id,
+            "state": state,
+            "progress": progress.get("progress", 0.0),
+            "worker": progress.get("worker", ""),
+            "error": (data or {}).get("error", ""),
+            "output_path": (data or {}).get("output_path", ""),
+        }
+
+    def wait(self, job_id: str, on_progress: Callable[[float, str], None] = None,
+             timeout: float = 6 * 3600, check_every: float = 60.0) -> Path:
+        """
+        Дождаться задания. on_progress(доля, воркер) — при каждом обновлении.
+
+        Raises:
+            RenderFarmError: задание упало или пропало
+            TimeoutError: не дождались
+        """
+        start = time.time()
+        last_check = start
+        last_progress = None
+        with DirectoryWatcher(self.spool.dirs["progress"]) as watcher:
+            while True:
+                status = self.status(job_id)
+                if status["state"] == "done":
+                    return Path(status["output_path"])
+                if status["state"] == "failed":
+                    raise RenderFarmError(status["error"] or "Рендер не удался")
+                if status["state"] is None:
+                    raise RenderFarmError(f"Задание {job_id} пропало из спула")
+
+                if on_progress and status["progress"] != last_progress:
+                    last_progress = status["progress"]
+                    on_progress(last_progress, status["worker"])
+
+                now = time.time()
+                if now - start >= timeout:
+                    raise TimeoutError(f"Рендер {job_id} не завершён за {timeout / 3600:.1f} ч")
+                if now - last_check >= check_every:
+                    # Воркеры могли умереть (OOM, kill) — поднимаем и чиним спул
+                    last_check = now
+                    self.start()
+                    self.spool.recover()
+                watcher.wait(min(check_every, timeout - (now - start)))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Рендер-воркер Video Factory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    worker = sub.add_parser("worker", help="Запустить воркер")
+    worker.add_argument("--spool", required=True, help="Папка спула (output/render_farm)")
+    worker.add_argument("--name", default=f"render-{os.getpid()}")
+    worker.add_argument("--cores", default="", help="Ядра: 0-3,8")
+
+    status = sub.add_parser("status", help="Состояние спула")
+    status.add_argument("--spool", required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "worker":
+        RenderWorker(Path(args.spool), args.name, _parse_cores(args.cores)).run()
+    else:
+        spool = RenderSpool(Path(args.spool))
+        for state in STATES:
+            jobs = sorted(p.stem for p in spool.dirs[state].glob("*.json"))
+            print(f"{state:8} {len(jobs):3}  {' '.join(jobs)}")
+        farm = RenderFarm(Path(args.spool))
+        for name, info in sorted(farm.alive_workers().items()):
+            print(f"{name}: pid={info['pid']} ядра={info['cores']} задание={info.get('job_id') or '-'}")
+
+
+if __name__ == "__main__":
+    main()
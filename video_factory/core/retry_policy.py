@@ -0,0 +1,158 @@
+"""
+Политика повторов для генераторов картинок
+
+Раньше каждый генератор решал сам: FluxGenerator.generate после
+исчерпанных попыток на квоте спал 60 сек и вызывал себя рекурсивно (без
+предела, держа поток generate_parallel), ImageService повторял с паузой,
+не отпуская слот провайдера.
+
+Здесь правила задаются таблицей по классу ошибки:
+
+    quota       — квота GPU/кредиты: другой токен или ожидание восстановления
+    rate_limit  — слишком частые запросы: экспоненциальная пауза
+    safety      — фильтр контента: перефразировать промпт, без паузы
+    transient   — сеть, 5xx, прочее: пауза и вариация промпта
+
+Для класса — число повторов, экспоненциальная пауза с разбросом (jitter:
+одновременно упавшие запросы не приходят обратно одной волной) и нужна ли
+правка промпта. Общий бюджет повторов проекта (RetryBudget) не даёт
+нескольким застрявшим промптам съесть этап.
+
+Ожидание — не в рабочем потоке: ImageService на время паузы отпускает
+слот провайдера, а FLUX ждёт токен в TokenScheduler асинхронно.
+"""
+
+import random
+import threading
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, Optional
+
+QUOTA = "quota"
+RATE_LIMIT = "rate_limit"
+SAFETY = "safety"
+TRANSIENT = "transient"
+
+
+def classify_error(error) -> str:
+    """Класс ошибки по исключению или тексту"""
+    # Типы ImageService — без импорта (модуль не зависит от httpx)
+    kind = type(error).__name__ if isinstance(error, Exception) else ""
+    if kind == "ContentRejected":
+        return SAFETY
+    message = str(error).lower()
+    if "rate limit" in message or "too many requests" in message or "http 429" in message:
+        return RATE_LIMIT
+    if kind == "QuotaExceeded" or "gpu quota" in message or "exceeded" in message or "http 402" in message:
+        return QUOTA
+    if "content" in message or "safety" in message or "nsfw" in message:
+        return SAFETY
+    return TRANSIENT
+
+
+@dataclass(frozen=True)
+class RetryRule:
+    """Как повторять ошибки одного класса"""
+    max_retries: int = 3       # Повторов этого класса на один запрос
+    base_delay: float = 1.0    # Пауза перед первым повтором, сек
+    max_delay: float = 60.0
+    multiplier: float = 2.0
+    jitter: float = 0.5        # Доля паузы, выбираемая случайно (1.0 — full jitter)
+    rewrite: bool = False      # Менять промпт перед повтором
+
+    def delay(self, attempt: int, hint: Optional[float] = None,
+              rng: Callable[[], float] = random.random) -> float:
+        """Пауза перед повтором номер attempt (с 1); hint — retry_after сервиса"""
+        if hint is not None:
+            return min(hint, self.max_delay)
+        delay = min(self.base_delay * self.multiplier ** (attempt - 1), self.max_delay)
+        return delay * (1 - self.jitter + self.jitter * rng())
+
+
+@dataclass
+class RetryDecision:
+    retry: bool
+    delay: float = 0.0
+    rewrite: bool = False
+    reason: str = ""
+
+
+class RetryBudget:
+    """Общий запас повторов (на проект): исчерпан — новые ошибки не повторяются"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self.spent >= self.limit:
+                return False
+            self.spent += 1
+            return True
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.spent)
+
+
+@dataclass
+class RetryState:
+    """Попытки одного запроса по классам ошибок"""
+    counts: Dict[str, int] = field(default_factory=dict)
+    last_class: str = ""
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+class RetryPolicy:
+    """Таблица правил по классам ошибок"""
+
+    def __init__(self, rules: Dict[str, RetryRule], default: RetryRule = None):
+        self.rules = dict(rules)
+        self.default = default or RetryRule()
+
+    def rule(self, error_class: str) -> RetryRule:
+        return self.rules.get(error_class, self.default)
+
+    def next(self, state: RetryState, error_class: str, retry_after: Optional[float] = None,
+             budget: Optional[RetryBudget] = None) -> RetryDecision:
+        """Учесть ошибку и решить, повторять ли запрос"""
+        rule = self.rule(error_class)
+        attempt = state.counts.get(error_class, 0) + 1
+        state.counts[error_class] = attempt
+        state.last_class = error_class
+        if attempt > rule.max_retries:
+            return RetryDecision(False, reason=f"{error_class}: исчерпано {rule.max_retries} повторов")
+        if budget is not None and not budget.spend():
+            return RetryDecision(False, reason=f"исчерпан бюджет повторов проекта ({budget.limit})")
+        return RetryDecision(True, delay=rule.delay(attempt, retry_after), rewrite=rule.rewrite)
+
+    def with_retries(self, max_retries: int) -> "RetryPolicy":
+        """Та же политика с другим числом повторов safety/transient"""
+        rules = dict(self.rules)
+        for error_class in (SAFETY, TRANSIENT):
+            rules[error_class] = replace(self.rule(error_class), max_retries=max_retries)
+        return RetryPolicy(rules, self.default)
+
+
+def standard_policy(max_retries: int = 2, base_delay: float = 2.0) -> RetryPolicy:
+    """Политика REST-провайдеров: квоту ждём по retry_after, контент — новый промпт"""
+    return RetryPolicy({
+        QUOTA: RetryRule(max_retries=2, base_delay=10, max_delay=60),
+        RATE_LIMIT: RetryRule(max_retries=3, base_delay=5, max_delay=60),
+        SAFETY: RetryRule(max_retries=max_retries, base_delay=0, rewrite=True),
+        TRANSIENT: RetryRule(max_retries=max_retries, base_delay=base_delay, max_delay=30, rewrite=True),
+    })
+
+
+# FLUX Space: ошибка квоты — прогноз TokenScheduler был неверен, он учится и
+# сразу выдаёт другой токен (или ждёт восстановления), поэтому без паузы
+FLUX_RETRY_POLICY = RetryPolicy({
+    QUOTA: RetryRule(max_retries=6, base_delay=0, jitter=0),
+    RATE_LIMIT: RetryRule(max_retries=4, base_delay=5, max_delay=60),
+    SAFETY: RetryRule(max_retries=2, base_delay=0, rewrite=True),
+    TRANSIENT: RetryRule(max_retries=2, base_delay=1, max_delay=20, rewrite=True),
+})
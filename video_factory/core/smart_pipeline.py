@@ -11,6 +11,23 @@ from dataclasses import dataclass, asdict, field
 from enum import Enum
 import threading
 
+from .artifact_manifest import ArtifactManifest, fingerprint
+from .fs_events import CompletionEvents, wait_for_files
+from .media_probe import IMAGE_EXTENSIONS, MediaProbeError, get_dimensions, get_duration
+from .pipeline_log import PipelineLogger, current_context, log_context
+from .project_queue import ProjectQueue
+from .project_state import PipelineSnapshot, ProjectStateManager, ProjectView
+from .project_store import ProjectStore
+from .stage_scheduler import Stage, StageScheduler
+from .stage_stats import STAGE_DONE_EVENT, StageStats
+
+# Сцены первых ~5 минут (картинка каждые ~12 сек, см. generate_image_prompts) —
+# удержание зрителя; похожие картинки из кэша берём только для сцен после них
+HOOK_IMAGES = 25
+
+# Превью, упёршиеся в квоту FLUX, повторяем, если она вернётся не позже, сек
+THUMBNAIL_QUOTA_WAIT = 600
+
 
 class ProjectStatus(Enum):
     """Статусы проекта"""
@@ -41,6 +58,8 @@ class SmartProject:
     competitor_channel: str = ""        # Канал конкурента для копирования стиля
     duration: str = "20-30 минут"      # Длительность
     language: str = "Русский"          # Язык
+    priority: int = 0                  # Больше — раньше в очереди
+    deadline: str = ""                 # Время публикации (ISO), к нему видео должно быть готово
     
     # ПРОФИЛЬ КАНАЛА (для запоминания стиля)
     channel_style_id: str = ""         # ID профиля канала
@@ -114,87 +133,160 @@ class SmartPipeline:
     - Применение правок пользователя
     """
     
-    def __init__(self, output_dir: Path = None, on_progress: Callable = None):
+    def __init__(self, output_dir: Path = None, on_progress: Callable = None,
+                 max_active_projects: int = 3, resource_limits: Dict[str, int] = None,
+                 render_workers: int = None, channel_weights: Dict[str, float] = None):
         self.output_dir = output_dir or Path("output")
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.on_progress = on_progress
+        self._logger = PipelineLogger(self.output_dir, on_message=on_progress)
         self.projects: Dict[str, SmartProject] = {}
-        self.queue: List[str] = []  # ID проектов в очереди
+        # ID проектов в очереди: приоритеты, дедлайны, round-robin по каналам
+        self.queue = ProjectQueue(self._queue_key)
+        self._channel_weights = channel_weights or {}
+        self._stage_stats = StageStats(self.output_dir)  # Для оценки времени готовности
         self.is_running = False
         self.current_project_id: Optional[str] = None
         self._worker_thread: Optional[threading.Thread] = None
         
-        # Загружаем сохранённые проекты
+        # Параллельность очереди: сколько проектов в работе и лимиты пулов API
+        self.max_active_projects = max_active_projects
+        self.resource_limits = resource_limits or {}
+        self._scheduler: Optional[StageScheduler] = None
+        self._manifests: Dict[str, ArtifactManifest] = {}
+        self._events = CompletionEvents()  # "<project_id>:images" — этап изображений идёт
+        
+        # Рендер-ферма: N процессов-рендереров вместо потока в процессе UI
+        if render_workers is None:
+            from config import config
+            render_workers = getattr(config.video, "render_workers", 0)
+        self._render_farm = None
+        if render_workers > 0:
+            from .render_farm import RenderFarm
+            self._render_farm = RenderFarm(self.output_dir / "render_farm", workers=render_workers)
+            self.resource_limits.setdefault("render", render_workers)
+        
+        # Все изменения проектов — через state (один писатель, снимки для UI)
+        self.state = ProjectStateManager(self._build_snapshot, on_change=self._persist)
+        
+        # Загружаем сохранённые проекты (по файлу на проект)
+        self._store = ProjectStore(self.output_dir)
         self._load_projects()
     
-    def _log(self, message: str):
-        """Логирование в консоль и файл"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_msg = f"[{timestamp}] {message}"
-        print(f"[Pipeline] {log_msg}")
+    def _log(self, message: str, **fields):
+        """
+        Логирование в консоль, файлы и UI (асинхронно, см. pipeline_log)
         
-        # Записываем в файл лога
-        try:
-            log_file = self.output_dir / "pipeline.log"
-            with open(log_file, "a", encoding="utf-8") as f:
-                f.write(f"{log_msg}\n")
-        except:
-            pass
-        if self.on_progress:
-            self.on_progress(message)
-    
-    def _save_projects(self):
-        """Сохранение проектов И ОЧЕРЕДИ"""
-        data = {
-            "_queue": self.queue.copy(),  # Сохраняем очередь!
-            "_is_running": self.is_running,
-            "_current_project": self.current_project_id
-        }
-        data.update({pid: p.to_dict() for pid, p in self.projects.items()})
-        save_path = self.output_dir / "projects.json"
-        save_path.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+        fields: project_id, stage, duration_ms, api, key_index, event — попадают
+        в pipeline.jsonl; project_id/stage обычно берутся из log_context()
+        """
+        self._logger.log(message, **fields)
+    
+    def _snapshot(self, full: bool = True) -> dict:
+        """Плоский словарь проектов и очереди для ProjectStore"""
+        with self.state.lock:
+            data = {
+                "_queue": self.queue.copy(),  # Сохраняем очередь!
+                "_is_running": self.is_running,
+                "_current_project": self.current_project_id,
+                "_channel_weights": dict(self.queue.weights),
+                # Оценка готовности (до минуты) — для cli.py status
+                "_eta": {pid: int(eta // 60 * 60) for pid, eta in self.estimate_completion().items()},
+            }
+            if full:
+                data.update({pid: p.to_dict() for pid, p in self.projects.items()})
+            else:
+                # Только быстро меняющиеся поля — без asdict всего сценария
+                data.update({
+                    pid: {f: getattr(p, f) for f in ProjectStore.STATE_FIELDS}
+                    for pid, p in self.projects.items()
+                })
+        return data
+    
+    def _build_snapshot(self, version: int) -> PipelineSnapshot:
+        """Неизменяемый снимок для UI (вызывается под state.lock)"""
+        return PipelineSnapshot(
+            version=version,
+            projects=tuple(ProjectView.from_project(p) for p in self.projects.values()),
+            queue=tuple(self.queue),
+            current_project_id=self.current_project_id,
+            is_running=self.is_running,
+            active_projects=tuple(self._scheduler.active_project_ids) if self._scheduler else (),
+            etas=tuple(self.estimate_completion().items()),
+        )
+    
+    def get_snapshot(self) -> PipelineSnapshot:
+        """Снимок очереди и проектов — для чтения из UI без блокировок"""
+        return self.state.snapshot()
+    
+    def _persist(self, full: bool):
+        """Отложенная запись после изменения состояния"""
+        self._store.save_later(self._snapshot, full=full)
+    
+    def _save_projects(self, immediate: bool = False):
+        """
+        Сохранение проектов И ОЧЕРЕДИ
+        
+        Пишутся только изменившиеся файлы проектов, частые вызовы
+        склеиваются в одну запись. immediate=True — записать сейчас.
+        """
+        self.state.changed(full=True)
+        if immediate:
+            self._store.flush()
+    
+    def _save_progress(self):
+        """Сохранение только статуса/прогресса (для частых колбэков)"""
+        self.state.changed(full=False)
     
     def _load_projects(self):
         """Загрузка проектов И ОЧЕРЕДИ"""
-        save_path = self.output_dir / "projects.json"
-        if save_path.exists():
-            try:
-                data = json.loads(save_path.read_text())
-                
-                # Загружаем очередь
-                self.queue = data.pop("_queue", [])
-                was_running = data.pop("_is_running", False)
-                self.current_project_id = data.pop("_current_project", None)
-                
-                # Загружаем проекты
-                for pid, pdata in data.items():
-                    if not pid.startswith("_"):
-                        self.projects[pid] = SmartProject.from_dict(pdata)
-                
-                # Восстанавливаем прерванные проекты в очередь
-                for pid, proj in self.projects.items():
-                    if proj.status in ["analyzing", "scripting", "generating_images", 
-                                       "generating_voice", "assembling"]:
-                        # Проект был прерван — добавляем в начало очереди
-                        if pid not in self.queue:
-                            self.queue.insert(0, pid)
-                            self._log(f"⚠️ Восстановлен прерванный проект: {proj.name}")
-                    elif proj.status == "queued":
-                        # Проект в статусе queued но не в очереди — добавляем
-                        if pid not in self.queue:
-                            self.queue.append(pid)
-                            self._log(f"📋 Восстановлен проект из очереди: {proj.name}")
-                
-                # Пересохраняем с новым форматом (включая очередь)
-                self._save_projects()
-                
-            except Exception as e:
-                print(f"Ошибка загрузки проектов: {e}")
+        try:
+            data = self._store.load()
+            
+            # Загружаем очередь
+            queued = data.pop("_queue", [])
+            was_running = data.pop("_is_running", False)
+            self.current_project_id = data.pop("_current_project", None)
+            self.queue.weights.update(data.pop("_channel_weights", {}))
+            self.queue.weights.update(self._channel_weights)
+            
+            # Загружаем проекты
+            for pid, pdata in data.items():
+                if not pid.startswith("_"):
+                    self.projects[pid] = SmartProject.from_dict(pdata)
+            self.queue.extend(pid for pid in queued if pid in self.projects)
+            
+            # Восстанавливаем прерванные проекты в очередь
+            for pid, proj in self.projects.items():
+                if proj.status in ["analyzing", "scripting", "generating_images", 
+                                   "generating_voice", "assembling"]:
+                    # Проект был прерван — добавляем в начало очереди
+                    if pid not in self.queue:
+                        self.queue.insert(0, pid)
+                        self._log(f"⚠️ Восстановлен прерванный проект: {proj.name}")
+                elif proj.status == "queued":
+                    # Проект в статусе queued но не в очереди — добавляем
+                    if pid not in self.queue:
+                        self.queue.append(pid)
+                        self._log(f"📋 Восстановлен проект из очереди: {proj.name}")
+            
+            # Пересохраняем (восстановленная очередь)
+            self._save_projects(immediate=True)
+            
+        except Exception as e:
+            print(f"Ошибка загрузки проектов: {e}")
     
     def create_project(self, name: str, topic: str, competitor_channel: str = "",
-                       duration: str = "20-30 минут", language: str = "Русский") -> SmartProject:
-        """Создание нового проекта"""
-        project_id = f"proj_{int(time.time())}_{len(self.projects)}"
+                       duration: str = "20-30 минут", language: str = "Русский",
+                       project_id: str = None, priority: int = 0,
+                       deadline: str = "") -> SmartProject:
+        """
+        Создание нового проекта
+        
+        project_id можно задать заранее — так CLI знает ID проекта, который
+        создаст работающий демон (см. pipeline_daemon)
+        """
+        project_id = project_id or self.new_project_id()
         
         project = SmartProject(
             id=project_id,
@@ -203,25 +295,137 @@ class SmartPipeline:
             topic=topic,
             competitor_channel=competitor_channel,
             duration=duration,
-            language=language
+            language=language,
+            priority=priority,
+            deadline=deadline,
         )
         
-        self.projects[project_id] = project
-        self._save_projects()
+        with self.state.transaction():
+            self.projects[project_id] = project
         
         return project
     
+    def _queue_key(self, project_id: str) -> tuple:
+        """(канал, приоритет, дедлайн) проекта для ProjectQueue"""
+        project = self.projects.get(project_id)
+        if project is None:
+            return "default", 0, None
+        deadline = None
+        if project.deadline:
+            try:
+                deadline = datetime.fromisoformat(project.deadline).timestamp()
+            except ValueError:
+                self._log(f"⚠️ [{project.name}] Неверный дедлайн: {project.deadline}")
+        return project.channel_style_id or "default", project.priority, deadline
+    
+    def set_priority(self, project_id: str, priority: int = None, deadline: str = None):
+        """Изменить приоритет и/или дедлайн (ISO) проекта — очередь пересортируется"""
+        project = self.projects.get(project_id)
+        if project is None:
+            return
+        fields = {}
+        if priority is not None:
+            fields["priority"] = priority
+        if deadline is not None:
+            fields["deadline"] = deadline
+        with self.state.transaction():
+            for name, value in fields.items():
+                setattr(project, name, value)
+            self.queue.refresh(project_id)
+    
+    def set_channel_weight(self, channel_style_id: str, weight: float):
+        """Вес канала в round-robin: 2.0 — вдвое больше слотов, чем у канала с 1.0"""
+        with self.state.transaction(full=False):
+            self.queue.set_weight(channel_style_id or "default", weight)
+    
+    def _stage_limits(self) -> Dict[str, int]:
+        limits = dict(StageScheduler.DEFAULT_LIMITS)
+        limits.update(self.resource_limits)
+        return limits
+    
+    def estimate_completion(self) -> Dict[str, float]:
+        """
+        Оценка времени готовности (unix-сек) для проектов в очереди
+        
+        По средним длительностям этапов: проект в работе — сейчас +
+        оставшийся критический путь; следующие в порядке очереди выходят
+        не чаще, чем раз в interval (узкое место), и не раньше, чем
+        через полный критический путь от старта.
+        """
+        stages = self.PIPELINE_STAGES
+        stats = self._stage_stats
+        now = time.time()
+        interval = stats.interval(stages, self._stage_limits(), self.max_active_projects)
+        full = stats.critical_path(stages)
+        
+        with self.state.lock:
+            scheduler = self._scheduler
+            active = scheduler.done_stages() if scheduler else {}
+            etas = {pid: now + stats.critical_path(stages, done) for pid, done in active.items()}
+            last = max(etas.values(), default=now)
+            for pid in self.queue.order():
+                if pid in etas:
+                    continue
+                entry = self.queue.entry(pid)
+                start = max(now, entry.not_before if entry else 0.0)
+                last = max(start + full, last + interval)
+                etas[pid] = last
+        return etas
+    
+    def _deadline_urgent(self, project_id: str, deadline: float) -> bool:
+        """Если отложить проект ещё на одну итерацию очереди — не успеет к дедлайну"""
+        stages = self.PIPELINE_STAGES
+        interval = self._stage_stats.interval(stages, self._stage_limits(), self.max_active_projects)
+        return time.time() + self._stage_stats.critical_path(stages) + interval >= deadline
+    
+    def new_project_id(self) -> str:
+        return f"proj_{int(time.time())}_{len(self.projects)}"
+    
     def add_to_queue(self, project_id: str):
         """Добавление проекта в очередь"""
-        if project_id in self.projects and project_id not in self.queue:
-            self.queue.append(project_id)
-            self.projects[project_id].status = ProjectStatus.QUEUED.value
-            self._save_projects()
+        with self.state.transaction():
+            if project_id in self.projects and project_id not in self.queue:
+                self.queue.append(project_id)
+                self.projects[project_id].status = ProjectStatus.QUEUED.value
+        self._wake_scheduler()
+    
+    def hold_project(self, project_id: str):
+        """
+        Проект на паузу: не в очереди и не восстанавливается в неё при
+        загрузке (новый проект по умолчанию queued)
+        """
+        project = self.projects.get(project_id)
+        if project is None:
+            return
+        self.remove_from_queue(project_id)
+        self.state.update(project, status=ProjectStatus.PAUSED.value)
     
     def remove_from_queue(self, project_id: str):
         """Удаление из очереди"""
-        if project_id in self.queue:
-            self.queue.remove(project_id)
+        with self.state.transaction():
+            if project_id in self.queue:
+                self.queue.remove(project_id)
+    
+    def requeue_failed(self) -> int:
+        """Вернуть в очередь проекты с ошибкой и потерянные queued"""
+        added = 0
+        with self.state.transaction():
+            for pid, project in self.projects.items():
+                if project.status in ["error", "queued"] and pid not in self.queue:
+                    self.queue.append(pid)
+                    project.status = ProjectStatus.QUEUED.value
+                    project.error_message = ""  # Сбрасываем ошибку
+                    added += 1
+        if added:
+            self._wake_scheduler()
+        return added
+    
+    def delete_project(self, project_id: str):
+        """Удаление проекта (файл проекта удалится при сохранении)"""
+        with self.state.transaction():
+            self.projects.pop(project_id, None)
+            if project_id in self.queue:
+                self.queue.remove(project_id)
     
     def start_queue(self):
         """Запуск обработки очереди"""
@@ -229,12 +433,170 @@ class SmartPipeline:
             return
         
         self.is_running = True
+        self.state.changed(full=False)
+        if self._render_farm:
+            self._render_farm.start()
         self._worker_thread = threading.Thread(target=self._process_queue, daemon=True)
         self._worker_thread.start()
     
+    def wait_queue(self, timeout: float = None) -> bool:
+        """Дождаться конца обработки очереди. True — очередь остановилась"""
+        thread = self._worker_thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+    
+    def close(self):
+        """Записать отложенное и закрыть журнал (консольный/демон-режим)"""
+        self._store.flush()
+        self._logger.close()
+    
+    def _wake_scheduler(self):
+        """Разбудить планировщик очереди (новый проект, таймер повтора)"""
+        scheduler = self._scheduler
+        if scheduler:
+            scheduler.notify()
+    
     def stop_queue(self):
-        """Остановка очереди"""
+        """Остановка очереди (текущие этапы доработают)"""
         self.is_running = False
+        self.state.changed(full=False)
+        if self._scheduler:
+            self._scheduler.notify()
+    
+    def _wait_for_images(self, project: SmartProject, project_dir: Path, max_wait: float = 7200) -> List[Path]:
+        """
+        Ожидание изображений для рендера (без опроса раз в минуту)
+        
+        Если этап изображений этого проекта идёт сейчас — ждём его события
+        завершения. Иначе ждём появления файлов в images/ (inotify или
+        частый опрос, если inotify недоступен).
+        """
+        key = f"{project.id}:images"
+        start = time.time()
+        self._log(f"[{project.name}] ⏳ Ожидание генерации изображений...")
+        
+        def on_waiting(elapsed: float):
+            self._log(f"[{project.name}] ⏳ Ожидание изображений... ({int(elapsed) // 60} мин)")
+        
+        if self._events.pending(key):
+            while not self._events.wait(key, timeout=300):
+                if time.time() - start >= max_wait:
+                    return []
+                on_waiting(time.time() - start)
+            images = [Path(p) for p in project.images if Path(p).exists()]
+        else:
+            images = wait_for_files(
+                project_dir / "images", "*", timeout=max_wait, on_waiting=on_waiting,
+                accept=self._is_scene_image,
+            )
+        
+        if images:
+            self._log(f"[{project.name}] ✅ Найдено {len(images)} изображений "
+                      f"после {int(time.time() - start) // 60} мин ожидания")
+        return images
+    
+    @staticmethod
+    def _is_scene_image(path: Path) -> bool:
+        """Готовая картинка сцены: любое расширение провайдеров, без .part и дублей hedging"""
+        name = path.name
+        return (path.suffix.lower() in IMAGE_EXTENSIONS and not name.startswith(".")
+                and ".hedge." not in name)
+    
+    # === МАНИФЕСТ АРТЕФАКТОВ ===
+    
+    def _manifest(self, project_id: str) -> ArtifactManifest:
+        """Манифест проекта (один объект на проект — этапы идут параллельно)"""
+        with self.state.lock:
+            manifest = self._manifests.get(project_id)
+            if manifest is None:
+                manifest = ArtifactManifest(self.output_dir / project_id)
+                self._manifests[project_id] = manifest
+            return manifest
+    
+    @staticmethod
+    def _image_key(index: int) -> str:
+        return f"image:{index + 1:03d}"
+    
+    def _image_prompt_texts(self, project: SmartProject) -> List[str]:
+        """Итоговые промпты FLUX: правки пользователя + стиль изображений"""
+        texts = []
+        for i, prompt_data in enumerate(project.image_prompts or []):
+            prompt = project.user_edits.get(f"image_{i}")
+            if not prompt:
+                prompt = prompt_data.get('prompt_en', str(prompt_data)) if isinstance(prompt_data, dict) else str(prompt_data)
+            texts.append(self._enhance_military_prompt(prompt, project.ai_image_style))
+        return texts
+    
+    @staticmethod
+    def _image_fingerprint(prompt: str) -> str:
+        # Размер — как в ImageRequest по умолчанию (провайдера выбирает роутер)
+        return fingerprint("flux-dev", prompt, 1280, 720)
+    
+    def _voice_fingerprint(self, project: SmartProject) -> str:
+        script_hash = fingerprint(project.script)
+        return fingerprint("elevenlabs", script_hash, self._get_voice_id(project.ai_voice), project.language)
+    
+    @staticmethod
+    def _image_size(path: Path) -> tuple:
+        """(width, height) из заголовка файла, без декодирования"""
+        try:
+            return get_dimensions(path)
+        except MediaProbeError:
+            return (None, None)
+    
+    def _images_status(self, project: SmartProject, project_dir: Path) -> tuple:
+        """
+        Готовые изображения
+        
+        Returns:
+            (пути готовых картинок по порядку сцен, всего промптов, все готовы)
+        """
+        total = len(project.image_prompts) if project.image_prompts else 0
+        manifest = self._manifest(project.id)
+        
+        if total and manifest.keys("image:"):
+            ready = []
+            for i, prompt in enumerate(self._image_prompt_texts(project)):
+                key = self._image_key(i)
+                if manifest.is_fresh(key, self._image_fingerprint(prompt)):
+                    ready.append(str(manifest.path_of(key)))
+            return ready, total, len(ready) == total
+        
+        # Проекты без манифеста — по файлам в папке (порог 90%)
+        images_dir = project_dir / "images"
+        existing = sorted(str(p) for p in images_dir.glob("*") if self._is_scene_image(p)) if images_dir.exists() else []
+        return existing, total, bool(total) and len(existing) >= total * 0.9
+    
+    def _voice_status(self, project: SmartProject, project_dir: Path) -> bool:
+        """Озвучка готова, соответствует сценарию/голосу и не короче минуты"""
+        manifest = self._manifest(project.id)
+        entry = manifest.get("voiceover")
+        if entry is not None:
+            if not manifest.is_fresh("voiceover", self._voice_fingerprint(project)):
+                return False
+            duration = entry.get("duration", 0)
+            if duration < 60:
+                self._log(f"[{project.name}] ⚠️ Озвучка слишком короткая: {duration:.1f} сек")
+                return False
+            return True
+        
+        # Проекты без манифеста — проверяем файл напрямую
+        voiceover_path = project_dir / "audio" / "voiceover.mp3"
+        if voiceover_path.exists():
+            # Проверяем длительность аудио — должно быть минимум 60 секунд для нормального видео
+            try:
+                audio_duration = get_duration(voiceover_path)
+                if audio_duration < 60:
+                    self._log(f"[{project.name}] ⚠️ Озвучка слишком короткая: {audio_duration:.1f} сек")
+                return audio_duration >= 60
+            except Exception as e:
+                self._log(f"[{project.name}] ⚠️ Ошибка проверки аудио: {e}")
+                return False
+        
+        voice_dir = project_dir / "voice"
+        return voice_dir.exists() and any(voice_dir.glob("*.mp3"))  # Старый формат с voice папкой
     
     def _get_resume_point(self, project: SmartProject, project_dir: Path) -> str:
         """
@@ -251,38 +613,9 @@ class SmartPipeline:
         # Проверяем что уже сделано (независимо от статуса!)
         has_script = bool(project.script and len(project.script) > 100)
         
-        # Считаем готовые изображения
-        images_dir = project_dir / "images"
-        existing_images = list(images_dir.glob("*.webp")) if images_dir.exists() else []
-        total_prompts = len(project.image_prompts) if project.image_prompts else 0
-        images_done = len(existing_images) >= total_prompts * 0.9 if total_prompts > 0 else False
-        
-        # Считаем готовые аудио и проверяем длительность
-        voice_dir = project_dir / "voice"
-        audio_dir = project_dir / "audio"
-        existing_voice = list(voice_dir.glob("*.mp3")) if voice_dir.exists() else []
-        
-        # Также проверяем папку audio (где хранится voiceover.mp3)
-        voiceover_path = audio_dir / "voiceover.mp3" if audio_dir.exists() else None
-        
-        voice_done = False
-        if voiceover_path and voiceover_path.exists():
-            # Проверяем длительность аудио — должно быть минимум 60 секунд для нормального видео
-            try:
-                from moviepy import AudioFileClip
-                audio = AudioFileClip(str(voiceover_path))
-                audio_duration = audio.duration
-                audio.close()
-                
-                # Минимум 60 секунд для короткого видео, иначе считаем неполным
-                voice_done = audio_duration >= 60
-                if not voice_done:
-                    self._log(f"[{project.name}] ⚠️ Озвучка слишком короткая: {audio_duration:.1f} сек")
-            except Exception as e:
-                self._log(f"[{project.name}] ⚠️ Ошибка проверки аудио: {e}")
-                voice_done = False
-        elif len(existing_voice) > 0:
-            voice_done = True  # Старый формат с voice папкой
+        # Готовые изображения и озвучка — по манифесту артефактов
+        existing_images, total_prompts, images_done = self._images_status(project, project_dir)
+        voice_done = self._voice_status(project, project_dir)
         
         # Проверяем превью
         preview_exists = (project_dir / "preview.mp4").exists()
@@ -317,249 +650,251 @@ class SmartPipeline:
         
         return None  # Всё готово или начинаем сначала
     
+    # Граф этапов: ключ → (зависимости, ресурс). Порядок = порядок в логах
+    PIPELINE_STAGES = [
+        Stage("analyze", "🔍 Анализ конкурента", "groq"),
+        Stage("script", "📝 Генерация сценария", "groq", ("analyze",)),
+        Stage("prompts", "✏️ Промпты изображений", "groq", ("script",)),
+        Stage("images", "🖼️ Генерация изображений", "flux", ("prompts",)),
+        Stage("voice", "🎙️ Озвучка", "elevenlabs", ("script",)),
+        Stage("assemble", "🎬 Сборка превью", "render", ("images", "voice")),
+        Stage("seo", "📈 SEO оптимизация", "groq", ("script",)),
+        Stage("thumbnails", "🖼️ Генерация превью", "flux", ("seo",)),
+        Stage("render", "🎬 Финальный рендер", "render", ("assemble", "thumbnails")),
+    ]
+    
     def _process_queue(self):
         """
-        🚀 ПАРАЛЛЕЛЬНАЯ обработка очереди
+        🚀 Обработка очереди через DAG этапов
         
-        Пока проект 1 на озвучке/изображениях, проект 2 уже генерит сценарий!
-        Это экономит 30-50% времени на очереди.
+        Несколько проектов идут одновременно по разным этапам: пока проект 1
+        рендерится, проект 2 генерирует картинки, а проект 3 — сценарий.
+        Каждый API (Groq, FLUX, ElevenLabs, рендер) имеет свой пул, поэтому
+        очередь упирается в самый медленный этап, а не в сумму всех этапов.
         """
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        
-        successful = 0
-        failed = 0
+        counters = {"successful": 0, "failed": 0}
         total = len(self.queue)
-        
-        # Кэш для предзагруженных данных и сценариев
-        preloaded_data = {}
-        pregenerated_scripts = {}  # {project_id: script}
+        retry_timers: List[threading.Timer] = []
+        with self.state.lock:
+            self.queue.release_all()  # Взятые прошлым запуском — снова в очередь
         
         self._log("=" * 50)
-        self._log(f"🚀 СТАРТ ОЧЕРЕДИ: {total} проектов")
+        self._log(f"🚀 СТАРТ ОЧЕРЕДИ: {total} проектов "
+                  f"(до {self.max_active_projects} одновременно)")
         self._log("=" * 50)
         
-        while self.is_running and self.queue:
-            project_id = self.queue[0]
-            self.current_project_id = project_id
+        def next_project(active: set) -> Optional[str]:
+            with self.state.lock:
+                while True:
+                    pid = self.queue.next(urgent=self._deadline_urgent)
+                    if pid is None or pid in self.projects:
+                        break
+                    self.queue.remove(pid)  # Удалён из UI
+            if pid is None:
+                return None
+            
+            project = self.projects[pid]
+            if project.deadline:
+                eta = time.time() + self._stage_stats.critical_path(self.PIPELINE_STAGES)
+                _, _, deadline = self._queue_key(pid)
+                if deadline and eta > deadline:
+                    self._log(f"⚠️ [{project.name}] Не успеваем к дедлайну {project.deadline}: "
+                              f"готовность ≈ {datetime.fromtimestamp(eta):%d.%m %H:%M}",
+                              project_id=pid)
+            return pid
+        
+        def prepare_project(project_id: str) -> set:
             project = self.projects[project_id]
+            project_dir = self.output_dir / project_id
+            project_dir.mkdir(parents=True, exist_ok=True)
             
-            self._log(f"\n{'='*40}")
-            self._log(f"📹 ПРОЕКТ: {project.name}")
-            self._log(f"{'='*40}")
+            self._log(f"\n{'='*40}", project_id=project_id)
+            self._log(f"📹 ПРОЕКТ: {project.name}", project_id=project_id)
+            self._log(f"{'='*40}", project_id=project_id)
             
-            # === ПАРАЛЛЕЛЬНАЯ ПОДГОТОВКА СЛЕДУЮЩЕГО ПРОЕКТА ===
-            next_project_id = self.queue[1] if len(self.queue) > 1 else None
-            script_future = None
+            with self.state.transaction(full=False):
+                self.current_project_id = project_id
+                project.status = ProjectStatus.ANALYZING.value
+            return self._get_done_stages(project, project_dir)
+        
+        def run_stage(project_id: str, stage: Stage):
+            project = self.projects.get(project_id)
+            if project is None:
+                raise RuntimeError("Проект удалён")
+            with log_context(project_id=project_id, stage=stage.name):
+                self._log(f"\n--- [{project.name}] {stage.title} ---")
+                start_time = time.time()
+                try:
+                    self._run_stage(project, stage.name)
+                except Exception as e:
+                    self._log(f"❌ [{project.name}] {stage.title}: {e}",
+                              duration_ms=int((time.time() - start_time) * 1000))
+                    raise
+                elapsed = time.time() - start_time
+                self._log(f"✅ [{project.name}] {stage.title}: {elapsed:.1f} сек",
+                          duration_ms=int(elapsed * 1000), api=stage.resource,
+                          event=STAGE_DONE_EVENT)
+                self._stage_stats.record(stage.name, elapsed)
+            self._save_projects()
+        
+        def on_project_done(project_id: str):
+            project = self.projects.get(project_id)
+            if project is None:  # Удалён из UI во время работы
+                return
+            with self.state.transaction():
+                project.status = ProjectStatus.COMPLETED.value
+                project.progress = 100
+                if project_id in self.queue:
+                    self.queue.remove(project_id)
+            self._log(f"\n🎉 ВИДЕО ПОЛНОСТЬЮ ГОТОВО: {project.name}", project_id=project_id)
+            self._log(f"📁 Папка: ~/Desktop/VideoFactory_Ready/", project_id=project_id)
+            
+            counters["successful"] += 1
+            self._save_projects(immediate=True)
+            
+            # Telegram уведомление о готовности проекта
+            self._notify_project_ready(project_id)
+        
+        def on_project_failed(project_id: str, error: Exception):
+            import traceback
+            error_msg = str(error)
+            self._log(f"❌ ОШИБКА: {error_msg}", project_id=project_id)
+            self._log("".join(traceback.format_exception(type(error), error, error.__traceback__)),
+                      project_id=project_id)
             
-            if next_project_id and next_project_id not in pregenerated_scripts:
-                # Запускаем генерацию сценария для СЛЕДУЮЩЕГО проекта в фоне
-                self._log(f"⚡ Параллельно готовлю следующий проект...")
-                script_future = self._start_background_script_generation(next_project_id)
+            project = self.projects.get(project_id)
+            if project is None:  # Удалён из UI во время работы
+                return
+            max_retries = 3  # Максимум 3 попытки
             
-            try:
-                # Используем предзагруженные данные если есть
-                preloaded = preloaded_data.get(project_id)
-                pregen_script = pregenerated_scripts.get(project_id)
-                
-                self._process_project_parallel(project_id, preloaded, pregen_script)
-                
-                # Очищаем использованные данные
-                if project_id in preloaded_data:
-                    del preloaded_data[project_id]
-                if project_id in pregenerated_scripts:
-                    del pregenerated_scripts[project_id]
-                
-                self.queue.pop(0)
-                successful += 1
-                
-                # Telegram уведомление о готовности проекта
-                self._notify_project_ready(project_id)
-                
-            except Exception as e:
-                import traceback
-                error_msg = str(e)
-                self._log(f"❌ ОШИБКА: {error_msg}")
-                self._log(traceback.format_exc())
-                
-                project = self.projects[project_id]
+            with self.state.transaction():
                 retry_count = project.user_edits.get('_retry_count', 0)
-                max_retries = 3  # Максимум 3 попытки
+                if project_id in self.queue:
+                    self.queue.remove(project_id)
                 
                 if retry_count < max_retries:
-                    # АВТОМАТИЧЕСКИЙ ПЕРЕЗАПУСК
+                    # АВТОМАТИЧЕСКИЙ ПЕРЕЗАПУСК — в конец очереди, не раньше чем через минуту.
+                    # Остальные проекты при этом продолжают работать
                     retry_count += 1
                     project.user_edits['_retry_count'] = retry_count
                     project.status = ProjectStatus.QUEUED.value
                     project.error_message = f"Попытка {retry_count}/{max_retries}: {error_msg[:100]}"
                     
-                    # Перемещаем в конец очереди
-                    self.queue.pop(0)
-                    self.queue.append(project_id)
+                    self.queue.requeue(project_id, delay=60)
                     
-                    self._log(f"🔄 АВТОПЕРЕЗАПУСК: попытка {retry_count}/{max_retries}, проект в конец очереди")
-                    self._log(f"⏳ Пауза 60 сек перед следующим проектом...")
-                    time.sleep(60)  # Пауза перед следующим проектом
+                    # Свой таймер на проект — остальные проекты не ждут
+                    timer = threading.Timer(60, self._wake_scheduler)
+                    timer.daemon = True
+                    timer.start()
+                    retry_timers.append(timer)
                 else:
                     # Все попытки исчерпаны
                     project.status = ProjectStatus.ERROR.value
                     project.error_message = f"Ошибка после {max_retries} попыток: {error_msg}"
-                    self.queue.pop(0)
-                    failed += 1
-                    
-                    self._log(f"❌ ФИНАЛЬНАЯ ОШИБКА после {max_retries} попыток")
-                    self._notify_project_error(project_id, error_msg)
+                    counters["failed"] += 1
             
-            # Собираем результат фоновой генерации сценария
-            if script_future and next_project_id:
-                try:
-                    result = script_future.result(timeout=5)
-                    if result:
-                        pregenerated_scripts[next_project_id] = result
-                        self._log(f"⚡ Сценарий для следующего проекта готов!")
-                except:
-                    pass  # Не критично если не успел
-            
-            self._save_projects()
+            if project.status == ProjectStatus.QUEUED.value:
+                self._log(f"🔄 АВТОПЕРЕЗАПУСК: попытка {retry_count}/{max_retries}, "
+                          f"проект в конец очереди (через 60 сек)")
+            else:
+                self._log(f"❌ ФИНАЛЬНАЯ ОШИБКА после {max_retries} попыток")
+                self._notify_project_error(project_id, error_msg)
+        
+        self._scheduler = StageScheduler(
+            self.PIPELINE_STAGES,
+            resource_limits=self.resource_limits,
+            max_active_projects=self.max_active_projects,
+            log=self._log,
+        )
+        try:
+            self._scheduler.run(
+                next_project=next_project,
+                prepare_project=prepare_project,
+                run_stage=run_stage,
+                on_project_done=on_project_done,
+                on_project_failed=on_project_failed,
+                is_running=lambda: self.is_running,
+                has_pending=self._queue_has_delayed,
+                priority_of=lambda pid: self.projects[pid].priority if pid in self.projects else 0,
+            )
+        finally:
+            self._scheduler = None
+            for timer in retry_timers:
+                timer.cancel()
+            with self.state.lock:
+                self.queue.release_all()  # Остановлено посреди проекта — вернуть в очередь
         
         # Уведомление о завершении очереди
         self._log(f"\n{'='*50}")
-        self._log(f"✅ ОЧЕРЕДЬ ЗАВЕРШЕНА: {successful}/{total} успешно")
+        self._log(f"✅ ОЧЕРЕДЬ ЗАВЕРШЕНА: {counters['successful']}/{total} успешно")
         self._log(f"{'='*50}")
         
         if total > 0:
-            self._notify_queue_complete(total, successful, failed)
+            self._notify_queue_complete(total, counters["successful"], counters["failed"])
         
-        self.is_running = False
-        self.current_project_id = None
+        with self.state.transaction():
+            self.is_running = False
+            self.current_project_id = None
+        self._store.flush()
     
-    def _start_background_script_generation(self, project_id: str):
-        """Запуск генерации сценария в фоне для следующего проекта"""
-        from concurrent.futures import ThreadPoolExecutor
-        
-        executor = ThreadPoolExecutor(max_workers=1)
-        
-        def generate():
-            try:
-                project = self.projects.get(project_id)
-                if not project or project.script:
-                    return None
-                
-                from .groq_client import get_groq_client
-                
-                groq = get_groq_client()
-                
-                # Генерируем сценарий на нужном языке
-                script = groq.generate_script(
-                    topic=project.topic,
-                    duration=project.duration,
-                    style=project.ai_style or "документальный, драматичный",
-                    language=project.language
-                )
-                
-                return script
-            except Exception as e:
-                self._log(f"[Background] Ошибка генерации сценария: {e}")
-                return None
-        
-        return executor.submit(generate)
+    def _queue_has_delayed(self) -> bool:
+        with self.state.lock:
+            return self.queue.has_delayed()
     
-    def _process_project_parallel(self, project_id: str, preloaded_data: dict = None, 
-                                   pregenerated_script: str = None):
-        """Обработка проекта с поддержкой предгенерированных данных и ПРОДОЛЖЕНИЯ"""
-        project = self.projects[project_id]
-        project_dir = self.output_dir / project_id
-        project_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Определяем с какого этапа продолжать
+    def _get_done_stages(self, project: SmartProject, project_dir: Path) -> set:
+        """Этапы DAG, которые уже выполнены (по точке продолжения)"""
         resume_from = self._get_resume_point(project, project_dir)
         if resume_from:
             self._log(f"⏩ ПРОДОЛЖАЕМ с этапа: {resume_from}")
         
-        project.status = ProjectStatus.ANALYZING.value
-        
-        # Используем предзагруженные данные
-        if preloaded_data:
-            project.user_edits['preloaded'] = preloaded_data
-            self._log(f"⚡ Используем предзагруженные данные")
-        
-        # Используем предгенерированный сценарий
-        if pregenerated_script and not project.script:
-            project.script = pregenerated_script
-            self._log(f"⚡ Используем предгенерированный сценарий ({len(pregenerated_script)} символов)")
-        
-        # Определяем какие этапы пропустить
-        skip_steps = set()
+        done = set()
+        if resume_from not in ["images", "voice", "assemble", "seo", "thumbnails"]:
+            return done
         
-        # Если есть сценарий — пропускаем анализ и генерацию сценария
-        if resume_from in ["images", "voice", "assemble", "seo", "thumbnails"]:
-            skip_steps.add("🔍 Анализ конкурента")
-            skip_steps.add("📝 Генерация сценария")
+        done.update({"analyze", "script"})
+        if project.image_prompts:
+            done.add("prompts")
         
-        # Проверяем реальное наличие изображений
-        images_dir = project_dir / "images"
-        existing_images = list(images_dir.glob("*.webp")) if images_dir.exists() else []
-        total_prompts = len(project.image_prompts) if project.image_prompts else 0
-        images_actually_done = len(existing_images) >= total_prompts * 0.9 if total_prompts > 0 else False
-        
-        # Пропускаем изображения ТОЛЬКО если они реально готовы
-        if resume_from in ["voice", "assemble", "seo", "thumbnails"] and images_actually_done:
-            skip_steps.add("🖼️ Генерация изображений")
-            project.images = sorted([str(p) for p in existing_images])
+        # Изображения пропускаем ТОЛЬКО если они реально готовы
+        ready_images, _, images_done = self._images_status(project, project_dir)
+        if resume_from != "images" and images_done:
+            done.add("images")
+            self.state.update(project, images=ready_images)
             self._log(f"📂 Загружено {len(project.images)} существующих картинок")
-        elif resume_from == "voice" and not images_actually_done:
-            # Изображений нет — НЕ пропускаем этот этап!
-            self._log(f"⚠️ Изображений {len(existing_images)}/{total_prompts}, генерируем заново")
         
-        # Пропускаем озвучку только если она реально готова
         if resume_from in ["assemble", "seo", "thumbnails"]:
-            skip_steps.add("🎙️ Озвучка")
-            voice_dir = project_dir / "voice"
-            if voice_dir.exists():
-                project.voice_files = sorted([str(p) for p in voice_dir.glob("*.mp3")])
-        
+            done.add("voice")
         if resume_from in ["seo", "thumbnails"]:
-            skip_steps.add("🎬 Сборка превью")
+            done.add("assemble")
         if resume_from == "thumbnails":
-            skip_steps.add("📈 SEO оптимизация")
-        
-        # Выполняем этапы
-        steps = [
-            ("🔍 Анализ конкурента", self._step_analyze_competitor),
-            ("📝 Генерация сценария", self._step_generate_script),
-            ("🖼️ Генерация изображений", lambda p: self._step_generate_images(p, project_dir)),
-            ("🎙️ Озвучка", lambda p: self._step_generate_voice(p, project_dir)),
-            ("🎬 Сборка превью", lambda p: self._step_assemble_preview(p, project_dir)),
-            ("📈 SEO оптимизация", self._step_generate_seo),
-            ("🖼️ Генерация превью", lambda p: self._step_generate_thumbnails(p, project_dir)),
-            ("🎬 Финальный рендер", lambda p: self._step_final_render_auto(p, project_dir)),
-        ]
+            done.add("seo")
         
-        for step_name, step_func in steps:
-            if not self.is_running:
-                break
-            
-            # Пропускаем уже выполненные этапы
-            if step_name in skip_steps:
-                self._log(f"⏭ {step_name} — пропускаем (уже готово)")
-                continue
-            
-            self._log(f"\n--- {step_name} ---")
-            start_time = time.time()
-            
-            try:
-                step_func(project)
-                elapsed = time.time() - start_time
-                self._log(f"✅ {step_name}: {elapsed:.1f} сек")
-            except Exception as e:
-                self._log(f"❌ {step_name}: {e}")
-                raise
-            
-            self._save_projects()
-        
-        project.status = ProjectStatus.COMPLETED.value
-        project.progress = 100
-        self._log(f"\n🎉 ВИДЕО ПОЛНОСТЬЮ ГОТОВО: {project.name}")
-        self._log(f"📁 Папка: ~/Desktop/VideoFactory_Ready/")
+        return done
+    
+    def _run_stage(self, project: SmartProject, stage_name: str):
+        """Выполнение одного этапа DAG для проекта"""
+        project_dir = self.output_dir / project.id
+        
+        if stage_name == "analyze":
+            self._step_analyze_competitor(project)
+        elif stage_name == "script":
+            self._step_generate_script(project)
+        elif stage_name == "prompts":
+            self._step_generate_prompts(project)
+        elif stage_name == "images":
+            self._step_generate_images(project, project_dir)
+        elif stage_name == "voice":
+            self._step_generate_voice(project, project_dir)
+        elif stage_name == "assemble":
+            self._step_assemble_preview(project, project_dir)
+        elif stage_name == "seo":
+            self._step_generate_seo(project)
+        elif stage_name == "thumbnails":
+            self._step_generate_thumbnails(project, project_dir)
+        elif stage_name == "render":
+            self._step_final_render_auto(project, project_dir)
+        else:
+            raise ValueError(f"Неизвестный этап: {stage_name}")
     
     def _notify_project_ready(self, project_id: str):
         """Telegram уведомление о готовности проекта"""
@@ -616,134 +951,14 @@ class SmartPipeline:
         except Exception as e:
             self._log(f"Ошибка Telegram уведомления: {e}")
     
-    def _preload_project(self, project_id: str, cache: dict):
-        """
-        Предзагрузка данных следующего проекта
-        
-        Пока текущий проект рендерится, загружаем данные для следующего:
-        - Анализ конкурента
-        - Генерация промптов для изображений
-        
-        Это экономит 30-60 секунд на каждом проекте!
-        """
-        try:
-            project = self.projects.get(project_id)
-            if not project:
-                return
-            
-            self._log(f"[Preload] Предзагрузка данных для: {project.name}")
-            
-            from .youtube_analyzer import YouTubeAnalyzer
-            from config import config
-            
-            preload_data = {}
-            
-            # Предзагрузка данных конкурента
-            if project.competitor_channel:
-                try:
-                    analyzer = YouTubeAnalyzer(config.api.youtube_keys)
-                    channel_info = analyzer.get_channel_info(project.competitor_channel)
-                    
-                    if channel_info:
-                        videos = analyzer.get_channel_videos(channel_info.channel_id, max_results=15)
-                        preload_data['channel_info'] = channel_info
-                        preload_data['videos'] = videos
-                        preload_data['titles'] = [v.title for v in videos]
-                        preload_data['descriptions'] = [v.description for v in videos if v.description]
-                        self._log(f"[Preload] ✅ Данные конкурента загружены")
-                except Exception as e:
-                    self._log(f"[Preload] Ошибка загрузки конкурента: {e}")
-            
-            cache[project_id] = preload_data
-            
-        except Exception as e:
-            self._log(f"[Preload] Ошибка: {e}")
-    
-    def _process_project(self, project_id: str, preloaded_data: dict = None):
-        """Полная обработка одного проекта с поддержкой ПРОДОЛЖЕНИЯ"""
-        project = self.projects[project_id]
-        project_dir = self.output_dir / project_id
-        project_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Определяем с какого этапа продолжать
-        resume_from = self._get_resume_point(project, project_dir)
-        if resume_from:
-            self._log(f"[{project.name}] ⏩ Продолжаем с этапа: {resume_from}")
-        
-        # Сохраняем предзагруженные данные
-        if preloaded_data:
-            project.user_edits['preloaded'] = preloaded_data
-            self._log(f"[{project.name}] Используем предзагруженные данные")
-        
-        # Шаги 1-2: последовательно (нужен сценарий для остального)
-        # Пропускаем если уже есть сценарий
-        if resume_from not in ["images", "voice", "assemble", "seo", "thumbnails"]:
-            sequential_steps = [
-                ("Анализ конкурента", lambda: self._step_analyze_competitor(project) if project.competitor_channel else self._step_set_defaults(project)),
-                ("Генерация сценария", lambda: self._step_generate_script(project)),
-            ]
-            
-            for step_name, step_func in sequential_steps:
-                if not self.is_running:
-                    self._log(f"[{project.name}] Остановлено пользователем")
-                    return
-                try:
-                    self._log(f"[{project.name}] {step_name}...")
-                    step_func()
-                except Exception as e:
-                    import traceback
-                    error_msg = f"{step_name}: {str(e)}"
-                    self._log(f"[{project.name}] ❌ Ошибка: {error_msg}")
-                    project.error_message = error_msg
-                    project.status = ProjectStatus.ERROR.value
-                    self._save_projects()
-                    raise
-        else:
-            self._log(f"[{project.name}] ⏭ Сценарий уже есть, пропускаем")
-        
-        # Шаги 3-4: ПАРАЛЛЕЛЬНО (изображения + озвучка одновременно!)
-        if resume_from not in ["assemble", "seo", "thumbnails"]:
-            self._log(f"[{project.name}] 🚀 Параллельная генерация: изображения + озвучка")
-            self._step_parallel_media(project, project_dir, resume=resume_from in ["images", "voice"])
-        else:
-            self._log(f"[{project.name}] ⏭ Медиа уже готово, пропускаем")
-        
-        # Шаги 5-8: последовательно (включая финальный рендер!)
-        final_steps = [
-            ("Генерация SEO", lambda: self._step_generate_seo(project)),
-            ("Генерация обложек (3 варианта)", lambda: self._step_generate_thumbnails(project, project_dir)),
-            ("Финальный рендер видео", lambda: self._step_final_render_auto(project, project_dir)),
-        ]
-        
-        for step_name, step_func in final_steps:
-            if not self.is_running:
-                self._log(f"[{project.name}] Остановлено пользователем")
-                return
-            
-            try:
-                self._log(f"[{project.name}] {step_name}...")
-                step_func()
-            except Exception as e:
-                import traceback
-                error_msg = f"{step_name}: {str(e)}"
-                self._log(f"[{project.name}] ❌ Ошибка: {error_msg}")
-                self._log(traceback.format_exc())
-                project.error_message = error_msg
-                project.status = ProjectStatus.ERROR.value
-                self._save_projects()
-                raise  # Пробрасываем ошибку наверх
-        
-        # Полностью завершён!
-        project.status = ProjectStatus.COMPLETED.value
-        project.progress = 100
-        self._save_projects()
-        self._log(f"[{project.name}] 🎉 ВИДЕО ПОЛНОСТЬЮ ГОТОВО: {project.final_video}")
-    
     def _step_analyze_competitor(self, project: SmartProject):
         """Анализ конкурента и подбор параметров (с поддержкой preload)"""
-        project.status = ProjectStatus.ANALYZING.value
-        project.current_step = "Анализ конкурента..."
-        project.progress = 5
+        self.state.update(
+            project,
+            status=ProjectStatus.ANALYZING.value,
+            current_step="Анализ конкурента...",
+            progress=5,
+        )
         self._log(f"[{project.name}] Анализ конкурента: {project.competitor_channel}")
         
         try:
@@ -774,8 +989,9 @@ class SmartPipeline:
                 descriptions = [v.description for v in videos if v.description]
             
             # СОХРАНЯЕМ данные конкурента для анализа крючков
-            project.user_edits['competitor_titles'] = titles
-            project.user_edits['competitor_descriptions'] = descriptions[:10]
+            with self.state.transaction():
+                project.user_edits['competitor_titles'] = titles
+                project.user_edits['competitor_descriptions'] = descriptions[:10]
             self._log(f"[{project.name}] Сохранено {len(titles)} заголовков для анализа крючков")
             
             # AI анализ стиля
@@ -783,16 +999,19 @@ class SmartPipeline:
             style_analysis = groq.analyze_style(descriptions, titles)
             
             # Применяем результаты
-            project.ai_style = style_analysis.get('narrative_style', 'Документальный')
-            project.ai_voice = self._map_voice(style_analysis.get('recommended_voice', {}))
-            project.ai_image_style = self._determine_image_style(project.topic, style_analysis)
-            project.ai_transitions = self._determine_transitions(style_analysis)
-            project.ai_effects = self._determine_effects(style_analysis)
-            project.ai_music_mood = self._determine_music_mood(project.topic, style_analysis)
-            
-            # Очищаем preloaded данные
-            if 'preloaded' in project.user_edits:
-                del project.user_edits['preloaded']
+            fields = dict(
+                ai_style=style_analysis.get('narrative_style', 'Документальный'),
+                ai_voice=self._map_voice(style_analysis.get('recommended_voice', {})),
+                ai_image_style=self._determine_image_style(project.topic, style_analysis),
+                ai_transitions=self._determine_transitions(style_analysis),
+                ai_effects=self._determine_effects(style_analysis),
+                ai_music_mood=self._determine_music_mood(project.topic, style_analysis),
+            )
+            with self.state.transaction():
+                for name, value in fields.items():
+                    setattr(project, name, value)
+                # Очищаем preloaded данные
+                project.user_edits.pop('preloaded', None)
                 
         except Exception as e:
             self._log(f"Ошибка анализа: {e}, используем defaults")
@@ -800,18 +1019,24 @@ class SmartPipeline:
     
     def _step_set_defaults(self, project: SmartProject):
         """Установка параметров по умолчанию"""
-        project.ai_style = "Документальный, драматичный"
-        project.ai_voice = "Brian (мужской, нарратор)"
-        project.ai_image_style = "cinematic, dramatic lighting, 8k, hyperrealistic"
-        project.ai_transitions = ["fade", "dissolve", "crossfade"]
-        project.ai_effects = {"zoom": 1.05, "pan": True}
-        project.ai_music_mood = "epic, dramatic"
+        self.state.update(
+            project,
+            ai_style="Документальный, драматичный",
+            ai_voice="Brian (мужской, нарратор)",
+            ai_image_style="cinematic, dramatic lighting, 8k, hyperrealistic",
+            ai_transitions=["fade", "dissolve", "crossfade"],
+            ai_effects={"zoom": 1.05, "pan": True},
+            ai_music_mood="epic, dramatic",
+        )
     
     def _step_generate_script(self, project: SmartProject):
         """Генерация сценария с мощным крючком"""
-        project.status = ProjectStatus.SCRIPTING.value
-        project.current_step = "Генерация сценария..."
-        project.progress = 15
+        self.state.update(
+            project,
+            status=ProjectStatus.SCRIPTING.value,
+            current_step="Генерация сценария...",
+            progress=15,
+        )
         self._log(f"[{project.name}] Генерация сценария с анализом крючков")
         
         from .groq_client import get_groq_client
@@ -826,7 +1051,7 @@ class SmartPipeline:
             
             if competitor_titles:
                 self._log(f"[{project.name}] Анализ крючков конкурента...")
-                project.current_step = "Анализ крючков..."
+                self.state.update(project, current_step="Анализ крючков...")
                 
                 try:
                     hooks_analysis = groq.analyze_hooks(competitor_titles, competitor_descriptions)
@@ -836,7 +1061,7 @@ class SmartPipeline:
                     self._log(f"[{project.name}] Ошибка анализа крючков: {e}")
         
         # Генерируем сценарий на нужном языке
-        project.current_step = "Генерация сценария..."
+        self.state.update(project, current_step="Генерация сценария...")
         script = groq.generate_script(
             topic=project.topic,
             duration=project.duration,
@@ -864,20 +1089,15 @@ class SmartPipeline:
             except Exception as e:
                 self._log(f"[{project.name}] Ошибка генерации крючка: {e}")
         
-        project.script = script
-        project.progress = 30
+        self.state.update(project, script=script, progress=30)
         self._save_projects()
     
-    def _step_generate_images(self, project: SmartProject, project_dir: Path):
-        """Генерация изображений через FLUX (ПАРАЛЛЕЛЬНО!)"""
-        project.status = ProjectStatus.GENERATING_IMAGES.value
-        project.current_step = "Генерация изображений (FLUX)..."
-        project.progress = 35
-        self._log(f"[{project.name}] 🚀 Параллельная генерация изображений через FLUX")
+    def _step_generate_prompts(self, project: SmartProject):
+        """Генерация промптов для изображений (Groq)"""
+        self.state.update(project, current_step="Генерация промптов для изображений...", progress=32)
+        self._log(f"[{project.name}] ✏️ Генерация промптов для изображений")
         
         from .groq_client import get_groq_client
-        from .flux_generator import FluxGenerator
-        from config import config
         
         # Генерация промптов через BATCH запрос (быстрее!)
         groq = get_groq_client()
@@ -899,117 +1119,271 @@ class SmartPipeline:
             project.ai_image_style,
             duration_minutes=duration_minutes
         )
-        project.image_prompts = prompts
+        self.state.update(project, image_prompts=prompts)
+        self._save_projects()
+    
+    def _step_generate_images(self, project: SmartProject, project_dir: Path):
+        """Генерация изображений через FLUX (ПАРАЛЛЕЛЬНО!)"""
+        # Событие завершения будит рендер, ожидающий картинки этого проекта
+        key = f"{project.id}:images"
+        self._events.begin(key)
+        try:
+            self._generate_images(project, project_dir)
+        finally:
+            self._events.finish(key)
+    
+    def _generate_images(self, project: SmartProject, project_dir: Path):
+        self.state.update(
+            project,
+            status=ProjectStatus.GENERATING_IMAGES.value,
+            current_step="Генерация изображений...",
+            progress=35,
+        )
+        
+        from contextlib import ExitStack
+        
+        from .image_cache import get_image_cache
+        from .image_postprocess import ImagePostprocessor
+        from .image_router import get_image_router
+        from .image_triage import ImageTriage
+        from .image_service import ImageRequest, ImageResponse
+        from .retry_policy import RetryBudget
+        from config import config
+        
+        # Провайдер для каждой сцены выбирает роутер: FLUX на квоте не держит этап
+        router = get_image_router()
+        providers = [p.name for p in router.candidates()]
+        self._log(f"[{project.name}] 🚀 Параллельная генерация изображений: {', '.join(providers)}")
+        
+        # Промпты — отдельный этап DAG; здесь только если вызвано напрямую
+        if not project.image_prompts:
+            self._step_generate_prompts(project)
+        prompts = project.image_prompts
         
-        # Генерация изображений через FLUX
         images_dir = project_dir / "images"
         images_dir.mkdir(exist_ok=True)
         
-        # Получаем токены HuggingFace
-        hf_tokens = getattr(config.api, 'huggingface_tokens', [])
-        generator = FluxGenerator(hf_tokens=hf_tokens, output_dir=images_dir)
-        
         # Подготавливаем промпты с улучшениями
-        enhanced_prompts = []
-        for prompt_data in prompts:
-            prompt = prompt_data.get('prompt_en', str(prompt_data)) if isinstance(prompt_data, dict) else str(prompt_data)
-            enhanced = self._enhance_military_prompt(prompt, project.ai_image_style)
-            enhanced_prompts.append(enhanced)
-        
+        enhanced_prompts = self._image_prompt_texts(project)
+        fingerprints = [self._image_fingerprint(p) for p in enhanced_prompts]
         total = len(enhanced_prompts)
-        self._log(f"[{project.name}] Генерация {total} изображений параллельно...")
         
-        # Callback для обновления прогресса
-        def on_progress(completed, total_count, result):
-            project.current_step = f"FLUX: {completed}/{total_count} изображений"
-            project.progress = 35 + int(30 * completed / total_count)
-            self._save_projects()
-            
-            if result and result.success:
-                self._log(f"  ✅ #{completed}: {result.generation_time:.1f}с")
-            elif result:
-                self._log(f"  ❌ #{completed}: {result.error[:50]}")
+        # Генерируем только картинки без актуальной записи в манифесте
+        manifest = self._manifest(project.id)
+        pending = [
+            i for i, fp in enumerate(fingerprints)
+            if not manifest.is_fresh(self._image_key(i), fp)
+        ]
+        if len(pending) < total:
+            self._log(f"[{project.name}] ⏭ Актуальных изображений: {total - len(pending)}/{total}")
+        self._log(f"[{project.name}] Генерация {len(pending)} изображений параллельно...")
         
-        # ПАРАЛЛЕЛЬНАЯ генерация (4-8 потоков в зависимости от токенов)
-        max_workers = min(8, len(hf_tokens)) if hf_tokens else 1
+        # Callback для обновления прогресса (из потоков FLUX — контекст лога передаём явно)
+        log_fields = {"project_id": project.id, "stage": "images", **current_context()}
         
-        results = generator.generate_parallel(
-            prompts=enhanced_prompts,
-            base_filename="scene",
-            max_workers=max_workers,
-            on_progress=on_progress
-        )
+        def on_progress(completed, total_count, result):
+            # Текущая параллельность провайдеров (AdaptiveLimit) — в статус для UI
+            concurrency = self._image_concurrency(router.service, active_only=True)
+            self.state.update(
+                project,
+                current_step=f"Изображения: {completed}/{total_count}"
+                             + (f" · {concurrency}" if concurrency else ""),
+                progress=35 + int(30 * completed / total_count),
+            )
+            if concurrency and completed % 10 == 0:
+                self._log(f"  📊 {concurrency}", **log_fields)
+            
+            if result:
+                # api="flux" — по этим записям учится TokenScheduler (load_flux_trace)
+                api = "flux" if result.provider.startswith("flux") else result.provider
+                result_fields = dict(
+                    log_fields, api=api, key_index=result.token_index,
+                    duration_ms=int(result.generation_time * 1000),
+                )
+                if result.success:
+                    self._log(f"  ✅ #{completed}: {result.generation_time:.1f}с", **result_fields)
+                else:
+                    self._log(f"  ❌ #{completed}: {result.error[:50]}", **result_fields)
+        
+        # Общий запас повторов: несколько «застрявших» промптов не съедают этап
+        retry_budget = RetryBudget(max(10, 2 * len(pending)))
+        requests = [
+            ImageRequest(prompt=enhanced_prompts[i], filename=f"scene_{i + 1:03d}", output_dir=images_dir,
+                         retry_budget=retry_budget)
+            for i in pending
+        ]
+        results = [None] * len(requests)
+        completed = 0
+        cache = get_image_cache()
+        cache_keys = {}  # Номер запроса → ключ кэша (плохую картинку из кэша убрать)
+        # Пулы проверки и подготовки закрываются и при исключении посреди этапа
+        with ExitStack() as pools:
+            # Мастер для рендера и превью — в фоне, пока генерируются остальные
+            postprocess = pools.enter_context(ImagePostprocessor(self._render_profile(project), log=self._log))
+            # Проверка кадров — в пуле процессов, тоже по мере прихода
+            triage = None
+            if requests and getattr(config.video, "image_triage", True):
+                triage = pools.enter_context(ImageTriage(requests[0].width / requests[0].height, log=self._log))
+                # Готовые картинки прошлых запусков — образцы для поиска повторов
+                pending_set = set(pending)
+                for i in range(total):
+                    if i not in pending_set and manifest.get(self._image_key(i)):
+                        triage.submit(i, manifest.path_of(self._image_key(i)))
+        
+            def remember(index, result):
+                """Готовая картинка: подготовка к монтажу, проверка, кэш"""
+                if not (result.success and result.path):
+                    return
+                postprocess.submit(result.path)
+                if triage:
+                    triage.submit(pending[index], result.path)
+                # В кэш сразу: перезапуск после сбоя не закажет картинку снова
+                if cache and result.provider != "cache":
+                    request = requests[index]
+                    cache.put(request.prompt, result.provider, request.width, request.height,
+                              request.steps, request.seed, result.path, result.seed, project.id)
+                    cache_keys[index] = cache.key(request.prompt, result.provider, request.width,
+                                                  request.height, request.steps, request.seed)
+        
+            def on_result(index, result):
+                nonlocal completed
+                completed += 1
+                results[index] = result
+                on_progress(completed, len(requests), result)
+                remember(index, result)
+        
+            # Кэш по промпту (все проекты); проходные сцены — похожей картинкой
+            if cache:
+                reuse_similar = getattr(config.video, "image_reuse_similar", 0.0)
+                for j, (i, request) in enumerate(zip(pending, requests)):
+                    args = (request.prompt, providers, request.width, request.height, request.steps)
+                    hit = cache.get(*args, request.seed)
+                    if hit is None and reuse_similar and i >= HOOK_IMAGES and request.seed is None:
+                        hit = cache.similar(*args, threshold=reuse_similar, exclude_project=project.id)
+                    if hit is not None:
+                        path = cache.materialize(hit, request.path(hit.path.suffix))
+                        cache_keys[j] = hit.key
+                        on_result(j, ImageResponse(success=True, path=path, seed=hit.seed, provider="cache"))
+                reused = sum(1 for r in results if r is not None)
+                if reused:
+                    self._log(f"[{project.name}] ♻️ Из кэша картинок: {reused}/{len(requests)}")
+            todo = [j for j, result in enumerate(results) if result is None]
+        
+            # Свои воркеры image_forge — первыми, всей пачкой; остальное — роутеру
+            rest = todo
+            exclude = []
+            if todo and "image_forge" in providers:
+                from .image_forge_client import ImageForgeBatch
+            
+                forge = ImageForgeBatch(config.api.image_forge_url, project_id=project.id, log=self._log)
+                try:
+                    forge.generate_batch([requests[j] for j in todo],
+                                         on_result=lambda k, result: on_result(todo[k], result))
+                except Exception as e:
+                    self._log(f"[{project.name}] ⚠️ image_forge: {e}")
+                rest = [j for j, result in enumerate(results) if result is None]
+                exclude = ["image_forge"]
+                if rest:
+                    self._log(f"[{project.name}] ↪ image_forge не сделал {len(rest)} изображений — другим провайдерам")
+        
+            # ПАРАЛЛЕЛЬНАЯ генерация: лимиты — у каждого провайдера свои
+            if rest:
+                router.generate_batch(
+                    [requests[j] for j in rest],
+                    on_result=lambda k, _, result: on_result(rest[k], result),
+                    exclude=exclude,
+                )
         
-        # Собираем успешные результаты
-        for result in results:
-            if result and result.success and result.path:
-                project.images.append(str(result.path))
+            # Плохие кадры — перегенерировать сейчас, а не увидеть в готовом ролике
+            if triage:
+                self._requeue_bad_images(project, router, requests, results, pending,
+                                         triage, remember, cache, cache_keys)
+                triage.close()  # Процессы больше не нужны
+            if cache:
+                cache.flush()
+        
+            # Записываем новые картинки в манифест (перезапуск перезаписывает те же файлы)
+            for i, result in zip(pending, results):
+                key = self._image_key(i)
+                if result and result.success and result.path:
+                    width, height = self._image_size(result.path)
+                    manifest.record(key, result.path, fingerprints[i],
+                                    width=width, height=height, seed=result.seed)
+                else:
+                    manifest.remove(key)
+            manifest.prune("image:", [self._image_key(i) for i in range(total)])
+            manifest.save()
         
-        success_count = len(project.images)
-        self._log(f"[{project.name}] ✅ Сгенерировано {success_count}/{total} изображений")
+            images = [
+                str(manifest.path_of(self._image_key(i)))
+                for i in range(total) if manifest.get(self._image_key(i))
+            ]
+            self.state.update(project, images=images)
+        
+            # Дождаться подготовки (и доделать картинки прошлых запусков)
+            prepared = postprocess.ensure(Path(p) for p in images)
+        if prepared:
+            self._log(f"[{project.name}] 🖼 Подготовлено к монтажу: {prepared} изображений")
+        
+        success_count = sum(1 for r in results if r and r.success)
+        self._log(f"[{project.name}] ✅ Сгенерировано {success_count}/{len(pending)} изображений "
+                  f"(всего готово {len(images)}/{total})")
+        if retry_budget.spent:
+            self._log(f"[{project.name}] 🔁 Повторов генерации: {retry_budget.spent}/{retry_budget.limit}")
+        concurrency = self._image_concurrency(router.service)
+        if concurrency:
+            self._log(f"[{project.name}] 📊 Параллельность: {concurrency}")
         
         self._save_projects()
     
-    def _step_parallel_media(self, project: SmartProject, project_dir: Path, resume: bool = False):
+    def _requeue_bad_images(self, project: SmartProject, router, requests: list, results: list,
+                            pending: List[int], triage, remember: Callable, cache, cache_keys: dict):
         """
-        ПАРАЛЛЕЛЬНАЯ генерация изображений и озвучки
-        
-        Запускает оба процесса одновременно — экономит 30-50% времени!
+        Перегенерация картинок, не прошедших проверку (core/image_triage.py)
         
-        Args:
-            resume: True если продолжаем прерванную генерацию
+        Не больше config.video.image_triage_retries раз; если новая картинка
+        не получилась — остаётся прежняя (лучше, чем пустая сцена).
         """
-        import concurrent.futures
-        
-        project.current_step = "Параллельная генерация медиа..."
-        project.progress = 35
-        
-        if resume:
-            self._log(f"[{project.name}] ⏩ Продолжаем генерацию медиа...")
-        
-        # Проверяем что уже готово
-        images_dir = project_dir / "images"
-        voice_dir = project_dir / "voice"
-        
-        existing_images = list(images_dir.glob("*.webp")) if images_dir.exists() else []
-        existing_voice = list(voice_dir.glob("*.mp3")) if voice_dir.exists() else []
-        
-        total_prompts = len(project.image_prompts) if project.image_prompts else 0
-        images_complete = len(existing_images) >= total_prompts * 0.95 if total_prompts > 0 else False
-        voice_complete = len(existing_voice) > 0
-        
-        if resume:
-            self._log(f"[{project.name}] Изображений: {len(existing_images)}/{total_prompts}, Озвучка: {'✅' if voice_complete else '❌'}")
+        from .image_triage import describe
+        from config import config
         
-        # Создаём executor для параллельного выполнения
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            futures = []
-            
-            # Запускаем только то что нужно
-            if not images_complete:
-                futures.append(("Изображения", executor.submit(self._step_generate_images, project, project_dir)))
-            else:
-                self._log(f"[{project.name}] ⏭ Изображения уже готовы ({len(existing_images)} шт)")
-                project.images = [str(p) for p in existing_images]
+        rounds = getattr(config.video, "image_triage_retries", 1)
+        position = {i: j for j, i in enumerate(pending)}
+        for attempt in range(rounds + 1):
+            bad = triage.failures(pending)
+            if not bad:
+                return
+            if attempt == rounds:
+                self._log(f"[{project.name}] ⚠️ Не прошли проверку кадров: {len(bad)} ({describe(bad)})")
+                return
+            self._log(f"[{project.name}] 🔍 Проверка кадров: {len(bad)} плохих ({describe(bad)}) — перегенерирую")
             
-            if not voice_complete:
-                futures.append(("Озвучка", executor.submit(self._step_generate_voice, project, project_dir)))
-            else:
-                self._log(f"[{project.name}] ⏭ Озвучка уже готова")
-                project.voice_files = [str(p) for p in existing_voice]
+            redo = [position[i] for i in sorted(bad)]
+            for j in redo:
+                if cache and j in cache_keys:
+                    cache.discard(cache_keys.pop(j))  # Кэш больше не выдаст плохую картинку
             
-            # Ждём завершения
-            errors = []
-            for name, future in futures:
-                try:
-                    future.result()
-                except Exception as e:
-                    errors.append(f"{name}: {e}")
+            def on_redo(k, _, result, redo=redo):
+                j = redo[k]
+                if not (result.success and result.path):
+                    return
+                old = results[j]
+                if old and old.path and Path(old.path) != Path(result.path):
+                    Path(old.path).unlink(missing_ok=True)  # Другой провайдер — другое расширение
+                results[j] = result
+                remember(j, result)
             
-            if errors:
-                raise Exception("; ".join(errors))
-        
-        self._log(f"[{project.name}] ✅ Параллельная генерация завершена")
+            router.generate_batch([requests[j] for j in redo], on_result=on_redo)
+    
+    @staticmethod
+    def _image_concurrency(service, active_only: bool = False) -> str:
+        """Лимит, задержки и пропускная способность провайдеров картинок одной строкой"""
+        from .adaptive_limit import describe
+        
+        return "; ".join(
+            describe(name, status) for name, status in service.concurrency_status().items()
+            if not active_only or status["in_flight"] or status["waiting"]
+        )
     
     def _enhance_military_prompt(self, prompt: str, style: str, use_bw: bool = True) -> str:
         """
@@ -1066,9 +1440,12 @@ class SmartPipeline:
     
     def _step_generate_voice(self, project: SmartProject, project_dir: Path):
         """Генерация озвучки (ПАРАЛЛЕЛЬНО с несколькими ключами!)"""
-        project.status = ProjectStatus.GENERATING_VOICE.value
-        project.current_step = "Генерация озвучки..."
-        project.progress = 70
+        self.state.update(
+            project,
+            status=ProjectStatus.GENERATING_VOICE.value,
+            current_step="Генерация озвучки...",
+            progress=70,
+        )
         self._log(f"[{project.name}] 🚀 Параллельная генерация озвучки")
         
         from .elevenlabs_client import ElevenLabsClient
@@ -1124,29 +1501,45 @@ class SmartPipeline:
                 )
             
             elapsed = time.time() - start_time
-            self._log(f"  ⏱️ Время озвучки: {elapsed:.1f} сек")
+            self._log(f"  ⏱️ Время озвучки: {elapsed:.1f} сек", api="elevenlabs",
+                      duration_ms=int(elapsed * 1000), key_index=client.current_key_index)
             
             if audio_path and Path(audio_path).exists():
                 file_size = Path(audio_path).stat().st_size / 1024 / 1024
-                project.audio_path = str(audio_path)
+                self.state.update(project, audio_path=str(audio_path))
                 self._log(f"  ✅ Озвучка готова: {audio_path} ({file_size:.1f} MB)")
+                
+                # Манифест: по нему продолжение не открывает аудио заново
+                manifest = self._manifest(project.id)
+                try:
+                    duration = get_duration(Path(audio_path))
+                except Exception as e:
+                    self._log(f"  ⚠️ Не удалось прочитать длительность: {e}")
+                    duration = None
+                manifest.record("voiceover", Path(audio_path), self._voice_fingerprint(project),
+                                duration=duration, voice_id=voice_id)
+                manifest.save()
             else:
                 raise Exception("Файл озвучки не создан")
                 
         except Exception as e:
             elapsed = time.time() - start_time
-            self._log(f"  ❌ Ошибка озвучки после {elapsed:.1f} сек: {e}")
+            self._log(f"  ❌ Ошибка озвучки после {elapsed:.1f} сек: {e}", api="elevenlabs",
+                      duration_ms=int(elapsed * 1000), key_index=client.current_key_index)
             # Пробрасываем ошибку чтобы проект не завершился без озвучки
             raise Exception(f"Ошибка генерации озвучки: {e}")
         
-        project.progress = 85
+        self.state.update(project, progress=85)
         self._save_projects()
     
     def _step_assemble_preview(self, project: SmartProject, project_dir: Path):
         """Сборка БЫСТРОГО превью видео для проверки"""
-        project.status = ProjectStatus.ASSEMBLING.value
-        project.current_step = "Сборка быстрого превью..."
-        project.progress = 90
+        self.state.update(
+            project,
+            status=ProjectStatus.ASSEMBLING.value,
+            current_step="Сборка быстрого превью...",
+            progress=90,
+        )
         self._log(f"[{project.name}] 🎬 Сборка быстрого превью (720p)")
         
         # Сохраняем данные для финального рендера
@@ -1177,19 +1570,18 @@ class SmartPipeline:
                     resolution=(1280, 720)
                 )
                 
-                project.preview_video = str(preview_path)
+                self.state.update(project, preview_video=str(preview_path))
                 self._log(f"[{project.name}] ✅ Быстрое превью готово: {preview_path}")
             else:
-                project.preview_video = str(data_path)
+                self.state.update(project, preview_video=str(data_path))
                 self._log(f"[{project.name}] ⚠️ Недостаточно данных для превью")
         except Exception as e:
             self._log(f"[{project.name}] ⚠️ Ошибка превью: {e}, сохраняем данные")
-            project.preview_video = str(data_path)
+            self.state.update(project, preview_video=str(data_path))
     
     def _step_generate_seo(self, project: SmartProject):
         """Генерация SEO с хештегами и A/B заголовками"""
-        project.current_step = "Генерация SEO..."
-        project.progress = 92
+        self.state.update(project, current_step="Генерация SEO...", progress=92)
         
         from .groq_client import get_groq_client
         
@@ -1205,20 +1597,16 @@ class SmartPipeline:
         
         # Заголовок и альтернативы для A/B теста
         alt_titles = seo.get('seo_title_alternatives', [])
-        project.seo_title = alt_titles[0] if alt_titles else project.name
-        project.seo_alt_titles = alt_titles
-        
-        # Описание
-        project.seo_description = seo.get('description', '')
-        
-        # Теги
-        project.seo_tags = seo.get('tags', [])
-        
-        # Хештеги
-        project.seo_hashtags = seo.get('hashtags', [])
-        
-        # Текст для закреплённого комментария
-        project.seo_first_comment = seo.get('first_comment', '')
+        self.state.update(
+            project,
+            seo_title=alt_titles[0] if alt_titles else project.name,
+            seo_alt_titles=alt_titles,
+            seo_description=seo.get('description', ''),
+            seo_tags=seo.get('tags', []),
+            seo_hashtags=seo.get('hashtags', []),
+            # Текст для закреплённого комментария
+            seo_first_comment=seo.get('first_comment', ''),
+        )
         
         self._log(f"  SEO: {len(project.seo_tags)} тегов, {len(project.seo_hashtags)} хештегов, {len(project.seo_alt_titles)} заголовков")
     
@@ -1233,12 +1621,12 @@ class SmartPipeline:
         4. Генерация изображений
         5. Сохранение промптов для редактирования
         """
-        project.current_step = "Анализ для превью..."
-        project.progress = 95
+        self.state.update(project, current_step="Анализ для превью...", progress=95)
         self._log(f"[{project.name}] 🎨 Генерация 3 вирусных превью")
         
         from .flux_generator import FluxGenerator
         from .groq_client import get_groq_client
+        from .retry_policy import RetryBudget
         from config import config
         
         thumbnails_dir = project_dir / "thumbnails"
@@ -1307,15 +1695,19 @@ class SmartPipeline:
         hf_tokens = getattr(config.api, 'huggingface_tokens', [])
         generator = FluxGenerator(hf_tokens=hf_tokens, output_dir=thumbnails_dir)
         
-        project.thumbnails = []
+        self.state.update(project, thumbnails=[])
         thumbnail_prompts = []  # Сохраняем промпты
+        # Общий запас повторов на все превью: при проблемах FLUX этап не
+        # растягивается на 3 × полный набор повторов
+        retry_budget = RetryBudget(6)
+        quota_failed = []  # (номер, концепт, через сколько сек вернётся квота)
         
-        for i, concept in enumerate(concepts[:3]):
+        def make_thumbnail(i: int, concept: dict):
             concept_type = concept.get('type', f'variant_{i+1}')
             prompt_en = concept.get('prompt_en', '')
             why_viral = concept.get('why_viral', '')
             
-            project.current_step = f"Превью {i+1}/3: {concept_type}"
+            self.state.update(project, current_step=f"Превью {i+1}/3: {concept_type}")
             self._log(f"[{project.name}] Генерация превью #{i+1}: {concept_type}")
             
             # Улучшаем промпт техническими тегами
@@ -1327,11 +1719,13 @@ class SmartPipeline:
                 width=1280,
                 height=720,
                 steps=30,  # Больше шагов для качества
-                guidance=4.5
+                guidance=4.5,
+                budget=retry_budget,
             )
             
             if result.success and result.path:
-                project.thumbnails.append(str(result.path))
+                with self.state.transaction():
+                    project.thumbnails.append(str(result.path))
                 
                 # Сохраняем промпт рядом с изображением
                 prompt_file = result.path.with_suffix('.txt')
@@ -1360,9 +1754,28 @@ ORIGINAL CONCEPT:
                 self._log(f"  ✅ Превью {concept_type}: готово + промпт сохранён")
             else:
                 self._log(f"  ❌ Превью {concept_type}: ошибка генерации")
-            
+            return result
+        
+        for i, concept in enumerate(concepts[:3]):
+            result = make_thumbnail(i, concept)
+            if not result.success and result.retry_after is not None:
+                quota_failed.append((i, concept, result.retry_after))
             time.sleep(2)
         
+        # Упёрлись в квоту FLUX — один повтор, когда она вернётся (если скоро)
+        if quota_failed:
+            wait = min(retry_after for _, _, retry_after in quota_failed)
+            if wait <= THUMBNAIL_QUOTA_WAIT:
+                self._log(f"[{project.name}] ⏳ Квота FLUX: повтор {len(quota_failed)} превью через {wait:.0f} сек")
+                time.sleep(wait)
+                for i, concept, _ in quota_failed:
+                    if not self.is_running:
+                        break
+                    make_thumbnail(i, concept)
+            else:
+                self._log(f"[{project.name}] ⚠️ Квота FLUX вернётся через {wait / 60:.0f} мин — "
+                          f"{len(quota_failed)} превью без повтора")
+        
         # Сохраняем все промпты в один файл для удобства
         all_prompts_file = thumbnails_dir / "ALL_PROMPTS.txt"
         all_prompts_content = f"""=== ПРОМПТЫ ДЛЯ ПРЕВЬЮ: {project.name} ===
@@ -1388,7 +1801,7 @@ PROMPT:
         all_prompts_file.write_text(all_prompts_content, encoding='utf-8')
         
         # Сохраняем промпты в проект для доступа из UI
-        project.thumbnail_prompts = thumbnail_prompts
+        self.state.update(project, thumbnail_prompts=thumbnail_prompts)
         
         self._log(f"[{project.name}] ✅ {len(project.thumbnails)} превью готовы, промпты сохранены")
         self._save_projects()
@@ -1644,19 +2057,89 @@ PROMPT:
             index = edit_data.get('index')
             new_prompt = edit_data.get('prompt')
             if index is not None and new_prompt:
-                project.user_edits[f"image_{index}"] = new_prompt
+                with self.state.transaction():
+                    project.user_edits[f"image_{index}"] = new_prompt
         
         elif edit_type == "change_transition":
-            project.ai_transitions = edit_data.get('transitions', project.ai_transitions)
+            self.state.update(project, ai_transitions=edit_data.get('transitions', project.ai_transitions))
         
         elif edit_type == "change_effects":
-            project.ai_effects.update(edit_data.get('effects', {}))
+            with self.state.transaction():
+                project.ai_effects.update(edit_data.get('effects', {}))
         
         elif edit_type == "edit_script":
-            project.script = edit_data.get('script', project.script)
+            self.state.update(project, script=edit_data.get('script', project.script))
         
         self._save_projects()
     
+    def _render_profile(self, project: SmartProject):
+        """Профиль мастеров картинок — те же эффекты, что VideoConfig финального рендера"""
+        from .image_postprocess import RenderProfile
+        
+        effects = project.ai_effects or {}
+        return RenderProfile(
+            resolution=(1920, 1080),
+            max_zoom=effects.get('zoom_max', 1.15),
+            grade=effects.get('color_correction', 'cinematic'),
+        )
+    
+    def _prepare_masters(self, project: SmartProject, config, scenes: list):
+        """Мастера картинок под фактический VideoConfig — если эффекты поменялись после генерации"""
+        from .image_postprocess import ImagePostprocessor, RenderProfile
+        
+        with ImagePostprocessor(RenderProfile.from_video_config(config), log=self._log) as postprocess:
+            prepared = postprocess.ensure(scene.image_path for scene in scenes)
+        if prepared:
+            self._log(f"[{project.name}] 🖼 Мастеров для рендера: {prepared}")
+    
+    def _render_video(self, project: SmartProject, config, scenes: list, audio_path: Path,
+                      output_path: Path, music_path: Optional[Path] = None,
+                      music_volume: float = 0.15, progress_range: tuple = (95, 99)) -> Path:
+        """
+        Рендер видео: в рендер-ферме (если включена) или в этом процессе
+        
+        С фермой поток этапа только ставит задание и ждёт его, а кадры
+        кодирует отдельный процесс. Задание с теми же входами не дублируется —
+        после перезапуска UI ожидание подхватывает уже идущий рендер.
+        """
+        self._prepare_masters(project, config, scenes)
+        
+        if self._render_farm is None:
+            from .video_editor import VideoEditor
+            return VideoEditor(config).create_video(
+                scenes=scenes,
+                audio_path=audio_path,
+                output_path=output_path,
+                music_path=music_path,
+                music_volume=music_volume,
+            )
+        
+        from .render_farm import RenderJob
+        
+        job = RenderJob(
+            project_id=project.id,
+            output_path=str(output_path),
+            audio_path=str(audio_path),
+            scenes=[{**asdict(scene), "image_path": str(scene.image_path)} for scene in scenes],
+            video_config=asdict(config),
+            music_path=str(music_path) if music_path else "",
+            music_volume=music_volume,
+        )
+        self._render_farm.start()
+        job_id = self._render_farm.submit(job)
+        self._log(f"[{project.name}] 🏭 Рендер передан в ферму: {job_id}")
+        
+        low, high = progress_range
+        
+        def on_progress(fraction: float, worker: str):
+            self.state.update(
+                project,
+                progress=low + int((high - low) * fraction),
+                current_step=f"Рендер {int(fraction * 100)}% ({worker or 'в очереди'})",
+            )
+        
+        return self._render_farm.wait(job_id, on_progress=on_progress)
+    
     def _step_final_render_auto(self, project: SmartProject, project_dir: Path):
         """
         Автоматический финальный рендер видео (без превью)
@@ -1667,19 +2150,19 @@ PROMPT:
         - Переходами
         - Цветокоррекцией
         """
-        project.status = ProjectStatus.RENDERING.value
-        project.current_step = "Финальный рендер видео..."
-        project.progress = 95
+        self.state.update(
+            project,
+            status=ProjectStatus.RENDERING.value,
+            current_step="Финальный рендер видео...",
+            progress=95,
+        )
         self._save_projects()
         
         # Проверяем длительность аудио перед рендером
         if not project.audio_path or not Path(project.audio_path).exists():
             raise Exception("Нет файла озвучки для рендера")
         
-        from moviepy import AudioFileClip
-        audio = AudioFileClip(project.audio_path)
-        audio_duration = audio.duration
-        audio.close()
+        audio_duration = get_duration(project.audio_path)
         
         # Минимум 60 секунд для нормального видео
         if audio_duration < 60:
@@ -1687,7 +2170,7 @@ PROMPT:
         
         self._log(f"[{project.name}] 🎬 Финальный рендер: {audio_duration/60:.1f} мин аудио, {len(project.images)} картинок")
         
-        from .video_editor import VideoEditor, VideoConfig, SceneConfig
+        from .video_editor import VideoConfig, SceneConfig
         
         # Получаем эффекты из анализа конкурента
         effects = project.ai_effects or {}
@@ -1708,35 +2191,12 @@ PROMPT:
         
         self._log(f"[{project.name}] Монтаж: переходы={project.ai_transitions}, zoom={config.min_zoom}-{config.max_zoom}, цвет={config.color_grade}")
         
-        editor = VideoEditor(config)
-        
         # Подготовка сцен
         images = [Path(p) for p in project.images if Path(p).exists()]
         
         # Если нет изображений — ждём их генерации (до 2 часов)
         if not images:
-            import time
-            max_wait = 7200  # 2 часа
-            waited = 0
-            wait_interval = 60  # Проверяем каждую минуту
-            
-            self._log(f"[{project.name}] ⏳ Ожидание генерации изображений...")
-            
-            while waited < max_wait:
-                time.sleep(wait_interval)
-                waited += wait_interval
-                
-                # Перечитываем изображения
-                images_dir = project_dir / "images"
-                if images_dir.exists():
-                    images = sorted([p for p in images_dir.glob("*.webp")])
-                    if images:
-                        self._log(f"[{project.name}] ✅ Найдено {len(images)} изображений после {waited//60} мин ожидания")
-                        break
-                
-                if waited % 300 == 0:  # Каждые 5 минут
-                    self._log(f"[{project.name}] ⏳ Ожидание изображений... ({waited//60} мин)")
-            
+            images = self._wait_for_images(project, project_dir, max_wait=7200)
             if not images:
                 raise Exception("Нет изображений для рендера после 2 часов ожидания")
         
@@ -1763,16 +2223,16 @@ PROMPT:
         
         # Рендерим
         self._log(f"[{project.name}] 🎥 Рендер {len(scenes)} сцен...")
-        editor.create_video(
-            scenes=scenes,
+        self._render_video(
+            project, config, scenes,
             audio_path=Path(project.audio_path),
             output_path=output_path,
             music_path=music_path,
-            music_volume=0.12
+            music_volume=0.12,
+            progress_range=(95, 99),
         )
         
-        project.final_video = str(output_path)
-        project.progress = 100
+        self.state.update(project, final_video=str(output_path), progress=100)
         self._save_projects()
         
         self._log(f"[{project.name}] ✅ Финальное видео готово: {output_path}")
@@ -1841,9 +2301,12 @@ PROMPT:
             return None
         
         project = self.projects[project_id]
-        project.status = ProjectStatus.RENDERING.value
-        project.current_step = "Подготовка к рендеру..."
-        project.progress = 0
+        self.state.update(
+            project,
+            status=ProjectStatus.RENDERING.value,
+            current_step="Подготовка к рендеру...",
+            progress=0,
+        )
         self._save_projects()
         
         try:
@@ -1866,8 +2329,7 @@ PROMPT:
             except Exception as e:
                 self._log(f"[{project.name}] ⚠️ Ошибка проверки качества: {e}")
             
-            project.current_step = "Настройка видео..."
-            project.progress = 10
+            self.state.update(project, current_step="Настройка видео...", progress=10)
             
             # Получаем эффекты из анализа конкурента
             effects = project.ai_effects or {}
@@ -1891,40 +2353,17 @@ PROMPT:
             editor = VideoEditor(config)
             
             # Подготовка сцен
-            project.current_step = "Расчёт таймингов..."
-            project.progress = 20
+            self.state.update(project, current_step="Расчёт таймингов...", progress=20)
             
-            from moviepy import AudioFileClip
-            audio = AudioFileClip(project.audio_path)
-            total_duration = audio.duration
-            audio.close()
+            total_duration = get_duration(project.audio_path)
             
             # Рассчитываем длительность каждой сцены
             images = [Path(p) for p in project.images if Path(p).exists()]
             
             # Если нет изображений — ждём их генерации
             if not images:
-                import time
                 project_dir = self.output_dir / project_id
-                max_wait = 7200  # 2 часа
-                waited = 0
-                
-                self._log(f"[{project.name}] ⏳ Ожидание генерации изображений...")
-                
-                while waited < max_wait:
-                    time.sleep(60)
-                    waited += 60
-                    
-                    images_dir = project_dir / "images"
-                    if images_dir.exists():
-                        images = sorted([p for p in images_dir.glob("*.webp")])
-                        if images:
-                            self._log(f"[{project.name}] ✅ Найдено {len(images)} изображений")
-                            break
-                    
-                    if waited % 300 == 0:
-                        self._log(f"[{project.name}] ⏳ Ожидание... ({waited//60} мин)")
-                
+                images = self._wait_for_images(project, project_dir, max_wait=7200)
                 if not images:
                     raise Exception("Нет изображений для рендера после ожидания")
             
@@ -1942,8 +2381,7 @@ PROMPT:
                 ))
                 current_time += scene_duration
             
-            project.current_step = f"Рендер видео ({len(scenes)} сцен)..."
-            project.progress = 30
+            self.state.update(project, current_step=f"Рендер видео ({len(scenes)} сцен)...", progress=30)
             self._save_projects()
             
             # Путь для выходного файла
@@ -1954,18 +2392,18 @@ PROMPT:
             music_path = self._find_music(project.ai_music_mood)
             
             # Рендерим базовое видео
-            editor.create_video(
-                scenes=scenes,
+            self._render_video(
+                project, config, scenes,
                 audio_path=Path(project.audio_path),
                 output_path=output_path,
                 music_path=music_path,
-                music_volume=0.12
+                music_volume=0.12,
+                progress_range=(30, 80),
             )
             
             # Добавляем субтитры если нужно
             if add_subtitles and project.script:
-                project.current_step = "Добавление субтитров..."
-                project.progress = 85
+                self.state.update(project, current_step="Добавление субтитров...", progress=85)
                 self._save_projects()
                 
                 try:
@@ -2004,10 +2442,13 @@ PROMPT:
                 except Exception as e:
                     self._log(f"[{project.name}] ⚠️ Ошибка субтитров: {e}, видео без субтитров")
             
-            project.final_video = str(output_path)
-            project.status = ProjectStatus.COMPLETED.value
-            project.progress = 100
-            project.current_step = "Готово!"
+            self.state.update(
+                project,
+                final_video=str(output_path),
+                status=ProjectStatus.COMPLETED.value,
+                progress=100,
+                current_step="Готово!",
+            )
             self._save_projects()
             
             # Копируем видео на рабочий стол в папку VideoFactory_Ready
@@ -2068,9 +2509,12 @@ PROMPT:
             return str(output_path)
             
         except Exception as e:
-            project.status = ProjectStatus.ERROR.value
-            project.error_message = str(e)
-            project.current_step = f"Ошибка: {e}"
+            self.state.update(
+                project,
+                status=ProjectStatus.ERROR.value,
+                error_message=str(e),
+                current_step=f"Ошибка: {e}",
+            )
             self._save_projects()
             self._log(f"❌ Ошибка рендера: {e}")
             return None
@@ -2120,12 +2564,9 @@ PROMPT:
         
         try:
             from .video_editor import generate_subtitles_from_script
-            from moviepy import AudioFileClip
             
             # Получаем длительность аудио
-            audio = AudioFileClip(project.audio_path)
-            total_duration = audio.duration
-            audio.close()
+            total_duration = get_duration(project.audio_path)
             
             # Генерируем субтитры
             subtitles = generate_subtitles_from_script(project.script, total_duration)
@@ -2166,17 +2607,21 @@ PROMPT:
         return self.projects.get(project_id)
     
     def get_all_projects(self) -> List[SmartProject]:
-        return list(self.projects.values())
+        with self.state.lock:
+            return list(self.projects.values())
     
     def get_ready_projects(self) -> List[SmartProject]:
         """Проекты готовые к проверке"""
-        return [p for p in self.projects.values() if p.status == ProjectStatus.READY_FOR_REVIEW.value]
+        with self.state.lock:
+            return [p for p in self.projects.values() if p.status == ProjectStatus.READY_FOR_REVIEW.value]
     
     def get_queue_status(self) -> dict:
         """Статус очереди"""
+        snapshot = self.get_snapshot()
         return {
-            "is_running": self.is_running,
-            "queue_length": len(self.queue),
-            "current_project": self.current_project_id,
-            "projects_in_queue": self.queue.copy()
+            "is_running": snapshot.is_running,
+            "queue_length": len(snapshot.queue),
+            "current_project": snapshot.current_project_id,
+            "active_projects": self._scheduler.active_project_ids if self._scheduler else [],
+            "projects_in_queue": list(snapshot.queue)
         }
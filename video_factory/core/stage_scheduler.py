@@ -0,0 +1,262 @@
+"""
+Планировщик этапов пайплайна — DAG этапов с пулами ресурсов
+
+Каждый проект проходит граф этапов (анализ → сценарий → промпты →
+{изображения, озвучка} → сборка → ...). Этапы разных проектов выполняются
+одновременно, но каждый внешний ресурс (Groq, FLUX, ElevenLabs, рендер)
+имеет свой лимит параллельности — так каждый API загружен независимо,
+а очередь из N проектов идёт со скоростью самого узкого этапа, а не суммы.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+@dataclass
+class Stage:
+    """Этап пайплайна"""
+    name: str                          # Ключ этапа ("images", "voice", ...)
+    title: str                         # Для логов ("🖼️ Генерация изображений")
+    resource: str                      # Пул ресурса ("groq", "flux", ...)
+    deps: Tuple[str, ...] = ()         # Этапы, которые должны завершиться раньше
+
+
+@dataclass
+class ProjectRun:
+    """Состояние проекта внутри планировщика"""
+    project_id: str
+    done: Set[str] = field(default_factory=set)
+    running: Set[str] = field(default_factory=set)
+    error: Optional[Exception] = None
+    admitted_at: float = field(default_factory=time.time)
+    priority: int = 0                  # Больше — раньше получает слоты ресурсов
+
+
+class StageScheduler:
+    """
+    Выполнение DAG этапов для нескольких проектов одновременно
+
+    Этап запускается, когда готовы все его зависимости и в пуле его ресурса
+    есть свободный слот. Среди готовых этапов первым идёт проект с большим
+    приоритетом, при равном — раньше попавший в работу.
+    """
+
+    DEFAULT_LIMITS = {
+        "groq": 2,        # Анализ, сценарии, промпты, SEO
+        "flux": 1,        # generate_parallel сам распределяет по токенам
+        "elevenlabs": 1,  # generate_voiceover_parallel сам распределяет по ключам
+        "render": 1,      # MoviePy/ffmpeg — CPU
+    }
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        resource_limits: Dict[str, int] = None,
+        max_active_projects: int = 3,
+        log: Callable[[str], None] = print,
+        idle_timeout: float = 30.0,
+    ):
+        self.stages = {s.name: s for s in stages}
+        self.order = [s.name for s in stages]
+        self.limits = dict(self.DEFAULT_LIMITS)
+        self.limits.update(resource_limits or {})
+        self.max_active_projects = max_active_projects
+        self._log = log
+        # Цикл просыпается по notify() (этап завершён, новый проект, стоп,
+        # таймер повтора); таймаут — только страховка
+        self.idle_timeout = idle_timeout
+
+        self._validate()
+
+        self._runs: Dict[str, ProjectRun] = {}
+        self._in_use: Dict[str, int] = {r: 0 for r in self.limits}
+        self._cond = threading.Condition()
+        self._wakeup = False  # notify() пришёл, пока цикл не спал
+
+        # Один пул потоков на ресурс, размером с его лимит
+        self._pools = {
+            resource: ThreadPoolExecutor(
+                max_workers=max(1, limit), thread_name_prefix=f"stage-{resource}"
+            )
+            for resource, limit in self.limits.items()
+        }
+
+    def _validate(self):
+        """Проверка графа: известные зависимости и ресурсы, нет циклов"""
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Этап {stage.name}: неизвестная зависимость {dep}")
+            if stage.resource not in self.limits:
+                raise ValueError(f"Этап {stage.name}: неизвестный ресурс {stage.resource}")
+
+        visited: Dict[str, int] = {}  # 1 = в обходе, 2 = готово
+
+        def visit(name: str):
+            state = visited.get(name)
+            if state == 1:
+                raise ValueError(f"Цикл в графе этапов через {name}")
+            if state == 2:
+                return
+            visited[name] = 1
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visited[name] = 2
+
+        for name in self.stages:
+            visit(name)
+
+    @property
+    def active_project_ids(self) -> List[str]:
+        with self._cond:
+            return list(self._runs)
+
+    def done_stages(self) -> Dict[str, Set[str]]:
+        """Выполненные этапы активных проектов (для оценки времени готовности)"""
+        with self._cond:
+            return {pid: set(run.done) for pid, run in self._runs.items()}
+
+    def notify(self):
+        """Разбудить цикл планировщика (новый проект в очереди, стоп и т.п.)"""
+        with self._cond:
+            self._wakeup = True
+            self._cond.notify_all()
+    
+    def _sleep(self):
+        """Ждать notify() (под блокировкой); не засыпать, если он уже был"""
+        finished = any(
+            not r.running and (r.error is not None or len(r.done) == len(self.stages))
+            for r in self._runs.values()
+        )
+        if not self._wakeup and not finished:
+            self._cond.wait(timeout=self.idle_timeout)
+        self._wakeup = False
+
+    def _ready_stages(self, run: ProjectRun) -> List[Stage]:
+        return [
+            self.stages[name] for name in self.order
+            if name not in run.done
+            and name not in run.running
+            and all(dep in run.done for dep in self.stages[name].deps)
+        ]
+
+    def run(
+        self,
+        next_project: Callable[[Set[str]], Optional[str]],
+        prepare_project: Callable[[str], Set[str]],
+        run_stage: Callable[[str, Stage], None],
+        on_project_done: Callable[[str], None],
+        on_project_failed: Callable[[str, Exception], None],
+        is_running: Callable[[], bool],
+        has_pending: Optional[Callable[[], bool]] = None,
+        priority_of: Optional[Callable[[str], int]] = None,
+    ):
+        """
+        Главный цикл. Возвращается, когда очередь пуста (или остановлена)
+        и все запущенные этапы завершились.
+
+        Args:
+            next_project: Следующий проект для запуска (аргумент — уже активные)
+            prepare_project: Возвращает множество уже выполненных этапов
+            run_stage: Выполняет этап проекта (исключение = ошибка проекта)
+            on_project_done / on_project_failed: Вызываются из цикла планировщика
+            is_running: False — не запускать новое, дождаться текущего
+            has_pending: True — в очереди есть проекты, которые станут
+                доступны позже (повтор по таймеру): не выходить, ждать notify()
+            priority_of: Приоритет проекта при раздаче слотов ресурсов
+        """
+        try:
+            while True:
+                finished: List[ProjectRun] = []
+
+                with self._cond:
+                    # Завершённые и упавшие проекты (ждём их текущие этапы)
+                    for pid, run in list(self._runs.items()):
+                        if run.running:
+                            continue
+                        if run.error is not None or len(run.done) == len(self.stages):
+                            finished.append(self._runs.pop(pid))
+
+                # Колбэки вне блокировки — они трогают очередь и сохраняют проекты
+                for run in finished:
+                    if run.error is not None:
+                        on_project_failed(run.project_id, run.error)
+                    else:
+                        on_project_done(run.project_id)
+
+                running = is_running()
+
+                # Берём новые проекты в работу
+                while running and len(self._runs) < self.max_active_projects:
+                    pid = next_project(set(self._runs))
+                    if pid is None:
+                        break
+                    try:
+                        done = set(prepare_project(pid)) & set(self.stages)
+                    except Exception as e:
+                        on_project_failed(pid, e)
+                        continue
+                    priority = priority_of(pid) if priority_of else 0
+                    with self._cond:
+                        self._runs[pid] = ProjectRun(project_id=pid, done=done, priority=priority)
+
+                with self._cond:
+                    idle = not self._runs
+                if idle:
+                    # has_pending() берёт блокировку состояния проектов, а та
+                    # сама обращается к планировщику — вызывать вне self._cond.
+                    # Проекты в _runs добавляет только этот поток: пока мы
+                    # здесь, idle не изменится, а notify() не потеряется (_wakeup)
+                    if running and has_pending and has_pending():
+                        with self._cond:
+                            self._sleep()
+                        continue
+                    return
+
+                with self._cond:
+                    if running:
+                        self._dispatch(run_stage)
+
+                    if not any(r.running for r in self._runs.values()) and not running:
+                        # Остановлено: бросаем незапущенные этапы
+                        self._runs.clear()
+                        return
+
+                    self._sleep()
+        finally:
+            for pool in self._pools.values():
+                pool.shutdown(wait=False)
+
+    def _dispatch(self, run_stage: Callable[[str, Stage], None]):
+        """Запуск готовых этапов в свободные слоты (под блокировкой)"""
+        for run in sorted(self._runs.values(), key=lambda r: (-r.priority, r.admitted_at)):
+            if run.error is not None:
+                continue
+            for stage in self._ready_stages(run):
+                if self._in_use[stage.resource] >= self.limits[stage.resource]:
+                    continue
+                self._in_use[stage.resource] += 1
+                run.running.add(stage.name)
+                self._pools[stage.resource].submit(
+                    self._execute, run, stage, run_stage
+                )
+
+    def _execute(self, run: ProjectRun, stage: Stage, run_stage: Callable[[str, Stage], None]):
+        error = None
+        try:
+            run_stage(run.project_id, stage)
+        except Exception as e:
+            error = e
+
+        with self._cond:
+            self._in_use[stage.resource] -= 1
+            run.running.discard(stage.name)
+            if error is None:
+                run.done.add(stage.name)
+            elif run.error is None:
+                run.error = error
+            self._wakeup = True
+            self._cond.notify_all()
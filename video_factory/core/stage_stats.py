@@ -0,0 +1,127 @@
+"""
+Статистика длительности этапов — для оценки времени готовности
+
+Для каждого этапа DAG хранится скользящее среднее (EWMA) длительности
+успешных запусков: output/stage_stats.json. При первом запуске история
+берётся из output/pipeline.jsonl (записи о завершении этапа с
+event=STAGE_DONE_EVENT), а если нет и его — из грубых значений по умолчанию.
+
+Оценки:
+- critical_path() — сколько идёт один проект от начала до конца, если
+  ресурсы свободны (самый длинный путь по зависимостям);
+- interval() — как часто очередь выпускает готовый проект: самый
+  загруженный пул ресурса (сумма этапов на ресурсе / лимит пула) или
+  число одновременных проектов, если узкое место — они.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable
+
+# Грубые значения до появления истории, сек
+DEFAULT_DURATIONS = {
+    "analyze": 30,
+    "script": 180,
+    "prompts": 60,
+    "images": 1500,
+    "voice": 600,
+    "assemble": 300,
+    "seo": 30,
+    "thumbnails": 300,
+    "render": 1800,
+}
+
+# Событие журнала «этап завершён»: в pipeline.jsonl есть и записи по
+# отдельным картинкам/озвучке с тем же stage и своим duration_ms
+STAGE_DONE_EVENT = "stage_done"
+
+
+class StageStats:
+    """Средняя длительность этапов (EWMA) с сохранением на диск"""
+
+    FILENAME = "stage_stats.json"
+
+    def __init__(self, output_dir: Path, alpha: float = 0.3):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / self.FILENAME
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._means: Dict[str, float] = {}
+        self._counts: Dict[str, int] = {}
+
+        data = None
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = None
+        if data:
+            self._means = {k: float(v) for k, v in data.get("means", {}).items()}
+            self._counts = {k: int(v) for k, v in data.get("counts", {}).items()}
+        else:
+            self._bootstrap(self.output_dir / "pipeline.jsonl")
+
+    def _bootstrap(self, log_path: Path):
+        """История из журнала: только записи о завершении этапа целиком"""
+        if not log_path.exists():
+            return
+        try:
+            with open(log_path, encoding="utf-8") as f:
+                for line in f:
+                    if STAGE_DONE_EVENT not in line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (entry.get("event") == STAGE_DONE_EVENT and entry.get("stage")
+                            and entry.get("duration_ms") is not None):
+                        self._add(entry["stage"], entry["duration_ms"] / 1000)
+        except OSError:
+            pass
+
+    def _add(self, stage: str, seconds: float):
+        if stage in self._means:
+            self._means[stage] += self.alpha * (seconds - self._means[stage])
+        else:
+            self._means[stage] = seconds
+        self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def record(self, stage: str, seconds: float):
+        """Учесть успешный запуск этапа"""
+        with self._lock:
+            self._add(stage, seconds)
+            data = {"means": self._means, "counts": self._counts}
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(json.dumps(data, indent=2))
+            os.replace(tmp_path, self.path)
+
+    def mean(self, stage: str) -> float:
+        with self._lock:
+            value = self._means.get(stage)
+        return value if value is not None else DEFAULT_DURATIONS.get(stage, 60)
+
+    def critical_path(self, stages: Iterable, done: Iterable[str] = ()) -> float:
+        """Длительность самого длинного пути по невыполненным этапам, сек"""
+        done = set(done)
+        finish: Dict[str, float] = {}
+        for stage in stages:  # Порядок PIPELINE_STAGES — топологический
+            start = max((finish[d] for d in stage.deps if d in finish), default=0.0)
+            finish[stage.name] = start + (0.0 if stage.name in done else self.mean(stage.name))
+        return max(finish.values(), default=0.0)
+
+    def interval(self, stages: Iterable, limits: Dict[str, int],
+                 max_active: int = 1) -> float:
+        """Через сколько секунд очередь выдаёт следующий проект (узкое место)"""
+        stages = list(stages)
+        load: Dict[str, float] = {}
+        for stage in stages:
+            load[stage.resource] = load.get(stage.resource, 0.0) + self.mean(stage.name)
+        per_resource = max(
+            (seconds / max(1, limits.get(resource, 1)) for resource, seconds in load.items()),
+            default=0.0,
+        )
+        return max(per_resource, self.critical_path(stages) / max(1, max_active))
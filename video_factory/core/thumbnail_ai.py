@@ -19,11 +19,17 @@ Clipdrop и Segmind — лучшее качество с ежедневным о
 import requests
 import time
 import base64
+import itertools
 from pathlib import Path
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass
 import json
 
+from .image_service import (
+    ImageProvider, ImageRequest, ImageResponse, ProviderError, QuotaExceeded,
+    download, raise_for_status,
+)
+
 
 @dataclass
 class ThumbnailResult:
@@ -788,6 +794,110 @@ class ThumbnailAI:
         }
 
 
+# === ПРОВАЙДЕРЫ ImageService (REST: отправка → опрос/ответ → скачивание) ===
+
+class _KeyedRestProvider(ImageProvider):
+    """Общее для REST-провайдеров с несколькими ключами"""
+    
+    def __init__(self, api_keys: List[str]):
+        self.api_keys = [k for k in (api_keys or []) if k]
+        self.max_concurrency = 2 * max(1, len(self.api_keys))
+        self._next_key = itertools.count()
+    
+    def available(self) -> bool:
+        return bool(self.api_keys)
+    
+    def _key(self) -> tuple:
+        index = next(self._next_key) % len(self.api_keys)
+        return index, self.api_keys[index]
+
+
+class ReplicateProvider(_KeyedRestProvider):
+    """Replicate (Flux schnell): предсказание, затем опрос статуса"""
+    
+    name = "replicate"
+    typical_latency = 15.0
+    VERSION = "39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"  # Flux schnell
+    
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        import asyncio
+        
+        start_time = time.time()
+        key_index, api_key = self._key()
+        headers = {"Authorization": f"Token {api_key}", "Prefer": "wait"}
+        response = await http.post(
+            "https://api.replicate.com/v1/predictions",
+            headers=headers,
+            json={
+                "version": self.VERSION,
+                "input": {
+                    "prompt": request.prompt,
+                    "width": request.width,
+                    "height": request.height,
+                    "num_outputs": 1,
+                    "num_inference_steps": 4,
+                    "go_fast": True,
+                    **({"seed": request.seed} if request.seed else {}),
+                },
+            },
+            timeout=90,
+        )
+        if response.status_code in (401, 403):
+            raise QuotaExceeded(f"Replicate: ключ #{key_index + 1} не работает")
+        raise_for_status(response, self.name)
+        prediction = response.json()
+        
+        deadline = time.time() + 120
+        while prediction.get("status") not in ("succeeded", "failed", "canceled"):
+            if time.time() > deadline:
+                raise ProviderError("Replicate: таймаут генерации")
+            await asyncio.sleep(2)
+            status = await http.get(prediction["urls"]["get"], headers=headers, timeout=30)
+            raise_for_status(status, self.name)
+            prediction = status.json()
+        
+        if prediction["status"] != "succeeded" or not prediction.get("output"):
+            raise ProviderError(f"Replicate: {prediction.get('error') or prediction['status']}")
+        path = await download(http, prediction["output"][0], request.path(".png"), timeout=60)
+        return ImageResponse(success=True, path=path, seed=request.seed or 0,
+                             generation_time=time.time() - start_time,
+                             provider=self.name, token_index=key_index)
+
+
+class FalProvider(_KeyedRestProvider):
+    """FAL AI (Flux schnell): синхронный ответ со ссылкой на картинку"""
+    
+    name = "fal"
+    typical_latency = 10.0
+    
+    async def generate(self, request: ImageRequest, http) -> ImageResponse:
+        start_time = time.time()
+        key_index, api_key = self._key()
+        response = await http.post(
+            "https://fal.run/fal-ai/flux/schnell",
+            headers={"Authorization": f"Key {api_key}"},
+            json={
+                "prompt": request.prompt,
+                "image_size": {"width": request.width, "height": request.height},
+                "num_inference_steps": 4,
+                "num_images": 1,
+                "enable_safety_checker": False,
+                **({"seed": request.seed} if request.seed else {}),
+            },
+            timeout=120,
+        )
+        if response.status_code in (401, 403):
+            raise QuotaExceeded(f"FAL: ключ #{key_index + 1} не работает")
+        raise_for_status(response, self.name)
+        images = response.json().get("images") or []
+        if not images or not images[0].get("url"):
+            raise ProviderError("FAL: нет изображения в ответе")
+        path = await download(http, images[0]["url"], request.path(".png"), timeout=60)
+        return ImageResponse(success=True, path=path, seed=request.seed or 0,
+                             generation_time=time.time() - start_time,
+                             provider=self.name, token_index=key_index)
+
+
 # === ГЛОБАЛЬНЫЙ ЭКЗЕМПЛЯР ===
 
 _thumbnail_ai: Optional[ThumbnailAI] = None
@@ -0,0 +1,665 @@
+"""
+Планировщик токенов Hugging Face для FLUX — с прогнозом квоты
+
+ZeroGPU даёт каждому аккаунту бюджет GPU-секунд, который восстанавливается
+со временем. Раньше токены перебирались по кругу, при занятости — опрос
+раз в 5 секунд, а после ошибки квоты — фиксированный cooldown 1.5 часа.
+Теперь для каждого токена ведётся модель «ведра»:
+
+- стоимость запроса — GPU-секунды, скользящее среднее по разрешению и
+  числу шагов (для новых размеров — пересчёт через сек/(Мпикс·шаг));
+- остаток квоты и скорость восстановления берутся из ошибки ZeroGPU
+  ("60s requested vs. 12s left ... Try again in 0:13:46"), ёмкость — из
+  того, сколько токен успел потратить до ошибки;
+- токен выбирается с наибольшим прогнозным остатком: полное ведро теряет
+  восстановление впустую, поэтому расходуем сначала его — это даёт
+  максимум изображений в час на весь набор токенов;
+- ожидающие потоки спят на Condition и просыпаются сразу, как только
+  токен освобождён или наступил прогнозный момент восстановления.
+
+Планировщик один на файл состояния (get_token_scheduler), поэтому
+этапы изображений и превью разных проектов делят одни токены.
+
+Симулятор — прогон журнала output/pipeline.jsonl на разном числе токенов:
+
+    python -m core.token_scheduler simulate --tokens 1,2,4,8,16
+    python -m core.token_scheduler status
+"""
+
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+INF = float("inf")
+
+# Cooldown, если ошибка квоты не сказала, когда повторять (как было раньше)
+DEFAULT_COOLDOWN = 5400
+RATE_LIMIT_COOLDOWN = 60
+# acquire_async: как часто корутина проверяет токены (release() её не будит)
+ASYNC_POLL = 1.0
+ASYNC_POLL_MAX = 30.0
+
+# Запас к прогнозной стоимости: запросы разные по длительности, лишняя ошибка квоты дороже ожидания
+COST_MARGIN = 1.2
+
+# GPU-секунды на (мегапиксель · шаг) до первых замеров: FLUX.1-dev 1280x720, 28 шагов ≈ 25 с
+DEFAULT_UNIT_COST = 1.0
+
+_REQUESTED_LEFT = re.compile(r"([\d.]+)\s*s\s+requested\s+vs\.?\s+([\d.]+)\s*s\s+left", re.I)
+_TRY_AGAIN = re.compile(r"try again in\s+(?:(\d+):)?(\d+):(\d{2})", re.I)
+
+
+def parse_quota_error(message: str) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """
+    Разбор ошибки квоты ZeroGPU
+
+    Returns:
+        (запрошено GPU-сек, осталось GPU-сек, через сколько секунд повторять)
+        — None там, где в сообщении нет данных
+    """
+    requested = left = retry_in = None
+    match = _REQUESTED_LEFT.search(message or "")
+    if match:
+        requested, left = float(match.group(1)), float(match.group(2))
+    match = _TRY_AGAIN.search(message or "")
+    if match:
+        hours, minutes, seconds = (int(g or 0) for g in match.groups())
+        retry_in = float(hours * 3600 + minutes * 60 + seconds)
+    return requested, left, retry_in
+
+
+def _token_id(token: str) -> str:
+    """Ключ токена в файле состояния (сам токен на диск не пишем)"""
+    return hashlib.sha256(token.encode()).hexdigest()[:12]
+
+
+def _short(token: Optional[str]) -> str:
+    return f"...{token[-8:]}" if token else "none"
+
+
+@dataclass
+class TokenState:
+    """Прогноз квоты одного токена"""
+    blocked_until: float = 0.0       # Ошибка квоты/лимита — не раньше этого времени
+    level: Optional[float] = None    # Остаток GPU-сек на level_ts (None — неизвестно, считаем полным)
+    level_ts: float = 0.0
+    capacity: Optional[float] = None  # Ёмкость ведра, GPU-сек
+    rate: Optional[float] = None      # Восстановление, GPU-сек в секунду
+    spent: float = 0.0               # Потрачено с момента «ведро полное»
+    from_full: bool = False          # spent считается от полного ведра — по нему учим ёмкость
+    requests: int = 0
+    quota_errors: int = 0
+    last_used: float = 0.0
+
+    def headroom(self, now: float) -> float:
+        """Прогнозный остаток квоты на момент now"""
+        if self.level is None:
+            return INF
+        if self.rate:
+            level = self.level + self.rate * (now - self.level_ts)
+        else:
+            # Скорость неизвестна — как раньше: после cooldown квота полная
+            level = INF if now >= self.blocked_until else self.level
+        return min(level, self.capacity or INF)
+
+    def ready_in(self, now: float, cost: float) -> Optional[float]:
+        """Через сколько секунд токен потянет запрос (None — неизвестно)"""
+        wait = max(0.0, self.blocked_until - now)
+        if self.capacity:
+            cost = min(cost, self.capacity)  # Больше ёмкости ведро не накопит
+        shortage = cost - self.headroom(now + wait)
+        if shortage > 1e-6:
+            if not self.rate:
+                return None
+            wait += shortage / self.rate
+        return wait
+
+    def consume(self, cost: float, now: float):
+        level = self.headroom(now)
+        if (self.level is None and not self.from_full) or (self.capacity and level >= self.capacity):
+            self.spent, self.from_full = 0.0, True
+        self.spent += cost
+        self.level = None if level == INF else max(0.0, level - cost)
+        self.level_ts = now
+
+
+class TokenScheduler:
+    """
+    Выдача токенов HF под прогноз квоты
+
+    acquire() блокирует, пока не найдётся токен (проект не падает из-за
+    квот), release() возвращает токен и учитывает потраченные GPU-секунды,
+    report_quota_exceeded()/report_rate_limited() — ошибки API.
+    """
+
+    EWMA_ALPHA = 0.3
+    SAVE_INTERVAL = 30.0
+
+    def __init__(
+        self,
+        tokens: List[str],
+        state_path: Optional[Path] = None,
+        clock: Callable[[], float] = time.time,
+        log: Callable[[str], None] = print,
+    ):
+        self.tokens: List[str] = list(dict.fromkeys(tokens))
+        self.state_path = Path(state_path) if state_path else None
+        self._clock = clock
+        self._log = log
+        self._cond = threading.Condition()
+        self._states: Dict[str, TokenState] = {t: TokenState() for t in self.tokens}
+        self._holders: Dict[str, int] = {t: 0 for t in self.tokens}
+        self._costs: Dict[str, float] = {}          # "WxH@steps" -> GPU-сек
+        self._unit_cost = DEFAULT_UNIT_COST
+        self._saved_at = 0.0
+        self._load()
+
+    # === Стоимость запроса ===
+
+    @staticmethod
+    def _cost_key(width: int, height: int, steps: int) -> str:
+        return f"{width}x{height}@{steps}"
+
+    def cost(self, width: int = 1280, height: int = 720, steps: int = 28) -> float:
+        """Ожидаемые GPU-секунды на один запрос"""
+        with self._cond:
+            known = self._costs.get(self._cost_key(width, height, steps))
+            if known is not None:
+                return known
+            return self._unit_cost * width * height / 1e6 * steps
+
+    def _learn_cost(self, width: int, height: int, steps: int, seconds: float):
+        key = self._cost_key(width, height, steps)
+        old = self._costs.get(key)
+        self._costs[key] = seconds if old is None else old + self.EWMA_ALPHA * (seconds - old)
+        unit = seconds / max(width * height / 1e6 * steps, 1e-6)
+        self._unit_cost += self.EWMA_ALPHA * (unit - self._unit_cost)
+
+    # === Выбор токена ===
+
+    def _pick(self, now: float, cost: float, exclusive: bool) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Лучший токен сейчас или время ожидания
+
+        Returns:
+            (токен, None) или (None, секунд до прогнозной готовности;
+            None — ждать release())
+        """
+        best, best_key = None, None
+        waits = []
+        for token in self.tokens:
+            state = self._states[token]
+            holders = self._holders[token]
+            ready_in = state.ready_in(now, cost)
+            if ready_in is not None and ready_in > 0:
+                waits.append(ready_in)
+                continue
+            if state.blocked_until > now:
+                continue
+            if exclusive and holders:
+                continue
+            # Больше остаток → меньше простоев ведра; при равенстве — давно не использованный
+            key = (min(state.headroom(now), 1e12), -holders, -state.last_used)
+            if best_key is None or key > best_key:
+                best, best_key = token, key
+        if best is not None:
+            return best, None
+        return None, min(waits, default=None)
+
+    def try_acquire(self, width: int = 1280, height: int = 720, steps: int = 28,
+                    exclusive: bool = True, now: float = None) -> Tuple[Optional[str], Optional[float]]:
+        """Неблокирующая попытка: (токен, None) или (None, сколько ждать)"""
+        cost = self.cost(width, height, steps) * COST_MARGIN
+        with self._cond:
+            now = self._clock() if now is None else now
+            token, wait = self._pick(now, cost, exclusive)
+            if token is not None:
+                self._holders[token] += 1
+                self._states[token].last_used = now
+            return token, wait
+
+    def predicted_wait(self, width: int = 1280, height: int = 720, steps: int = 28) -> float:
+        """Через сколько секунд у какого-то токена хватит квоты (0 — уже сейчас)"""
+        if not self.tokens:
+            return 0.0
+        cost = self.cost(width, height, steps) * COST_MARGIN
+        with self._cond:
+            token, wait = self._pick(self._clock(), cost, exclusive=False)
+        if token is not None:
+            return 0.0
+        return wait if wait is not None else DEFAULT_COOLDOWN
+
+    def acquire(self, width: int = 1280, height: int = 720, steps: int = 28,
+                exclusive: bool = True, timeout: float = None) -> Optional[str]:
+        """
+        Взять токен под запрос. Никогда не падает из-за квот: если все
+        токены исчерпаны — ждёт прогнозного восстановления.
+
+        Args:
+            exclusive: не выдавать токен, который уже держит другой поток
+            timeout: ждать не дольше (сек), иначе TimeoutError — для
+                переключения на другой провайдер вместо ожидания квоты
+        Returns:
+            Токен или None, если токенов нет вовсе (работа без токена)
+        """
+        if not self.tokens:
+            return None
+        announced = 0.0
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            while True:
+                token, wait = self.try_acquire(width, height, steps, exclusive)
+                if token is not None:
+                    return token
+                if deadline is not None:
+                    left = deadline - self._clock()
+                    if left <= 0:
+                        raise TimeoutError(f"Нет токена с квотой (прогноз: {int(wait or 0)} сек)")
+                    wait = min(wait, left) if wait else left
+                elif wait and wait > 60 and self._clock() - announced > 600:
+                    announced = self._clock()
+                    available = sum(1 for s in self._states.values() if s.blocked_until <= announced)
+                    self._log(f"[FLUX] ⏳ Все {len(self.tokens)} токенов исчерпаны ({available} без cooldown)")
+                    self._log(f"[FLUX] 💤 Прогноз восстановления квоты: {int(wait / 60)} мин")
+                # Будит release()/ошибка другого потока; таймаут — прогноз восстановления
+                self._cond.wait(timeout=min(wait, 600) if wait else 600)
+
+    async def acquire_async(self, width: int = 1280, height: int = 720, steps: int = 28,
+                            exclusive: bool = True, timeout: float = None) -> Optional[str]:
+        """
+        То же, что acquire(), но ожидание — asyncio.sleep, а не поток,
+        заснувший на условии: сотня запросов в очереди за квотой не держит
+        сотню потоков пула
+        """
+        import asyncio
+
+        if not self.tokens:
+            return None
+        announced = 0.0
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            token, wait = self.try_acquire(width, height, steps, exclusive)
+            if token is not None:
+                return token
+            if deadline is not None:
+                left = deadline - self._clock()
+                if left <= 0:
+                    raise TimeoutError(f"Нет токена с квотой (прогноз: {int(wait or 0)} сек)")
+                wait = min(wait, left) if wait else left
+            elif wait and wait > 60 and self._clock() - announced > 600:
+                announced = self._clock()
+                self._log(f"[FLUX] ⏳ Все {len(self.tokens)} токенов исчерпаны, "
+                          f"прогноз восстановления квоты: {int(wait / 60)} мин")
+            # wait=None — токены заняты другими запросами: проверяем чаще
+            await asyncio.sleep(min(wait, ASYNC_POLL_MAX) if wait else ASYNC_POLL)
+
+    def release(self, token: Optional[str], gpu_seconds: float = None,
+                width: int = 1280, height: int = 720, steps: int = 28):
+        """
+        Вернуть токен
+
+        Args:
+            gpu_seconds: длительность успешного запроса — учитывается в квоте
+                токена и в модели стоимости
+        """
+        if not token or token not in self._states:
+            return
+        with self._cond:
+            now = self._clock()
+            self._holders[token] = max(0, self._holders[token] - 1)
+            if gpu_seconds is not None:
+                state = self._states[token]
+                state.consume(gpu_seconds, now)
+                state.requests += 1
+                self._learn_cost(width, height, steps, gpu_seconds)
+            self._cond.notify_all()
+            self._save(now)
+
+    def report_quota_exceeded(self, token: Optional[str], message: str = "",
+                              cost: float = None) -> float:
+        """
+        Ошибка квоты GPU: обновить прогноз токена
+
+        Returns:
+            Через сколько секунд токен снова будет доступен
+        """
+        if not token or token not in self._states:
+            return 0.0
+        requested, left, retry_in = parse_quota_error(message)
+        with self._cond:
+            now = self._clock()
+            state = self._states[token]
+            left = left if left is not None else 0.0
+            need = requested if requested is not None else (cost or self._unit_cost * 0.92 * 28)
+
+            if retry_in:
+                observed = max(need - left, 0.0) / retry_in
+                if observed > 0:
+                    state.rate = observed if not state.rate else state.rate + self.EWMA_ALPHA * (observed - state.rate)
+            if state.from_full and state.spent > 0:
+                observed = state.spent + left
+                state.capacity = observed if not state.capacity else state.capacity + self.EWMA_ALPHA * (observed - state.capacity)
+
+            if retry_in:
+                wait = retry_in
+            elif state.rate:
+                wait = max(need - left, 0.0) / state.rate
+            else:
+                wait = DEFAULT_COOLDOWN
+            state.level, state.level_ts = left, now
+            state.spent, state.from_full = 0.0, False
+            state.blocked_until = now + wait
+            state.quota_errors += 1
+
+            available = sum(1 for s in self._states.values() if s.blocked_until <= now)
+            self._log(f"[FLUX] Токен {_short(token)} без квоты ещё {wait / 60:.0f} мин")
+            self._log(f"[FLUX] Доступно: {available}/{len(self.tokens)} токенов")
+            self._cond.notify_all()
+            self._save(now, force=True)
+            return wait
+
+    def report_rate_limited(self, token: Optional[str], seconds: float = RATE_LIMIT_COOLDOWN):
+        """Rate limit — короткая пауза, квота не тронута"""
+        if not token or token not in self._states:
+            return
+        with self._cond:
+            now = self._clock()
+            state = self._states[token]
+            state.blocked_until = max(state.blocked_until, now + seconds)
+            self._cond.notify_all()
+            self._save(now, force=True)
+
+    def clear(self):
+        """Забыть все блокировки и прогнозы остатка (ёмкость и скорость остаются)"""
+        with self._cond:
+            for state in self._states.values():
+                state.blocked_until = 0.0
+                state.level = None
+                state.spent = 0.0
+            self._cond.notify_all()
+            self._save(self._clock(), force=True)
+
+    # === Состояние ===
+
+    def status(self, width: int = 1280, height: int = 720, steps: int = 28) -> dict:
+        """Прогноз по токенам: свободен/занят/ждёт и когда восстановится"""
+        cost = self.cost(width, height, steps)
+        with self._cond:
+            now = self._clock()
+            tokens = []
+            for token in self.tokens:
+                state = self._states[token]
+                ready_in = state.ready_in(now, cost)
+                headroom = state.headroom(now)
+                tokens.append({
+                    "token": _short(token),
+                    "in_use": self._holders[token],
+                    "ready_in": ready_in,
+                    "headroom": None if headroom == INF else round(headroom, 1),
+                    "capacity": round(state.capacity, 1) if state.capacity else None,
+                    "rate_per_hour": round(state.rate * 3600, 1) if state.rate else None,
+                    "requests": state.requests,
+                    "quota_errors": state.quota_errors,
+                })
+            return {"cost": round(cost, 1), "tokens": tokens}
+
+    def _load(self):
+        if not self.state_path or not self.state_path.exists():
+            return
+        try:
+            data = json.loads(self.state_path.read_text())
+        except (OSError, ValueError) as e:
+            self._log(f"[FLUX] Не удалось загрузить состояние токенов: {e}")
+            return
+        known = {f.name for f in fields(TokenState)}
+        saved = data.get("tokens", {})
+        for token in self.tokens:
+            values = saved.get(_token_id(token))
+            if values:
+                self._states[token] = TokenState(**{k: v for k, v in values.items() if k in known})
+        # Старый формат hf_cooldowns.json: токен -> время окончания cooldown
+        for token, until in data.get("cooldowns", {}).items():
+            if token in self._states:
+                state = self._states[token]
+                state.blocked_until = max(state.blocked_until, float(until))
+        self._costs = {k: float(v) for k, v in data.get("costs", {}).items()}
+        self._unit_cost = float(data.get("unit_cost", self._unit_cost))
+
+        now = self._clock()
+        blocked = sum(1 for s in self._states.values() if s.blocked_until > now)
+        if blocked:
+            self._log(f"[FLUX] Загружены cooldowns: {len(self.tokens) - blocked}/{len(self.tokens)} токенов доступно")
+
+    def _save(self, now: float, force: bool = False):
+        """Запись состояния (вызывается под self._cond)"""
+        if not self.state_path or (not force and now - self._saved_at < self.SAVE_INTERVAL):
+            return
+        self._saved_at = now
+        data = {}
+        if self.state_path.exists():
+            try:
+                data = json.loads(self.state_path.read_text())
+            except (OSError, ValueError):
+                data = {}
+        data.pop("cooldowns", None)
+        tokens = data.setdefault("tokens", {})
+        for token, state in self._states.items():
+            tokens[_token_id(token)] = asdict(state)
+        data["costs"] = self._costs
+        data["unit_cost"] = self._unit_cost
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(data, indent=2))
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            self._log(f"[FLUX] Не удалось сохранить состояние токенов: {e}")
+
+    def learned_quota(self) -> Tuple[Optional[float], Optional[float]]:
+        """Медианные (ёмкость, скорость восстановления) по токенам с замерами"""
+        with self._cond:
+            capacities = sorted(s.capacity for s in self._states.values() if s.capacity)
+            rates = sorted(s.rate for s in self._states.values() if s.rate)
+        median = lambda values: values[len(values) // 2] if values else None
+        return median(capacities), median(rates)
+
+
+# === Общий планировщик на процесс ===
+
+_schedulers: Dict[Tuple[str, Tuple[str, ...]], TokenScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def default_state_path() -> Path:
+    try:
+        from config import OUTPUT_DIR
+    except ImportError:
+        OUTPUT_DIR = Path("output")
+    return Path(OUTPUT_DIR) / "hf_cooldowns.json"
+
+
+def get_token_scheduler(tokens: List[str], state_path: Path = None) -> TokenScheduler:
+    """Один планировщик на набор токенов и файл состояния"""
+    state_path = Path(state_path or default_state_path())
+    key = (str(state_path.resolve()), tuple(dict.fromkeys(tokens)))
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = TokenScheduler(list(tokens), state_path)
+        return scheduler
+
+
+# === Симулятор ===
+
+def load_flux_trace(log_path: Path) -> Tuple[List[float], dict]:
+    """
+    Длительности успешных запросов FLUX из pipeline.jsonl (по порядку)
+
+    Returns:
+        (GPU-секунды запросов, сводка журнала: images, tokens, per_hour)
+    """
+    costs, stamps, keys = [], [], set()
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            if '"flux"' not in line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("api") != "flux" or not entry.get("duration_ms"):
+                continue
+            if "✅" not in entry.get("msg", ""):
+                continue
+            costs.append(entry["duration_ms"] / 1000)
+            if entry.get("key_index", -1) >= 0:
+                keys.add(entry["key_index"])
+            try:
+                stamps.append(time.mktime(time.strptime(entry["ts"][:19], "%Y-%m-%dT%H:%M:%S")))
+            except (KeyError, ValueError):
+                pass
+    summary = {"images": len(costs), "tokens": len(keys), "per_hour": None}
+    if len(stamps) > 1 and max(stamps) > min(stamps):
+        summary["per_hour"] = len(stamps) / ((max(stamps) - min(stamps)) / 3600)
+    return costs, summary
+
+
+def simulate(costs: List[float], n_tokens: int, workers: int, hours: float,
+             capacity: float, refill_seconds: float, error_latency: float = 2.0) -> dict:
+    """
+    Прогон очереди запросов через TokenScheduler в виртуальном времени
+
+    У каждого токена настоящее ведро (capacity GPU-сек, полное
+    восстановление за refill_seconds), о котором планировщик узнаёт
+    только из ошибок квоты — как в работе с настоящим API.
+    """
+    now = 0.0
+    end = hours * 3600
+    rate = capacity / refill_seconds
+    tokens = [f"hf_sim{i:04d}" for i in range(n_tokens)]
+    scheduler = TokenScheduler(tokens, clock=lambda: now, log=lambda message: None)
+    buckets = {t: [capacity, 0.0] for t in tokens}  # (уровень, время)
+
+    trace = itertools.cycle(costs)
+    seq = itertools.count()
+    running: list = []  # (конец, seq, токен, стоимость, успех, остаток)
+    idle = workers
+    done = errors = 0
+    cost = next(trace)
+
+    while now < end:
+        wait = None
+        while idle and now < end:
+            token, wait = scheduler.try_acquire(exclusive=True, now=now)
+            if token is None:
+                break
+            level, ts = buckets[token]
+            level = min(capacity, level + rate * (now - ts))
+            idle -= 1
+            if level >= cost:
+                buckets[token] = [level - cost, now]
+                heapq.heappush(running, (now + cost, next(seq), token, cost, True, 0.0))
+            else:
+                buckets[token] = [level, now]
+                heapq.heappush(running, (now + error_latency, next(seq), token, cost, False, level))
+            cost = next(trace)
+
+        next_finish = running[0][0] if running else INF
+        next_ready = now + wait if (idle and wait) else INF
+        now = min(next_finish, next_ready, end)
+        if now == INF:
+            break
+        while running and running[0][0] <= now:
+            _, _, token, spent, ok, left = heapq.heappop(running)
+            idle += 1
+            if ok:
+                done += 1
+                scheduler.release(token, gpu_seconds=spent)
+            else:
+                errors += 1
+                retry = int((spent - left) / rate)
+                scheduler.report_quota_exceeded(
+                    token,
+                    f"You have exceeded your GPU quota ({spent:.0f}s requested vs. {left:.0f}s left). "
+                    f"Try again in {retry // 3600}:{retry % 3600 // 60:02d}:{retry % 60:02d}",
+                )
+                scheduler.release(token)
+
+    return {
+        "tokens": n_tokens,
+        "workers": workers,
+        "images_per_hour": done / hours,
+        "quota_errors_per_hour": errors / hours,
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Планировщик токенов HF (FLUX)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sim = sub.add_parser("simulate", help="Изображений в час в зависимости от числа токенов")
+    sim.add_argument("--log", default=None, help="pipeline.jsonl (по умолчанию output/pipeline.jsonl)")
+    sim.add_argument("--tokens", default="1,2,4,8,16", help="Числа токенов через запятую")
+    sim.add_argument("--workers", type=int, default=8, help="Параллельных запросов (как generate_parallel)")
+    sim.add_argument("--hours", type=float, default=24.0)
+    sim.add_argument("--capacity", type=float, default=None, help="Квота токена, GPU-сек")
+    sim.add_argument("--refill", type=float, default=None, help="Полное восстановление квоты, сек")
+
+    sub.add_parser("status", help="Прогноз квоты по токенам из конфига")
+
+    args = parser.parse_args(argv)
+    state_path = default_state_path()
+
+    if args.command == "status":
+        from config import config
+        tokens = [t for t in getattr(config.api, "huggingface_tokens", []) if t and t.startswith("hf_")]
+        status = TokenScheduler(tokens, state_path).status()
+        print(f"Стоимость запроса 1280x720@28: {status['cost']} GPU-сек")
+        for info in status["tokens"]:
+            ready = "сейчас" if info["ready_in"] == 0 else (
+                "?" if info["ready_in"] is None else f"через {info['ready_in'] / 60:.0f} мин")
+            print(f"{info['token']}: {ready:14} остаток={info['headroom'] or '?'} "
+                  f"ёмкость={info['capacity'] or '?'} восст/ч={info['rate_per_hour'] or '?'} "
+                  f"запросов={info['requests']} ошибок квоты={info['quota_errors']}")
+        return
+
+    log_path = Path(args.log) if args.log else state_path.parent / "pipeline.jsonl"
+    costs, summary = load_flux_trace(log_path) if log_path.exists() else ([], {"images": 0})
+    if not costs:
+        print(f"В {log_path} нет успешных запросов FLUX — беру 25 с на запрос")
+        costs = [25.0]
+    else:
+        line = f"Журнал: {summary['images']} изображений, {summary['tokens']} токенов"
+        if summary.get("per_hour"):
+            line += f", {summary['per_hour']:.0f} изобр/ч за время работы"
+        print(line)
+
+    # Квота — из выученного состояния, иначе из аргументов/умолчаний
+    learned_capacity = learned_rate = None
+    if state_path.exists():
+        from config import config
+        tokens = [t for t in getattr(config.api, "huggingface_tokens", []) if t and t.startswith("hf_")]
+        learned_capacity, learned_rate = TokenScheduler(tokens, state_path, log=lambda m: None).learned_quota()
+    capacity = args.capacity or learned_capacity or 300.0
+    refill = args.refill or (capacity / learned_rate if learned_rate else DEFAULT_COOLDOWN)
+    print(f"Квота токена: {capacity:.0f} GPU-сек, восстановление за {refill / 60:.0f} мин, "
+          f"средний запрос {sum(costs) / len(costs):.1f} с")
+
+    print(f"{'токенов':>8} {'потоков':>8} {'изобр/ч':>9} {'ошибок квоты/ч':>15}")
+    for n in (int(x) for x in args.tokens.split(",") if x.strip()):
+        workers = min(args.workers, n)
+        result = simulate(costs, n, workers, args.hours, capacity, refill)
+        print(f"{n:>8} {workers:>8} {result['images_per_hour']:>9.1f} {result['quota_errors_per_hour']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@
 
 import os
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict, Any
+from typing import Callable, List, Optional, Tuple, Dict, Any
 from dataclasses import dataclass
 import random
 import numpy as np
@@ -17,6 +17,26 @@ from moviepy import (
 )
 from moviepy.video.fx import FadeIn, FadeOut, Resize
 from PIL import Image, ImageFilter, ImageEnhance
+from proglog import ProgressBarLogger
+
+from .image_postprocess import (
+    PREVIEW_SIZE, RenderProfile, find_master, find_preview, grade_image, headroom_size,
+)
+from .media_probe import get_duration
+
+
+class _ProgressLogger(ProgressBarLogger):
+    """Логгер MoviePy, передающий долю записанных кадров в колбэк"""
+    
+    def __init__(self, callback: Callable[[float], None]):
+        super().__init__()
+        self.callback = callback
+    
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar == "frame_index" and attr == "index":
+            total = self.bars[bar].get("total") or 0
+            if total:
+                self.callback(min(1.0, value / total))
 
 
 @dataclass
@@ -88,25 +108,30 @@ class VideoEditor:
         target_w, target_h = self.config.resolution
         scale_factor = self.config.max_zoom * 1.1
         
-        # Рассчитываем размер
-        img_ratio = img.width / img.height
-        target_ratio = target_w / target_h
-        
-        if img_ratio > target_ratio:
-            new_h = int(target_h * scale_factor)
-            new_w = int(new_h * img_ratio)
+        if img.size == headroom_size(self.config.resolution, self.config.max_zoom):
+            # Мастер из image_postprocess — уже нужного размера
+            temp_path = None
+            clip = ImageClip(str(image_path)).with_duration(duration)
         else:
-            new_w = int(target_w * scale_factor)
-            new_h = int(new_w / img_ratio)
-        
-        img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        # Сохраняем временный файл
-        temp_path = image_path.parent / f"_temp_{image_path.name}"
-        img.save(temp_path)
-        
-        # Создаём клип
-        clip = ImageClip(str(temp_path)).with_duration(duration)
+            # Рассчитываем размер
+            img_ratio = img.width / img.height
+            target_ratio = target_w / target_h
+            
+            if img_ratio > target_ratio:
+                new_h = int(target_h * scale_factor)
+                new_w = int(new_h * img_ratio)
+            else:
+                new_w = int(target_w * scale_factor)
+                new_h = int(new_w / img_ratio)
+            
+            img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+            
+            # Сохраняем временный файл
+            temp_path = image_path.parent / f"_temp_{image_path.name}"
+            img.save(temp_path)
+            
+            # Создаём клип
+            clip = ImageClip(str(temp_path)).with_duration(duration)
         
         if self.config.enable_zoom:
             # Параметры зума
@@ -144,11 +169,11 @@ class VideoEditor:
             
             # Удаляем временный файл сразу после создания клипа
             # (данные уже в памяти в original_frame)
-            if temp_path.exists():
+            if temp_path and temp_path.exists():
                 temp_path.unlink()
         else:
             # Если зум отключен, удаляем временный файл после создания клипа
-            if temp_path.exists():
+            if temp_path and temp_path.exists():
                 temp_path.unlink()
         
         return clip.with_duration(duration)
@@ -200,51 +225,7 @@ class VideoEditor:
             return clip
         
         def color_filter(frame):
-            img = Image.fromarray(frame)
-            
-            if grade == "cinematic":
-                # Увеличиваем контраст, слегка синий оттенок
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.2)
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(0.9)
-            
-            elif grade == "cinematic_bw":
-                # Ч/Б с высоким контрастом — стиль военных документалок
-                img = img.convert('L').convert('RGB')  # Ч/Б
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.3)  # Высокий контраст
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(1.05)  # Чуть светлее
-            
-            elif grade == "warm":
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(1.1)
-                
-            elif grade == "cold":
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(0.9)
-            
-            elif grade == "vintage":
-                # Винтажный стиль — сепия + низкий контраст
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(0.9)
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(0.7)
-                # Добавляем тёплый оттенок
-                r, g, b = img.split()
-                r = r.point(lambda x: min(255, x + 20))
-                b = b.point(lambda x: max(0, x - 10))
-                img = Image.merge('RGB', (r, g, b))
-            
-            elif grade == "dramatic":
-                # Высокий контраст для драматичных сцен
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(1.4)
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(0.85)  # Слегка десатурация
-            
-            return np.array(img)
+            return np.array(grade_image(Image.fromarray(frame), grade))
         
         # MoviePy 2.x: используем image_transform вместо fl_image
         return clip.image_transform(color_filter)
@@ -322,12 +303,28 @@ class VideoEditor:
         audio_path: Path,
         output_path: Path,
         music_path: Optional[Path] = None,
-        music_volume: float = 0.15
+        music_volume: float = 0.15,
+        on_progress: Optional[Callable[[float], None]] = None
     ) -> Path:
-        """Создание финального видео"""
+        """
+        Создание финального видео
+        
+        on_progress(доля 0..1) — прогресс записи кадров (для рендер-фермы)
+        """
         
         clips = []
         
+        # Мастера (core/image_postprocess.py): кадр нужного размера, грейд уже внутри.
+        # Грейд по кадрам не смешиваем с готовым — без полного набора берём исходники
+        profile = RenderProfile.from_video_config(self.config)
+        masters = [find_master(scene.image_path, profile) for scene in scenes]
+        pregraded = profile.pregraded and bool(scenes) and all(masters)
+        if profile.pregraded and not pregraded:
+            masters = [None] * len(scenes)
+        if any(masters):
+            print(f"[VideoEditor] Мастера: {sum(1 for m in masters if m)}/{len(scenes)}"
+                  f"{', грейд уже применён' if pregraded else ''}")
+        
         for i, scene in enumerate(scenes):
             # Определяем направление зума
             zoom_dir = scene.zoom_direction
@@ -336,7 +333,7 @@ class VideoEditor:
             
             # Создаём клип
             clip = self.create_ken_burns_clip(
-                scene.image_path,
+                masters[i] or scene.image_path,
                 scene.duration,
                 zoom_dir
             )
@@ -354,7 +351,7 @@ class VideoEditor:
             video = concatenate_videoclips(clips, method="compose")
         
         # Применяем цветокоррекцию
-        if self.config.color_grade and self.config.color_grade != "none":
+        if self.config.color_grade and self.config.color_grade != "none" and not pregraded:
             video = self.apply_color_grade(video)
         
         # Применяем виньетку (затемнение по краям)
@@ -393,7 +390,8 @@ class VideoEditor:
             codec='libx264',
             audio_codec='aac',
             bitrate='12M',
-            threads=4
+            threads=max(1, len(os.sched_getaffinity(0))) if hasattr(os, "sched_getaffinity") else 4,
+            logger=_ProgressLogger(on_progress) if on_progress else "bar"
         )
         
         # Закрываем клипы
@@ -412,10 +410,8 @@ class VideoEditor:
     ) -> Path:
         """Упрощённое создание видео — автоматический расчёт длительности"""
         
-        # Загружаем аудио для определения длительности
-        audio = AudioFileClip(str(audio_path))
-        total_duration = audio.duration
-        audio.close()
+        # Длительность — из заголовков файла, без декодирования
+        total_duration = get_duration(audio_path)
         
         # Рассчитываем длительность каждой сцены
         scene_duration = total_duration / len(images)
@@ -461,9 +457,9 @@ class VideoEditor:
         
         # Определяем длительность
         if audio_path and Path(audio_path).exists():
-            audio = AudioFileClip(str(audio_path))
-            total_duration = audio.duration
+            total_duration = get_duration(audio_path)
             duration_per_image = total_duration / len(images)
+            audio = AudioFileClip(str(audio_path))  # Нужен для дорожки превью
         else:
             audio = None
             total_duration = duration_per_image * len(images)
@@ -474,33 +470,39 @@ class VideoEditor:
             if not Path(img_path).exists():
                 continue
             
-            # Загружаем и ресайзим изображение
-            img = Image.open(img_path)
+            preview = find_preview(img_path) if tuple(resolution) == PREVIEW_SIZE else None
+            if preview:
+                # Превью из image_postprocess — уже нужного размера
+                temp_path = None
+                clip = ImageClip(str(preview)).with_duration(duration_per_image)
+            else:
+                # Загружаем и ресайзим изображение
+                img = Image.open(img_path)
             
-            # Масштабируем под разрешение
-            img_ratio = img.width / img.height
-            target_ratio = resolution[0] / resolution[1]
+                # Масштабируем под разрешение
+                img_ratio = img.width / img.height
+                target_ratio = resolution[0] / resolution[1]
             
-            if img_ratio > target_ratio:
-                new_h = resolution[1]
-                new_w = int(new_h * img_ratio)
-            else:
-                new_w = resolution[0]
-                new_h = int(new_w / img_ratio)
+                if img_ratio > target_ratio:
+                    new_h = resolution[1]
+                    new_w = int(new_h * img_ratio)
+                else:
+                    new_w = resolution[0]
+                    new_h = int(new_w / img_ratio)
             
-            img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+                img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
             
-            # Центрируем и обрезаем
-            left = (new_w - resolution[0]) // 2
-            top = (new_h - resolution[1]) // 2
-            img = img.crop((left, top, left + resolution[0], top + resolution[1]))
+                # Центрируем и обрезаем
+                left = (new_w - resolution[0]) // 2
+                top = (new_h - resolution[1]) // 2
+                img = img.crop((left, top, left + resolution[0], top + resolution[1]))
             
-            # Сохраняем временный файл
-            temp_path = Path(img_path).parent / f"_preview_temp_{i}.jpg"
-            img.save(temp_path, quality=85)
+                # Сохраняем временный файл
+                temp_path = Path(img_path).parent / f"_preview_temp_{i}.jpg"
+                img.save(temp_path, quality=85)
             
-            # Создаём клип
-            clip = ImageClip(str(temp_path)).with_duration(duration_per_image)
+                # Создаём клип
+                clip = ImageClip(str(temp_path)).with_duration(duration_per_image)
             
             # Простой fade
             if i > 0:
@@ -511,7 +513,7 @@ class VideoEditor:
             clips.append(clip)
             
             # Удаляем временный файл
-            if temp_path.exists():
+            if temp_path and temp_path.exists():
                 temp_path.unlink()
         
         # Собираем видео
@@ -561,8 +563,8 @@ class VideoEditor:
             if not Path(img_path).exists():
                 continue
             
-            # Ресайзим для скорости
-            img = Image.open(img_path)
+            # Ресайзим для скорости (готовое превью 1280x720 декодируется быстрее исходника)
+            img = Image.open(find_preview(img_path) or img_path)
             img.thumbnail((1280, 720), Image.Resampling.LANCZOS)
             
             # Создаём фон и центрируем
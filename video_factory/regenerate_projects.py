@@ -10,16 +10,18 @@
 5. SEO — 3 кликбейтных заголовка, длинное описание
 """
 
-import json
+import sys
 from pathlib import Path
 
-projects_file = Path("video_factory/output/projects.json")
+sys.path.insert(0, "video_factory/core")
+from project_store import ProjectStore
 
-if not projects_file.exists():
-    print("Файл projects.json не найден!")
-    exit(1)
+store = ProjectStore(Path("video_factory/output"))
+data = store.load()
 
-data = json.load(open(projects_file))
+if not data:
+    print("Проекты не найдены!")
+    exit(1)
 
 print("=== ТЕКУЩИЕ ПРОЕКТЫ ===")
 for k, p in data.items():
@@ -78,7 +80,7 @@ if choice == "1":
         
         print(f"✅ Сброшен: {p.get('name', '')[:40]}")
     
-    json.dump(data, open(projects_file, 'w'), ensure_ascii=False, indent=2)
+    store.save(data)
     print("\n✅ Все проекты сброшены. Перезапустите очередь для перегенерации.")
 
 elif choice == "2":
@@ -104,7 +106,7 @@ elif choice == "2":
             print(f"✅ Сброшен: {p.get('name', '')[:40]}")
     
     if count > 0:
-        json.dump(data, open(projects_file, 'w'), ensure_ascii=False, indent=2)
+        store.save(data)
         print(f"\n✅ Сброшено {count} проектов с неправильным языком.")
     else:
         print("\n✅ Проектов с неправильным языком не найдено.")
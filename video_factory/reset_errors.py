@@ -1,7 +1,11 @@
-import json
+import sys
+from pathlib import Path
 
-with open('video_factory/output/projects.json', 'r') as f:
-    data = json.load(f)
+sys.path.insert(0, 'video_factory/core')
+from project_store import ProjectStore
+
+store = ProjectStore(Path('video_factory/output'))
+data = store.load()
 
 reset_count = 0
 for key, proj in data.items():
@@ -12,7 +16,6 @@ for key, proj in data.items():
             print(f"Сброшен: {proj.get('name', '')[:40]}")
             reset_count += 1
 
-with open('video_factory/output/projects.json', 'w') as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
+store.save(data)
 
 print(f"\nСброшено {reset_count} проектов")
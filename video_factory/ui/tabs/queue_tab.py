@@ -13,6 +13,7 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
 from PyQt6.QtGui import QColor, QPixmap
 from pathlib import Path
+from datetime import datetime
 import sys
 
 sys.path.insert(0, str(__file__).rsplit('/', 3)[0])
@@ -285,6 +286,8 @@ class ProjectPreviewDialog(QDialog):
         self.images_grid = QGridLayout(images_widget)
         
         if project.images:
+            from core.image_postprocess import find_preview
+            
             cols = 4
             for i, img_path in enumerate(project.images):
                 frame = QFrame()
@@ -292,7 +295,7 @@ class ProjectPreviewDialog(QDialog):
                 frame_layout = QVBoxLayout(frame)
                 
                 img_label = QLabel()
-                pixmap = QPixmap(img_path)
+                pixmap = QPixmap(str(find_preview(img_path) or img_path))  # 1280x720 — декодируется быстрее
                 if not pixmap.isNull():
                     scaled = pixmap.scaled(150, 100, Qt.AspectRatioMode.KeepAspectRatio)
                     img_label.setPixmap(scaled)
@@ -670,9 +673,9 @@ class QueueTab(QWidget):
             
             # Если выбран профиль канала — применяем его настройки
             if data.get('channel_style_id'):
-                project.channel_style_id = data['channel_style_id']
-                self.style_manager.apply_style_to_project(data['channel_style_id'], project)
-                self.pipeline._save_projects()
+                with self.pipeline.state.transaction():
+                    project.channel_style_id = data['channel_style_id']
+                    self.style_manager.apply_style_to_project(data['channel_style_id'], project)
             
             self.pipeline.add_to_queue(project.id)
             self._refresh_table()
@@ -707,9 +710,9 @@ class QueueTab(QWidget):
                 
                 # Применяем профиль если выбран
                 if data.get('channel_style_id'):
-                    project.channel_style_id = data['channel_style_id']
-                    self.style_manager.apply_style_to_project(data['channel_style_id'], project)
-                    self.pipeline._save_projects()
+                    with self.pipeline.state.transaction():
+                        project.channel_style_id = data['channel_style_id']
+                        self.style_manager.apply_style_to_project(data['channel_style_id'], project)
                 
                 self.pipeline.add_to_queue(project.id)
                 added += 1
@@ -726,26 +729,18 @@ class QueueTab(QWidget):
     def _start_queue(self):
         """Запуск обработки очереди"""
         # ВСЕГДА добавляем проекты с ошибками в очередь (для перезапуска)
-        added = 0
-        for pid, project in self.pipeline.projects.items():
-            # Добавляем проекты с ошибками или в статусе queued
-            if project.status in ["error", "queued"] and pid not in self.pipeline.queue:
-                self.pipeline.queue.append(pid)
-                project.status = "queued"
-                project.error_message = ""  # Сбрасываем ошибку
-                added += 1
-        
+        added = self.pipeline.requeue_failed()
         if added > 0:
-            self.pipeline._save_projects()
             self._refresh_table()
         
-        if not self.pipeline.queue:
+        queue_len = len(self.pipeline.get_snapshot().queue)
+        if not queue_len:
             QMessageBox.warning(self, "Ошибка", "Нет проектов для обработки")
             return
         
         reply = QMessageBox.question(
             self, "Запуск очереди",
-            f"Запустить обработку {len(self.pipeline.queue)} проектов?\n\n"
+            f"Запустить обработку {queue_len} проектов?\n\n"
             "Процесс будет работать в фоне.",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
         )
@@ -794,7 +789,9 @@ class QueueTab(QWidget):
         if not self.pipeline:
             return
         
-        projects = self.pipeline.get_all_projects()
+        # Снимок: поток очереди может менять проекты прямо сейчас
+        snapshot = self.pipeline.get_snapshot()
+        projects = snapshot.projects
         self.table.setRowCount(len(projects))
         
         for row, project in enumerate(projects):
@@ -814,7 +811,11 @@ class QueueTab(QWidget):
             status_item.setBackground(self._get_status_color(project.status))
             self.table.setItem(row, 4, status_item)
             
-            self.table.setItem(row, 5, QTableWidgetItem(f"{project.progress}%"))
+            progress_item = QTableWidgetItem(f"{project.progress}%")
+            eta = snapshot.eta(project.id)
+            if eta:
+                progress_item.setToolTip(f"Готовность ≈ {datetime.fromtimestamp(eta):%d.%m %H:%M}")
+            self.table.setItem(row, 5, progress_item)
             
             # Кнопки действий
             btn_widget = QWidget()
@@ -840,14 +841,14 @@ class QueueTab(QWidget):
             self.table.setItem(row, 7, id_item)
         
         # Обновляем список готовых
-        self._update_ready_list()
+        self._update_ready_list(snapshot)
         
         # Обновляем статус
-        queue_len = len(self.pipeline.queue)
+        queue_len = len(snapshot.queue)
         self.queue_status.setText(f"Очередь: {queue_len} проектов | Всего: {len(projects)}")
         
-        if self.pipeline.current_project_id:
-            current = self.pipeline.get_project(self.pipeline.current_project_id)
+        if snapshot.current_project_id:
+            current = snapshot.get(snapshot.current_project_id)
             if current:
                 self.current_status.setText(f"⏳ {current.name}: {current.current_step}")
     
@@ -855,10 +856,11 @@ class QueueTab(QWidget):
         """Периодическое обновление таблицы"""
         self._refresh_table()
     
-    def _update_ready_list(self):
+    def _update_ready_list(self, snapshot=None):
         """Обновление списка готовых проектов"""
+        snapshot = snapshot or self.pipeline.get_snapshot()
         self.ready_list.clear()
-        for project in self.pipeline.get_ready_projects():
+        for project in snapshot.with_status("ready"):
             item = QListWidgetItem(f"✅ {project.name}")
             item.setData(Qt.ItemDataRole.UserRole, project.id)
             self.ready_list.addItem(item)
@@ -966,11 +968,7 @@ class QueueTab(QWidget):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
-            if project_id in self.pipeline.projects:
-                del self.pipeline.projects[project_id]
-            if project_id in self.pipeline.queue:
-                self.pipeline.queue.remove(project_id)
-            self.pipeline._save_projects()
+            self.pipeline.delete_project(project_id)
             self._refresh_table()
     
     def add_batch_from_quickstart(self, data: dict):